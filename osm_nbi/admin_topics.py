@@ -25,6 +25,7 @@ from osm_nbi.validation import user_new_schema, user_edit_schema, project_new_sc
     validate_input, ValidationError, is_valid_uuid    # To check that User/Project Names don't look like UUIDs
 from osm_nbi.base_topic import BaseTopic, EngineException
 from osm_nbi.authconn import AuthconnNotFoundException, AuthconnConflictException
+from osm_nbi.auth import invalidate_tokens_cache, send_token_revocation
 from osm_common.dbbase import deep_update_rfc7396
 
 __author__ = "Alfonso Tierno <alfonso.tiernosepulveda@telefonica.com>"
@@ -32,6 +33,7 @@ __author__ = "Alfonso Tierno <alfonso.tiernosepulveda@telefonica.com>"
 
 class UserTopic(BaseTopic):
     topic = "users"
+    db_indexes = (("username",),)
     topic_msg = "users"
     schema_new = user_new_schema
     schema_edit = user_edit_schema
@@ -126,6 +128,7 @@ class UserTopic(BaseTopic):
 
 class ProjectTopic(BaseTopic):
     topic = "projects"
+    db_indexes = (("name",),)
     topic_msg = "projects"
     schema_new = project_new_schema
     schema_edit = project_edit_schema
@@ -201,6 +204,7 @@ class CommonVimWimSdn(BaseTopic):
     """Common class for VIM, WIM SDN just to unify methods that are equal to all of them"""
     config_to_encrypt = {}     # what keys at config must be encrypted because contains passwords
     password_to_encrypt = ""   # key that contains a password
+    default_exclude_fields = ("_admin.operations", )
 
     @staticmethod
     def _create_operation(op_type, params=None):
@@ -321,6 +325,7 @@ class CommonVimWimSdn(BaseTopic):
             return None
 
         # remove reference from project_read. If not last delete
+        projects_read = list(db_content["_admin"]["projects_read"])
         if session["project_id"]:
             for project_id in session["project_id"]:
                 if project_id in db_content["_admin"]["projects_read"]:
@@ -334,11 +339,13 @@ class CommonVimWimSdn(BaseTopic):
         update_dict = {"_admin.projects_read": db_content["_admin"]["projects_read"],
                        "_admin.projects_write": db_content["_admin"]["projects_write"]
                        }
+        removed_projects = [p for p in projects_read if p not in db_content["_admin"]["projects_read"]]
 
         # check if there are projects referencing it (apart from ANY that means public)....
         if db_content["_admin"]["projects_read"] and (len(db_content["_admin"]["projects_read"]) > 1 or
                                                       db_content["_admin"]["projects_read"][0] != "ANY"):
             self.db.set_one(self.topic, filter_q, update_dict=update_dict)  # remove references but not delete
+            self.update_quota_usage(removed_projects, -1)
             return None
 
         # It must be deleted
@@ -356,6 +363,7 @@ class CommonVimWimSdn(BaseTopic):
             # so the -1 is not needed
             op_id = "{}:{}".format(db_content["_id"], len(db_content["_admin"]["operations"]))
             self._send_msg("delete", {"_id": _id, "op_id": op_id}, not_send_msg=not_send_msg)
+        self.update_quota_usage(removed_projects, -1)
         return op_id
 
 
@@ -606,12 +614,13 @@ class UserTopicAuth(UserTopic):
         except ValidationError as e:
             raise EngineException(e, HTTPStatus.UNPROCESSABLE_ENTITY)
 
-    def show(self, session, _id):
+    def show(self, session, _id, kwargs=None):
         """
         Get complete information on an topic
 
         :param session: contains "username", "admin", "force", "public", "project_id", "set_project"
         :param _id: server internal id
+        :param kwargs: query string. Only SOL005 attribute selectors are used
         :return: dictionary, raise exception if not found.
         """
         # Allow _id to be a name or uuid
@@ -619,7 +628,7 @@ class UserTopicAuth(UserTopic):
         # users = self.auth.get_user_list(filter_q)
         users = self.list(session, filter_q)   # To allow default filtering (Bug 853)
         if len(users) == 1:
-            return users[0]
+            return self._apply_projection(users[0], self._get_projection(kwargs))
         elif len(users) > 1:
             raise EngineException("Too many users found", HTTPStatus.CONFLICT)
         else:
@@ -735,6 +744,8 @@ class UserTopicAuth(UserTopic):
                                    "add_project_role_mappings": mappings_to_add,
                                    "remove_project_role_mappings": mappings_to_remove
                                    })
+            if mappings_to_remove:
+                self._revoke_user_tokens(_id)
 
             # return _id
         except ValidationError as e:
@@ -747,11 +758,27 @@ class UserTopicAuth(UserTopic):
         :param filter_q: filter of data to be applied
         :return: The list, it can be empty if no one match the filter.
         """
+        projection = self._get_projection(filter_q)
         user_list = self.auth.get_user_list(filter_q)
         if not session["allow_show_user_project_role"]:
             # Bug 853 - Default filtering
             user_list = [usr for usr in user_list if usr["username"] == session["username"]]
-        return user_list
+        return [self._apply_projection(item, projection) for item in user_list]
+
+    def list_page(self, session, filter_q=None, limit=None, nextpage_opaque_marker=None):
+        return self._get_page(self.list(session, filter_q), limit, nextpage_opaque_marker)
+
+    def _revoke_user_tokens(self, user_id):
+        """
+        Removes the tokens of a user from the tokens cache, and notifies the other NBI instances to remove them from
+        their caches. A message bus error is only logged, as the user change is already done at this point
+        :param user_id: user _id
+        :return: None
+        """
+        params = {"user_id": user_id}
+        if self.token_cache is not None:
+            invalidate_tokens_cache(self.token_cache, params)
+        send_token_revocation(self.msg, params, self.logger)
 
     def delete(self, session, _id, dry_run=False, not_send_msg=None):
         """
@@ -770,6 +797,7 @@ class UserTopicAuth(UserTopic):
         self.check_conflict_on_del(session, uid, user)
         if not dry_run:
             v = self.auth.delete_user(uid)
+            self._revoke_user_tokens(uid)
             return v
         return None
 
@@ -891,12 +919,13 @@ class ProjectTopicAuth(ProjectTopic):
         except ValidationError as e:
             raise EngineException(e, HTTPStatus.UNPROCESSABLE_ENTITY)
 
-    def show(self, session, _id):
+    def show(self, session, _id, kwargs=None):
         """
         Get complete information on an topic
 
         :param session: contains "username", "admin", "force", "public", "project_id", "set_project"
         :param _id: server internal id
+        :param kwargs: query string. Only SOL005 attribute selectors are used
         :return: dictionary, raise exception if not found.
         """
         # Allow _id to be a name or uuid
@@ -904,7 +933,7 @@ class ProjectTopicAuth(ProjectTopic):
         # projects = self.auth.get_project_list(filter_q=filter_q)
         projects = self.list(session, filter_q)   # To allow default filtering (Bug 853)
         if len(projects) == 1:
-            return projects[0]
+            return self._apply_projection(projects[0], self._get_projection(kwargs))
         elif len(projects) > 1:
             raise EngineException("Too many projects found", HTTPStatus.CONFLICT)
         else:
@@ -918,13 +947,17 @@ class ProjectTopicAuth(ProjectTopic):
         :param filter_q: filter of data to be applied
         :return: The list, it can be empty if no one match the filter.
         """
+        projection = self._get_projection(filter_q)
         project_list = self.auth.get_project_list(filter_q)
         if not session["allow_show_user_project_role"]:
             # Bug 853 - Default filtering
             user = self.auth.get_user(session["username"])
             projects = [prm["project"] for prm in user["project_role_mappings"]]
             project_list = [proj for proj in project_list if proj["_id"] in projects]
-        return project_list
+        return [self._apply_projection(item, projection) for item in project_list]
+
+    def list_page(self, session, filter_q=None, limit=None, nextpage_opaque_marker=None):
+        return self._get_page(self.list(session, filter_q), limit, nextpage_opaque_marker)
 
     def delete(self, session, _id, dry_run=False, not_send_msg=None):
         """
@@ -942,6 +975,8 @@ class ProjectTopicAuth(ProjectTopic):
         self.check_conflict_on_del(session, pid, proj)
         if not dry_run:
             v = self.auth.delete_project(pid)
+            if self.quota_ledger:
+                self.quota_ledger.delete_project(pid)
             return v
         return None
 
@@ -977,6 +1012,7 @@ class ProjectTopicAuth(ProjectTopic):
 
 class RoleTopicAuth(BaseTopic):
     topic = "roles"
+    db_indexes = (("name",),)
     topic_msg = None    # "roles"
     schema_new = roles_new_schema
     schema_edit = roles_edit_schema
@@ -1159,12 +1195,13 @@ class RoleTopicAuth(BaseTopic):
             final_content["permissions"]["admin"] = False
         return None
 
-    def show(self, session, _id):
+    def show(self, session, _id, kwargs=None):
         """
         Get complete information on an topic
 
         :param session: contains "username", "admin", "force", "public", "project_id", "set_project"
         :param _id: server internal id
+        :param kwargs: query string. Only SOL005 attribute selectors are used
         :return: dictionary, raise exception if not found.
         """
         filter_q = {BaseTopic.id_field(self.topic, _id): _id}
@@ -1174,7 +1211,7 @@ class RoleTopicAuth(BaseTopic):
             raise AuthconnNotFoundException("Not found any role with filter {}".format(filter_q))
         elif len(roles) > 1:
             raise AuthconnConflictException("Found more than one role with filter {}".format(filter_q))
-        return roles[0]
+        return self._apply_projection(roles[0], self._get_projection(kwargs))
 
     def list(self, session, filter_q=None):
         """
@@ -1184,13 +1221,17 @@ class RoleTopicAuth(BaseTopic):
         :param filter_q: filter of data to be applied
         :return: The list, it can be empty if no one match the filter.
         """
+        projection = self._get_projection(filter_q)
         role_list = self.auth.get_role_list(filter_q)
         if not session["allow_show_user_project_role"]:
             # Bug 853 - Default filtering
             user = self.auth.get_user(session["username"])
             roles = [prm["role"] for prm in user["project_role_mappings"]]
             role_list = [role for role in role_list if role["_id"] in roles]
-        return role_list
+        return [self._apply_projection(item, projection) for item in role_list]
+
+    def list_page(self, session, filter_q=None, limit=None, nextpage_opaque_marker=None):
+        return self._get_page(self.list(session, filter_q), limit, nextpage_opaque_marker)
 
     def new(self, rollback, session, indata=None, kwargs=None, headers=None):
         """
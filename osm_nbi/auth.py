@@ -42,6 +42,9 @@ from os import path
 from osm_nbi.authconn import AuthException, AuthExceptionUnauthorized
 from osm_nbi.authconn_keystone import AuthconnKeystone
 from osm_nbi.authconn_internal import AuthconnInternal   # Comment out for testing&debugging, uncomment when ready
+from osm_nbi.cache import LruCache
+from osm_nbi.tracing import traced
+from osm_nbi import metrics
 from osm_common import dbmongo
 from osm_common import dbmemory
 from osm_common.dbbase import DbException
@@ -60,6 +63,8 @@ class Authenticator:
     """
 
     periodin_db_pruning = 60 * 30  # for the internal backend only. every 30 minutes expired tokens will be pruned
+    tokens_cache_size = 10000  # default maximum number of tokens kept in memory
+    permission_decisions_size = 4096  # maximum number of memoized permission decisions
 
     def __init__(self, valid_methods, valid_query_string):
         """
@@ -69,26 +74,36 @@ class Authenticator:
         self.backend = None
         self.config = None
         self.db = None
-        self.tokens_cache = dict()
+        self.msg = None
+        self.tokens_cache = LruCache(max_size=self.tokens_cache_size)
         self.next_db_prune_time = 0  # time when next cleaning of expired tokens must be done
         self.roles_to_operations_file = None
         # self.roles_to_operations_table = None
         self.resources_to_operations_mapping = {}
         self.operation_to_allowed_roles = {}
+        # permission bits, role bitmasks and memoized decisions. See load_operation_to_allowed_roles
+        self.permission_matrix = ({}, {}, LruCache(max_size=self.permission_decisions_size))
+        self.instance_id = uuid4().hex  # identifies the messages sent by this NBI instance
         self.logger = logging.getLogger("nbi.authenticator")
         self.role_permissions = []
         self.valid_methods = valid_methods
         self.valid_query_string = valid_query_string
 
-    def start(self, config):
+    def start(self, config, msg=None):
         """
         Method to configure the Authenticator object. This method should be called
         after object creation. It is responsible by initializing the selected backend,
         as well as the initialization of the database connection.
 
         :param config: dictionary containing the relevant parameters for this object.
+        :param msg: message bus used to notify token revocations to other NBI instances. None for not notifying
         """
         self.config = config
+        if msg:
+            self.msg = msg
+        if config["authentication"].get("tokens_cache_size"):
+            self.tokens_cache.max_size = int(config["authentication"]["tokens_cache_size"])
+        metrics.registry.set_collector("tokens_cache", self.collect_tokens_cache_metrics)
 
         try:
             if not self.db:
@@ -150,6 +165,7 @@ class Authenticator:
             raise AuthException(str(e))
 
     def stop(self):
+        metrics.registry.set_collector("tokens_cache", None)
         try:
             if self.db:
                 self.db.db_disconnect()
@@ -290,11 +306,15 @@ class Authenticator:
     def load_operation_to_allowed_roles(self):
         """
         Fills the internal self.operation_to_allowed_roles based on database role content and self.role_permissions
+        It compiles a permission matrix: each role is represented by an integer bitmask over self.role_permissions,
+        so that checking a permission is a bitwise AND. Previous permission decisions are forgotten.
         It works in a shadow copy and replace at the end to allow other threads working with the old copy
         :return: None
         """
-
-        permissions = {oper: [] for oper in self.role_permissions}
+        permission_bits = {oper: 1 << index for index, oper in enumerate(self.role_permissions)}
+        all_permissions = (1 << len(self.role_permissions)) - 1
+        prefix_masks = {}  # permission prefix: bitmask of the permissions starting with it
+        role_masks = {}
         # records = self.db.get_list(self.roles_to_operations_table)
         records = self.backend.get_role_list()
 
@@ -302,24 +322,58 @@ class Authenticator:
         for record in records:
             if not record.get("permissions"):
                 continue
-            record_permissions = {oper: record["permissions"].get("default", False) for oper in self.role_permissions}
+            role_mask = all_permissions if record["permissions"].get("default", False) is True else 0
             operations_joined = [(oper, value) for oper, value in record["permissions"].items()
                                  if oper not in ignore_fields]
+            # generic permissions first, so that more specific ones override them
             operations_joined.sort(key=lambda x: x[0].count(":"))
 
-            for oper in operations_joined:
-                match = list(filter(lambda x: x.find(oper[0]) == 0, record_permissions.keys()))
-
-                for m in match:
-                    record_permissions[m] = oper[1]
+            for oper, value in operations_joined:
+                prefix_mask = prefix_masks.get(oper)
+                if prefix_mask is None:
+                    prefix_mask = 0
+                    for permission, bit in permission_bits.items():
+                        if permission.startswith(oper):
+                            prefix_mask |= bit
+                    prefix_masks[oper] = prefix_mask
+                if value is True:
+                    role_mask |= prefix_mask
+                else:
+                    role_mask &= ~prefix_mask
+            role_masks[record["name"]] = role_mask
 
-            allowed_operations = [k for k, v in record_permissions.items() if v is True]
+        self.operation_to_allowed_roles = {oper: [role for role, role_mask in role_masks.items() if role_mask & bit]
+                                           for oper, bit in permission_bits.items()}
+        # a single assignment, so that a concurrent check_permissions uses either the old or the new matrix
+        self.permission_matrix = (permission_bits, role_masks, LruCache(max_size=self.permission_decisions_size))
 
-            for allowed_op in allowed_operations:
-                permissions[allowed_op].append(record["name"])
+    def reload_roles(self):
+        """
+        Reloads the permission matrix after a change of roles, and notifies it to the other NBI instances
+        :return: None
+        """
+        self.load_operation_to_allowed_roles()
+        if not self.msg:
+            return
+        try:
+            self.msg.write("admin", "reload_roles", {"sender": self.instance_id})
+        except Exception as e:
+            self.logger.error("Cannot notify roles reload to other NBI instances: {}".format(e))
 
-        self.operation_to_allowed_roles = permissions
+    def process_roles_reload(self, params):
+        """
+        Reloads the permission matrix after a change of roles notified by other NBI instance. The roles are read again
+        from the backend, not from the users, projects and roles it keeps in memory
+        :param params: content of the 'reload_roles' message, with the "sender" instance
+        :return: False if the message was sent by this instance and it is ignored, True otherwise
+        """
+        if isinstance(params, dict) and params.get("sender") == self.instance_id:
+            return False
+        self.backend.invalidate_directory()
+        self.load_operation_to_allowed_roles()
+        return True
 
+    @traced("authorize")
     def authorize(self, role_permission=None, query_string_operations=None, item_id=None):
         token = None
         user_passwd64 = None
@@ -354,15 +408,8 @@ class Authenticator:
             if not token:
                 raise AuthException("Needed a token or Authorization http header",
                                     http_code=HTTPStatus.UNAUTHORIZED)
-            token_info = self.backend.validate_token(token)
-            # TODO add to token info remote host, port
-
-            if role_permission:
-                RBAC_auth = self.check_permissions(token_info, cherrypy.request.method, role_permission,
-                                                   query_string_operations, item_id)
-                token_info["allow_show_user_project_role"] = RBAC_auth
-
-            return token_info
+            return self.authorize_token(token, cherrypy.request.method, role_permission, query_string_operations,
+                                        item_id)
         except AuthException as e:
             if not isinstance(e, AuthExceptionUnauthorized):
                 if cherrypy.session.get('Authorization'):
@@ -376,6 +423,32 @@ class Authenticator:
                         "roles": ["system_admin"]}
             raise
 
+    def authorize_token(self, token, method, role_permission=None, query_string_operations=None, item_id=None):
+        """
+        Validates a token and checks that it has permissions for the operation. It does not depend on cherrypy
+        :param token: token identifier
+        :param method: GET, PUT, POST, ...
+        :param role_permission: role permission name of the operation required. If None only token is validated
+        :param query_string_operations: list of admin query strings provided by user
+        :param item_id: item identifier if included in the URL, None otherwise
+        :return: token_info. It raises AuthException if not valid or AuthExceptionUnauthorized if not allowed
+        """
+        token_info = self.backend.validate_token(token)
+        # TODO add to token info remote host, port
+
+        if role_permission:
+            RBAC_auth = self.check_permissions(token_info, method, role_permission, query_string_operations, item_id)
+            token_info["allow_show_user_project_role"] = RBAC_auth
+        return token_info
+
+    def is_token_cached(self, token):
+        """
+        Checks if a token can be validated without accessing to database or to external authentication services
+        :param token: token identifier
+        :return: True or False
+        """
+        return self.backend.is_token_cached(token)
+
     def new_token(self, token_info, indata, remote):
         new_token_info = self.backend.authenticate(
             user=indata.get("username"),
@@ -396,7 +469,7 @@ class Authenticator:
         elif remote.ip:
             new_token_info["remote_host"] = remote.ip
 
-        self.tokens_cache[new_token_info["_id"]] = new_token_info
+        self.tokens_cache.set(new_token_info["_id"], new_token_info, expires=new_token_info["expires"])
 
         # TODO call self._internal_tokens_prune(now) ?
         return deepcopy(new_token_info)
@@ -425,10 +498,38 @@ class Authenticator:
         try:
             self.backend.revoke_token(token)
             self.tokens_cache.pop(token, None)
+            self.send_token_revocation({"_id": token})
             return "token '{}' deleted".format(token)
         except KeyError:
             raise AuthException("Token '{}' not found".format(token), http_code=HTTPStatus.NOT_FOUND)
 
+    def send_token_revocation(self, params):
+        """
+        Notifies to other NBI instances that some tokens are revoked, so that they remove them from their caches
+        :param params: dictionary with "_id" of the revoked token, or "user_id" to revoke all the tokens of a user
+        :return: None
+        """
+        send_token_revocation(self.msg, params, self.logger)
+
+    def get_tokens_cache_stats(self):
+        """
+        :return: dictionary with the size, hits and misses of the tokens cache
+        """
+        return self.tokens_cache.get_stats()
+
+    def collect_tokens_cache_metrics(self, registry):
+        """
+        Updates the metrics of the tokens cache. Registered as metrics collector at start
+        :param registry: metrics registry
+        :return: None
+        """
+        stats = self.tokens_cache.get_stats()
+        registry.gauge("osm_nbi_tokens_cache_entries", "Tokens kept in memory").set(value=stats["size"])
+        registry.counter("osm_nbi_tokens_cache_hits_total", "Tokens found at the tokens cache").set(
+            value=stats["hits"])
+        registry.counter("osm_nbi_tokens_cache_misses_total", "Tokens not found or expired at the tokens cache").set(
+            value=stats["misses"])
+
     def check_permissions(self, token_info, method, role_permission=None, query_string_operations=None, item_id=None):
         """
         Checks that operation has permissions to be done, base on the assigned roles to this user project
@@ -444,30 +545,10 @@ class Authenticator:
         :raises: AuthExceptionUnauthorized if access denied
         """
 
-        roles_required = self.operation_to_allowed_roles[role_permission]
-        roles_allowed = [role["name"] for role in token_info["roles"]]
-
-        # fills token_info["admin"] if some roles allows it
-        token_info["admin"] = False
-        for role in roles_allowed:
-            if role in self.operation_to_allowed_roles["admin:" + method.lower()]:
-                token_info["admin"] = True
-                break
-
-        if "anonymous" in roles_required:
+        token_info["admin"], decision = self._get_permission_decision(
+            tuple(role["name"] for role in token_info["roles"]), method, role_permission, query_string_operations)
+        if decision:
             return True
-        operation_allowed = False
-        for role in roles_allowed:
-            if role in roles_required:
-                operation_allowed = True
-                # if query_string operations, check if this role allows it
-                if not query_string_operations:
-                    return True
-                for query_string_operation in query_string_operations:
-                    if role not in self.operation_to_allowed_roles[query_string_operation]:
-                        break
-                else:
-                    return True
 
         # Bug 853 - Final Solution
         # User/Project/Role whole listings are filtered elsewhere
@@ -479,11 +560,53 @@ class Authenticator:
             # or (role_permission == "roles:id:get" and item_id in [role[rid] for role in token_info["roles"]]):
             return False
 
-        if not operation_allowed:
+        if decision is None:
             raise AuthExceptionUnauthorized("Access denied: lack of permissions.")
         else:
             raise AuthExceptionUnauthorized("Access denied: You have not permissions to use these admin query string")
 
+    def _get_permission_decision(self, roles, method, role_permission, query_string_operations):
+        """
+        Decides if a set of roles is allowed for an operation. Decisions are memoized until roles are reloaded
+        :param roles: tuple of role names
+        :param method: GET,PUT, POST, ...
+        :param role_permission: role permission name of the operation required
+        :param query_string_operations: list of admin query strings provided by user, or None
+        :return: tuple with admin (True if some role allows admin for this method) and decision: True if allowed,
+            None if no role allows the operation, False if the operation is allowed but not the query strings
+        """
+        permission_bits, role_masks, decisions = self.permission_matrix
+        key = (roles, method, role_permission, tuple(query_string_operations) if query_string_operations else ())
+        result = decisions.get(key)
+        if result is not None:
+            return result
+
+        operation_bit = permission_bits[role_permission]
+        required_mask = operation_bit
+        for query_string_operation in key[3]:
+            required_mask |= permission_bits[query_string_operation]
+        admin_bit = permission_bits["admin:" + method.lower()]
+        admin = False
+        decision = None
+        if role_masks.get("anonymous", 0) & operation_bit:
+            decision = True
+        for role in roles:
+            role_mask = role_masks.get(role, 0)
+            if role_mask & admin_bit:
+                admin = True
+            if not decision and role_mask & operation_bit:
+                # a single role must allow both the operation and all the query strings
+                decision = role_mask & required_mask == required_mask
+        result = (admin, decision)
+        decisions.set(key, result)
+        return result
+
+    def get_permission_decisions_stats(self):
+        """
+        :return: dictionary with the size, hits and misses of the memoized permission decisions
+        """
+        return self.permission_matrix[2].get_stats()
+
     def get_user_list(self):
         return self.backend.get_user_list()
 
@@ -557,4 +680,37 @@ class Authenticator:
         if not self.next_db_prune_time or self.next_db_prune_time >= now:
             self.db.del_list("tokens", {"expires.lt": now})
             self.next_db_prune_time = self.periodin_db_pruning + now
-            self.tokens_cache.clear()  # force to reload tokens from database
+            self.tokens_cache.prune(now)
+
+
+def send_token_revocation(msg, params, logger):
+    """
+    Notifies to other NBI instances that some tokens are revoked, so that they remove them from their caches. A message
+    bus error is only logged
+    :param msg: message bus. None for not notifying
+    :param params: dictionary with "_id" of the revoked token, or "user_id" to revoke all the tokens of a user
+    :param logger: logger for the errors
+    :return: None
+    """
+    if not msg:
+        return
+    try:
+        msg.write("admin", "revoke_token", params)
+    except Exception as e:
+        logger.error("Cannot notify token revocation {} to other NBI instances: {}".format(params, e))
+
+
+def invalidate_tokens_cache(tokens_cache, params):
+    """
+    Removes the revoked tokens from a tokens cache. Used when a revocation message is received from kafka 'admin' topic
+    :param tokens_cache: the tokens cache
+    :param params: dictionary with "_id" of the revoked token, or "user_id" to remove all the tokens of a user
+    :return: number of removed tokens
+    """
+    if not isinstance(params, dict):
+        return 0
+    if params.get("_id"):
+        return 0 if tokens_cache.pop(params["_id"]) is None else 1
+    if params.get("user_id"):
+        return tokens_cache.pop_if(lambda token: params["user_id"] in (token.get("user_id"), token.get("username")))
+    return 0
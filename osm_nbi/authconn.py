@@ -148,6 +148,24 @@ class Authconn:
         """
         raise AuthconnNotImplementedException("Should have implemented this")
 
+    def is_token_cached(self, token):
+        """
+        Check if the token can be validated from memory, without any access to database or external service.
+
+        :param token: token to check
+        :return: True if validate_token will not block, False otherwise
+        """
+        return False
+
+    def invalidate_directory(self):
+        """
+        Forgets the users, projects and roles kept in memory, if any, so that they are read again from the backend.
+        Used when they are changed at other NBI instance
+
+        :return: None
+        """
+        pass
+
     def revoke_token(self, token):
         """
         Invalidate a token.
@@ -31,6 +31,7 @@ __date__ = "$06-jun-2019 11:16:08$"
 from osm_nbi.authconn import Authconn, AuthException   # , AuthconnOperationException
 from osm_common.dbbase import DbException
 from osm_nbi.base_topic import BaseTopic
+from osm_nbi.cache import LruCache
 
 import logging
 import re
@@ -43,6 +44,11 @@ from random import choice as random_choice
 
 
 class AuthconnInternal(Authconn):
+    # _id and name of projects and roles, shared by all the instances. Entries are indexed by _id and by name, and
+    # they are removed when a project or role is changed. Expiration bounds the changes done by other NBI instances
+    names_cache = {"projects": LruCache(max_size=4096), "roles": LruCache(max_size=4096)}
+    names_cache_age = 60
+
     def __init__(self, config, db, token_cache):
         Authconn.__init__(self, config, db, token_cache)
 
@@ -75,19 +81,15 @@ class AuthconnInternal(Authconn):
             if not token:
                 raise AuthException("Needed a token or Authorization HTTP header", http_code=HTTPStatus.UNAUTHORIZED)
 
-            # try to get from cache first
-            now = time()
+            # try to get from cache first. Expired tokens are not returned by the cache
             token_info = self.token_cache.get(token)
-            if token_info and token_info["expires"] < now:
-                # delete token. MUST be done with care, as another thread maybe already delete it. Do not use del
-                self.token_cache.pop(token, None)
-                token_info = None
 
             # get from database if not in cache
             if not token_info:
                 token_info = self.db.get_one("tokens", {"_id": token})
-                if token_info["expires"] < now:
+                if token_info["expires"] < time():
                     raise AuthException("Expired Token or Authorization HTTP header", http_code=HTTPStatus.UNAUTHORIZED)
+                self.token_cache.set(token, token_info, expires=token_info["expires"])
 
             return token_info
 
@@ -103,6 +105,15 @@ class AuthconnInternal(Authconn):
             raise AuthException("Error during token validation using internal backend",
                                 http_code=HTTPStatus.UNAUTHORIZED)
 
+    def is_token_cached(self, token):
+        """
+        Check if the token can be validated from memory, without any access to database.
+
+        :param token: token to check
+        :return: True if validate_token will not block, False otherwise
+        """
+        return self.token_cache.peek(token) is not None
+
     def revoke_token(self, token):
         """
         Invalidate a token.
@@ -192,16 +203,17 @@ class AuthconnInternal(Authconn):
         # add token roles
         roles = []
         roles_list = []
-        for prm in prm_list:
-            if prm["project"] in [project_id, project_name]:
-                role = self.db.get_one("roles", {BaseTopic.id_field("roles", prm["role"]): prm["role"]})
-                rid = role["_id"]
-                if rid not in roles:
-                    rnm = role["name"]
-                    roles.append(rid)
-                    roles_list.append({"name": rnm, "id": rid})
+        prm_roles = [prm["role"] for prm in prm_list if prm["project"] in (project_id, project_name)]
+        id_names = self._get_id_names("roles", prm_roles)
+        for role_id_name in prm_roles:
+            role = self._get_found("roles", id_names, role_id_name)
+            rid = role["_id"]
+            if rid not in roles:
+                rnm = role["name"]
+                roles.append(rid)
+                roles_list.append({"name": rnm, "id": rid})
         if not roles_list:
-            rid = self.db.get_one("roles", {"name": "project_admin"})["_id"]
+            rid = self._get_found("roles", self._get_id_names("roles", ["project_admin"]), "project_admin")["_id"]
             roles_list = [{"name": "project_admin", "id": rid}]
 
         new_token = {"issued_at": now,
@@ -216,7 +228,7 @@ class AuthconnInternal(Authconn):
                      "roles": roles_list,
                      }
 
-        self.token_cache[token_id] = new_token
+        self.token_cache.set(token_id, new_token, expires=new_token["expires"])
         self.db.create("tokens", new_token)
         return deepcopy(new_token)
 
@@ -249,6 +261,7 @@ class AuthconnInternal(Authconn):
         :param role_id: role identifier.
         :raises AuthconnOperationException: if role deletion failed.
         """
+        self._invalidate_names_cache("roles", role_id)
         return self.db.del_one("roles", {"_id": role_id})
 
     def update_role(self, role_info):
@@ -261,6 +274,7 @@ class AuthconnInternal(Authconn):
         """
         rid = role_info["_id"]
         self.db.set_one("roles", {"_id": rid}, role_info)   # CONFIRM
+        self._invalidate_names_cache("roles", rid)
         return {"_id": rid, "name": role_info["name"]}
 
     def create_user(self, user_info):
@@ -321,7 +335,7 @@ class AuthconnInternal(Authconn):
         self.db.set_one("users", {idf: uid}, user_data)
         if user_info.get("remove_project_role_mappings"):
             self.db.del_list("tokens", {"user_id" if idf == "_id" else idf: uid})
-            self.token_cache.clear()
+            self.token_cache.pop_if(lambda token: token.get("user_id" if idf == "_id" else idf) == uid)
 
     def delete_user(self, user_id):
         """
@@ -332,7 +346,7 @@ class AuthconnInternal(Authconn):
         """
         self.db.del_one("users", {"_id": user_id})
         self.db.del_list("tokens", {"user_id": user_id})
-        self.token_cache.clear()
+        self.token_cache.pop_if(lambda token: token.get("user_id") == user_id)
         return True
 
     def get_user_list(self, filter_q=None):
@@ -347,8 +361,20 @@ class AuthconnInternal(Authconn):
             filt["username"] = filt["name"]
             del filt["name"]
         users = self.db.get_list("users", filt)
-        project_id_name = {}
-        role_id_name = {}
+        # resolve all the referenced projects and roles at once
+        project_ids = []
+        role_ids = []
+        for user in users:
+            if user.get("project_role_mappings"):
+                for prm in user["project_role_mappings"]:
+                    project_ids.append(prm["project"])
+                    role_ids.append(prm["role"])
+            elif user.get("projects"):
+                project_ids += user["projects"]
+                role_ids.append("project_admin")
+        project_id_name = self._get_id_names("projects", project_ids)
+        role_id_name = self._get_id_names("roles", role_ids)
+
         for user in users:
             prms = user.get("project_role_mappings")
             projects = user.get("projects")
@@ -356,28 +382,19 @@ class AuthconnInternal(Authconn):
                 projects = []
                 # add project_name and role_name. Generate projects for backward compatibility
                 for prm in prms:
-                    project_id = prm["project"]
-                    if project_id not in project_id_name:
-                        pr = self.db.get_one("projects", {BaseTopic.id_field("projects", project_id): project_id},
-                                             fail_on_empty=False)
-                        project_id_name[project_id] = pr["name"] if pr else None
-                    prm["project_name"] = project_id_name[project_id]
+                    pr = project_id_name.get(prm["project"])
+                    prm["project_name"] = pr["name"] if pr else None
                     if prm["project_name"] not in projects:
                         projects.append(prm["project_name"])
-
-                    role_id = prm["role"]
-                    if role_id not in role_id_name:
-                        role = self.db.get_one("roles", {BaseTopic.id_field("roles", role_id): role_id},
-                                               fail_on_empty=False)
-                        role_id_name[role_id] = role["name"] if role else None
-                    prm["role_name"] = role_id_name[role_id]
+                    role = role_id_name.get(prm["role"])
+                    prm["role_name"] = role["name"] if role else None
                 user["projects"] = projects  # for backward compatibility
             elif projects:
                 # user created with an old version. Create a project_role mapping with role project_admin
                 user["project_role_mappings"] = []
-                role = self.db.get_one("roles", {BaseTopic.id_field("roles", "project_admin"): "project_admin"})
+                role = self._get_found("roles", role_id_name, "project_admin")
                 for p_id_name in projects:
-                    pr = self.db.get_one("projects", {BaseTopic.id_field("projects", p_id_name): p_id_name})
+                    pr = self._get_found("projects", project_id_name, p_id_name)
                     prm = {"project": pr["_id"],
                            "project_name": pr["name"],
                            "role_name": "project_admin",
@@ -390,6 +407,52 @@ class AuthconnInternal(Authconn):
 
         return users
 
+    def _get_id_names(self, topic, ids_or_names):
+        """
+        Gets the _id and name of several projects or roles, using a cache. Not cached ones are obtained from database
+        with at most two queries, one by _id and other by name, whatever the number of them
+        :param topic: "projects" or "roles"
+        :param ids_or_names: iterable of _id or names. It can contain repetitions
+        :return: dictionary indexed by the provided _id or name, with the found ones as {"_id": _id, "name": name}
+        """
+        cache = self.names_cache[topic]
+        id_names = {}
+        not_cached = {"_id": set(), "name": set()}
+        for id_or_name in ids_or_names:
+            if id_or_name in id_names:
+                continue
+            content = cache.get(id_or_name)
+            if content:
+                id_names[id_or_name] = content
+            else:
+                not_cached[BaseTopic.id_field(topic, id_or_name)].add(id_or_name)
+        for field, values in not_cached.items():
+            if not values:
+                continue
+            expires = time() + self.names_cache_age
+            for db_content in self.db.get_list(topic, {field + ".cont": list(values)}):
+                content = {"_id": db_content["_id"], "name": db_content["name"]}
+                id_names[content[field]] = content
+                cache.set(content["_id"], content, expires=expires)
+                cache.set(content["name"], content, expires=expires)
+        return id_names
+
+    @staticmethod
+    def _get_found(topic, id_names, id_or_name):
+        """
+        Gets a content obtained with _get_id_names, raising the same exception as db.get_one if not found
+        """
+        if id_or_name not in id_names:
+            raise DbException("Not found any {} with filter='{}'".format(
+                topic[:-1], {BaseTopic.id_field(topic, id_or_name): id_or_name}), HTTPStatus.NOT_FOUND)
+        return id_names[id_or_name]
+
+    def _invalidate_names_cache(self, topic, id_or_name):
+        """
+        Removes a project or role from the cache of names, because it has been changed
+        """
+        self.names_cache[topic].pop_if(lambda content: id_or_name in (content["_id"], content["name"]))
+
     def get_project_list(self, filter_q={}):
         """
         Get role list.
@@ -418,6 +481,7 @@ class AuthconnInternal(Authconn):
         """
         filter_q = {BaseTopic.id_field("projects", project_id): project_id}
         r = self.db.del_one("projects", filter_q)
+        self._invalidate_names_cache("projects", project_id)
         return r
 
     def update_project(self, project_id, project_info):
@@ -430,3 +494,4 @@ class AuthconnInternal(Authconn):
         :raises AuthconnOperationException: if project update failed.
         """
         self.db.set_one("projects", {BaseTopic.id_field("projects", project_id): project_id}, project_info)
+        self._invalidate_names_cache("projects", project_id)
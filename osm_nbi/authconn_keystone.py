@@ -35,21 +35,54 @@ from osm_nbi.authconn import Authconn, AuthException, AuthconnOperationException
 import logging
 import requests
 import time
+from copy import deepcopy
+from threading import Event, Lock
 from keystoneauth1 import session
 from keystoneauth1.identity import v3
 from keystoneauth1.exceptions.base import ClientException
-from keystoneauth1.exceptions.http import Conflict
+from keystoneauth1.exceptions.http import Conflict, NotFound, Unauthorized
 from keystoneclient.v3 import client
 from http import HTTPStatus
 from osm_nbi.validation import is_valid_uuid
+from osm_nbi.cache import LruCache
+
+
+class _TokenValidation:
+    """
+    A validation of a token in progress against keystone. Other threads validating the same token wait for its result
+    """
+    def __init__(self):
+        self.done = Event()
+        self.token_info = None
+        self.exception = None
 
 
 class AuthconnKeystone(Authconn):
+    token_cache_max_age = 300       # maximum seconds a validated token is trusted without asking again to keystone
+    token_cache_expiry_margin = 30  # validated tokens are not trusted during the last seconds before expiration
+    invalid_token_cache_age = 60    # seconds an invalid token is rejected without asking again to keystone
+    directory_cache_age = 60        # seconds the snapshot of keystone users, projects and roles is used
+
     def __init__(self, config, db, token_cache):
         Authconn.__init__(self, config, db, token_cache)
 
         self.logger = logging.getLogger("nbi.authenticator.keystone")
 
+        # tokens shared with the authenticator, that stores there the login information and removes the revoked ones
+        self.token_cache = token_cache if token_cache is not None else LruCache(max_size=10000)
+        # results of the keystone validations, only used while the token is at token_cache. And negative cache of
+        # invalid tokens. Content: token: error text
+        self.validated_token_cache = LruCache(max_size=10000)
+        self.invalid_token_cache = LruCache(max_size=10000)
+        self.token_cache_max_age = int(config.get("token_cache_max_age", self.token_cache_max_age))
+        self.invalid_token_cache_age = int(config.get("invalid_token_cache_age", self.invalid_token_cache_age))
+        self._validations = {}  # validations in progress. token: _TokenValidation
+        self._validations_lock = Lock()
+        self.directory_cache_age = int(config.get("directory_cache_age", self.directory_cache_age))
+        self._directory = None  # snapshot of users, projects, roles and role assignments. See _get_directory
+        self._directory_version = 0  # increased at every change, so that an ongoing snapshot is discarded
+        self._directory_lock = Lock()
+
         self.auth_url = "http://{0}:{1}/v3".format(config.get("auth_url", "keystone"), config.get("auth_port", "5000"))
         self.user_domain_name = config.get("user_domain_name", "default")
         self.admin_project = config.get("service_project", "service")
@@ -160,7 +193,11 @@ class AuthconnKeystone(Authconn):
 
     def validate_token(self, token):
         """
-        Check if the token is valid.
+        Check if the token is valid. Validated tokens are cached until shortly before expiration, but no more than
+        token_cache_max_age seconds, and while they are not removed from the shared token_cache (e.g. revoked).
+        The login information stored there by the authenticator is not a validation. Invalid tokens are cached for
+        invalid_token_cache_age seconds. Concurrent validations of the same token are done with only one request to
+        keystone
 
         :param token: token id to be validated
         :return: dictionary with information associated with the token:
@@ -169,11 +206,54 @@ class AuthconnKeystone(Authconn):
              "project_id": project_id,
              "username": ,
              "roles": list with dict containing {name, id}
+         Each caller obtains its own copy, as it is modified with the permissions of the request.
          If the token is not valid an exception is raised.
         """
         if not token:
             return
 
+        token_info = self.validated_token_cache.get(token)
+        if token_info and self.token_cache.peek(token) is not None:
+            return deepcopy(token_info)
+        error_text = self.invalid_token_cache.get(token)
+        if error_text:
+            raise AuthException(error_text, http_code=HTTPStatus.UNAUTHORIZED)
+
+        with self._validations_lock:
+            validation = self._validations.get(token)
+            in_progress = validation is not None
+            if not in_progress:
+                validation = self._validations[token] = _TokenValidation()
+        if in_progress:
+            # other thread is validating this token
+            validation.done.wait()
+            if validation.exception:
+                raise validation.exception
+            return deepcopy(validation.token_info)
+
+        try:
+            token_info = validation.token_info = self._validate_token_keystone(token)
+            expires = min(token_info["expires"] - self.token_cache_expiry_margin,
+                          time.time() + self.token_cache_max_age)
+            self.validated_token_cache.set(token, token_info, expires=expires)
+            if self.token_cache.peek(token) is None:
+                self.token_cache.set(token, token_info, expires=token_info["expires"])
+            return deepcopy(validation.token_info)
+        except Exception as e:
+            validation.exception = e
+            raise
+        finally:
+            with self._validations_lock:
+                self._validations.pop(token, None)
+            validation.done.set()
+
+    def _validate_token_keystone(self, token):
+        """
+        Validates a token against keystone
+        :param token: token id to be validated
+        :return: dictionary with information associated with the token. If the token is not valid an exception is
+            raised, and it is stored at the invalid tokens cache
+        """
         try:
             token_info = self.keystone.tokens.validate(token=token)
             ses = {
@@ -191,8 +271,28 @@ class AuthconnKeystone(Authconn):
             return ses
         except ClientException as e:
             # self.logger.exception("Error during token validation using keystone: {}".format(e))
-            raise AuthException("Error during token validation using Keystone: {}".format(e),
-                                http_code=HTTPStatus.UNAUTHORIZED)
+            error_text = "Error during token validation using Keystone: {}".format(e)
+            if isinstance(e, (NotFound, Unauthorized)):
+                # the token is not valid. Other errors, as connection problems, are not cached
+                self.invalid_token_cache.set(token, error_text, expires=time.time() + self.invalid_token_cache_age)
+            raise AuthException(error_text, http_code=HTTPStatus.UNAUTHORIZED)
+
+    def is_token_cached(self, token):
+        """
+        Check if the token can be validated from memory, without any access to keystone.
+
+        :param token: token to check
+        :return: True if validate_token will not block, False otherwise
+        """
+        return (self.validated_token_cache.peek(token) is not None and self.token_cache.peek(token) is not None) or \
+            self.invalid_token_cache.peek(token) is not None
+
+    def get_cache_stats(self):
+        """
+        :return: dictionary with the statistics of the validated and invalid token caches
+        """
+        return {"tokens": self.validated_token_cache.get_stats(),
+                "invalid_tokens": self.invalid_token_cache.get_stats()}
 
     def revoke_token(self, token):
         """
@@ -202,6 +302,8 @@ class AuthconnKeystone(Authconn):
         """
         try:
             self.logger.info("Revoking token: " + token)
+            self.token_cache.pop(token, None)
+            self.validated_token_cache.pop(token, None)
             self.keystone.tokens.revoke_token(token=token)
 
             return True
@@ -210,6 +312,62 @@ class AuthconnKeystone(Authconn):
             raise AuthException("Error during token revocation using Keystone: {}".format(e),
                                 http_code=HTTPStatus.UNAUTHORIZED)
 
+    def _get_directory(self):
+        """
+        Gets a snapshot of keystone users, projects, roles and project role assignments, obtained with four bulk
+        requests instead of asking for the projects and roles of every user. The snapshot is taken again after
+        directory_cache_age seconds, or after a change done through this connector.
+        :return: dictionary with "users": list of users, "projects" and "roles": dictionaries indexed by _id,
+            "assignments": dictionary indexed by user _id with a list of (project _id, role _id) tuples
+        :raises: ClientException if keystone fails
+        """
+        directory = self._directory
+        if directory and directory["expires"] > time.time():
+            return directory
+        with self._directory_lock:
+            directory = self._directory
+            if directory and directory["expires"] > time.time():
+                return directory  # refreshed by another thread meanwhile
+            version = self._directory_version
+            expires = time.time() + self.directory_cache_age
+            users = [{
+                "username": user.name,
+                "_id": user.id,
+                "id": user.id,
+                "_admin": user.to_dict().get("_admin", {})   # TODO: REVISE
+            } for user in self.keystone.users.list()]
+            projects = {project.id: {
+                "name": project.name,
+                "_id": project.id,
+                "_admin": project.to_dict().get("_admin", {}),  # TODO: REVISE
+                "quotas": project.to_dict().get("quotas", {}),  # TODO: REVISE
+            } for project in self.keystone.projects.list()}
+            roles = {role.id: {
+                "name": role.name,
+                "_id": role.id,
+                "_admin": role.to_dict().get("_admin", {}),
+                "permissions": role.to_dict().get("permissions", {})
+            } for role in self.keystone.roles.list()}
+            assignments = {}
+            for assignment in self.keystone.role_assignments.list():
+                # only direct assignments of users to projects
+                user = getattr(assignment, "user", None)
+                project = getattr(assignment, "scope", {}).get("project")
+                if user and project:
+                    assignments.setdefault(user["id"], []).append((project["id"], assignment.role["id"]))
+            directory = {"expires": expires, "users": users, "projects": projects, "roles": roles,
+                         "assignments": assignments}
+            if version == self._directory_version:
+                self._directory = directory
+            return directory
+
+    def invalidate_directory(self):
+        """
+        Forces a new snapshot of keystone users, projects and roles after a change, done here or at other NBI instance
+        """
+        self._directory_version += 1
+        self._directory = None
+
     def create_user(self, user_info):
         """
         Create a user.
@@ -221,6 +379,7 @@ class AuthconnKeystone(Authconn):
         try:
             new_user = self.keystone.users.create(user_info["username"], password=user_info["password"],
                                                   domain=self.user_domain_name, _admin=user_info["_admin"])
+            self.invalidate_directory()
             if "project_role_mappings" in user_info.keys():
                 for mapping in user_info["project_role_mappings"]:
                     self.assign_role_to_user(new_user.id, mapping["project"], mapping["role"])
@@ -258,6 +417,7 @@ class AuthconnKeystone(Authconn):
                 self.remove_role_from_user(user_id, mapping["project"], mapping["role"])
             for mapping in user_info.get("add_project_role_mappings", []):
                 self.assign_role_to_user(user_id, mapping["project"], mapping["role"])
+            self.invalidate_directory()
         except ClientException as e:
             # self.logger.exception("Error during user password/name update using keystone: {}".format(e))
             raise AuthconnOperationException("Error during user update using Keystone: {}".format(e))
@@ -271,6 +431,7 @@ class AuthconnKeystone(Authconn):
         """
         try:
             result, detail = self.keystone.users.delete(user_id)
+            self.invalidate_directory()
             if result.status_code != 204:
                 raise ClientException("error {} {}".format(result.status_code, detail))
             return True
@@ -289,33 +450,31 @@ class AuthconnKeystone(Authconn):
             filter_name = None
             if filter_q:
                 filter_name = filter_q.get("name") or filter_q.get("username")
-            users = self.keystone.users.list(name=filter_name)
-            users = [{
-                "username": user.name,
-                "_id": user.id,
-                "id": user.id,
-                "_admin": user.to_dict().get("_admin", {})   # TODO: REVISE
-            } for user in users if user.name != self.admin_username]
+            directory = self._get_directory()
+            users = [user for user in directory["users"] if user["username"] != self.admin_username and
+                     (not filter_name or user["username"] == filter_name)]
 
             if filter_q and filter_q.get("_id"):
                 users = [user for user in users if filter_q["_id"] == user["_id"]]
 
+            users = deepcopy(users)
             for user in users:
                 user["project_role_mappings"] = []
                 user["projects"] = []
-                projects = self.keystone.projects.list(user=user["_id"])
-                for project in projects:
-                    user["projects"].append(project.name)
-
-                    roles = self.keystone.roles.list(user=user["_id"], project=project.id)
-                    for role in roles:
-                        prm = {
-                            "project": project.id,
-                            "project_name": project.name,
-                            "role_name": role.name,
-                            "role": role.id,
-                        }
-                        user["project_role_mappings"].append(prm)
+                for project_id, role_id in directory["assignments"].get(user["_id"], ()):
+                    project = directory["projects"].get(project_id)
+                    role = directory["roles"].get(role_id)
+                    if not project or not role:
+                        continue
+                    if project["name"] not in user["projects"]:
+                        user["projects"].append(project["name"])
+                    prm = {
+                        "project": project["_id"],
+                        "project_name": project["name"],
+                        "role_name": role["name"],
+                        "role": role["_id"],
+                    }
+                    user["project_role_mappings"].append(prm)
 
             return users
         except ClientException as e:
@@ -333,19 +492,13 @@ class AuthconnKeystone(Authconn):
             filter_name = None
             if filter_q:
                 filter_name = filter_q.get("name")
-            roles_list = self.keystone.roles.list(name=filter_name)
-
-            roles = [{
-                "name": role.name,
-                "_id": role.id,
-                "_admin": role.to_dict().get("_admin", {}),
-                "permissions": role.to_dict().get("permissions", {})
-            } for role in roles_list if role.name != "service"]
+            roles = [role for role in self._get_directory()["roles"].values()
+                     if role["name"] != "service" and (not filter_name or role["name"] == filter_name)]
 
             if filter_q and filter_q.get("_id"):
                 roles = [role for role in roles if filter_q["_id"] == role["_id"]]
 
-            return roles
+            return deepcopy(roles)
         except ClientException as e:
             # self.logger.exception("Error during user role listing using keystone: {}".format(e))
             raise AuthException("Error during user role listing using Keystone: {}".format(e),
@@ -361,6 +514,7 @@ class AuthconnKeystone(Authconn):
         try:
             result = self.keystone.roles.create(role_info["name"], permissions=role_info.get("permissions"),
                                                 _admin=role_info.get("_admin"))
+            self.invalidate_directory()
             return result.id
         except Conflict as ex:
             raise AuthconnConflictException(str(ex))
@@ -377,6 +531,7 @@ class AuthconnKeystone(Authconn):
         """
         try:
             result, detail = self.keystone.roles.delete(role_id)
+            self.invalidate_directory()
 
             if result.status_code != 204:
                 raise ClientException("error {} {}".format(result.status_code, detail))
@@ -401,6 +556,7 @@ class AuthconnKeystone(Authconn):
                 rid = role_obj_list[0].id
             self.keystone.roles.update(rid, name=role_info["name"], permissions=role_info.get("permissions"),
                                        _admin=role_info.get("_admin"))
+            self.invalidate_directory()
         except ClientException as e:
             # self.logger.exception("Error during role update using keystone: {}".format(e))
             raise AuthconnOperationException("Error during role updating using Keystone: {}".format(e))
@@ -416,20 +572,14 @@ class AuthconnKeystone(Authconn):
             filter_name = None
             if filter_q:
                 filter_name = filter_q.get("name")
-            projects = self.keystone.projects.list(name=filter_name)
-
-            projects = [{
-                "name": project.name,
-                "_id": project.id,
-                "_admin": project.to_dict().get("_admin", {}),  # TODO: REVISE
-                "quotas": project.to_dict().get("quotas", {}),  # TODO: REVISE
-            } for project in projects]
+            projects = [project for project in self._get_directory()["projects"].values()
+                        if not filter_name or project["name"] == filter_name]
 
             if filter_q and filter_q.get("_id"):
                 projects = [project for project in projects
                             if filter_q["_id"] == project["_id"]]
 
-            return projects
+            return deepcopy(projects)
         except ClientException as e:
             # self.logger.exception("Error during user project listing using keystone: {}".format(e))
             raise AuthException("Error during user project listing using Keystone: {}".format(e),
@@ -448,6 +598,7 @@ class AuthconnKeystone(Authconn):
                                                    _admin=project_info["_admin"],
                                                    quotas=project_info.get("quotas", {})
                                                    )
+            self.invalidate_directory()
             return result.id
         except ClientException as e:
             # self.logger.exception("Error during project creation using keystone: {}".format(e))
@@ -466,6 +617,7 @@ class AuthconnKeystone(Authconn):
             # result, _ = self.keystone.projects.delete(project_obj)
 
             result, detail = self.keystone.projects.delete(project_id)
+            self.invalidate_directory()
             if result.status_code != 204:
                 raise ClientException("error {} {}".format(result.status_code, detail))
 
@@ -486,6 +638,7 @@ class AuthconnKeystone(Authconn):
                                           _admin=project_info["_admin"],
                                           quotas=project_info.get("quotas", {})
                                           )
+            self.invalidate_directory()
         except ClientException as e:
             # self.logger.exception("Error during project update using keystone: {}".format(e))
             raise AuthconnOperationException("Error during project update using Keystone: {}".format(e))
@@ -525,6 +678,7 @@ class AuthconnKeystone(Authconn):
                 role_obj = role_obj_list[0]
 
             self.keystone.roles.grant(role_obj, user=user_obj, project=project_obj)
+            self.invalidate_directory()
         except ClientException as e:
             # self.logger.exception("Error during user role assignment using keystone: {}".format(e))
             raise AuthconnOperationException("Error during role '{}' assignment to user '{}' and project '{}' using "
@@ -566,6 +720,7 @@ class AuthconnKeystone(Authconn):
                 role_obj = role_obj_list[0]
 
             self.keystone.roles.revoke(role_obj, user=user_obj, project=project_obj)
+            self.invalidate_directory()
         except ClientException as e:
             # self.logger.exception("Error during user role revocation using keystone: {}".format(e))
             raise AuthconnOperationException("Error during role '{}' revocation to user '{}' and project '{}' using "
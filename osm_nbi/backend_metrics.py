@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from asyncio import iscoroutinefunction
+from functools import partial, wraps
+from time import perf_counter
+from osm_nbi.db_indexes import get_filter_fields, project_filter_fields
+from osm_nbi import metrics
+
+
+labelnames = ("backend", "method", "topic", "filter")
+# filter label of the fields that are not known for the collection, as they come from the user query strings
+other_fields = "other"
+
+
+def get_known_fields(catalogue):
+    """
+    Obtains the fields used as filter label by collection, that is, the _id, project filter and indexed fields
+    :param catalogue: dictionary by collection with a tuple of indexes, each one a tuple of fields. Can be None
+    :return: dictionary by collection with a set of fields
+    """
+    known_fields = {}
+    for collection, indexes in (catalogue or {}).items():
+        known_fields[collection] = {field for index in indexes for field in index}
+    return known_fields
+
+
+def _filter_label(fields, known_fields):
+    label_fields = [field for field in fields if field == "_id" or field in project_filter_fields or
+                    field in known_fields]
+    if len(label_fields) < len(fields):
+        label_fields.append(other_fields)
+    return ",".join(label_fields)
+
+
+def _db_labels(known_fields, method_name, args, kwargs):
+    # database methods receive the collection first, and the filter second (except create and replace)
+    table = args[0] if args else kwargs.get("table", "")
+    if method_name in ("create", "create_list"):
+        return table, ""
+    if method_name == "replace":
+        return table, "_id"
+    q_filter = args[1] if len(args) > 1 else kwargs.get("q_filter")
+    return table, _filter_label(get_filter_fields(q_filter), known_fields.get(table, ()))
+
+
+def _fs_labels(method_name, args, kwargs):
+    # storage paths start with the item _id, that is not used as topic to keep the number of labels bounded
+    return "", ""
+
+
+def _msg_labels(method_name, args, kwargs):
+    return (args[0] if args else kwargs.get("topic", "")), ""
+
+
+def _result_size(result):
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    if isinstance(result, dict):
+        return result["deleted"] if len(result) == 1 and "deleted" in result else 1
+    return 0
+
+
+class BackendMetrics:
+    """
+    Records the number of calls, errors, latency and number of items returned by the database, storage and message
+    methods, by backend, method, topic and filter keys. The objects are instrumented in place, so that the driver type
+    is kept. Nothing is recorded for the objects not attached. Filter keys that are not indexed are labelled as
+    "other", so that user queries do not create an unbounded number of series
+    """
+    db_methods = ("get_list", "get_list_projected", "get_one", "count", "create", "create_list", "set_one", "set_list",
+                  "replace", "del_one", "del_list")
+    fs_methods = ("file_exists", "file_size", "file_open", "file_extract", "file_delete", "dir_ls", "dir_rename",
+                  "mkdir", "sync")
+    msg_methods = ("write", "aiowrite")
+
+    def __init__(self, registry=None):
+        registry = registry or metrics.registry
+        self.requests = registry.counter("osm_nbi_backend_requests_total", "Calls to database, storage and message "
+                                         "methods", labelnames)
+        self.errors = registry.counter("osm_nbi_backend_errors_total", "Calls to database, storage and message "
+                                       "methods that raised an exception", labelnames)
+        self.latency = registry.histogram("osm_nbi_backend_latency_seconds", "Duration of the calls to database, "
+                                          "storage and message methods", labelnames)
+        self.items = registry.counter("osm_nbi_backend_result_items_total", "Number of items returned or deleted "
+                                      "by database methods, and entries listed by storage", labelnames)
+
+    def attach_db(self, db, catalogue=None):
+        """
+        Instruments the database methods
+        :param db: database object
+        :param catalogue: dictionary by collection with a tuple of indexes, whose fields are used as filter label.
+            Only _id and the project filter fields are used if not provided
+        :return: None
+        """
+        self._attach(db, "db", self.db_methods, partial(_db_labels, get_known_fields(catalogue)))
+
+    def attach_fs(self, fs):
+        self._attach(fs, "fs", self.fs_methods, _fs_labels)
+
+    def attach_msg(self, msg):
+        self._attach(msg, "msg", self.msg_methods, _msg_labels)
+
+    def _attach(self, obj, backend, method_names, get_labels):
+        for method_name in method_names:
+            if hasattr(obj, method_name):
+                setattr(obj, method_name, self._instrument(getattr(obj, method_name), backend, method_name,
+                                                           get_labels))
+
+    def _record(self, labels, start, result=None, error=False):
+        self.latency.observe(labels, perf_counter() - start)
+        self.requests.inc(labels)
+        if error:
+            self.errors.inc(labels)
+        else:
+            size = _result_size(result)
+            if size:
+                self.items.inc(labels, size)
+
+    def _instrument(self, method, backend, method_name, get_labels):
+        if iscoroutinefunction(method):
+            @wraps(method)
+            async def instrumented_async(*args, **kwargs):
+                labels = (backend, method_name) + get_labels(method_name, args, kwargs)
+                start = perf_counter()
+                try:
+                    result = await method(*args, **kwargs)
+                except Exception:
+                    self._record(labels, start, error=True)
+                    raise
+                self._record(labels, start, result)
+                return result
+            return instrumented_async
+
+        @wraps(method)
+        def instrumented(*args, **kwargs):
+            labels = (backend, method_name) + get_labels(method_name, args, kwargs)
+            start = perf_counter()
+            try:
+                result = method(*args, **kwargs)
+            except Exception:
+                self._record(labels, start, error=True)
+                raise
+            self._record(labels, start, result)
+            return result
+        return instrumented
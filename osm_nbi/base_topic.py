@@ -14,10 +14,13 @@
 # limitations under the License.
 
 import logging
+from functools import partial
 from uuid import uuid4
 from http import HTTPStatus
 from time import time
-from osm_common.dbbase import deep_update_rfc7396
+from osm_common.dbbase import deep_update_rfc7396, DbException
+from osm_common.dbmongo import DbMongo
+from pymongo import UpdateOne
 from osm_nbi.validation import validate_input, ValidationError, is_valid_uuid
 
 __author__ = "Alfonso Tierno <alfonso.tiernosepulveda@telefonica.com>"
@@ -64,6 +67,108 @@ def versiontuple(v):
     return tuple(filled)
 
 
+def bulk_create(db, table, contents):
+    """
+    Inserts several entries at database with one round trip when the database driver allows it, either with its
+    create_list method or with a native mongo insert_many. Otherwise they are inserted one by one
+    :param db: database driver
+    :param table: collection
+    :param contents: list of entries to insert. Each one must contain its "_id"
+    :return: list of inserted _id
+    """
+    if not contents:
+        return []
+    if hasattr(db, "create_list"):
+        return db.create_list(table, contents)
+    if isinstance(db, DbMongo):
+        try:
+            db.db[table].insert_many(contents, ordered=True)
+        except Exception as e:  # pymongo errors
+            raise DbException(e, HTTPStatus.INTERNAL_SERVER_ERROR)
+        return [content["_id"] for content in contents]
+    return [db.create(table, content) for content in contents]
+
+
+def bulk_set(db, table, updates, fail_on_empty=True):
+    """
+    Updates several entries at database, each one with its own content, with one round trip when the database driver
+    is mongo (bulk_write). Otherwise they are updated one by one
+    :param db: database driver
+    :param table: collection
+    :param updates: list of tuples (_id, update_dict). Entries with an empty update_dict are skipped
+    :param fail_on_empty: raise an exception if any of the entries is not found
+    :return: number of updated entries
+    """
+    updates = [(_id, update_dict) for _id, update_dict in updates if update_dict]
+    if not updates:
+        return 0
+    if isinstance(db, DbMongo):
+        try:
+            result = db.db[table].bulk_write([UpdateOne({"_id": _id}, {"$set": update_dict})
+                                              for _id, update_dict in updates], ordered=True)
+        except Exception as e:  # pymongo errors
+            raise DbException(e, HTTPStatus.INTERNAL_SERVER_ERROR)
+        if fail_on_empty and result.matched_count < len(updates):
+            not_found = len(updates) - result.matched_count
+            raise DbException("{} of {} entries not found at '{}'".format(not_found, len(updates), table),
+                              HTTPStatus.NOT_FOUND)
+        return result.matched_count
+    for _id, update_dict in updates:
+        db.set_one(table, {"_id": _id}, update_dict, fail_on_empty=fail_on_empty)
+    return len(updates)
+
+
+def get_list_projected(db, table, q_filter=None, projection=None, limit=None):
+    """
+    Gets a list from a mongo database with a native find, so that field selection, sorting and limit are done by the
+    database. It is added as 'get_list_projected' method of the mongo database driver by extend_db, so that it is
+    instrumented as the rest of database methods. Use it through the driver method, not directly
+    :param db: mongo database driver
+    :param table: collection
+    :param q_filter: osm_common filter
+    :param projection: mongo projection. None for all fields
+    :param limit: maximum number of items to return, sorted by _id. None for all of them, unsorted
+    :return: list of items
+    """
+    try:
+        cursor = db.db[table].find(db._format_filter(q_filter or {}), projection)
+        if limit:
+            cursor = cursor.sort("_id", 1).limit(limit)
+        return list(cursor)
+    except Exception as e:  # pymongo errors
+        raise DbException(e, HTTPStatus.INTERNAL_SERVER_ERROR)
+
+
+def extend_db(db):
+    """
+    Adds to the database driver the methods not provided by osm_common: get_list_projected for mongo. It must be
+    called before the driver methods are instrumented (metrics, tracing, index advisor)
+    :param db: database driver
+    :return: None
+    """
+    if isinstance(db, DbMongo) and not hasattr(db, "get_list_projected"):
+        db.get_list_projected = partial(get_list_projected, db)
+
+
+def get_descriptor(db, topic, _id, project_filter=None, fail_on_empty=True):
+    """
+    Gets a vnfd, nsd or nst by its _id. It is obtained from the descriptor cache when enabled, otherwise from database.
+    All the topics must use this function for reading these descriptors by _id
+    :param db: database driver
+    :param topic: "vnfds", "nsds" or "nsts"
+    :param _id: descriptor internal _id
+    :param project_filter: project filter, as returned by BaseTopic._get_project_filter. None for not filtering
+    :param fail_on_empty: raise DbException NOT_FOUND if not found. Otherwise None is returned
+    :return: the descriptor. It is a copy that can be modified
+    """
+    if BaseTopic.descriptor_cache and topic in BaseTopic.descriptor_cache.topics:
+        return BaseTopic.descriptor_cache.get(topic, _id, project_filter, fail_on_empty=fail_on_empty)
+    filter_q = {"_id": _id}
+    if project_filter:
+        filter_q.update(project_filter)
+    return db.get_one(topic, filter_q, fail_on_empty=fail_on_empty, fail_on_more=False)
+
+
 class BaseTopic:
     # static variables for all instance classes
     topic = None        # to_override
@@ -73,6 +178,12 @@ class BaseTopic:
     multiproject = True  # True if this Topic can be shared by several projects. Then it contains _admin.projects_read
 
     default_quota = 500
+    quota_ledger = None  # QuotaLedger shared by all topics, set by Engine. None for counting items at every check
+    descriptor_cache = None  # DescriptorCache shared by all topics, set by Engine. None for reading always database
+    token_cache = None  # tokens cache of this NBI instance, set by Engine. Revoked tokens are removed from it
+    default_exclude_fields = ()  # SOL005 "default exclude set". Not returned when query string 'exclude_default'
+    # database indexes of the topic collection, each one a tuple of fields. Ensured by Engine at database init
+    db_indexes = (("_admin.projects_read",), ("name",))
 
     # Alternative ID Fields for some Topics
     alt_id_field = {
@@ -120,11 +231,64 @@ class BaseTopic:
             proj = self.auth.get_project(project)
             pid = proj["_id"]
             quota = proj.get("quotas", {}).get(self.topic, self.default_quota)
-            count = self.db.count(self.topic, {"_admin.projects_read": pid})
+            if self.quota_ledger:
+                count = self.quota_ledger.get_usage(self.topic, pid)
+            else:
+                count = self.db.count(self.topic, {"_admin.projects_read": pid})
             if count >= quota:
                 name = proj["name"]
                 raise ValidationError("{} quota ({}) exceeded for project {} ({})".format(self.topic, quota, name, pid))
 
+    def update_quota_usage(self, project_ids, increment, topic=None):
+        """
+        Updates the quota ledger after creating, sharing or removing an item. Errors are only logged, as the ledger is
+        reconciled periodically
+        :param project_ids: list of projects that gain or lose the item
+        :param increment: 1 for a new item, -1 for a removed one
+        :param topic: database collection. By default the one of this topic
+        :return: None
+        """
+        if not self.quota_ledger or not project_ids:
+            return
+        try:
+            self.quota_ledger.add(topic or self.topic, project_ids, increment)
+        except Exception as e:
+            self.logger.error("Cannot update quota usage of {} for projects {}: {}".format(
+                topic or self.topic, project_ids, e))
+
+    def _create_list(self, rollback, contents, topic=None):
+        """
+        Creates several entries at database with a single round trip when the database driver allows it
+        :param rollback: list where one entry covering all the created items is appended
+        :param contents: list of entries to insert, each one with its "_id"
+        :param topic: database collection. By default the one of this topic
+        :return: list of inserted _id
+        """
+        if not contents:
+            return []
+        topic = topic or self.topic
+        # appended before writing, so that a partial insertion is also removed
+        rollback.append({"topic": topic, "_ids": [content["_id"] for content in contents]})
+        return bulk_create(self.db, topic, contents)
+
+    def _set_list(self, rollback, updates, topic=None):
+        """
+        Updates several entries at database, each one with its own content, with a single round trip when the database
+        driver allows it
+        :param rollback: list where one entry covering all the updated items is appended
+        :param updates: list of tuples (_id, update_dict, rollback_dict), where rollback_dict contains the original
+            values of the updated keys
+        :param topic: database collection. By default the one of this topic
+        :return: None
+        """
+        updates = [update for update in updates if update[1]]
+        if not updates:
+            return
+        topic = topic or self.topic
+        rollback.append({"topic": topic, "operation": "set_list",
+                         "contents": [(_id, rollback_dict) for _id, _, rollback_dict in updates]})
+        bulk_set(self.db, topic, [(_id, update_dict) for _id, update_dict, _ in updates])
+
     def _validate_input_new(self, input, force=False):
         """
         Validates input user content for a new entry. It uses jsonschema. Some overrides will use pyangbind
@@ -282,6 +446,14 @@ class BaseTopic:
             final_content["_admin"]["modified"] = now
         return None
 
+    def _invalidate_cache(self, _id=None):
+        """
+        Removes an edited or deleted item from the descriptor cache, if this topic is cached
+        :param _id: item internal _id. None for all the items
+        """
+        if self.descriptor_cache:
+            self.descriptor_cache.invalidate(self.topic, _id)
+
     def _send_msg(self, action, content, not_send_msg=None):
         if self.topic_msg and not_send_msg is not False:
             content.pop("_admin", None)
@@ -336,11 +508,13 @@ class BaseTopic:
             raise EngineException(
                 "Invalid query string '{}'. Index '{}' out of  range".format(k, kitem_old))
 
-    def show(self, session, _id):
+    def show(self, session, _id, kwargs=None):
         """
         Get complete information on an topic
         :param session: contains "username", "admin", "force", "public", "project_id", "set_project"
         :param _id: server internal id
+        :param kwargs: query string. Only SOL005 attribute selectors are used: all_fields, fields, exclude_fields,
+            exclude_default
         :return: dictionary, raise exception if not found.
         """
         if not self.multiproject:
@@ -349,8 +523,15 @@ class BaseTopic:
             filter_db = self._get_project_filter(session)
         # To allow project&user addressing by name AS WELL AS _id
         filter_db[BaseTopic.id_field(self.topic, _id)] = _id
-        return self.db.get_one(self.topic, filter_db)
-        # TODO transform data for SOL005 URL requests
+        projection = self._get_projection(kwargs)
+        if not projection:
+            return self.db.get_one(self.topic, filter_db)
+        content = self._get_list_from_db(filter_db, projection=projection)
+        if not content:
+            raise DbException("Not found entry with filter='{}'".format(filter_db), HTTPStatus.NOT_FOUND)
+        elif len(content) > 1:
+            raise DbException("Found more than one entry with filter='{}'".format(filter_db), HTTPStatus.CONFLICT)
+        return content[0]
         # TODO remove _admin if not admin
 
     def get_file(self, session, _id, path=None, accept_header=None):
@@ -368,17 +549,173 @@ class BaseTopic:
         """
         Get a list of the topic that matches a filter
         :param session: contains the used login username and working project
-        :param filter_q: filter of data to be applied
+        :param filter_q: filter of data to be applied. It can contain SOL005 attribute selectors
         :return: The list, it can be empty if no one match the filter.
         """
         if not filter_q:
             filter_q = {}
+        projection = self._get_projection(filter_q)
         if self.multiproject:
             filter_q.update(self._get_project_filter(session))
 
         # TODO transform data for SOL005 URL requests. Transform filtering
-        # TODO implement "field-type" query string SOL005
-        return self.db.get_list(self.topic, filter_q)
+        return self._get_list_from_db(filter_q, projection=projection)
+
+    def _get_projection(self, kwargs):
+        """
+        Extracts the SOL005 attribute selectors (all_fields, fields, exclude_fields, exclude_default) from the query
+        string and obtains the fields to be returned. If no selector is provided, all fields are returned
+        :param kwargs: query string. Attribute selectors are removed from it
+        :return: None to return all the fields, or a database projection dictionary: {field: 1} for the fields to be
+            included (and "_id"), or {field: 0} for the fields to be excluded
+        """
+        if not kwargs:
+            return None
+        selectors = {k: kwargs.pop(k) for k in ("all_fields", "fields", "exclude_fields", "exclude_default")
+                     if k in kwargs}
+        if not selectors:
+            return None
+        if "all_fields" in selectors:
+            if len(selectors) > 1:
+                raise EngineException("Query string 'all_fields' cannot be combined with other attribute selectors")
+            return None
+        if "fields" in selectors and "exclude_fields" in selectors:
+            raise EngineException("Query strings 'fields' and 'exclude_fields' cannot be combined")
+
+        def _get_field_list(value):
+            if not value:
+                return []
+            if isinstance(value, str):
+                return value.split(",")
+            return list(value)
+
+        def _remove_nested(field_list):
+            # a field inside another one of the list is redundant and not allowed by database projections
+            return [f for f in field_list if not any(f.startswith(other + ".") for other in field_list)]
+
+        fields = _get_field_list(selectors.get("fields"))
+        exclude_fields = _get_field_list(selectors.get("exclude_fields"))
+        if "exclude_default" in selectors:
+            # fields are those of the default exclude set that must be returned
+            exclude_fields += [f for f in self.default_exclude_fields
+                               if not any(f == x or f.startswith(x + ".") or x.startswith(f + ".") for x in fields)]
+            fields = []
+        if fields:
+            return {f: 1 for f in _remove_nested(fields + ["_id"])}
+        if exclude_fields:
+            return {f: 0 for f in _remove_nested(exclude_fields)}
+        return None
+
+    @staticmethod
+    def _apply_projection(content, projection):
+        """
+        Selects the fields of a content already loaded, in the same way that a database projection does
+        :param content: dictionary with the item content
+        :param projection: projection dictionary as returned by _get_projection, or None
+        :return: the same content if projection is None or excludes fields (it is modified), or a new dictionary
+        """
+        def _exclude(target, key_list):
+            if isinstance(target, list):
+                for item in target:
+                    _exclude(item, key_list)
+            elif isinstance(target, dict) and key_list[0] in target:
+                if len(key_list) == 1:
+                    del target[key_list[0]]
+                else:
+                    _exclude(target[key_list[0]], key_list[1:])
+
+        def _include(source, target, key_list):
+            if isinstance(source, list):
+                for index, item in enumerate(source):
+                    if isinstance(item, dict):
+                        if len(target) <= index:
+                            target.append({})
+                        _include(item, target[index], key_list)
+            elif isinstance(source, dict) and key_list[0] in source:
+                if len(key_list) == 1:
+                    target[key_list[0]] = source[key_list[0]]
+                else:
+                    value = source[key_list[0]]
+                    if isinstance(value, (dict, list)):
+                        if key_list[0] not in target:
+                            target[key_list[0]] = [] if isinstance(value, list) else {}
+                        _include(value, target[key_list[0]], key_list[1:])
+
+        if not projection:
+            return content
+        if not any(projection.values()):
+            for field in projection:
+                _exclude(content, field.split("."))
+            return content
+        selected = {}
+        for field in projection:
+            _include(content, selected, field.split("."))
+        return selected
+
+    def _get_list_from_db(self, filter_q, projection=None, limit=None):
+        """
+        Get a list of the topic from database. When database driver allows it (get_list_projected, see extend_db),
+        field selection, sorting and limit are done by the database, so that the whole collection or the unneeded
+        fields are not loaded
+        :param filter_q: filter of data to be applied
+        :param projection: fields to return as obtained from _get_projection. None for all fields
+        :param limit: maximum number of items to return, sorted by _id. None for all of them, unsorted
+        :return: The list, it can be empty if no one match the filter.
+        """
+        if not projection and not limit:
+            return self.db.get_list(self.topic, filter_q)
+        if hasattr(self.db, "get_list_projected"):
+            return self.db.get_list_projected(self.topic, filter_q, projection=projection, limit=limit)
+        content = self.db.get_list(self.topic, filter_q)
+        if limit:
+            content.sort(key=lambda x: x["_id"])
+            content = content[:limit]
+        if projection:
+            content = [self._apply_projection(item, projection) for item in content]
+        return content
+
+    @staticmethod
+    def _get_page(content, limit, nextpage_opaque_marker=None):
+        """
+        Get a page of an already loaded list
+        :param content: list of items, must contain one more than limit if there are more pages
+        :param limit: maximum number of items of the page
+        :param nextpage_opaque_marker: if provided, items with _id lower or equal to this are skipped
+        :return: tuple with the page list and the marker for the next page, None if it is the last one
+        """
+        if nextpage_opaque_marker:
+            content = [item for item in content if item["_id"] > nextpage_opaque_marker]
+        content.sort(key=lambda x: x["_id"])
+        if len(content) > limit:
+            return content[:limit], content[limit - 1]["_id"]
+        return content, None
+
+    def list_page(self, session, filter_q=None, limit=None, nextpage_opaque_marker=None):
+        """
+        Get a page of the list of the topic that matches a filter. Items are sorted by _id (SOL013 paging)
+        :param session: contains the used login username and working project
+        :param filter_q: filter of data to be applied
+        :param limit: maximum number of items of the page
+        :param nextpage_opaque_marker: marker returned for the previous page. None for the first page
+        :return: tuple with the page list and the marker for the next page, None if it is the last one
+        """
+        if not filter_q:
+            filter_q = {}
+        projection = self._get_projection(filter_q)
+        exclude_id = bool(projection) and projection.get("_id") == 0
+        if exclude_id:
+            # _id is needed for paging. It is removed once the page is obtained
+            projection = {k: v for k, v in projection.items() if k != "_id"} or None
+        if self.multiproject:
+            filter_q.update(self._get_project_filter(session))
+        if nextpage_opaque_marker:
+            filter_q["_id.gt"] = nextpage_opaque_marker
+        content = self._get_list_from_db(filter_q, projection=projection, limit=limit + 1)
+        content, next_marker = self._get_page(content, limit)
+        if exclude_id:
+            for item in content:
+                item.pop("_id", None)
+        return content, next_marker
 
     def new(self, rollback, session, indata=None, kwargs=None, headers=None):
         """
@@ -405,6 +742,9 @@ class BaseTopic:
             op_id = self.format_on_new(content, project_id=session["project_id"], make_public=session["public"])
             _id = self.db.create(self.topic, content)
             rollback.append({"topic": self.topic, "_id": _id})
+            if self.multiproject:
+                self.update_quota_usage(content["_admin"]["projects_read"], 1)
+                rollback[-1]["quota_projects"] = content["_admin"]["projects_read"]
             if op_id:
                 content["op_id"] = op_id
             self._send_msg("created", content)
@@ -438,6 +778,7 @@ class BaseTopic:
             filter_q = {}
         if self.multiproject:
             filter_q.update(self._get_project_filter(session))
+        self._invalidate_cache()
         return self.db.del_list(self.topic, filter_q)
 
     def delete_extra(self, session, _id, db_content, not_send_msg=None):
@@ -481,13 +822,21 @@ class BaseTopic:
             # is raised
             self.db.set_one(self.topic, filter_q, update_dict=None,
                             pull={"_admin.projects_read": {"$in": session["project_id"]}})
+            self._invalidate_cache(_id)
+            self.update_quota_usage([p for p in session["project_id"] if p in item_content["_admin"]["projects_read"]],
+                                    -1)
             # try to delete if there is not any more reference from projects. Ignore if it is not deleted
             filter_q = {'_id': _id, '_admin.projects_read': [[], ["ANY"]]}
             v = self.db.del_one(self.topic, filter_q, fail_on_empty=False)
             if not v or not v["deleted"]:
+                # still shared with other projects. Notify it, so that other NBI instances update their caches
+                self._send_msg("edited", {"_id": _id}, not_send_msg=not_send_msg)
                 return None
         else:
             self.db.del_one(self.topic, filter_q)
+            self._invalidate_cache(_id)
+            if self.multiproject:
+                self.update_quota_usage(item_content["_admin"]["projects_read"], -1)
         self.delete_extra(session, _id, item_content, not_send_msg=not_send_msg)
         self._send_msg("deleted", {"_id": _id}, not_send_msg=not_send_msg)
         return None
@@ -516,6 +865,7 @@ class BaseTopic:
             # TODO self._check_edition(session, indata, _id, force)
             if not content:
                 content = self.show(session, _id)
+            projects_read = list(content.get("_admin", {}).get("projects_read") or ()) if self.multiproject else ()
             deep_update_rfc7396(content, indata)
 
             # To allow project addressing by name AS WELL AS _id. Get the _id, just in case the provided one is a name
@@ -525,6 +875,11 @@ class BaseTopic:
             op_id = self.format_on_edit(content, indata)
 
             self.db.replace(self.topic, _id, content)
+            self._invalidate_cache(_id)
+            if self.multiproject:
+                new_projects_read = content.get("_admin", {}).get("projects_read") or ()
+                self.update_quota_usage([p for p in new_projects_read if p not in projects_read], 1)
+                self.update_quota_usage([p for p in projects_read if p not in new_projects_read], -1)
 
             indata.pop("_admin", None)
             if op_id:
@@ -534,3 +889,78 @@ class BaseTopic:
             return op_id
         except ValidationError as e:
             raise EngineException(e, HTTPStatus.UNPROCESSABLE_ENTITY)
+
+
+class ReferenceResolver:
+    """
+    Gets the descriptors referenced by other descriptor or instance, with one project filtered query per topic
+    instead of one query per reference. Results are memoized, so an instance of this class can be shared by the nested
+    creations of the same request (e.g. the NSs of a NetSlice instance) to avoid fetching again the same descriptors.
+    Returned descriptors are shared and must not be modified
+    """
+
+    def __init__(self, db, session):
+        """
+        :param db: database driver
+        :param session: contains "username", "admin", "force", "public", "project_id", "set_project"
+        """
+        self.db = db
+        self.project_filter = BaseTopic._get_project_filter(session)
+        self.found = {}  # (topic, key): {value: list of descriptors with this key value}
+
+    def _fetch(self, topic, values, key):
+        index = self.found.setdefault((topic, key), {})
+        pending = [value for value in dict.fromkeys(values) if value not in index]  # unique, keeping order
+        if not pending:
+            return index
+        if key == "_id" and BaseTopic.descriptor_cache and topic in BaseTopic.descriptor_cache.topics:
+            for value in pending:
+                descriptor = get_descriptor(self.db, topic, value, self.project_filter, fail_on_empty=False)
+                index[value] = [descriptor] if descriptor else []
+            return index
+        filter_q = self.project_filter.copy()
+        if len(pending) == 1:
+            filter_q[key] = pending[0]
+        else:
+            filter_q[key + ".cont"] = pending
+        fetched = {value: [] for value in pending}
+        for descriptor in self.db.get_list(topic, filter_q):
+            if descriptor.get(key) in fetched:
+                fetched[descriptor[key]].append(descriptor)
+        index.update(fetched)
+        if key != "_id":
+            # _id is unique, so the descriptors fetched by other key can be obtained later by _id
+            id_index = self.found.setdefault((topic, "_id"), {})
+            for descriptors in fetched.values():
+                for descriptor in descriptors:
+                    id_index[descriptor["_id"]] = [descriptor]
+        return index
+
+    def resolve(self, topic, values, key="id"):
+        """
+        Gets several descriptors with at most one database query, for the ones not already fetched
+        :param topic: collection where the referenced descriptors are, e.g. "vnfds"
+        :param values: iterable with the referenced values. It can contain repetitions
+        :param key: descriptor field that is referenced, "id" or "_id"
+        :return: dictionary indexed by the referenced value with the first descriptor found. Not found ones are not
+            present
+        """
+        index = self._fetch(topic, values, key)
+        return {value: index[value][0] for value in values if index[value]}
+
+    def get_one(self, topic, value, key="id"):
+        """
+        Gets a descriptor, fetching it only if it is not already fetched. Raises the same exceptions as db.get_one
+        :param topic: collection where the referenced descriptor is, e.g. "vnfds"
+        :param value: referenced value
+        :param key: descriptor field that is referenced, "id" or "_id"
+        :return: the descriptor
+        """
+        found = self._fetch(topic, (value,), key)[value]
+        if not found:
+            raise DbException("Not found any {} with filter='{}'".format(topic[:-1], {key: value}),
+                              HTTPStatus.NOT_FOUND)
+        if len(found) > 1:
+            raise DbException("Found more than one {} with filter='{}'".format(topic[:-1], {key: value}),
+                              HTTPStatus.CONFLICT)
+        return found[0]
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict
+from threading import Lock
+from time import time
+
+
+class LruCache:
+    """
+    Thread safe dictionary with a maximum number of entries. When full, the least recently used entry is removed.
+    Entries can have an expiration time, after that they are not returned any more.
+    It keeps statistics of hits and misses
+    """
+
+    def __init__(self, max_size=128):
+        self.max_size = max_size
+        self._entries = OrderedDict()   # key: (value, expires)
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            if entry[1] is not None and entry[1] < time():
+                del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def peek(self, key, default=None):
+        """
+        Gets a non expired entry without updating the statistics nor the least recently used order
+        """
+        entry = self._entries.get(key)
+        if entry is None or (entry[1] is not None and entry[1] < time()):
+            return default
+        return entry[0]
+
+    def set(self, key, value, expires=None):
+        """
+        Stores an entry
+        :param key: key of the entry
+        :param value: value to store
+        :param expires: None for no expiration, or epoch time when the entry expires
+        :return: None
+        """
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def pop_if(self, condition):
+        """
+        Removes the entries whose value fulfill a condition
+        :param condition: function that receives the value and returns True if must be removed
+        :return: number of removed entries
+        """
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if condition(entry[0])]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def prune(self, now=None):
+        """
+        Removes the expired entries
+        :param now: current epoch time. By default time()
+        :return: number of removed entries
+        """
+        now = now or time()
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if entry[1] is not None and entry[1] < now]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def values(self):
+        """
+        :return: list with the values of the non expired entries
+        """
+        now = time()
+        with self._lock:
+            return [entry[0] for entry in self._entries.values() if entry[1] is None or entry[1] >= now]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get_stats(self):
+        """
+        :return: dictionary with the number of entries, hits and misses
+        """
+        return {"size": len(self._entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
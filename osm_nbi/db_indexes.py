@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+from collections import Counter
+from functools import wraps
+from http import HTTPStatus
+from threading import Lock
+from osm_common.dbbase import DbException
+from osm_common.dbmongo import DbMongo
+
+
+# suffixes of the osm_common filter keys that express the comparison, not the field
+filter_operators = ("eq", "neq", "gt", "gte", "lt", "lte", "cont", "ncont")
+# fields of the project filter added to the queries of the multiproject topics
+project_filter_fields = ("_admin.projects_read", "_admin.projects_write")
+
+
+def get_filter_fields(q_filter):
+    """
+    Obtains the shape of a database filter, that is, the fields it compares without the values nor the operators.
+    E.g. {"_admin.projects_read.cont": [...], "constituent-vnfd.ANYINDEX.vnfd-id-ref": "x"} gives
+    ("_admin.projects_read", "constituent-vnfd.vnfd-id-ref")
+    :param q_filter: osm_common filter dictionary. Can be None
+    :return: sorted tuple of fields
+    """
+    fields = set()
+    for key in q_filter or ():
+        key_items = key.split(".")
+        if len(key_items) > 1 and key_items[-1] in filter_operators:
+            key_items.pop()
+        fields.add(".".join(k for k in key_items if k != "ANYINDEX" and not k.isdigit()))
+    return tuple(sorted(fields))
+
+
+def is_covered(fields, indexes):
+    """
+    Checks if a filter shape can use any of the indexes, that is, if the filter compares the leading field of an index.
+    Collection _id is always indexed. The project filter fields, present at almost every query, only count when the
+    filter has no other field, as an index on them does not select the items of a project by any other field
+    :param fields: filter shape, as returned by get_filter_fields
+    :param indexes: iterable of indexes, each one a tuple of fields
+    :return: True or False
+    """
+    if not fields or "_id" in fields:
+        return True
+    selective_fields = [field for field in fields if field not in project_filter_fields] or fields
+    return any(index[0] in selective_fields for index in indexes)
+
+
+def ensure_indexes(db, catalogue):
+    """
+    Creates the indexes of the catalogue that do not exist at database. It can be called several times, existing
+    indexes are kept. Only mongo database is indexed, other drivers are ignored
+    :param db: database object
+    :param catalogue: dictionary by collection with a tuple of indexes, each one a tuple of fields
+    :return: number of indexes ensured
+    """
+    if not isinstance(db, DbMongo):
+        return 0
+    ensured = 0
+    try:
+        for collection, indexes in catalogue.items():
+            for index in indexes:
+                db.db[collection].create_index([(field, 1) for field in index], background=True)
+                ensured += 1
+    except Exception as e:  # TODO refine
+        raise DbException(e, HTTPStatus.INTERNAL_SERVER_ERROR)
+    return ensured
+
+
+class IndexAdvisor:
+    """
+    Records the shape of the filters that reach the database methods and reports the ones that cannot use any index of
+    the catalogue. The database object is instrumented in place, so that the driver type is kept. Operations done
+    directly with the native driver are not recorded
+    """
+    db_methods = ("get_list", "get_list_projected", "get_one", "count", "del_list", "del_one", "set_one", "set_list")
+
+    def __init__(self, catalogue):
+        self.catalogue = catalogue
+        self.shapes = Counter()     # number of queries by (collection, fields)
+        self.lock = Lock()
+        self.logger = logging.getLogger("nbi.engine.indexes")
+
+    def attach(self, db):
+        """
+        Instruments the filter methods of a database object
+        :param db: database object
+        :return: None
+        """
+        for method_name in self.db_methods:
+            if hasattr(db, method_name):
+                setattr(db, method_name, self._instrument(getattr(db, method_name)))
+
+    def _instrument(self, method):
+        @wraps(method)
+        def instrumented(table, q_filter=None, *args, **kwargs):
+            self.record(table, q_filter)
+            return method(table, q_filter, *args, **kwargs)
+        return instrumented
+
+    def record(self, table, q_filter):
+        key = (table, get_filter_fields(q_filter))
+        with self.lock:
+            new_shape = key not in self.shapes
+            self.shapes[key] += 1
+        if new_shape and not is_covered(key[1], self.catalogue.get(table, ())):
+            self.logger.warning("Query on '{}' by {} without a covering index".format(table, ", ".join(key[1])))
+
+    def get_report(self, uncovered_only=True):
+        """
+        Obtains the recorded filter shapes, most used first
+        :param uncovered_only: if True only the shapes that cannot use any index are returned
+        :return: list of dictionaries with collection, fields, queries and covered
+        """
+        with self.lock:
+            shapes = self.shapes.most_common()
+        report = []
+        for (table, fields), queries in shapes:
+            covered = is_covered(fields, self.catalogue.get(table, ()))
+            if uncovered_only and covered:
+                continue
+            report.append({"collection": table, "fields": list(fields), "queries": queries, "covered": covered})
+        return report
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+from copy import deepcopy
+from http import HTTPStatus
+from threading import Lock
+from osm_common.dbbase import DbException
+from osm_nbi.cache import LruCache
+
+
+def match_project_filter(content, project_filter):
+    """
+    Checks in memory if a database content fulfills a project filter generated by BaseTopic._get_project_filter
+    :param content: database content
+    :param project_filter: dictionary with "_admin.projects_read|write.cont|ncont" keys. None or empty for any
+    :return: True or False
+    """
+    for key, values in (project_filter or {}).items():
+        field, operator = key.rsplit(".", 1)
+        projects = content.get("_admin", {}).get(field[len("_admin."):]) or ()
+        found = any(project in values for project in projects)
+        if found != (operator == "cont"):
+            return False
+    return True
+
+
+class DescriptorCache:
+    """
+    In-process cache of the descriptors (vnfds, nsds, nsts) keyed by _id, limited to a maximum number of entries.
+    Entries are populated when read from database and are removed when the descriptor is edited or deleted, locally
+    or at other NBI instances ('edited' and 'deleted' messages at kafka). Stored descriptors are never modified, each
+    reader obtains its own copy. Note that operational fields as _admin.usageState, updated without message, can be
+    outdated
+    """
+    msg_topics = {"vnfd": "vnfds", "nsd": "nsds", "nst": "nsts"}  # kafka topic: database collection
+    topics = tuple(msg_topics.values())
+
+    def __init__(self, db, max_size=256):
+        self.db = db
+        self.cache = LruCache(max_size=max_size)
+        self.generation = 0  # increased at each invalidation, to not store what was read before it
+        self.lock = Lock()
+        self.logger = logging.getLogger("nbi.engine.cache")
+
+    def get(self, topic, _id, project_filter=None, fail_on_empty=True):
+        """
+        Gets a descriptor by _id, reading it from database if not cached
+        :param topic: "vnfds", "nsds" or "nsts"
+        :param _id: descriptor internal _id
+        :param project_filter: project filter the descriptor must fulfill. None for not checking
+        :param fail_on_empty: raise DbException NOT_FOUND if not found or not allowed. Otherwise None is returned
+        :return: a copy of the descriptor
+        """
+        descriptor = self.cache.get((topic, _id))
+        if descriptor is None:
+            generation = self.generation
+            descriptor = self.db.get_one(topic, {"_id": _id}, fail_on_empty=False)
+            if descriptor is not None:
+                with self.lock:
+                    # not stored if it has been edited meanwhile, because it could be the previous version
+                    if generation == self.generation:
+                        self.cache.set((topic, _id), descriptor)
+        if descriptor is None or not match_project_filter(descriptor, project_filter):
+            if fail_on_empty:
+                raise DbException("Not found any {} with filter='{}'".format(topic[:-1], {"_id": _id}),
+                                  HTTPStatus.NOT_FOUND)
+            return None
+        return deepcopy(descriptor)
+
+    def invalidate(self, topic, _id=None):
+        """
+        Removes a descriptor from the cache
+        :param topic: "vnfds", "nsds" or "nsts". Other topics are ignored
+        :param _id: descriptor internal _id. None for removing all the descriptors
+        :return: None
+        """
+        if topic not in self.topics:
+            return
+        with self.lock:
+            self.generation += 1
+            if _id is None:
+                self.cache.clear()
+            else:
+                self.cache.pop((topic, _id))
+
+    def process_msg(self, msg_topic, command, params):
+        """
+        Invalidates the descriptors edited or deleted at other NBI instances
+        :param msg_topic: kafka topic, e.g. "vnfd"
+        :param command: kafka command, e.g. "edited"
+        :param params: message content, with the descriptor "_id"
+        :return: True if the message is about a cached topic, False otherwise
+        """
+        topic = self.msg_topics.get(msg_topic)
+        if not topic:
+            return False
+        if command in ("edited", "deleted") and isinstance(params, dict) and params.get("_id"):
+            self.logger.debug("received {} {} {}, removed from cache".format(msg_topic, command, params["_id"]))
+            self.invalidate(topic, params["_id"])
+        return True
+
+    def get_stats(self):
+        return self.cache.get_stats()
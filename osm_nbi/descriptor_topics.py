@@ -17,22 +17,133 @@ import tarfile
 import yaml
 import json
 # import logging
-from hashlib import md5
 from osm_common.dbbase import DbException, deep_update_rfc7396
 from http import HTTPStatus
 from time import time
 from osm_nbi.validation import ValidationError, pdu_new_schema, pdu_edit_schema
-from osm_nbi.base_topic import BaseTopic, EngineException, get_iterable
-from osm_im.vnfd import vnfd as vnfd_im
-from osm_im.nsd import nsd as nsd_im
-from osm_im.nst import nst as nst_im
-from pyangbind.lib.serialise import pybindJSONDecoder
-import pyangbind.lib.pybindJSON as pybindJSON
+from osm_nbi.base_topic import BaseTopic, EngineException, ReferenceResolver, get_iterable
+from osm_nbi.cache import LruCache
+from osm_nbi.package_upload import PackageUpload, check_tar_members
+from copy import deepcopy
+from hashlib import sha256
 
 __author__ = "Alfonso Tierno <alfonso.tiernosepulveda@telefonica.com>"
 
+# pyangbind information models are loaded at first use, as it is slow. Content: item: (model class, envelope function)
+_pyangbind_models = {}
+
+
+def _get_pyangbind_model(item):
+    """
+    Imports the pyangbind information model of a descriptor type
+    :param item: vnfds, nsds or nsts
+    :return: tuple with the model class and a function that adds the envelope needed by the model to a descriptor
+    """
+    if not _pyangbind_models:
+        from osm_im.vnfd import vnfd as vnfd_im
+        from osm_im.nsd import nsd as nsd_im
+        from osm_im.nst import nst as nst_im
+        _pyangbind_models.update({
+            "vnfds": (vnfd_im, lambda data: {'vnfd:vnfd-catalog': {'vnfd': [data]}}),
+            "nsds": (nsd_im, lambda data: {'nsd:nsd-catalog': {'nsd': [data]}}),
+            "nsts": (nst_im, lambda data: {'nst': [data]}),
+        })
+    return _pyangbind_models.get(item)
+
+
+class VnfdSymbolTable:
+    """
+    Elements of a vnfd indexed by their identifiers, built in one pass, so that the cross references of the
+    descriptor are checked without walking it again. When an identifier is repeated, the first element is kept
+    """
+
+    def __init__(self, vnfd):
+        self.cps = {}                       # connection-point by name
+        self.vdus = {}                      # vdu by id
+        self.icps = {}                      # vdu id by vdu internal-connection-point id
+        self.vdu_monitoring_params = set()  # (vdu id, monitoring-param id) of the vdus
+        self.vdu_metrics = set()            # (vdu id, metric name) of the vdu-configuration
+        self.monitoring_params = {}         # vnf monitoring-param by id
+        self.ip_profiles = {}               # ip-profile by name
+        self.config_primitives = {}         # vnf-configuration config-primitive by name
+        for cp in get_iterable(vnfd.get("connection-point")):
+            self.cps.setdefault(cp["name"], cp)
+        for vdu in get_iterable(vnfd.get("vdu")):
+            self.vdus.setdefault(vdu["id"], vdu)
+            for internal_cp in get_iterable(vdu.get("internal-connection-point")):
+                self.icps.setdefault(internal_cp["id"], vdu["id"])
+            for vmp in get_iterable(vdu.get("monitoring-param")):
+                self.vdu_monitoring_params.add((vdu["id"], vmp["id"]))
+            if vdu.get("vdu-configuration"):
+                for metric in get_iterable(vdu["vdu-configuration"].get("metrics")):
+                    self.vdu_metrics.add((vdu["id"], metric["name"]))
+        for mp in get_iterable(vnfd.get("monitoring-param")):
+            self.monitoring_params.setdefault(mp["id"], mp)
+        for ip_profile in get_iterable(vnfd.get("ip-profiles")):
+            self.ip_profiles.setdefault(ip_profile["name"], ip_profile)
+        if vnfd.get("vnf-configuration"):
+            for primitive in get_iterable(vnfd["vnf-configuration"].get("config-primitive")):
+                self.config_primitives.setdefault(primitive["name"], primitive)
+
+
+class PackageFolders:
+    """
+    Checks the content of the folders of a package. Each folder and file is looked for once at storage, and reused
+    for all the elements of the descriptor that reference it
+    """
+
+    def __init__(self, fs, storage_params):
+        """
+        :param fs: storage object
+        :param storage_params: _admin.storage of the descriptor, with "folder" and "pkg-dir"
+        """
+        self.fs = fs
+        self.storage_params = storage_params
+        self.base_folder = None   # resolved at first use, as it needs a storage query
+        self.folders_content = {}
+        self.files_exist = {}
+
+    def _get_folder(self, folder):
+        if not self.storage_params or not self.storage_params.get("pkg-dir"):
+            return None
+        if self.base_folder is None:
+            if self.fs.file_exists("{}_".format(self.storage_params["folder"]), 'dir'):
+                self.base_folder = "{}_/{}".format(self.storage_params["folder"], self.storage_params["pkg-dir"])
+            else:
+                self.base_folder = "{}/{}".format(self.storage_params["folder"], self.storage_params["pkg-dir"])
+        return "{}/{}".format(self.base_folder, folder)
+
+    def has_content(self, folder):
+        """
+        :param folder: folder of the package, e.g. charms
+        :return: True if the folder exists and it is not empty
+        """
+        if folder not in self.folders_content:
+            folder_path = self._get_folder(folder)
+            self.folders_content[folder] = bool(folder_path and self.fs.file_exists(folder_path, 'dir') and
+                                                self.fs.dir_ls(folder_path))
+        return self.folders_content[folder]
+
+    def has_file(self, folder, file):
+        """
+        :param folder: folder of the package, e.g. cloud_init
+        :param file: file name, relative to folder
+        :return: True if the file exists
+        """
+        if (folder, file) not in self.files_exist:
+            folder_path = self._get_folder(folder)
+            self.files_exist[(folder, file)] = bool(folder_path and
+                                                    self.fs.file_exists("{}/{}".format(folder_path, file), 'file'))
+        return self.files_exist[(folder, file)]
+
 
 class DescriptorTopic(BaseTopic):
+    db_indexes = BaseTopic.db_indexes + (("id",),)
+    # pyangbind validation results, by item type, force flag and descriptor content hash
+    pyangbind_cache = LruCache(max_size=64)
+    # state of the package uploads by chunks, by (temporal folder, file name)
+    uploads = LruCache(max_size=64)
+    upload_buffer_size = 1 << 20
 
     def __init__(self, db, fs, msg, auth):
         BaseTopic.__init__(self, db, fs, msg, auth)
@@ -161,7 +272,8 @@ class DescriptorTopic(BaseTopic):
             content = {"_admin": {"userDefinedData": indata}}
             self.format_on_new(content, session["project_id"], make_public=session["public"])
             _id = self.db.create(self.topic, content)
-            rollback.append({"topic": self.topic, "_id": _id})
+            rollback.append({"topic": self.topic, "_id": _id, "quota_projects": content["_admin"]["projects_read"]})
+            self.update_quota_usage(content["_admin"]["projects_read"], 1)
             self._send_msg("created", {"_id": _id})
             return _id, None
         except ValidationError as e:
@@ -225,57 +337,39 @@ class DescriptorTopic(BaseTopic):
                 raise EngineException("invalid Content-Range start sequence, expected '{}' but received '{}'".format(
                     file_size, start), HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
             file_pkg = self.fs.file_open(file_path, 'a+b')
+            upload = self.uploads.pop(file_path)
+            if not upload or upload.size != start:
+                # previous chunks received by other NBI instance, or first one
+                upload = PackageUpload(compressed=bool(compressed))
+                if start:
+                    upload.load(file_pkg, self.upload_buffer_size)
             if isinstance(indata, dict):
                 indata_text = yaml.safe_dump(indata, indent=4, default_flow_style=False)
-                file_pkg.write(indata_text.encode(encoding="utf-8"))
+                indata_len = upload.write(file_pkg, indata_text.encode(encoding="utf-8"), self.upload_buffer_size)
             else:
-                indata_len = 0
-                while True:
-                    indata_text = indata.read(4096)
-                    indata_len += len(indata_text)
-                    if not indata_text:
-                        break
-                    file_pkg.write(indata_text)
+                indata_len = upload.write(file_pkg, indata, self.upload_buffer_size)
             if content_range_text:
                 if indata_len != end-start:
                     raise EngineException("Mismatch between Content-Range header {}-{} and body length of {}".format(
                         start, end-1, indata_len), HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
                 if end != total:
                     # TODO update to UPLOADING
+                    self.uploads.set(file_path, upload)
                     return False
 
             # PACKAGE UPLOADED
-            if expected_md5:
-                file_pkg.seek(0, 0)
-                file_md5 = md5()
-                chunk_data = file_pkg.read(1024)
-                while chunk_data:
-                    file_md5.update(chunk_data)
-                    chunk_data = file_pkg.read(1024)
-                if expected_md5 != file_md5.hexdigest():
-                    raise EngineException("Error, MD5 mismatch", HTTPStatus.CONFLICT)
+            if expected_md5 and expected_md5 != upload.md5.hexdigest():
+                raise EngineException("Error, MD5 mismatch", HTTPStatus.CONFLICT)
+            storage["checksum"] = {"algorithm": "SHA-256", "hash": upload.sha256.hexdigest()}
             file_pkg.seek(0, 0)
             if compressed == "gzip":
-                tar = tarfile.open(mode='r', fileobj=file_pkg)
-                descriptor_file_name = None
-                for tarinfo in tar:
-                    tarname = tarinfo.name
-                    tarname_path = tarname.split("/")
-                    if not tarname_path[0] or ".." in tarname_path:  # if start with "/" means absolute path
-                        raise EngineException("Absolute path or '..' are not allowed for package descriptor tar.gz")
-                    if len(tarname_path) == 1 and not tarinfo.isdir():
-                        raise EngineException("All files must be inside a dir for package descriptor tar.gz")
-                    if tarname.endswith(".yaml") or tarname.endswith(".json") or tarname.endswith(".yml"):
-                        storage["pkg-dir"] = tarname_path[0]
-                        if len(tarname_path) == 2:
-                            if descriptor_file_name:
-                                raise EngineException(
-                                    "Found more than one descriptor file at package descriptor tar.gz")
-                            descriptor_file_name = tarname
-                if not descriptor_file_name:
-                    raise EngineException("Not found any descriptor file at package descriptor tar.gz")
+                # tar index already validated while receiving, it is only read again to extract the content
+                descriptor_file_name = upload.tar_validator.close()
+                storage["pkg-dir"] = upload.tar_validator.pkg_dir
                 storage["descriptor"] = descriptor_file_name
                 storage["zipfile"] = filename
+                tar = tarfile.open(mode='r', fileobj=file_pkg)
+                check_tar_members(tar)
                 self.fs.file_extract(tar, temp_folder)
                 with self.fs.file_open((temp_folder, descriptor_file_name), "r") as descriptor_file:
                     content = descriptor_file.read()
@@ -306,6 +400,7 @@ class DescriptorTopic(BaseTopic):
             self.check_conflict_on_edit(session, current_desc, indata, _id=_id)
             current_desc["_admin"]["modified"] = time()
             self.db.replace(self.topic, _id, current_desc)
+            self._invalidate_cache(_id)
             self.fs.dir_rename(temp_folder, _id)
 
             indata["_id"] = _id
@@ -390,32 +485,42 @@ class DescriptorTopic(BaseTopic):
             return self.fs.file_open((storage['folder'], storage['zipfile']), "rb"), accept_zip
 
     def pyangbind_validation(self, item, data, force=False):
+        """
+        Validates a descriptor with the pyangbind information model. The result of identical descriptors is cached
+        :param item: vnfds, nsds or nsts
+        :param data: descriptor content
+        :param force: if True unknown fields are ignored
+        :return: the descriptor serialized by the information model
+        """
         try:
-            if item == "vnfds":
-                myvnfd = vnfd_im()
-                pybindJSONDecoder.load_ietf_json({'vnfd:vnfd-catalog': {'vnfd': [data]}}, None, None, obj=myvnfd,
-                                                 path_helper=True, skip_unknown=force)
-                out = pybindJSON.dumps(myvnfd, mode="ietf")
-            elif item == "nsds":
-                mynsd = nsd_im()
-                pybindJSONDecoder.load_ietf_json({'nsd:nsd-catalog': {'nsd': [data]}}, None, None, obj=mynsd,
-                                                 path_helper=True, skip_unknown=force)
-                out = pybindJSON.dumps(mynsd, mode="ietf")
-            elif item == "nsts":
-                mynst = nst_im()
-                pybindJSONDecoder.load_ietf_json({'nst': [data]}, None, None, obj=mynst,
-                                                 path_helper=True, skip_unknown=force)
-                out = pybindJSON.dumps(mynst, mode="ietf")
-            else:
-                raise EngineException("Not possible to validate '{}' item".format(item),
-                                      http_code=HTTPStatus.INTERNAL_SERVER_ERROR)
-
-            desc_out = self._remove_envelop(yaml.safe_load(out))
-            return desc_out
-
+            content_hash = sha256(json.dumps(data, sort_keys=True, separators=(",", ":"), default=str)
+                                  .encode("utf8")).hexdigest()
+        except (TypeError, ValueError):
+            content_hash = None
+        cache_key = (item, bool(force), content_hash)
+        if content_hash:
+            desc_out = self.pyangbind_cache.get(cache_key)
+            if desc_out is not None:
+                return deepcopy(desc_out)
+        model = _get_pyangbind_model(item)
+        if not model:
+            raise EngineException("Not possible to validate '{}' item".format(item),
+                                  http_code=HTTPStatus.INTERNAL_SERVER_ERROR)
+        try:
+            from pyangbind.lib.serialise import pybindJSONDecoder
+            import pyangbind.lib.pybindJSON as pybindJSON
+            model_class, get_envelop = model
+            myitem = model_class()
+            pybindJSONDecoder.load_ietf_json(get_envelop(data), None, None, obj=myitem,
+                                             path_helper=True, skip_unknown=force)
+            out = pybindJSON.dumps(myitem, mode="ietf", indent=None)
+            desc_out = self._remove_envelop(json.loads(out))
         except Exception as e:
             raise EngineException("Error in pyangbind validation: {}".format(str(e)),
                                   http_code=HTTPStatus.UNPROCESSABLE_ENTITY)
+        if content_hash:
+            self.pyangbind_cache.set(cache_key, deepcopy(desc_out))
+        return desc_out
 
 
 class VnfdTopic(DescriptorTopic):
@@ -495,26 +600,23 @@ class VnfdTopic(DescriptorTopic):
     def _validate_input_new(self, indata, storage_params, force=False):
         indata = self.pyangbind_validation("vnfds", indata, force)
         # Cross references validation in the descriptor
+        symbols = VnfdSymbolTable(indata)
+        package_folders = PackageFolders(self.fs, storage_params)
         if indata.get("vdu"):
             if not indata.get("mgmt-interface"):
                 raise EngineException("'mgmt-interface' is a mandatory field and it is not defined",
                                       http_code=HTTPStatus.UNPROCESSABLE_ENTITY)
             if indata["mgmt-interface"].get("cp"):
-                for cp in get_iterable(indata.get("connection-point")):
-                    if cp["name"] == indata["mgmt-interface"]["cp"]:
-                        break
-                else:
+                if indata["mgmt-interface"]["cp"] not in symbols.cps:
                     raise EngineException("mgmt-interface:cp='{}' must match an existing connection-point"
                                           .format(indata["mgmt-interface"]["cp"]),
                                           http_code=HTTPStatus.UNPROCESSABLE_ENTITY)
 
         for vdu in get_iterable(indata.get("vdu")):
+            vdu_icp_ids = None
             for interface in get_iterable(vdu.get("interface")):
                 if interface.get("external-connection-point-ref"):
-                    for cp in get_iterable(indata.get("connection-point")):
-                        if cp["name"] == interface["external-connection-point-ref"]:
-                            break
-                    else:
+                    if interface["external-connection-point-ref"] not in symbols.cps:
                         raise EngineException("vdu[id='{}']:interface[name='{}']:external-connection-point-ref='{}' "
                                               "must match an existing connection-point"
                                               .format(vdu["id"], interface["name"],
@@ -522,10 +624,10 @@ class VnfdTopic(DescriptorTopic):
                                               http_code=HTTPStatus.UNPROCESSABLE_ENTITY)
 
                 elif interface.get("internal-connection-point-ref"):
-                    for internal_cp in get_iterable(vdu.get("internal-connection-point")):
-                        if interface["internal-connection-point-ref"] == internal_cp.get("id"):
-                            break
-                    else:
+                    if vdu_icp_ids is None:
+                        vdu_icp_ids = {internal_cp.get("id") for internal_cp in
+                                       get_iterable(vdu.get("internal-connection-point"))}
+                    if interface["internal-connection-point-ref"] not in vdu_icp_ids:
                         raise EngineException("vdu[id='{}']:interface[name='{}']:internal-connection-point-ref='{}' "
                                               "must match an existing vdu:internal-connection-point"
                                               .format(vdu["id"], interface["name"],
@@ -534,21 +636,21 @@ class VnfdTopic(DescriptorTopic):
             # Validate that if descriptor contains charms, artifacts _admin.storage."pkg-dir" is not none
             if vdu.get("vdu-configuration"):
                 if vdu["vdu-configuration"].get("juju"):
-                    if not self._validate_package_folders(storage_params, 'charms'):
+                    if not package_folders.has_content('charms'):
                         raise EngineException("Charm defined in vnf[id={}]:vdu[id={}] but not present in "
                                               "package".format(indata["id"], vdu["id"]))
             # Validate that if descriptor contains cloud-init, artifacts _admin.storage."pkg-dir" is not none
             if vdu.get("cloud-init-file"):
-                if not self._validate_package_folders(storage_params, 'cloud_init', vdu["cloud-init-file"]):
+                if not package_folders.has_file('cloud_init', vdu["cloud-init-file"]):
                     raise EngineException("Cloud-init defined in vnf[id={}]:vdu[id={}] but not present in "
                                           "package".format(indata["id"], vdu["id"]))
         # Validate that if descriptor contains charms, artifacts _admin.storage."pkg-dir" is not none
         if indata.get("vnf-configuration"):
             if indata["vnf-configuration"].get("juju"):
-                if not self._validate_package_folders(storage_params, 'charms'):
+                if not package_folders.has_content('charms'):
                     raise EngineException("Charm defined in vnf[id={}] but not present in "
                                           "package".format(indata["id"]))
-        vld_names = []  # For detection of duplicated VLD names
+        vld_names = set()  # For detection of duplicated VLD names
         for ivld in get_iterable(indata.get("internal-vld")):
             # BEGIN Detection of duplicated VLD names
             ivld_name = ivld["name"]
@@ -557,58 +659,29 @@ class VnfdTopic(DescriptorTopic):
                                       .format(ivld["name"], indata["id"], ivld["id"]),
                                       http_code=HTTPStatus.UNPROCESSABLE_ENTITY)
             else:
-                vld_names.append(ivld_name)
+                vld_names.add(ivld_name)
             # END Detection of duplicated VLD names
             for icp in get_iterable(ivld.get("internal-connection-point")):
-                icp_mark = False
-                for vdu in get_iterable(indata.get("vdu")):
-                    for internal_cp in get_iterable(vdu.get("internal-connection-point")):
-                        if icp["id-ref"] == internal_cp["id"]:
-                            icp_mark = True
-                            break
-                    if icp_mark:
-                        break
-                else:
+                if icp["id-ref"] not in symbols.icps:
                     raise EngineException("internal-vld[id='{}']:internal-connection-point='{}' must match an existing "
                                           "vdu:internal-connection-point".format(ivld["id"], icp["id-ref"]),
                                           http_code=HTTPStatus.UNPROCESSABLE_ENTITY)
             if ivld.get("ip-profile-ref"):
-                for ip_prof in get_iterable(indata.get("ip-profiles")):
-                    if ip_prof["name"] == get_iterable(ivld.get("ip-profile-ref")):
-                        break
-                else:
+                if ivld["ip-profile-ref"] not in symbols.ip_profiles:
                     raise EngineException("internal-vld[id='{}']:ip-profile-ref='{}' does not exist".format(
                         ivld["id"], ivld["ip-profile-ref"]),
                         http_code=HTTPStatus.UNPROCESSABLE_ENTITY)
         for mp in get_iterable(indata.get("monitoring-param")):
             if mp.get("vdu-monitoring-param"):
-                mp_vmp_mark = False
-                for vdu in get_iterable(indata.get("vdu")):
-                    for vmp in get_iterable(vdu.get("monitoring-param")):
-                        if vmp["id"] == mp["vdu-monitoring-param"].get("vdu-monitoring-param-ref") and vdu["id"] ==\
-                                mp["vdu-monitoring-param"]["vdu-ref"]:
-                            mp_vmp_mark = True
-                            break
-                    if mp_vmp_mark:
-                        break
-                else:
+                if (mp["vdu-monitoring-param"]["vdu-ref"], mp["vdu-monitoring-param"].get("vdu-monitoring-param-ref")) \
+                        not in symbols.vdu_monitoring_params:
                     raise EngineException("monitoring-param:vdu-monitoring-param:vdu-monitoring-param-ref='{}' not "
                                           "defined at vdu[id='{}'] or vdu does not exist"
                                           .format(mp["vdu-monitoring-param"]["vdu-monitoring-param-ref"],
                                                   mp["vdu-monitoring-param"]["vdu-ref"]),
                                           http_code=HTTPStatus.UNPROCESSABLE_ENTITY)
             elif mp.get("vdu-metric"):
-                mp_vm_mark = False
-                for vdu in get_iterable(indata.get("vdu")):
-                    if vdu.get("vdu-configuration"):
-                        for metric in get_iterable(vdu["vdu-configuration"].get("metrics")):
-                            if metric["name"] == mp["vdu-metric"]["vdu-metric-name-ref"] and vdu["id"] == \
-                                    mp["vdu-metric"]["vdu-ref"]:
-                                mp_vm_mark = True
-                                break
-                        if mp_vm_mark:
-                            break
-                else:
+                if (mp["vdu-metric"]["vdu-ref"], mp["vdu-metric"]["vdu-metric-name-ref"]) not in symbols.vdu_metrics:
                     raise EngineException("monitoring-param:vdu-metric:vdu-metric-name-ref='{}' not defined at "
                                           "vdu[id='{}'] or vdu does not exist"
                                           .format(mp["vdu-metric"]["vdu-metric-name-ref"],
@@ -618,25 +691,16 @@ class VnfdTopic(DescriptorTopic):
         for sgd in get_iterable(indata.get("scaling-group-descriptor")):
             for sp in get_iterable(sgd.get("scaling-policy")):
                 for sc in get_iterable(sp.get("scaling-criteria")):
-                    for mp in get_iterable(indata.get("monitoring-param")):
-                        if mp["id"] == get_iterable(sc.get("vnf-monitoring-param-ref")):
-                            break
-                    else:
+                    if sc.get("vnf-monitoring-param-ref") not in symbols.monitoring_params:
                         raise EngineException("scaling-group-descriptor[name='{}']:scaling-criteria[name='{}']:"
                                               "vnf-monitoring-param-ref='{}' not defined in any monitoring-param"
                                               .format(sgd["name"], sc["name"], sc["vnf-monitoring-param-ref"]),
                                               http_code=HTTPStatus.UNPROCESSABLE_ENTITY)
-            for sgd_vdu in get_iterable(sgd.get("vdu")):
-                sgd_vdu_mark = False
-                for vdu in get_iterable(indata.get("vdu")):
-                    if vdu["id"] == sgd_vdu["vdu-id-ref"]:
-                        sgd_vdu_mark = True
-                        break
-                if sgd_vdu_mark:
-                    break
-            else:
+            # at least one of the scaling vdus must exist
+            sgd_vdus = get_iterable(sgd.get("vdu"))
+            if sgd_vdus and not any(sgd_vdu["vdu-id-ref"] in symbols.vdus for sgd_vdu in sgd_vdus):
                 raise EngineException("scaling-group-descriptor[name='{}']:vdu-id-ref={} does not match any vdu"
-                                      .format(sgd["name"], sgd_vdu["vdu-id-ref"]),
+                                      .format(sgd["name"], sgd_vdus[-1]["vdu-id-ref"]),
                                       http_code=HTTPStatus.UNPROCESSABLE_ENTITY)
             for sca in get_iterable(sgd.get("scaling-config-action")):
                 if not indata.get("vnf-configuration"):
@@ -644,10 +708,7 @@ class VnfdTopic(DescriptorTopic):
                                           "scaling-group-descriptor[name='{}']:scaling-config-action"
                                           .format(sgd["name"]),
                                           http_code=HTTPStatus.UNPROCESSABLE_ENTITY)
-                for primitive in get_iterable(indata["vnf-configuration"].get("config-primitive")):
-                    if primitive["name"] == sca["vnf-config-primitive-name-ref"]:
-                        break
-                else:
+                if sca["vnf-config-primitive-name-ref"] not in symbols.config_primitives:
                     raise EngineException("scaling-group-descriptor[name='{}']:scaling-config-action:vnf-config-"
                                           "primitive-name-ref='{}' does not match any "
                                           "vnf-configuration:config-primitive:name"
@@ -660,25 +721,16 @@ class VnfdTopic(DescriptorTopic):
         return indata
 
     def _validate_package_folders(self, storage_params, folder, file=None):
-        if not storage_params or not storage_params.get("pkg-dir"):
-            return False
-        else:
-            if self.fs.file_exists("{}_".format(storage_params["folder"]), 'dir'):
-                f = "{}_/{}/{}".format(storage_params["folder"], storage_params["pkg-dir"], folder)
-            else:
-                f = "{}/{}/{}".format(storage_params["folder"], storage_params["pkg-dir"], folder)
-            if file:
-                return self.fs.file_exists("{}/{}".format(f, file), 'file')
-            else:
-                if self.fs.file_exists(f, 'dir'):
-                    if self.fs.dir_ls(f):
-                        return True
-            return False
+        package_folders = PackageFolders(self.fs, storage_params)
+        if file:
+            return package_folders.has_file(folder, file)
+        return package_folders.has_content(folder)
 
 
 class NsdTopic(DescriptorTopic):
     topic = "nsds"
     topic_msg = "nsd"
+    db_indexes = DescriptorTopic.db_indexes + (("constituent-vnfd.vnfd-id-ref",),)
 
     def __init__(self, db, fs, msg, auth):
         DescriptorTopic.__init__(self, db, fs, msg, auth)
@@ -759,28 +811,27 @@ class NsdTopic(DescriptorTopic):
             return
         member_vnfd_index = {}
         if descriptor.get("constituent-vnfd") and not session["force"]:
+            # all the referenced vnfds are obtained with a single query
+            vnfds = ReferenceResolver(self.db, session).resolve(
+                "vnfds", [vnf["vnfd-id-ref"] for vnf in descriptor["constituent-vnfd"]])
             for vnf in descriptor["constituent-vnfd"]:
                 vnfd_id = vnf["vnfd-id-ref"]
-                filter_q = self._get_project_filter(session)
-                filter_q["id"] = vnfd_id
-                vnf_list = self.db.get_list("vnfds", filter_q)
-                if not vnf_list:
+                if vnfd_id not in vnfds:
                     raise EngineException("Descriptor error at 'constituent-vnfd':'vnfd-id-ref'='{}' references a non "
                                           "existing vnfd".format(vnfd_id), http_code=HTTPStatus.CONFLICT)
-                # elif len(vnf_list) > 1:
-                #     raise EngineException("More than one vnfd found for id='{}'".format(vnfd_id),
-                #                           http_code=HTTPStatus.CONFLICT)
-                member_vnfd_index[vnf["member-vnf-index"]] = vnf_list[0]
+                member_vnfd_index[vnf["member-vnf-index"]] = vnfds[vnfd_id]
 
         # Cross references validation in the descriptor and vnfd connection point validation
+        cp_names_by_vnfd = {}
         for vld in get_iterable(descriptor.get("vld")):
             for referenced_vnfd_cp in get_iterable(vld.get("vnfd-connection-point-ref")):
                 # look if this vnfd contains this connection point
                 vnfd = member_vnfd_index.get(referenced_vnfd_cp["member-vnf-index-ref"])
-                for vnfd_cp in get_iterable(vnfd.get("connection-point")):
-                    if referenced_vnfd_cp.get("vnfd-connection-point-ref") == vnfd_cp["name"]:
-                        break
-                else:
+                cp_names = cp_names_by_vnfd.get(vnfd["id"])
+                if cp_names is None:
+                    cp_names = {vnfd_cp["name"] for vnfd_cp in get_iterable(vnfd.get("connection-point"))}
+                    cp_names_by_vnfd[vnfd["id"]] = cp_names
+                if referenced_vnfd_cp.get("vnfd-connection-point-ref") not in cp_names:
                     raise EngineException(
                         "Error at vld[id='{}']:vnfd-connection-point-ref[member-vnf-index-ref='{}']:vnfd-"
                         "connection-point-ref='{}' references a non existing conection-point:name inside vnfd '{}'"
@@ -826,6 +877,7 @@ class NsdTopic(DescriptorTopic):
 class NstTopic(DescriptorTopic):
     topic = "nsts"
     topic_msg = "nst"
+    db_indexes = DescriptorTopic.db_indexes + (("netslice-subnet.nsd-ref",),)
 
     def __init__(self, db, fs, msg, auth):
         DescriptorTopic.__init__(self, db, fs, msg, auth)
@@ -863,11 +915,11 @@ class NstTopic(DescriptorTopic):
         """
         if not descriptor.get("netslice-subnet"):
             return
+        nsds = ReferenceResolver(self.db, session).resolve("nsds", [nsd["nsd-ref"] for nsd in
+                                                                    descriptor["netslice-subnet"]])
         for nsd in descriptor["netslice-subnet"]:
             nsd_id = nsd["nsd-ref"]
-            filter_q = self._get_project_filter(session)
-            filter_q["id"] = nsd_id
-            if not self.db.get_list("nsds", filter_q):
+            if nsd_id not in nsds:
                 raise EngineException("Descriptor error at 'netslice-subnet':'nsd-ref'='{}' references a non "
                                       "existing nsd".format(nsd_id), http_code=HTTPStatus.CONFLICT)
 
@@ -899,6 +951,7 @@ class NstTopic(DescriptorTopic):
 class PduTopic(BaseTopic):
     topic = "pdus"
     topic_msg = "pdu"
+    db_indexes = BaseTopic.db_indexes + (("type", "vim_accounts", "_admin.usageState"), ("_admin.usage.nsr_id",))
     schema_new = pdu_new_schema
     schema_edit = pdu_edit_schema
 
@@ -23,16 +23,22 @@ from http import HTTPStatus
 
 from osm_nbi.authconn_keystone import AuthconnKeystone
 from osm_nbi.authconn_internal import AuthconnInternal
-from osm_nbi.base_topic import EngineException, versiontuple
+from osm_nbi.base_topic import BaseTopic, EngineException, versiontuple, bulk_set, extend_db
 from osm_nbi.admin_topics import VimAccountTopic, WimAccountTopic, SdnTopic
 from osm_nbi.admin_topics import K8sClusterTopic, K8sRepoTopic
 from osm_nbi.admin_topics import UserTopicAuth, ProjectTopicAuth, RoleTopicAuth
 from osm_nbi.descriptor_topics import VnfdTopic, NsdTopic, PduTopic, NstTopic
 from osm_nbi.instance_topics import NsrTopic, VnfrTopic, NsLcmOpTopic, NsiTopic, NsiLcmOpTopic
 from osm_nbi.pmjobs_topics import PmJobsTopic
+from osm_nbi.lock_manager import LockManager
+from osm_nbi.quota_ledger import QuotaLedger
+from osm_nbi.descriptor_cache import DescriptorCache
+from osm_nbi.db_indexes import ensure_indexes, IndexAdvisor
+from osm_nbi.backend_metrics import BackendMetrics
+from osm_nbi import tracing
+from osm_nbi.validation import compile_schemas
 from base64 import b64encode
 from os import urandom, path
-from threading import Lock
 
 __author__ = "Alfonso Tierno <alfonso.tiernosepulveda@telefonica.com>"
 min_common_version = "0.1.16"
@@ -61,6 +67,35 @@ class Engine(object):
         # "pm_jobs": PmJobsTopic will be added manually because it needs other parameters
     }
 
+    # other topics that are modified when writing a topic. They are locked together with the main one
+    map_topic_to_related_topics = {
+        "nsrs": ("vnfrs", "nslcmops", "pdus"),
+        "nslcmops": ("nsrs", "vnfrs", "pdus"),
+        "nsis": ("nsrs", "vnfrs", "nslcmops", "nsilcmops", "pdus"),
+        "nsilcmops": ("nsis", "nsrs", "vnfrs", "nslcmops", "pdus"),
+    }
+
+    # other topics whose items are referenced, and checked that exist, when writing a topic. They are locked in shared
+    # mode, so that the referenced items cannot be deleted or modified meanwhile, e.g. a vnfd used by a new nsd
+    map_topic_to_read_topics = {
+        "nsds": ("vnfds",),
+        "nsts": ("nsds",),
+        "nsrs": ("nsds", "vnfds", "vim_accounts", "wim_accounts", "k8sclusters"),
+        "nslcmops": ("nsds", "vnfds", "vim_accounts", "wim_accounts", "k8sclusters"),
+        "nsis": ("nsts", "nsds", "vnfds", "vim_accounts", "wim_accounts", "k8sclusters"),
+        "nsilcmops": ("nsts", "nsds", "vnfds", "vim_accounts", "wim_accounts", "k8sclusters"),
+    }
+
+    # topics whose creation is limited by the project quotas
+    quota_topics = ("vnfds", "nsds", "nsts", "pdus", "nsrs", "nsis", "vim_accounts", "wim_accounts", "sdns",
+                    "k8sclusters", "k8srepos")
+
+    # database indexes of the collections not managed by a topic class, each one a tuple of fields
+    map_collection_to_indexes = {
+        "tokens": (("expires",), ("username", "expires"), ("user_id",)),
+        QuotaLedger.collection: QuotaLedger.db_indexes,
+    }
+
     map_target_version_to_int = {
         "1.0": 1000,
         "1.1": 1001,
@@ -68,6 +103,8 @@ class Engine(object):
         # Add new versions here
     }
 
+    default_page_size = 100   # number of items of a list page when query string 'limit' is not provided
+
     def __init__(self, token_cache):
         self.db = None
         self.fs = None
@@ -77,7 +114,11 @@ class Engine(object):
         self.operations = None
         self.logger = logging.getLogger("nbi.engine")
         self.map_topic = {}
-        self.write_lock = None
+        self.lock_manager = None
+        self.quota_ledger = None
+        self.descriptor_cache = None
+        self.index_advisor = None
+        self.backend_metrics = None
         self.token_cache = token_cache
 
     def start(self, config):
@@ -152,7 +193,22 @@ class Engine(object):
                     if value not in self.operations:
                         self.operations += [value]
 
-            self.write_lock = Lock()
+            extend_db(self.db)
+            if config.get("global", {}).get("metrics.backend") and not self.backend_metrics:
+                self.backend_metrics = BackendMetrics()
+                self.backend_metrics.attach_db(self.db, self.get_index_catalogue())
+                self.backend_metrics.attach_fs(self.fs)
+                self.backend_metrics.attach_msg(self.msg)
+            if config["database"].get("index_advisor") and not self.index_advisor:
+                self.index_advisor = IndexAdvisor(self.get_index_catalogue())
+                self.index_advisor.attach(self.db)
+            self.lock_manager = LockManager()
+            self.quota_ledger = QuotaLedger(self.db)
+            BaseTopic.quota_ledger = self.quota_ledger
+            descriptor_cache_size = int(config["database"].get("descriptor_cache_size", 256))
+            self.descriptor_cache = DescriptorCache(self.db, descriptor_cache_size) if descriptor_cache_size else None
+            BaseTopic.descriptor_cache = self.descriptor_cache
+            BaseTopic.token_cache = self.token_cache
             # create one class per topic
             for topic, topic_class in self.map_from_topic_to_class.items():
                 # if self.auth and topic_class in (UserTopicAuth, ProjectTopicAuth):
@@ -162,6 +218,9 @@ class Engine(object):
                                                         self.operations)
                 else:
                     self.map_topic[topic] = topic_class(self.db, self.fs, self.msg, self.auth)
+                # create the jsonschema validators now instead of at the first request
+                compile_schemas(topic_class.schema_new, topic_class.schema_edit,
+                                *getattr(topic_class, "operation_schema", {}).values())
             
             self.map_topic["pm_jobs"] = PmJobsTopic(self.db, config["prometheus"].get("host"),
                                                     config["prometheus"].get("port"))
@@ -176,10 +235,92 @@ class Engine(object):
                 self.fs.fs_disconnect()
             if self.msg:
                 self.msg.disconnect()
-            self.write_lock = None
+            self.lock_manager = None
+            self.quota_ledger = None
+            BaseTopic.quota_ledger = None
+            self.descriptor_cache = None
+            BaseTopic.descriptor_cache = None
+            BaseTopic.token_cache = None
         except (DbException, FsException, MsgException) as e:
             raise EngineException(str(e), http_code=e.http_code)
 
+    def _lock(self, topic, _id=None):
+        """
+        Locks the topic, or only the item _id of the topic, plus the related topics that are modified with it, and in
+        shared mode the topics that it references
+        :param topic: main topic to lock
+        :param _id: if provided only this item of the main topic is locked, instead of the whole topic
+        :return: context manager
+        """
+        related_topics = self.map_topic_to_related_topics.get(topic, ())
+        read_topics = self.map_topic_to_read_topics.get(topic, ())
+        return self.lock_manager.lock((topic, _id), *related_topics, shared=read_topics)
+
+    def get_lock_stats(self):
+        """
+        Obtain the time waited by the write operations on each topic lock. They are exported also as metrics
+        :return: dictionary by topic, empty if not started. See LockManager.get_stats
+        """
+        return self.lock_manager.get_stats() if self.lock_manager else {}
+
+    def get_descriptor_cache_stats(self):
+        """
+        Obtain the size, hits and misses of the descriptor cache
+        :return: dictionary, None if the descriptor cache is disabled. See LruCache.get_stats
+        """
+        return self.descriptor_cache.get_stats() if self.descriptor_cache else None
+
+    def get_index_catalogue(self):
+        """
+        Obtains the database indexes declared by the topic classes and the other collections
+        :return: dictionary by collection with a tuple of indexes, each one a tuple of fields
+        """
+        catalogue = {}
+        for topic_class in self.map_from_topic_to_class.values():
+            catalogue[topic_class.topic] = topic_class.db_indexes
+        catalogue.update(self.map_collection_to_indexes)
+        if self.config["authentication"]["backend"] == "keystone":
+            # users, projects, roles and tokens are stored at keystone
+            for collection in ("users", "projects", "roles", "tokens"):
+                catalogue.pop(collection, None)
+        return catalogue
+
+    def get_index_advice(self, uncovered_only=True):
+        """
+        Obtains the filter shapes that have reached the database, when index advisor is enabled
+        :param uncovered_only: if True only the shapes that cannot use any index are returned
+        :return: list of dictionaries with collection, fields, queries and covered
+        """
+        if not self.index_advisor:
+            raise EngineException("Index advisor is not enabled. Set 'index_advisor' at '[database]'",
+                                  HTTPStatus.NOT_FOUND)
+        return self.index_advisor.get_report(uncovered_only)
+
+    def get_quota_usage(self, session, project):
+        """
+        Obtains the number of items of each topic that a project has, compared with its quota
+        :param session: contains the used login username and working project
+        :param project: project _id or name
+        :return: dictionary by topic with "usage" and "quota"
+        """
+        project_content = self.map_topic["projects"].show(session, project)
+        quotas = project_content.get("quotas") or {}
+        usage = {}
+        for topic in self.quota_topics:
+            topic_object = self.map_topic[topic]
+            usage[topic_object.topic] = {
+                "usage": self.quota_ledger.get_usage(topic_object.topic, project_content["_id"]),
+                "quota": quotas.get(topic_object.topic, topic_object.default_quota)
+            }
+        return usage
+
+    def reconcile_quota_usage(self):
+        """
+        Counts again at database the items of each project, fixing the quota usage ledger
+        :return: number of fixed counters
+        """
+        return self.quota_ledger.reconcile()
+
     def new_item(self, rollback, session, topic, indata=None, kwargs=None, headers=None):
         """
         Creates a new entry into database. For nsds and vnfds it creates an almost empty DISABLED  entry,
@@ -194,9 +335,41 @@ class Engine(object):
         """
         if topic not in self.map_topic:
             raise EngineException("Unknown topic {}!!!".format(topic), HTTPStatus.INTERNAL_SERVER_ERROR)
-        with self.write_lock:
+        with tracing.span("engine.new_item", topic=topic), self._lock(topic):
             return self.map_topic[topic].new(rollback, session, indata, kwargs, headers)
 
+    def rollback(self, rollback):
+        """
+        Undoes, in reverse order, the database changes recorded by new_item at the rollback list
+        :param rollback: list filled by new_item. Each entry contains "topic" and one of:
+            "_id" or "_ids": created items to be deleted, with optional "quota_projects" to update the quota usage
+            "operation": "set", "_id" and "content": item to be updated with its original content
+            "operation": "set_list" and "contents": list of (_id, original content) of the items to be updated
+        :return: list of error texts of the entries that could not be undone
+        """
+        errors = []
+        for rollback_item in reversed(rollback):
+            try:
+                topic = rollback_item["topic"]
+                operation = rollback_item.get("operation")
+                if operation == "set":
+                    self.db.set_one(topic, {"_id": rollback_item["_id"]}, rollback_item["content"],
+                                    fail_on_empty=False)
+                elif operation == "set_list":
+                    bulk_set(self.db, topic, rollback_item["contents"], fail_on_empty=False)
+                else:
+                    if "_ids" in rollback_item:
+                        self.db.del_list(topic, {"_id.cont": rollback_item["_ids"]})
+                        deleted = len(rollback_item["_ids"])
+                    else:
+                        self.db.del_one(topic, {"_id": rollback_item["_id"]}, fail_on_empty=False)
+                        deleted = 1
+                    if rollback_item.get("quota_projects") and self.quota_ledger:
+                        self.quota_ledger.add(topic, rollback_item["quota_projects"], -deleted)
+            except Exception as e:
+                errors.append("Rollback Exception {}: {}".format(rollback_item, e))
+        return errors
+
     def upload_content(self, session, topic, _id, indata, kwargs, headers):
         """
         Upload content for an already created entry (_id)
@@ -210,7 +383,7 @@ class Engine(object):
         """
         if topic not in self.map_topic:
             raise EngineException("Unknown topic {}!!!".format(topic), HTTPStatus.INTERNAL_SERVER_ERROR)
-        with self.write_lock:
+        with tracing.span("engine.upload_content", topic=topic), self._lock(topic):
             return self.map_topic[topic].upload_content(session, _id, indata, kwargs, headers)
 
     def get_item_list(self, session, topic, filter_q=None):
@@ -223,19 +396,48 @@ class Engine(object):
         """
         if topic not in self.map_topic:
             raise EngineException("Unknown topic {}!!!".format(topic), HTTPStatus.INTERNAL_SERVER_ERROR)
-        return self.map_topic[topic].list(session, filter_q)
+        with tracing.span("engine.get_item_list", topic=topic):
+            return self.map_topic[topic].list(session, filter_q)
 
-    def get_item(self, session, topic, _id):
+    def get_item_page(self, session, topic, filter_q=None):
+        """
+        Get a page of a list of items, sorted by _id
+        :param session: contains the used login username and working project
+        :param topic: it can be: users, projects, vnfds, nsds, ...
+        :param filter_q: filter of data to be applied. It contains also the paging query strings "limit", by default
+            self.default_page_size, and "nextpage_opaque_marker", that are removed from the filter
+        :return: tuple with the list of items and the marker for the next page, None if it is the last one
+        """
+        if topic not in self.map_topic:
+            raise EngineException("Unknown topic {}!!!".format(topic), HTTPStatus.INTERNAL_SERVER_ERROR)
+        if not filter_q:
+            filter_q = {}
+        limit = filter_q.pop("limit", None)
+        nextpage_opaque_marker = filter_q.pop("nextpage_opaque_marker", None)
+        if limit is None:
+            limit = self.default_page_size
+        try:
+            limit = int(limit)
+            if limit <= 0:
+                raise ValueError("must be greater than 0")
+        except (ValueError, TypeError) as e:
+            raise EngineException("Invalid query string 'limit={}': {}".format(limit, e), HTTPStatus.BAD_REQUEST)
+        with tracing.span("engine.get_item_page", topic=topic):
+            return self.map_topic[topic].list_page(session, filter_q, limit, nextpage_opaque_marker)
+
+    def get_item(self, session, topic, _id, kwargs=None):
         """
         Get complete information on an item
         :param session: contains the used login username and working project
         :param topic: it can be: users, projects, vnfds, nsds,
         :param _id: server id of the item
+        :param kwargs: query string, used for SOL005 attribute selectors
         :return: dictionary, raise exception if not found.
         """
         if topic not in self.map_topic:
             raise EngineException("Unknown topic {}!!!".format(topic), HTTPStatus.INTERNAL_SERVER_ERROR)
-        return self.map_topic[topic].show(session, _id)
+        with tracing.span("engine.get_item", topic=topic):
+            return self.map_topic[topic].show(session, _id, kwargs)
 
     def get_file(self, session, topic, _id, path=None, accept_header=None):
         """
@@ -249,7 +451,8 @@ class Engine(object):
         """
         if topic not in self.map_topic:
             raise EngineException("Unknown topic {}!!!".format(topic), HTTPStatus.INTERNAL_SERVER_ERROR)
-        return self.map_topic[topic].get_file(session, _id, path, accept_header)
+        with tracing.span("engine.get_file", topic=topic):
+            return self.map_topic[topic].get_file(session, _id, path, accept_header)
 
     def del_item_list(self, session, topic, _filter=None):
         """
@@ -261,7 +464,7 @@ class Engine(object):
         """
         if topic not in self.map_topic:
             raise EngineException("Unknown topic {}!!!".format(topic), HTTPStatus.INTERNAL_SERVER_ERROR)
-        with self.write_lock:
+        with tracing.span("engine.del_item_list", topic=topic), self._lock(topic):
             return self.map_topic[topic].delete_list(session, _filter)
 
     def del_item(self, session, topic, _id, not_send_msg=None):
@@ -277,7 +480,7 @@ class Engine(object):
         """
         if topic not in self.map_topic:
             raise EngineException("Unknown topic {}!!!".format(topic), HTTPStatus.INTERNAL_SERVER_ERROR)
-        with self.write_lock:
+        with tracing.span("engine.del_item", topic=topic), self._lock(topic, _id):
             return self.map_topic[topic].delete(session, _id, not_send_msg=not_send_msg)
 
     def edit_item(self, session, topic, _id, indata=None, kwargs=None):
@@ -292,7 +495,7 @@ class Engine(object):
         """
         if topic not in self.map_topic:
             raise EngineException("Unknown topic {}!!!".format(topic), HTTPStatus.INTERNAL_SERVER_ERROR)
-        with self.write_lock:
+        with tracing.span("engine.edit_item", topic=topic), self._lock(topic):
             return self.map_topic[topic].edit(session, _id, indata, kwargs)
 
     def upgrade_db(self, current_version, target_version):
@@ -356,4 +559,11 @@ class Engine(object):
         if db_version != target_version:
             self.upgrade_db(db_version, target_version)
 
+        # indexes are created after migration, existing ones are kept
+        try:
+            indexes = ensure_indexes(self.db, self.get_index_catalogue())
+            if indexes:
+                self.logger.debug("Ensured {} database indexes".format(indexes))
+        except DbException as e:
+            raise EngineException(str(e), http_code=e.http_code)
         return
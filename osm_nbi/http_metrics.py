@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from os import fstat
+from time import perf_counter
+from osm_nbi import metrics
+
+
+labelnames = ("role_permission", "method", "status")
+phase_labelnames = ("role_permission", "method", "phase")
+size_buckets = (100, 1000, 10000, 100000, 1000000, 10000000, 100000000)
+phases = ("authorize", "format_in", "engine", "format_out")   # in the order they are done
+
+
+class RequestMetrics:
+    """
+    Time of one HTTP request, split in phases. Created by HttpMetrics.start
+    """
+
+    def __init__(self, http_metrics):
+        self.http_metrics = http_metrics
+        self.start = self.last = perf_counter()
+        self.phases = {}
+        self.last_phase = None
+        self.role_permission = ""
+        self.method = ""
+        self.in_flight = True
+
+    def set_operation(self, role_permission, method):
+        """
+        :param role_permission: normalized operation, e.g. ns_instances:id:instantiate:post
+        :param method: HTTP method
+        """
+        self.role_permission = role_permission or ""
+        self.method = method
+
+    def mark(self, phase):
+        """
+        Ends a phase, that started at the end of the previous one or at the request beginning
+        :param phase: phase name: authorize, format_in, engine, format_out
+        """
+        now = perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0) + now - self.last
+        self.last = now
+        self.last_phase = phase
+
+    def mark_failed(self):
+        """
+        Ends the phase that was running when the request failed, that is, the one following the last ended phase
+        """
+        index = phases.index(self.last_phase) + 1 if self.last_phase in phases else 0
+        self.mark(phases[min(index, len(phases) - 1)])
+
+    def finish(self, status, body):
+        """
+        Records the request once the response has been built. Streamed responses are recorded when the last chunk
+        has been sent
+        :param status: HTTP status code
+        :param body: response body: None, text, bytes, file or generator of chunks
+        :return: the body to send, that can be a new generator for streamed responses
+        """
+        status = str(status or 200)[:3]
+        if body is None or isinstance(body, (str, bytes)):
+            self.mark("format_out")
+            self._record(status, len(body) if body else 0)
+            return body
+        if hasattr(body, "read"):
+            self.mark("format_out")
+            try:
+                size = fstat(body.fileno()).st_size
+            except Exception:
+                size = 0
+            self._record(status, size)
+            return body
+        return self._stream(status, body)
+
+    def _stream(self, status, chunks):
+        size = 0
+        try:
+            for chunk in chunks:
+                size += len(chunk)
+                yield chunk
+        finally:
+            self.mark("format_out")
+            self._record(status, size)
+
+    def _record(self, status, size):
+        http_metrics = self.http_metrics
+        labels = (self.role_permission, self.method, status)
+        http_metrics.requests.inc(labels)
+        http_metrics.latency.observe(labels, perf_counter() - self.start)
+        http_metrics.response_size.observe(labels, size)
+        for phase, elapsed in self.phases.items():
+            http_metrics.phase_latency.observe((self.role_permission, self.method, phase), elapsed)
+
+    def done(self):
+        """
+        Called when the request handler ends, with or without exception
+        """
+        if self.in_flight:
+            self.in_flight = False
+            self.http_metrics.in_flight.dec()
+
+
+class NullRequestMetrics:
+    """
+    Used when HTTP metrics are disabled. Records nothing
+    """
+
+    def set_operation(self, role_permission, method):
+        pass
+
+    def mark(self, phase):
+        pass
+
+    def mark_failed(self):
+        pass
+
+    def finish(self, status, body):
+        return body
+
+    def done(self):
+        pass
+
+
+class HttpMetrics:
+    """
+    Number, latency and response size of the HTTP requests, by role_permission, method and HTTP status.
+    Latency is also recorded by phase: authorize, format_in, engine and format_out
+    """
+
+    def __init__(self, registry=None):
+        registry = registry or metrics.registry
+        self.requests = registry.counter("osm_nbi_http_requests_total", "HTTP requests", labelnames)
+        self.in_flight = registry.gauge("osm_nbi_http_requests_in_flight", "HTTP requests being processed")
+        self.latency = registry.histogram("osm_nbi_http_request_duration_seconds", "Duration of the HTTP requests, "
+                                          "until the last byte of the response is sent", labelnames)
+        self.phase_latency = registry.histogram("osm_nbi_http_request_phase_seconds", "Duration of each phase of "
+                                                "the HTTP requests", phase_labelnames)
+        self.response_size = registry.histogram("osm_nbi_http_response_size_bytes", "Size of the HTTP response "
+                                                "bodies", labelnames, buckets=size_buckets)
+
+    def start(self):
+        """
+        Starts the recording of a request
+        :return: RequestMetrics object
+        """
+        self.in_flight.inc()
+        return RequestMetrics(self)
+
+
+null_request_metrics = NullRequestMetrics()
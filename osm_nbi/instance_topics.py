@@ -19,7 +19,9 @@ from http import HTTPStatus
 from time import time
 from copy import copy, deepcopy
 from osm_nbi.validation import validate_input, ValidationError, ns_instantiate, ns_action, ns_scale, nsi_instantiate
-from osm_nbi.base_topic import BaseTopic, EngineException, get_iterable, deep_get
+from osm_nbi.base_topic import BaseTopic, EngineException, ReferenceResolver, get_iterable, deep_get, \
+    get_descriptor
+from osm_nbi import tracing
 # from descriptor_topics import DescriptorTopic
 from yaml import safe_dump
 from osm_common.dbbase import DbException
@@ -33,7 +35,9 @@ __author__ = "Alfonso Tierno <alfonso.tiernosepulveda@telefonica.com>"
 class NsrTopic(BaseTopic):
     topic = "nsrs"
     topic_msg = "ns"
+    db_indexes = BaseTopic.db_indexes + (("nsd-id",), ("vnfd-id",))
     schema_new = ns_instantiate
+    default_exclude_fields = ("nsd", )
 
     def __init__(self, db, fs, msg, auth):
         BaseTopic.__init__(self, db, fs, msg, auth)
@@ -120,12 +124,36 @@ class NsrTopic(BaseTopic):
         return formated_request
 
     @staticmethod
-    def _format_addional_params(ns_request, member_vnf_index=None, vdu_id=None, kdu_name=None, descriptor=None):
+    def _index_additional_params(ns_request):
+        """
+        Indexes the user additional params for VNF, so that they are not looked for at every vnf, vdu and kdu
+        :param ns_request: User instantiation additional parameters
+        :return: dictionary by member-vnf-index of tuples (item, item vdus by vdu_id, item kdus by kdu_name). When
+            repeated, the first one is used
+        """
+        params_index = {}
+        for item in get_iterable(ns_request.get("additionalParamsForVnf")):
+            if item["member-vnf-index"] in params_index:
+                continue
+            vdu_items = {}
+            for item_vdu in get_iterable(item.get("additionalParamsForVdu")):
+                vdu_items.setdefault(item_vdu["vdu_id"], item_vdu)
+            kdu_items = {}
+            for item_kdu in get_iterable(item.get("additionalParamsForKdu")):
+                kdu_items.setdefault(item_kdu["kdu_name"], item_kdu)
+            params_index[item["member-vnf-index"]] = (item, vdu_items, kdu_items)
+        return params_index
+
+    @staticmethod
+    def _format_addional_params(ns_request, member_vnf_index=None, vdu_id=None, kdu_name=None, descriptor=None,
+                                params_index=None, vdud=None):
         """
         Get and format user additional params for NS or VNF
         :param ns_request: User instantiation additional parameters
         :param member_vnf_index: None for extract NS params, or member_vnf_index to extract VNF params
         :param descriptor: If not None it check that needed parameters of descriptor are supplied
+        :param params_index: additional params for VNF indexed by _index_additional_params. Computed if not supplied
+        :param vdud: descriptor of vdu_id, to avoid looking for it at descriptor
         :return: a formatted copy of additional params or None if not supplied
         """
         additional_params = None
@@ -134,22 +162,22 @@ class NsrTopic(BaseTopic):
             where_ = "additionalParamsForNs"
         elif ns_request.get("additionalParamsForVnf"):
             where_ = "additionalParamsForVnf[member-vnf-index={}]".format(member_vnf_index)
-            item = next((x for x in ns_request["additionalParamsForVnf"] if x["member-vnf-index"] == member_vnf_index),
-                        None)
+            if params_index is None:
+                params_index = NsrTopic._index_additional_params(ns_request)
+            item, vdu_items, kdu_items = params_index.get(member_vnf_index, (None, None, None))
             if item:
                 additional_params = copy(item.get("additionalParams")) or {}
-                if vdu_id and item.get("additionalParamsForVdu"):
-                    item_vdu = next((x for x in item["additionalParamsForVdu"] if x["vdu_id"] == vdu_id), None)
+                if vdu_id:
+                    item_vdu = vdu_items.get(vdu_id)
                     if item_vdu and item_vdu.get("additionalParams"):
                         where_ += ".additionalParamsForVdu[vdu_id={}]".format(vdu_id)
                         additional_params = item_vdu["additionalParams"]
                 if kdu_name:
                     additional_params = {}
-                    if item.get("additionalParamsForKdu"):
-                        item_kdu = next((x for x in item["additionalParamsForKdu"] if x["kdu_name"] == kdu_name), None)
-                        if item_kdu and item_kdu.get("additionalParams"):
-                            where_ += ".additionalParamsForKdu[kdu_name={}]".format(kdu_name)
-                            additional_params = item_kdu["additionalParams"]
+                    item_kdu = kdu_items.get(kdu_name)
+                    if item_kdu and item_kdu.get("additionalParams"):
+                        where_ += ".additionalParamsForKdu[kdu_name={}]".format(kdu_name)
+                        additional_params = item_kdu["additionalParams"]
 
         if additional_params:
             for k, v in additional_params.items():
@@ -173,7 +201,8 @@ class NsrTopic(BaseTopic):
                 if kdu_name:
                     initial_primitives = None
                 elif vdu_id:
-                    vdud = next(x for x in descriptor["vdu"] if x["id"] == vdu_id)
+                    if not vdud:
+                        vdud = next(x for x in descriptor["vdu"] if x["id"] == vdu_id)
                     initial_primitives = deep_get(vdud, ("vdu-configuration", "initial-config-primitive"))
                 else:
                     initial_primitives = deep_get(descriptor, ("vnf-configuration", "initial-config-primitive"))
@@ -193,7 +222,54 @@ class NsrTopic(BaseTopic):
 
         return additional_params or None
 
-    def new(self, rollback, session, indata=None, kwargs=None, headers=None):
+    @staticmethod
+    def _get_ns_vld_by_cp(nsd):
+        """
+        Maps the vnfd connection points to the nsd vld where they are connected
+        :param nsd: ns descriptor
+        :return: dictionary by (member-vnf-index-ref, vnfd-connection-point-ref) of the nsd vld id. When a connection
+            point appears at several vld, the first one is used
+        """
+        ns_vld_by_cp = {}
+        for nsd_vld in get_iterable(nsd.get("vld")):
+            for nsd_vld_cp in get_iterable(nsd_vld.get("vnfd-connection-point-ref")):
+                ns_vld_by_cp.setdefault((nsd_vld_cp.get("member-vnf-index-ref"),
+                                         nsd_vld_cp.get("vnfd-connection-point-ref")), nsd_vld["id"])
+        return ns_vld_by_cp
+
+    @staticmethod
+    def _get_vnf_vld_by_icp(vnfd):
+        """
+        Maps the vdu internal connection points to the vnfd internal-vld where they are connected
+        :param vnfd: vnf descriptor
+        :return: dictionary by internal connection point id-ref of the internal-vld id. When an internal connection
+            point appears at several internal-vld, the first one is used
+        """
+        vnf_vld_by_icp = {}
+        for vnfd_ivld in get_iterable(vnfd.get("internal-vld")):
+            for vnfd_ivld_icp in get_iterable(vnfd_ivld.get("internal-connection-point")):
+                vnf_vld_by_icp.setdefault(vnfd_ivld_icp.get("id-ref"), vnfd_ivld["id"])
+        return vnf_vld_by_icp
+
+    @staticmethod
+    def _copy_vdur(vdur_template, index):
+        """
+        Copies a vdur for another count-index. Only the nested lists and dictionaries are copied, that is faster
+        than a deepcopy
+        :param vdur_template: vdur filled for count-index 0
+        :param index: count-index of the new vdur
+        :return: the new vdur
+        """
+        vdur = copy(vdur_template)
+        vdur["internal-connection-point"] = [copy(vdu_icp) for vdu_icp in vdur_template["internal-connection-point"]]
+        vdur["interfaces"] = [copy(vdu_iface) for vdu_iface in vdur_template["interfaces"]]
+        if vdur_template.get("additionalParams"):
+            vdur["additionalParams"] = copy(vdur_template["additionalParams"])
+        vdur["_id"] = str(uuid4())
+        vdur["count-index"] = index
+        return vdur
+
+    def new(self, rollback, session, indata=None, kwargs=None, headers=None, resolver=None):
         """
         Creates a new nsr into database. It also creates needed vnfrs
         :param rollback: list to append the created items at database in case a rollback must be done
@@ -201,6 +277,8 @@ class NsrTopic(BaseTopic):
         :param indata: params to be used for the nsr
         :param kwargs: used to override the indata descriptor
         :param headers: http request headers
+        :param resolver: ReferenceResolver with the descriptors already fetched at this request. Used when the nsr is
+            created by other topic, as NetSlice instances
         :return: the _id of nsr descriptor created at database. Or an exception of type
             EngineException, ValidationError, DbException, FsException, MsgException.
             Note: Exceptions are not captured on purpose. They should be captured at called
@@ -218,10 +296,9 @@ class NsrTopic(BaseTopic):
 
             # look for nsr
             step = "getting nsd id='{}' from database".format(ns_request.get("nsdId"))
-            _filter = self._get_project_filter(session)
-            _filter["_id"] = ns_request["nsdId"]
-            nsd = self.db.get_one("nsds", _filter)
-            del _filter["_id"]
+            if not resolver:
+                resolver = ReferenceResolver(self.db, session)
+            nsd = resolver.get_one("nsds", ns_request["nsdId"], key="_id")
 
             nsr_id = str(uuid4())
 
@@ -277,20 +354,29 @@ class NsrTopic(BaseTopic):
 
             # Create VNFR
             needed_vnfds = {}
+            vnf_vld_by_icp_by_vnfd = {}
+            vnfr_descriptors = []
+            # lookup maps computed once, instead of walking the descriptors for every interface
+            ns_vld_by_cp = self._get_ns_vld_by_cp(nsd)
+            params_index = self._index_additional_params(ns_request)
+            step = "getting vnfds of nsd id='{}' from database".format(nsd["id"])
+            resolver.resolve("vnfds", [member_vnf["vnfd-id-ref"] for member_vnf in nsd.get("constituent-vnfd", ())])
             for member_vnf in nsd.get("constituent-vnfd", ()):
+                vnfr_span = tracing.start_span("create_vnfr", member_vnf_index=member_vnf["member-vnf-index"])
                 vnfd_id = member_vnf["vnfd-id-ref"]
                 step = "getting vnfd id='{}' constituent-vnfd='{}' from database".format(
                     member_vnf["vnfd-id-ref"], member_vnf["member-vnf-index"])
                 if vnfd_id not in needed_vnfds:
-                    # Obtain vnfd
-                    _filter["id"] = vnfd_id
-                    vnfd = self.db.get_one("vnfds", _filter, fail_on_empty=True, fail_on_more=True)
-                    del _filter["id"]
-                    vnfd.pop("_admin")
+                    # Obtain vnfd, already fetched by the resolver. It is shared, so it is copied without _admin
+                    vnfd = resolver.get_one("vnfds", vnfd_id)
+                    vnfd = {k: v for k, v in vnfd.items() if k != "_admin"}
                     needed_vnfds[vnfd_id] = vnfd
+                    vnf_vld_by_icp_by_vnfd[vnfd_id] = self._get_vnf_vld_by_icp(vnfd)
                     nsr_descriptor["vnfd-id"].append(vnfd["_id"])
                 else:
                     vnfd = needed_vnfds[vnfd_id]
+                vnf_vld_by_icp = vnf_vld_by_icp_by_vnfd[vnfd_id]
+                member_vnf_index = member_vnf["member-vnf-index"]
                 step = "filling vnfr  vnfd-id='{}' constituent-vnfd='{}'".format(
                     member_vnf["vnfd-id-ref"], member_vnf["member-vnf-index"])
                 vnfr_id = str(uuid4())
@@ -299,8 +385,8 @@ class NsrTopic(BaseTopic):
                     "_id": vnfr_id,
                     "nsr-id-ref": nsr_id,
                     "member-vnf-index-ref": member_vnf["member-vnf-index"],
-                    "additionalParamsForVnf": self._format_addional_params(ns_request, member_vnf["member-vnf-index"],
-                                                                           descriptor=vnfd),
+                    "additionalParamsForVnf": self._format_addional_params(ns_request, member_vnf_index,
+                                                                           descriptor=vnfd, params_index=params_index),
                     "created-time": now,
                     # "vnfd": vnfd,        # at OSM model.but removed to avoid data duplication TODO: revise
                     "vnfd-ref": vnfd_id,
@@ -332,28 +418,16 @@ class NsrTopic(BaseTopic):
 
                 # Create k8s-cluster information
                 if vnfd.get("k8s-cluster"):
-                    vnfr_descriptor["k8s-cluster"] = vnfd["k8s-cluster"]
+                    vnfr_descriptor["k8s-cluster"] = deepcopy(vnfd["k8s-cluster"])
                     for net in get_iterable(vnfr_descriptor["k8s-cluster"].get("nets")):
                         if net.get("external-connection-point-ref"):
-                            for nsd_vld in get_iterable(nsd.get("vld")):
-                                for nsd_vld_cp in get_iterable(nsd_vld.get("vnfd-connection-point-ref")):
-                                    if nsd_vld_cp.get("vnfd-connection-point-ref") == \
-                                            net["external-connection-point-ref"] and \
-                                            nsd_vld_cp.get("member-vnf-index-ref") == member_vnf["member-vnf-index"]:
-                                        net["ns-vld-id"] = nsd_vld["id"]
-                                        break
-                                else:
-                                    continue
-                                break
+                            ns_vld_id = ns_vld_by_cp.get((member_vnf_index, net["external-connection-point-ref"]))
+                            if ns_vld_id:
+                                net["ns-vld-id"] = ns_vld_id
                         elif net.get("internal-connection-point-ref"):
-                            for vnfd_ivld in get_iterable(vnfd.get("internal-vld")):
-                                for vnfd_ivld_icp in get_iterable(vnfd_ivld.get("internal-connection-point")):
-                                    if vnfd_ivld_icp.get("id-ref") == net["internal-connection-point-ref"]:
-                                        net["vnf-vld-id"] = vnfd_ivld["id"]
-                                        break
-                                else:
-                                    continue
-                                break
+                            vnf_vld_id = vnf_vld_by_icp.get(net["internal-connection-point-ref"])
+                            if vnf_vld_id:
+                                net["vnf-vld-id"] = vnf_vld_id
                 # update kdus
                 for kdu in get_iterable(vnfd.get("kdu")):
                     kdur = {x: kdu[x] for x in kdu if x in ("helm-chart", "juju-bundle")}
@@ -361,8 +435,9 @@ class NsrTopic(BaseTopic):
                     # TODO      "name": ""     Name of the VDU in the VIM
                     kdur["ip-address"] = None  # mgmt-interface filled by LCM
                     kdur["k8s-cluster"] = {}
-                    kdur["additionalParams"] = self._format_addional_params(ns_request, member_vnf["member-vnf-index"],
-                                                                            kdu_name=kdu["name"], descriptor=vnfd)
+                    kdur["additionalParams"] = self._format_addional_params(ns_request, member_vnf_index,
+                                                                            kdu_name=kdu["name"], descriptor=vnfd,
+                                                                            params_index=params_index)
                     if not vnfr_descriptor.get("kdur"):
                         vnfr_descriptor["kdur"] = []
                     vnfr_descriptor["kdur"].append(kdur)
@@ -375,8 +450,9 @@ class NsrTopic(BaseTopic):
                         # "vim-id", "flavor-id", "image-id", "management-ip" # filled by LCM
                         "internal-connection-point": [],
                         "interfaces": [],
-                        "additionalParams": self._format_addional_params(ns_request, member_vnf["member-vnf-index"],
-                                                                         vdu_id=vdu["id"], descriptor=vnfd)
+                        "additionalParams": self._format_addional_params(ns_request, member_vnf_index,
+                                                                         vdu_id=vdu["id"], descriptor=vnfd,
+                                                                         params_index=params_index, vdud=vdu)
                     }
                     if vdu.get("pdu-type"):
                         vdur["pdu-type"] = vdu["pdu-type"]
@@ -403,51 +479,40 @@ class NsrTopic(BaseTopic):
 
                         # look for network where this interface is connected
                         if iface.get("external-connection-point-ref"):
-                            for nsd_vld in get_iterable(nsd.get("vld")):
-                                for nsd_vld_cp in get_iterable(nsd_vld.get("vnfd-connection-point-ref")):
-                                    if nsd_vld_cp.get("vnfd-connection-point-ref") == \
-                                            iface["external-connection-point-ref"] and \
-                                            nsd_vld_cp.get("member-vnf-index-ref") == member_vnf["member-vnf-index"]:
-                                        vdu_iface["ns-vld-id"] = nsd_vld["id"]
-                                        break
-                                else:
-                                    continue
-                                break
+                            ns_vld_id = ns_vld_by_cp.get((member_vnf_index, iface["external-connection-point-ref"]))
+                            if ns_vld_id:
+                                vdu_iface["ns-vld-id"] = ns_vld_id
                         elif iface.get("internal-connection-point-ref"):
-                            for vnfd_ivld in get_iterable(vnfd.get("internal-vld")):
-                                for vnfd_ivld_icp in get_iterable(vnfd_ivld.get("internal-connection-point")):
-                                    if vnfd_ivld_icp.get("id-ref") == iface["internal-connection-point-ref"]:
-                                        vdu_iface["vnf-vld-id"] = vnfd_ivld["id"]
-                                        break
-                                else:
-                                    continue
-                                break
+                            vnf_vld_id = vnf_vld_by_icp.get(iface["internal-connection-point-ref"])
+                            if vnf_vld_id:
+                                vdu_iface["vnf-vld-id"] = vnf_vld_id
 
                         vdur["interfaces"].append(vdu_iface)
                     count = vdu.get("count", 1)
                     if count is None:
                         count = 1
                     count = int(count)    # TODO remove when descriptor serialized with payngbind
+                    # vdur is the template for the rest of count-index
+                    vdur["_id"] = str(uuid4())
+                    vdur["count-index"] = 0
                     for index in range(0, count):
-                        if index:
-                            vdur = deepcopy(vdur)
-                        vdur["_id"] = str(uuid4())
-                        vdur["count-index"] = index
-                        vnfr_descriptor["vdur"].append(vdur)
-
-                step = "creating vnfr vnfd-id='{}' constituent-vnfd='{}' at database".format(
-                    member_vnf["vnfd-id-ref"], member_vnf["member-vnf-index"])
+                        vnfr_descriptor["vdur"].append(self._copy_vdur(vdur, index) if index else vdur)
 
-                # add at database
                 self.format_on_new(vnfr_descriptor, session["project_id"], make_public=session["public"])
-                self.db.create("vnfrs", vnfr_descriptor)
-                rollback.append({"topic": "vnfrs", "_id": vnfr_id})
+                vnfr_descriptors.append(vnfr_descriptor)
                 nsr_descriptor["constituent-vnfr-ref"].append(vnfr_id)
+                tracing.end_span(vnfr_span)
+
+            # add all the vnfrs at database at once
+            step = "creating {} vnfrs at database".format(len(vnfr_descriptors))
+            self._create_list(rollback, vnfr_descriptors, topic="vnfrs")
 
             step = "creating nsr at database"
             self.format_on_new(nsr_descriptor, session["project_id"], make_public=session["public"])
             self.db.create("nsrs", nsr_descriptor)
-            rollback.append({"topic": "nsrs", "_id": nsr_id})
+            rollback.append({"topic": "nsrs", "_id": nsr_id,
+                             "quota_projects": nsr_descriptor["_admin"]["projects_read"]})
+            self.update_quota_usage(nsr_descriptor["_admin"]["projects_read"], 1)
 
             step = "creating nsr temporal folder"
             self.fs.mkdir(nsr_id)
@@ -463,6 +528,8 @@ class NsrTopic(BaseTopic):
 class VnfrTopic(BaseTopic):
     topic = "vnfrs"
     topic_msg = None
+    db_indexes = BaseTopic.db_indexes + (("nsr-id-ref",), ("vnfd-id",), ("vim-account-id",), ("vdur.pdu-id",))
+    default_exclude_fields = ("vdur", )
 
     def __init__(self, db, fs, msg, auth):
         BaseTopic.__init__(self, db, fs, msg, auth)
@@ -481,6 +548,7 @@ class VnfrTopic(BaseTopic):
 class NsLcmOpTopic(BaseTopic):
     topic = "nslcmops"
     topic_msg = "ns"
+    db_indexes = BaseTopic.db_indexes + (("nsInstanceId",),)
     operation_schema = {    # mapping between operation and jsonschema to validate
         "instantiate": ns_instantiate,
         "action": ns_action,
@@ -514,7 +582,7 @@ class NsLcmOpTopic(BaseTopic):
             if not vnfr:
                 raise EngineException("Invalid parameter member_vnf_index='{}' is not one of the "
                                       "nsd:constituent-vnfd".format(member_vnf_index))
-            vnfd = self.db.get_one("vnfds", {"_id": vnfr["vnfd-id"]}, fail_on_empty=False)
+            vnfd = get_descriptor(self.db, "vnfds", vnfr["vnfd-id"], fail_on_empty=False)
             if not vnfd:
                 raise EngineException("vnfd id={} has been deleted!. Operation cannot be performed".
                                       format(vnfr["vnfd-id"]))
@@ -679,6 +747,7 @@ class NsLcmOpTopic(BaseTopic):
                     raise EngineException("Invalid parameter vld:name='{}' is not present at nsd:vld".format(
                         in_vld["name"]))
 
+    @tracing.traced("look_for_pdu")
     def _look_for_pdu(self, session, rollback, vnfr, vim_account, vnfr_update, vnfr_update_rollback):
         """
         Look for a free PDU in the catalog matching vdur type and interfaces. Fills vnfr.vdur with the interface
@@ -865,6 +934,7 @@ class NsLcmOpTopic(BaseTopic):
         # get vnfr
         nsr_id = nsr["_id"]
         vnfrs = self.db.get_list("vnfrs", {"nsr-id-ref": nsr_id})
+        vnfr_updates = []
 
         for vnfr in vnfrs:
             vnfr_update = {}
@@ -890,9 +960,8 @@ class NsLcmOpTopic(BaseTopic):
             # get kdus
             ifaces_forcing_vim_network += self._look_for_k8scluster(session, rollback, vnfr, vim_account, vnfr_update,
                                                                     vnfr_update_rollback)
-            # update database vnfr
-            self.db.set_one("vnfrs", {"_id": vnfr["_id"]}, vnfr_update)
-            rollback.append({"topic": "vnfrs", "_id": vnfr["_id"], "operation": "set", "content": vnfr_update_rollback})
+            # database vnfrs are updated at once at the end
+            vnfr_updates.append((vnfr["_id"], vnfr_update, vnfr_update_rollback))
 
             # Update indada in case pdu forces to use a concrete vim-network-name
             # TODO check if user has already insert a vim-network-name and raises an error
@@ -914,6 +983,9 @@ class NsLcmOpTopic(BaseTopic):
                                           ("name", "vim-network-name", "vim-network-id") if iface_info.get(key)}]
                     })
 
+        # update database vnfrs
+        self._set_list(rollback, vnfr_updates, topic="vnfrs")
+
     @staticmethod
     def _create_nslcmop(nsr_id, operation, params):
         """
@@ -1022,6 +1094,7 @@ class NsLcmOpTopic(BaseTopic):
 class NsiTopic(BaseTopic):
     topic = "nsis"
     topic_msg = "nsi"
+    db_indexes = BaseTopic.db_indexes + (("nst-id",), ("_admin.nst-id",))
 
     def __init__(self, db, fs, msg, auth):
         BaseTopic.__init__(self, db, fs, msg, auth)
@@ -1197,9 +1270,7 @@ class NsiTopic(BaseTopic):
             # look for nstd
             step = "getting nstd id='{}' from database".format(slice_request.get("nstId"))
             _filter = self._get_project_filter(session)
-            _filter["_id"] = slice_request["nstId"]
-            nstd = self.db.get_one("nsts", _filter)
-            del _filter["_id"]
+            nstd = get_descriptor(self.db, "nsts", slice_request["nstId"], _filter)
 
             nstd.pop("_admin", None)
             nstd_id = nstd.pop("_id", None)
@@ -1245,24 +1316,18 @@ class NsiTopic(BaseTopic):
 
             nsi_descriptor["_admin"]["netslice-vld"] = nsi_vlds
             # Creating netslice-subnet_record.
-            needed_nsds = {}
             services = []
+            # shared with the nsrs creation, so that each nsd and vnfd is fetched once for the whole NetSlice
+            resolver = ReferenceResolver(self.db, session)
+            step = "getting nsds of nstd id='{}' from database".format(nstd.get("id"))
+            resolver.resolve("nsds", [member_ns["nsd-ref"] for member_ns in nstd["netslice-subnet"]])
 
             # Updating the nstd with the nsd["_id"] associated to the nss -> services list
             for member_ns in nstd["netslice-subnet"]:
                 nsd_id = member_ns["nsd-ref"]
                 step = "getting nstd id='{}' constituent-nsd='{}' from database".format(
                     member_ns["nsd-ref"], member_ns["id"])
-                if nsd_id not in needed_nsds:
-                    # Obtain nsd
-                    _filter["id"] = nsd_id
-                    nsd = self.db.get_one("nsds", _filter, fail_on_empty=True, fail_on_more=True)
-                    del _filter["id"]
-                    nsd.pop("_admin")
-                    needed_nsds[nsd_id] = nsd
-                else:
-                    nsd = needed_nsds[nsd_id]
-                member_ns["_id"] = needed_nsds[nsd_id].get("_id")
+                member_ns["_id"] = resolver.get_one("nsds", nsd_id)["_id"]
                 services.append(member_ns)
 
                 step = "filling nsir nsd-id='{}' constituent-nsd='{}' from database".format(
@@ -1315,7 +1380,7 @@ class NsiTopic(BaseTopic):
                                 break                   
 
                     # Creates Nsr objects
-                    _id_nsr, _ = self.nsrTopic.new(rollback, session, indata_ns, kwargs, headers)
+                    _id_nsr, _ = self.nsrTopic.new(rollback, session, indata_ns, kwargs, headers, resolver=resolver)
                 nsrs_item = {"nsrId": _id_nsr, "shared": service.get("is-shared-nss"), "nsd-id": service["nsd-ref"], 
                              "nss-id": service["id"], "nslcmop_instantiate": None}
                 indata_ns["nss-id"] = service["id"]
@@ -1331,7 +1396,9 @@ class NsiTopic(BaseTopic):
 
             # Creating the entry in the database
             self.db.create("nsis", nsi_descriptor)
-            rollback.append({"topic": "nsis", "_id": nsi_id})
+            rollback.append({"topic": "nsis", "_id": nsi_id,
+                             "quota_projects": nsi_descriptor["_admin"]["projects_read"]})
+            self.update_quota_usage(nsi_descriptor["_admin"]["projects_read"], 1)
             return nsi_id, None
         except Exception as e:   # TODO remove try Except, it is captured at nbi.py
             self.logger.exception("Exception {} at NsiTopic.new()".format(e), exc_info=True)
@@ -1346,6 +1413,7 @@ class NsiTopic(BaseTopic):
 class NsiLcmOpTopic(BaseTopic):
     topic = "nsilcmops"
     topic_msg = "nsi"
+    db_indexes = BaseTopic.db_indexes + (("netsliceInstanceId",),)
     operation_schema = {  # mapping between operation and jsonschema to validate
         "instantiate": nsi_instantiate,
         "terminate": None
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from contextlib import contextmanager
+from threading import Condition, Lock
+from time import monotonic
+from osm_nbi import metrics
+
+
+SHARED = "shared"   # lock mode of a topic that is only read
+
+
+class _TopicLock:
+    """
+    Lock of a single topic. It can be taken for the whole topic (exclusive), for some items of the topic, or shared by
+    the operations that only read the topic. Items locks are exclusive among them, but several different items can be
+    locked at the same time by different threads. Shared locks are compatible among them, but not with items or whole
+    topic locks. A waiting whole topic lock has preference over new items and shared locks, and a waiting items lock
+    over new shared locks, so that they are not starved
+    """
+
+    def __init__(self):
+        self.condition = Condition(Lock())
+        self.exclusive = False
+        self.exclusive_waiting = 0
+        self.items = set()
+        self.items_waiting = 0
+        self.shared = 0
+
+    def acquire(self, items=None):
+        """
+        Blocks until the topic (items is None), all the requested items, or the shared lock is obtained
+        :param items: None to lock the whole topic; SHARED for a shared lock; or a set of _id to lock
+        :return: None
+        """
+        with self.condition:
+            if items is None:
+                self.exclusive_waiting += 1
+                try:
+                    while self.exclusive or self.items or self.shared:
+                        self.condition.wait()
+                finally:
+                    self.exclusive_waiting -= 1
+                self.exclusive = True
+            elif items == SHARED:
+                while self.exclusive or self.exclusive_waiting or self.items or self.items_waiting:
+                    self.condition.wait()
+                self.shared += 1
+            else:
+                self.items_waiting += 1
+                try:
+                    while self.exclusive or self.exclusive_waiting or self.shared or \
+                            not self.items.isdisjoint(items):
+                        self.condition.wait()
+                finally:
+                    self.items_waiting -= 1
+                self.items.update(items)
+
+    def release(self, items=None):
+        with self.condition:
+            if items is None:
+                self.exclusive = False
+            elif items == SHARED:
+                self.shared -= 1
+            else:
+                self.items.difference_update(items)
+            self.condition.notify_all()
+
+
+class LockManager:
+    """
+    Locks used by the engine to serialize the write operations. Instead of a global lock, it locks only the topics,
+    or the items of a topic, that are going to be modified. Several topics are always locked in the same order
+    (alphabetically) to avoid dead locks. It keeps also statistics of the time waited for each topic lock, that are
+    exported also at the metrics registry
+    """
+
+    def __init__(self, registry=None):
+        self._topics = {}
+        self._stats = {}
+        self._lock = Lock()   # protects _topics and _stats
+        registry = registry or metrics.registry
+        self._wait_metric = registry.histogram("osm_nbi_engine_lock_wait_seconds", "Time waited by the engine "
+                                               "operations to obtain the topic locks", ("topic", "mode"))
+
+    def _get_topic_lock(self, topic):
+        with self._lock:
+            topic_lock = self._topics.get(topic)
+            if not topic_lock:
+                topic_lock = self._topics[topic] = _TopicLock()
+            return topic_lock
+
+    def _add_stats(self, topic, items, waited):
+        mode = "topic" if items is None else SHARED if items == SHARED else "items"
+        self._wait_metric.observe((topic, mode), waited)
+        with self._lock:
+            stats = self._stats.get(topic)
+            if not stats:
+                stats = self._stats[topic] = {"acquired": 0, "contended": 0, "wait_time": 0.0, "max_wait_time": 0.0}
+            stats["acquired"] += 1
+            if waited > 0.001:
+                stats["contended"] += 1
+            stats["wait_time"] += waited
+            if waited > stats["max_wait_time"]:
+                stats["max_wait_time"] = waited
+
+    @staticmethod
+    def _get_resources(resources, shared=()):
+        """
+        Join the requested resources by topic
+        :param resources: iterable of topic (lock the whole topic) or tuples (topic, _id) (lock only this item)
+        :param shared: iterable of topics to lock in shared mode. Ignored if the topic is also at resources
+        :return: dictionary with topic as key and None (whole topic), SHARED, or a set of _ids as value
+        """
+        topics = {topic: SHARED for topic in shared}
+        for resource in resources:
+            if isinstance(resource, str):
+                topic, _id = resource, None
+            else:
+                topic, _id = resource
+            if _id is None:
+                topics[topic] = None
+            elif topic not in topics or topics[topic] == SHARED:
+                topics[topic] = {_id}
+            elif topics[topic] is not None:
+                topics[topic].add(_id)
+        return topics
+
+    @contextmanager
+    def lock(self, *resources, shared=()):
+        """
+        Context manager that locks several resources. Usage: with lock_manager.lock("nsrs", ("vnfds", _id)):
+        :param resources: topic to lock the whole topic, or tuple (topic, _id) to lock only an item of the topic
+        :param shared: topics that are only read, e.g. to check that the referenced items exist. They are locked in
+            shared mode, compatible with other readers but not with the operations that modify them
+        :return: None
+        """
+        acquired = []
+        try:
+            for topic, items in sorted(self._get_resources(resources, shared).items()):
+                topic_lock = self._get_topic_lock(topic)
+                start = monotonic()
+                topic_lock.acquire(items)
+                acquired.append((topic_lock, items))
+                self._add_stats(topic, items, monotonic() - start)
+            yield
+        finally:
+            for topic_lock, items in reversed(acquired):
+                topic_lock.release(items)
+
+    def get_stats(self):
+        """
+        Obtain the lock statistics
+        :return: dictionary by topic with the number of locks acquired, number of them that have waited (contended),
+            the total and maximum waiting time in seconds
+        """
+        with self._lock:
+            return {topic: dict(stats) for topic, stats in self._stats.items()}
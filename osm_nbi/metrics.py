@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Minimal metrics registry exported with the Prometheus text exposition format (version 0.0.4).
+Metrics are identified by name and a tuple of label values, in the same order than the metric labelnames
+"""
+
+from bisect import bisect_left
+from threading import Lock
+
+
+content_type = "text/plain; version=0.0.4; charset=utf-8"
+# default latency buckets in seconds
+default_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, labels, extra=""):
+    items = ['{}="{}"'.format(name, _escape(value)) for name, value in zip(labelnames, labels)]
+    if extra:
+        items.append(extra)
+    return "{" + ",".join(items) + "}" if items else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    metric_type = None  # to_override
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}   # by label values
+        self._lock = Lock()
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def get(self, labels=()):
+        """
+        :param labels: tuple of label values
+        :return: current value for these labels, None if never set
+        """
+        with self._lock:
+            return self._values.get(tuple(labels))
+
+    def _samples(self):
+        """
+        :return: iterable of tuples with sample name suffix, label values, extra label text and value
+        """
+        with self._lock:
+            return [("", labels, "", value) for labels, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.documentation.replace("\n", " ")),
+                 "# TYPE {} {}".format(self.name, self.metric_type)]
+        for suffix, labels, extra, value in self._samples():
+            lines.append("{}{}{} {}".format(self.name, suffix, _format_labels(self.labelnames, labels, extra),
+                                            _format_value(value)))
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def set(self, labels=(), value=0):
+        """
+        Sets a total counted elsewhere, e.g. by a cache. Used by the registry collectors
+        """
+        with self._lock:
+            self._values[labels] = value
+
+
+class Gauge(Metric):
+    metric_type = "gauge"
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+    def set(self, labels=(), value=0):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=default_buckets):
+        Metric.__init__(self, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, labels=(), value=0):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if not entry:
+                # observations per bucket (not cumulative, last one for +Inf), sum
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def get(self, labels=()):
+        """
+        :param labels: tuple of label values
+        :return: dictionary with count, sum and cumulative buckets; None if never observed
+        """
+        with self._lock:
+            entry = self._values.get(tuple(labels))
+            if not entry:
+                return None
+            observations, total = list(entry[0]), entry[1]
+        cumulative = []
+        count = 0
+        for observed in observations:
+            count += observed
+            cumulative.append(count)
+        return {"count": count, "sum": total, "buckets": dict(zip(self.buckets + (float("inf"),), cumulative))}
+
+    def _samples(self):
+        with self._lock:
+            labels_list = sorted(self._values)
+        samples = []
+        for labels in labels_list:
+            values = self.get(labels)
+            for bound, count in values["buckets"].items():
+                samples.append(("_bucket", labels, 'le="{}"'.format(_format_value(float(bound))), count))
+            samples.append(("_sum", labels, "", values["sum"]))
+            samples.append(("_count", labels, "", values["count"]))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Set of metrics, obtained by name. A metric is created the first time it is requested
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = {}   # by name. Functions that update metrics kept elsewhere before rendering
+        self._lock = Lock()
+
+    def _get_metric(self, metric_class, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if not metric:
+                metric = self._metrics[name] = metric_class(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, metric_class) or metric.labelnames != tuple(labelnames):
+                raise ValueError("Metric '{}' already registered with other type or labels".format(name))
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_metric(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get_metric(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=default_buckets):
+        return self._get_metric(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def set_collector(self, name, collector):
+        """
+        Registers a function that updates some metrics from values kept elsewhere, e.g. cache statistics. It is called
+        with the registry before rendering. A collector with the same name is replaced
+        :param name: collector name
+        :param collector: function that receives the registry. None for removing it
+        :return: None
+        """
+        with self._lock:
+            if collector:
+                self._collectors[name] = collector
+            else:
+                self._collectors.pop(name, None)
+
+    def clear(self):
+        """
+        Removes the values of all the metrics, keeping them registered
+        """
+        for metric in list(self._metrics.values()):
+            metric.clear()
+
+    def render(self):
+        """
+        :return: text with all the metrics at Prometheus exposition format
+        """
+        with self._lock:
+            collectors = list(self._collectors.values())
+        for collector in collectors:
+            collector(self)
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        return "".join(metric.render() + "\n" for _, metric in metrics)
+
+
+# registry shared by all the NBI modules
+registry = MetricsRegistry()
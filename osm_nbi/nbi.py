@@ -16,9 +16,10 @@
 
 import cherrypy
 import time
-import json
 import yaml
 import osm_nbi.html_out as html
+import osm_nbi.serializer as serializer
+import osm_nbi.metrics as metrics
 import logging
 import logging.handlers
 import getopt
@@ -28,12 +29,15 @@ from osm_nbi.authconn import AuthException, AuthconnException
 from osm_nbi.auth import Authenticator
 from osm_nbi.engine import Engine, EngineException
 from osm_nbi.subscriptions import SubscriptionThread
+from osm_nbi.http_metrics import HttpMetrics, null_request_metrics
+from osm_nbi.tracing import Tracer, traced
 from osm_nbi.validation import ValidationError
+from osm_nbi.package_upload import MultipartPart, MultipartReader
 from osm_common.dbbase import DbException
 from osm_common.fsbase import FsException
 from osm_common.msgbase import MsgException
 from http import HTTPStatus
-from codecs import getreader
+from urllib.parse import parse_qsl, urlencode
 from os import environ, path
 from osm_nbi import version as _nbi_version, version_date as nbi_version_date
 
@@ -107,6 +111,7 @@ URL: /osm                                                       GET     POST
                 /<id>                                           O               O       O       O
             /projects                                           O       O
                 /<id>                                           O                       O
+                    /usage                                      O
             /vim_accounts  (also vims for compatibility)        O       O
                 /<id>                                           O                       O       O
             /wim_accounts                                       O       O
@@ -117,6 +122,7 @@ URL: /osm                                                       GET     POST
                 /<id>                                           O                       O       O
             /k8srepos                                           O       O
                 /<id>                                           O                               O
+            /metrics                                            O
 
         /nst/v1                                                 O       O
             /netslice_templates_content                         O       O
@@ -151,18 +157,20 @@ query string:
     For filtering inside array, it must select the element of the array, or add ANYINDEX to apply the filtering over any
     item of the array, that is, pass if any item of the array pass the filter.
     It allows both ne and neq for not equal
-    TODO: 4.3.3 Attribute selectors
+    Paging of lists follows SOL013 section 5.4.2:
+        limit=<number>: maximum number of items to return. The list is sorted by _id
+        nextpage_opaque_marker=<marker>: get the next page. The URL of next page is provided at the 'Link' header
+    Attribute selectors follow SOL005 section 4.3.3, with the exception that by default all attributes are returned:
         all_fields, fields=x,y,.., exclude_default, exclude_fields=x,y,...
-        (none)	… same as “exclude_default”
+        (none)	… same as “all_fields”, for backward compatibility
         all_fields	… all attributes.
-        fields=<list>	… all attributes except all complex attributes with minimum cardinality of zero that are not
-        conditionally mandatory, and that are not provided in <list>.
+        fields=<list>	… only the attributes provided in <list>, plus _id.
         exclude_fields=<list>	… all attributes except those complex attributes with a minimum cardinality of zero that
         are not conditionally mandatory, and that are provided in <list>.
         exclude_default	… all attributes except those complex attributes with a minimum cardinality of zero that are not
         conditionally mandatory, and that are part of the "default exclude set" defined in the present specification for
         the particular resource
-        exclude_default and include=<list>	… all attributes except those complex attributes with a minimum cardinality
+        exclude_default and fields=<list>	… all attributes except those complex attributes with a minimum cardinality
         of zero that are not conditionally mandatory and that are part of the "default exclude set" defined in the
         present specification for the particular resource, but that are not part of <list>
     Additionally it admits some administrator values:
@@ -174,6 +182,7 @@ query string:
 Header field name	Reference	Example	Descriptions
     Accept	IETF RFC 7231 [19]	application/json	Content-Types that are acceptable for the response.
     This header field shall be present if the response is expected to have a non-empty message body.
+    By default json is returned compact. Use "application/json; indent=4" to obtain an indented output
     Content-Type	IETF RFC 7231 [19]	application/json	The MIME type of the body of the request.
     This header field shall be present if the request has a non-empty message body.
     Authorization	IETF RFC 7235 [22]	Bearer mF_9.B5f-4.1JqM 	The authorization token for the request.
@@ -224,7 +233,10 @@ valid_url_methods = {
             "projects": {"METHODS": ("GET", "POST"),
                          "ROLE_PERMISSION": "projects:",
                          "<ID>": {"METHODS": ("GET", "DELETE", "PATCH"),
-                                  "ROLE_PERMISSION": "projects:id:"}
+                                  "ROLE_PERMISSION": "projects:id:",
+                                  "usage": {"METHODS": ("GET",),
+                                            "ROLE_PERMISSION": "projects:id:usage:"}
+                                  }
                          },
             "roles": {"METHODS": ("GET", "POST"),
                       "ROLE_PERMISSION": "roles:",
@@ -268,6 +280,9 @@ valid_url_methods = {
                                   "ROLE_PERMISSION": "k8srepos:id:"
                                   }
                          },
+            "metrics": {"METHODS": ("GET",),
+                        "ROLE_PERMISSION": "metrics:",
+                        },
 
         }
     },
@@ -476,16 +491,61 @@ class NbiException(Exception):
         self.http_code = http_code
 
 
+def process_multipart_stream(entity):
+    """
+    cherrypy body processor for multipart/form-data that does not spool the files into temporary files. Form fields
+    before the first file are read as usual. The file is provided as a MultipartPart, read directly from the request
+    body by the handler. Content after the file is discarded
+    """
+    boundary = entity.content_type.params.get("boundary", "").strip('"')
+    if not boundary:
+        raise cherrypy.HTTPError(HTTPStatus.BAD_REQUEST.value, "Missing multipart boundary")
+    try:
+        for part in MultipartReader(entity.fp, boundary.encode("latin-1")):
+            if part.name is None:
+                continue
+            value = part.read().decode("utf-8") if part.filename is None else part
+            if part.name not in entity.params:
+                entity.params[part.name] = value
+            elif isinstance(entity.params[part.name], list):
+                entity.params[part.name].append(value)
+            else:
+                entity.params[part.name] = [entity.params[part.name], value]
+            if part.filename is not None:
+                break
+    except (ValueError, UnicodeDecodeError) as e:
+        raise cherrypy.HTTPError(HTTPStatus.BAD_REQUEST.value, str(e))
+
+
+def _stream_package_content():
+    """
+    Sets the streaming multipart processor for the urls that upload packages, so that they are written only once to
+    the storage
+    """
+    request = cherrypy.serving.request
+    url_items = request.path_info.strip("/").split("/")
+    if (len(url_items) == 3 and url_items[2] in package_content_topics) or \
+            (len(url_items) == 5 and url_items[4] in package_content_items):
+        request.body.processors["multipart/form-data"] = process_multipart_stream
+
+
+package_content_topics = ("ns_descriptors_content", "vnf_packages_content", "netslice_templates_content")
+package_content_items = ("nsd_content", "package_content", "nst_content")
+cherrypy.tools.package_stream = cherrypy.Tool("before_request_body", _stream_package_content)
+
+
 class Server(object):
+    _cp_config = {"tools.package_stream.on": True}
     instance = 0
-    # to decode bytes to str
-    reader = getreader("utf-8")
 
     def __init__(self):
         self.instance += 1
         self.authenticator = Authenticator(valid_url_methods, valid_query_string)
         self.engine = Engine(self.authenticator.tokens_cache)
+        self.http_metrics = None    # HttpMetrics when enabled by configuration
+        self.tracer = None          # Tracer when enabled by configuration
 
+    @traced("format_in")
     def _format_in(self, kwargs):
         try:
             indata = None
@@ -495,11 +555,11 @@ class Server(object):
                 if "Content-Type" in cherrypy.request.headers:
                     if "application/json" in cherrypy.request.headers["Content-Type"]:
                         error_text = "Invalid json format "
-                        indata = json.load(self.reader(cherrypy.request.body))
+                        indata = serializer.json_load(cherrypy.request.body)
                         cherrypy.request.headers.pop("Content-File-MD5", None)
                     elif "application/yaml" in cherrypy.request.headers["Content-Type"]:
                         error_text = "Invalid yaml format "
-                        indata = yaml.load(cherrypy.request.body, Loader=yaml.SafeLoader)
+                        indata = serializer.yaml_load(cherrypy.request.body)
                         cherrypy.request.headers.pop("Content-File-MD5", None)
                     elif "application/binary" in cherrypy.request.headers["Content-Type"] or \
                          "application/gzip" in cherrypy.request.headers["Content-Type"] or \
@@ -509,21 +569,27 @@ class Server(object):
                     elif "multipart/form-data" in cherrypy.request.headers["Content-Type"]:
                         if "descriptor_file" in kwargs:
                             filecontent = kwargs.pop("descriptor_file")
-                            if not filecontent.file:
+                            if isinstance(filecontent, MultipartPart):
+                                # package upload streamed from the request body
+                                indata = filecontent
+                                if filecontent.content_type:
+                                    cherrypy.request.headers["Content-Type"] = filecontent.content_type
+                            elif not filecontent.file:
                                 raise NbiException("empty file or content", HTTPStatus.BAD_REQUEST)
-                            indata = filecontent.file  # .read()
-                            if filecontent.content_type.value:
-                                cherrypy.request.headers["Content-Type"] = filecontent.content_type.value
+                            else:
+                                indata = filecontent.file  # .read()
+                                if filecontent.content_type.value:
+                                    cherrypy.request.headers["Content-Type"] = filecontent.content_type.value
                     else:
                         # raise cherrypy.HTTPError(HTTPStatus.Not_Acceptable,
                         #                          "Only 'Content-Type' of type 'application/json' or
                         # 'application/yaml' for input format are available")
                         error_text = "Invalid yaml format "
-                        indata = yaml.load(cherrypy.request.body, Loader=yaml.SafeLoader)
+                        indata = serializer.yaml_load(cherrypy.request.body)
                         cherrypy.request.headers.pop("Content-File-MD5", None)
                 else:
                     error_text = "Invalid yaml format "
-                    indata = yaml.load(cherrypy.request.body, Loader=yaml.SafeLoader)
+                    indata = serializer.yaml_load(cherrypy.request.body)
                     cherrypy.request.headers.pop("Content-File-MD5", None)
             if not indata:
                 indata = {}
@@ -531,35 +597,7 @@ class Server(object):
             format_yaml = False
             if cherrypy.request.headers.get("Query-String-Format") == "yaml":
                 format_yaml = True
-
-            for k, v in kwargs.items():
-                if isinstance(v, str):
-                    if v == "":
-                        kwargs[k] = None
-                    elif format_yaml:
-                        try:
-                            kwargs[k] = yaml.load(v, Loader=yaml.SafeLoader)
-                        except Exception:
-                            pass
-                    elif k.endswith(".gt") or k.endswith(".lt") or k.endswith(".gte") or k.endswith(".lte"):
-                        try:
-                            kwargs[k] = int(v)
-                        except Exception:
-                            try:
-                                kwargs[k] = float(v)
-                            except Exception:
-                                pass
-                    elif v.find(",") > 0:
-                        kwargs[k] = v.split(",")
-                elif isinstance(v, (list, tuple)):
-                    for index in range(0, len(v)):
-                        if v[index] == "":
-                            v[index] = None
-                        elif format_yaml:
-                            try:
-                                v[index] = yaml.load(v[index], Loader=yaml.SafeLoader)
-                            except Exception:
-                                pass
+            self._format_query_string(kwargs, format_yaml)
 
             return indata
         except (ValueError, yaml.YAMLError) as exc:
@@ -569,10 +607,47 @@ class Server(object):
         except Exception as exc:
             raise NbiException(error_text + str(exc), HTTPStatus.BAD_REQUEST)
 
+    @staticmethod
+    def _format_query_string(kwargs, format_yaml=False):
+        """
+        Converts the query string values: empty to None, numbers for comparison filters, comma separated to lists
+        :param kwargs: query string dictionary. It is modified
+        :param format_yaml: if True values are parsed as yaml
+        :return: None
+        """
+        for k, v in kwargs.items():
+            if isinstance(v, str):
+                if v == "":
+                    kwargs[k] = None
+                elif format_yaml:
+                    try:
+                        kwargs[k] = yaml.load(v, Loader=yaml.SafeLoader)
+                    except Exception:
+                        pass
+                elif k.endswith(".gt") or k.endswith(".lt") or k.endswith(".gte") or k.endswith(".lte"):
+                    try:
+                        kwargs[k] = int(v)
+                    except Exception:
+                        try:
+                            kwargs[k] = float(v)
+                        except Exception:
+                            pass
+                elif v.find(",") > 0:
+                    kwargs[k] = v.split(",")
+            elif isinstance(v, (list, tuple)):
+                for index in range(0, len(v)):
+                    if v[index] == "":
+                        v[index] = None
+                    elif format_yaml:
+                        try:
+                            v[index] = yaml.load(v[index], Loader=yaml.SafeLoader)
+                        except Exception:
+                            pass
+
     @staticmethod
     def _format_out(data, token_info=None, _format=None):
         """
-        return string of dictionary data according to requested json, yaml, xml. By default json
+        return string of dictionary data according to requested json, yaml, xml. By default json. Lists are streamed
         :param data: response to be sent. Can be a dict, text or file
         :param token_info: Contains among other username and project
         :param _format: The format to be set as Content-Type if data is a file
@@ -596,8 +671,7 @@ class Server(object):
         if accept:
             if "application/json" in accept:
                 cherrypy.response.headers["Content-Type"] = 'application/json; charset=utf-8'
-                a = json.dumps(data, indent=4) + "\n"
-                return a.encode("utf8")
+                return Server._stream_out(serializer.iter_json(data, serializer.get_json_indent(accept)), data)
             elif "text/html" in accept:
                 return html.format(data, cherrypy.request, cherrypy.response, token_info)
 
@@ -609,8 +683,20 @@ class Server(object):
                                          "Only 'Accept' of type 'application/json' or 'application/yaml' "
                                          "for output format are available")
         cherrypy.response.headers["Content-Type"] = 'application/yaml'
-        return yaml.safe_dump(data, explicit_start=True, indent=4, default_flow_style=False, tags=False,
-                              encoding='utf-8', allow_unicode=True)  # , canonical=True, default_style='"'
+        return Server._stream_out(serializer.iter_yaml(data), data)
+
+    @staticmethod
+    def _stream_out(chunks, data):
+        """
+        Lists are streamed chunk by chunk as they are encoded, instead of building the whole response in memory
+        :param chunks: generator of encoded chunks
+        :param data: content being encoded
+        :return: the chunks generator for lists, or the whole encoded content
+        """
+        if isinstance(data, list) and data:
+            cherrypy.response.stream = True
+            return chunks
+        return b"".join(chunks)
 
     @cherrypy.expose
     def index(self, *args, **kwargs):
@@ -723,7 +809,7 @@ class Server(object):
         thread_info = None
         if args and args[0] == "help":
             return "<html><pre>\ninit\nfile/<name>  download file\ndb-clear/table\nfs-clear[/folder]\nlogin\nlogin2\n"\
-                   "sleep/<time>\nmessage/topic\n</pre></html>"
+                   "sleep/<time>\nmessage/topic\nstats\nindexes[?all=true]\n</pre></html>"
 
         elif args and args[0] == "init":
             try:
@@ -761,6 +847,18 @@ class Server(object):
             if not cherrypy.request.headers.get("Authorization"):
                 cherrypy.response.headers["WWW-Authenticate"] = 'Bearer realm="Access to OSM site"'
                 cherrypy.response.status = HTTPStatus.UNAUTHORIZED.value
+        elif args and args[0] == "stats":
+            return self._format_out({"tokens_cache": self.authenticator.get_tokens_cache_stats(),
+                                     "permission_decisions": self.authenticator.get_permission_decisions_stats(),
+                                     "descriptor_cache": self.engine.get_descriptor_cache_stats(),
+                                     "locks": self.engine.get_lock_stats()})
+        elif args and args[0] == "indexes":
+            try:
+                uncovered_only = kwargs.get("all", "false").lower() != "true"
+                return self._format_out(self.engine.get_index_advice(uncovered_only))
+            except EngineException as e:
+                cherrypy.response.status = e.http_code.value
+                return self._format_out(str(e))
         elif args and args[0] == "sleep":
             sleep_time = 5
             try:
@@ -852,6 +950,30 @@ class Server(object):
         cherrypy.response.headers["Location"] = "/osm/{}/{}/{}/{}".format(main_topic, version, topic, id)
         return
 
+    @staticmethod
+    def _get_next_page_link(path, query_string, next_marker):
+        """
+        Generates the value of the Link header pointing to the next page of a list
+        :param path: URL path of the request
+        :param query_string: query string of the request
+        :param next_marker: nextpage_opaque_marker of the next page
+        :return: Link header value
+        """
+        query_list = [(k, v) for k, v in parse_qsl(query_string, keep_blank_values=True)
+                      if k != "nextpage_opaque_marker"]
+        query_list.append(("nextpage_opaque_marker", next_marker))
+        return '<{}?{}>; rel="next"'.format(path, urlencode(query_list))
+
+    @staticmethod
+    def _set_next_page_header(next_marker):
+        """
+        Insert response header Link with the URL of the next page of a list
+        :param next_marker: nextpage_opaque_marker of the next page
+        :return: None
+        """
+        cherrypy.response.headers["Link"] = Server._get_next_page_link(
+            cherrypy.request.script_name + cherrypy.request.path_info, cherrypy.request.query_string, next_marker)
+
     @staticmethod
     def _extract_query_string_operations(kwargs, method):
         """
@@ -939,6 +1061,43 @@ class Server(object):
             admin_query["method"] = "write"
         return admin_query
 
+    @staticmethod
+    def _get_engine_topic(main_topic, topic, item):
+        """
+        Obtains the engine topic that manages an URL
+        :param main_topic: URL main topic: admin, nsd, vnfpkgm, nslcm, ...
+        :param topic: URL topic
+        :param item: URL item after the _id, or None
+        :return: engine topic
+        """
+        engine_topic = topic
+        if topic == "subscriptions":
+            engine_topic = main_topic + "_" + topic
+        if item and topic != "pm_jobs":
+            engine_topic = item
+
+        if main_topic == "nsd":
+            engine_topic = "nsds"
+        elif main_topic == "vnfpkgm":
+            engine_topic = "vnfds"
+        elif main_topic == "nslcm":
+            engine_topic = "nsrs"
+            if topic == "ns_lcm_op_occs":
+                engine_topic = "nslcmops"
+            if topic == "vnfrs" or topic == "vnf_instances":
+                engine_topic = "vnfrs"
+        elif main_topic == "nst":
+            engine_topic = "nsts"
+        elif main_topic == "nsilcm":
+            engine_topic = "nsis"
+            if topic == "nsi_lcm_op_occs":
+                engine_topic = "nsilcmops"
+        elif main_topic == "pdu":
+            engine_topic = "pdus"
+        if engine_topic == "vims":   # TODO this is for backward compatibility, it will be removed in the future
+            engine_topic = "vim_accounts"
+        return engine_topic
+
     @cherrypy.expose
     def default(self, main_topic=None, version=None, topic=None, _id=None, item=None, *args, **kwargs):
         token_info = None
@@ -948,6 +1107,12 @@ class Server(object):
         engine_topic = None
         rollback = []
         engine_session = None
+        request_metrics = self.http_metrics.start() if self.http_metrics else null_request_metrics
+        trace = None
+        if self.tracer:
+            trace = self.tracer.start(cherrypy.request.method, cherrypy.request.headers.get("traceparent"),
+                                      path=cherrypy.request.path_info)
+        error_text = None
         try:
             if not main_topic or not version or not topic:
                 raise NbiException("URL must contain at least 'main_topic/version/topic'",
@@ -964,38 +1129,24 @@ class Server(object):
                 method = cherrypy.request.method
 
             role_permission = self._check_valid_url_method(method, main_topic, version, topic, _id, item, *args)
+            request_metrics.set_operation(role_permission, method)
+            if trace:
+                trace.root.name = role_permission
             query_string_operations = self._extract_query_string_operations(kwargs, method)
             if main_topic == "admin" and topic == "tokens":
-                return self.token(method, _id, kwargs)
+                outdata = self.token(method, _id, kwargs)
+                request_metrics.mark("engine")
+                return request_metrics.finish(cherrypy.response.status, outdata)
             token_info = self.authenticator.authorize(role_permission, query_string_operations, _id)
+            if main_topic == "admin" and topic == "metrics":
+                cherrypy.response.headers["Content-Type"] = metrics.content_type
+                request_metrics.mark("authorize")
+                return request_metrics.finish(cherrypy.response.status, metrics.registry.render())
             engine_session = self._manage_admin_query(token_info, kwargs, method, _id)
+            request_metrics.mark("authorize")
             indata = self._format_in(kwargs)
-            engine_topic = topic
-            if topic == "subscriptions":
-                engine_topic = main_topic + "_" + topic
-            if item and topic != "pm_jobs":
-                engine_topic = item
-
-            if main_topic == "nsd":
-                engine_topic = "nsds"
-            elif main_topic == "vnfpkgm":
-                engine_topic = "vnfds"
-            elif main_topic == "nslcm":
-                engine_topic = "nsrs"
-                if topic == "ns_lcm_op_occs":
-                    engine_topic = "nslcmops"
-                if topic == "vnfrs" or topic == "vnf_instances":
-                    engine_topic = "vnfrs"
-            elif main_topic == "nst":
-                engine_topic = "nsts"
-            elif main_topic == "nsilcm":
-                engine_topic = "nsis"
-                if topic == "nsi_lcm_op_occs":
-                    engine_topic = "nsilcmops"
-            elif main_topic == "pdu":
-                engine_topic = "pdus"
-            if engine_topic == "vims":   # TODO this is for backward compatibility, it will be removed in the future
-                engine_topic = "vim_accounts"
+            request_metrics.mark("format_in")
+            engine_topic = self._get_engine_topic(main_topic, topic, item)
 
             if method == "GET":
                 if item in ("nsd_content", "package_content", "artifacts", "vnfd", "nsd", "nst", "nst_content"):
@@ -1010,13 +1161,19 @@ class Server(object):
                     file, _format = self.engine.get_file(engine_session, engine_topic, _id, path,
                                                          cherrypy.request.headers.get("Accept"))
                     outdata = file
+                elif not _id and ("limit" in kwargs or "nextpage_opaque_marker" in kwargs):
+                    outdata, next_marker = self.engine.get_item_page(engine_session, engine_topic, kwargs)
+                    if next_marker:
+                        self._set_next_page_header(next_marker)
                 elif not _id:
                     outdata = self.engine.get_item_list(engine_session, engine_topic, kwargs)
+                elif item == "usage":
+                    outdata = self.engine.get_quota_usage(engine_session, _id)
                 else:
                     if item == "reports":
                         # TODO check that project_id (_id in this context) has permissions
                         _id = args[0]
-                    outdata = self.engine.get_item(engine_session, engine_topic, _id)
+                    outdata = self.engine.get_item(engine_session, engine_topic, _id, kwargs)
             elif method == "POST":
                 cherrypy.response.status = HTTPStatus.CREATED.value
                 if topic in ("ns_descriptors_content", "vnf_packages_content", "netslice_templates_content"):
@@ -1129,11 +1286,13 @@ class Server(object):
             else:
                 raise NbiException("Method {} not allowed".format(method), HTTPStatus.METHOD_NOT_ALLOWED)
 
-            # if Role information changes, it is needed to reload the information of roles
+            # if Role information changes, it is needed to reload the information of roles, also at other NBI instances
             if topic == "roles" and method != "GET":
-                self.authenticator.load_operation_to_allowed_roles()
-            return self._format_out(outdata, token_info, _format)
+                self.authenticator.reload_roles()
+            request_metrics.mark("engine")
+            return request_metrics.finish(cherrypy.response.status, self._format_out(outdata, token_info, _format))
         except Exception as e:
+            request_metrics.mark_failed()
             if isinstance(e, (NbiException, EngineException, DbException, FsException, MsgException, AuthException,
                               ValidationError, AuthconnException)):
                 http_code_value = cherrypy.response.status = e.http_code.value
@@ -1146,19 +1305,9 @@ class Server(object):
             if hasattr(outdata, "close"):  # is an open file
                 outdata.close()
             error_text = str(e)
-            rollback.reverse()
-            for rollback_item in rollback:
-                try:
-                    if rollback_item.get("operation") == "set":
-                        self.engine.db.set_one(rollback_item["topic"], {"_id": rollback_item["_id"]},
-                                               rollback_item["content"], fail_on_empty=False)
-                    else:
-                        self.engine.db.del_one(rollback_item["topic"], {"_id": rollback_item["_id"]},
-                                               fail_on_empty=False)
-                except Exception as e2:
-                    rollback_error_text = "Rollback Exception {}: {}".format(rollback_item, e2)
-                    cherrypy.log(rollback_error_text)
-                    error_text += ". " + rollback_error_text
+            for rollback_error_text in self.engine.rollback(rollback):
+                cherrypy.log(rollback_error_text)
+                error_text += ". " + rollback_error_text
             # if isinstance(e, MsgException):
             #     error_text = "{} has been '{}' but other modules cannot be informed because an error on bus".format(
             #         engine_topic[:-1], method, error_text)
@@ -1167,9 +1316,14 @@ class Server(object):
                 "status": http_code_value,
                 "detail": error_text,
             }
-            return self._format_out(problem_details, token_info)
+            return request_metrics.finish(cherrypy.response.status, self._format_out(problem_details, token_info))
             # raise cherrypy.HTTPError(e.http_code.value, str(e))
         finally:
+            request_metrics.done()
+            if trace:
+                cherrypy.response.headers["traceparent"] = trace.get_traceparent()
+                trace.root.attributes["status"] = cherrypy.response.status
+                self.tracer.finish(trace, error_text)
             if token_info:
                 self._format_login(token_info)
                 if method in ("PUT", "PATCH", "POST") and isinstance(outdata, dict):
@@ -1219,7 +1373,7 @@ def _start_service():
                 update_dict['server.socket_port'] = int(v)
             elif k == 'OSMNBI_SOCKET_HOST' or k == 'OSMNBI_SERVER_HOST':
                 update_dict['server.socket_host'] = v
-            elif k1 in ("server", "test", "auth", "log"):
+            elif k1 in ("server", "test", "auth", "log", "codec", "metrics", "trace"):
                 update_dict[k1 + '.' + k2] = v
             elif k1 in ("message", "database", "storage", "authentication"):
                 # k2 = k2.replace('_', '.')
@@ -1266,6 +1420,10 @@ def _start_service():
         logger_cherry.setLevel(engine_config["global"]["log.level"])
         logger_nbi.setLevel(engine_config["global"]["log.level"])
 
+    if engine_config["global"].get("codec.json"):
+        serializer.set_json_codec(engine_config["global"]["codec.json"])
+    cherrypy.log.error("Using '{}' json codec".format(serializer.json_codec))
+
     # logging other modules
     for k1, logname in {"message": "nbi.msg", "database": "nbi.db", "storage": "nbi.fs"}.items():
         engine_config[k1]["logger_name"] = logname
@@ -1278,13 +1436,25 @@ def _start_service():
         if "loglevel" in engine_config[k1]:
             logger_module.setLevel(engine_config[k1]["loglevel"])
     # TODO add more entries, e.g.: storage
+    if engine_config["global"].get("metrics.http"):
+        cherrypy.tree.apps['/osm'].root.http_metrics = HttpMetrics()
     cherrypy.tree.apps['/osm'].root.engine.start(engine_config)
-    cherrypy.tree.apps['/osm'].root.authenticator.start(engine_config)
+    cherrypy.tree.apps['/osm'].root.authenticator.start(engine_config,
+                                                        msg=cherrypy.tree.apps['/osm'].root.engine.msg)
+    if engine_config["global"].get("trace.slow_request") is not None or engine_config["global"].get("trace.otlp_file"):
+        slow_request = engine_config["global"].get("trace.slow_request")
+        tracer = Tracer(float(slow_request) if slow_request is not None else None,
+                        engine_config["global"].get("trace.otlp_file"))
+        tracer.attach_db(cherrypy.tree.apps['/osm'].root.engine.db)
+        tracer.attach_db(cherrypy.tree.apps['/osm'].root.authenticator.db)
+        tracer.attach_msg(cherrypy.tree.apps['/osm'].root.engine.msg)
+        cherrypy.tree.apps['/osm'].root.tracer = tracer
     cherrypy.tree.apps['/osm'].root.engine.init_db(target_version=database_version)
     cherrypy.tree.apps['/osm'].root.authenticator.init_db(target_version=auth_database_version)
 
     # start subscriptions thread:
-    subscription_thread = SubscriptionThread(config=engine_config, engine=nbi_server.engine)
+    subscription_thread = SubscriptionThread(config=engine_config, engine=nbi_server.engine,
+                                             authenticator=nbi_server.authenticator)
     subscription_thread.start()
     # Do not capture except SubscriptionException
 
@@ -0,0 +1,468 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Optional asyncio (ASGI) front end of the NBI, to be run alongside the cherrypy server (nbi.py).
+It serves the read (GET) operations, that are the ones done by dashboards and other polling clients, so that a lot
+of concurrent, mostly idle, clients do not need a thread each. Write operations must be done at the cherrypy server.
+Blocking engine calls run at a bounded thread executor, while token validation from cache and pm_jobs run at the
+event loop. It uses the same configuration file as nbi.py. Database must be initialized by the cherrypy server.
+Run it with:
+    python3 -m osm_nbi.nbi_async -c nbi.cfg
+It needs 'uvicorn' to be installed, or it can be served by any other ASGI server with the AsyncServer application
+"""
+
+import asyncio
+import logging
+import getopt
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http import HTTPStatus
+from os import environ, path
+from urllib.parse import parse_qsl
+from uuid import uuid4
+from cherrypy.lib import reprconf
+from osm_nbi.authconn import AuthException, AuthExceptionUnauthorized, AuthconnException
+from osm_nbi.auth import Authenticator, invalidate_tokens_cache
+from osm_nbi.descriptor_cache import DescriptorCache
+from osm_nbi.engine import Engine, EngineException
+from osm_nbi.http_metrics import HttpMetrics, null_request_metrics
+from osm_nbi.nbi import Server, NbiException, valid_url_methods, valid_query_string
+from osm_nbi.tracing import Tracer, run_in_trace
+from osm_nbi.validation import ValidationError
+import osm_nbi.metrics as metrics
+import osm_nbi.serializer as serializer
+from osm_common.dbbase import DbException
+from osm_common.fsbase import FsException
+from osm_common.msgbase import MsgException
+
+try:
+    import uvicorn
+except ImportError:
+    uvicorn = None
+
+
+valid_main_topics = ("admin", "vnfpkgm", "nsd", "nslcm", "pdu", "nst", "nsilcm", "nspm")
+file_items = ("nsd_content", "package_content", "artifacts", "vnfd", "nsd", "nst", "nst_content")
+
+
+class AsyncServer:
+    """
+    ASGI application. It reuses the URL and permission checking of the cherrypy Server and the engine topics
+    """
+    file_chunk_size = 65536
+
+    def __init__(self, config, max_workers=10):
+        """
+        :param config: two level dictionary with configuration, as the one used by cherrypy server
+        :param max_workers: maximum number of threads for blocking engine calls. Requests exceeding it wait
+            at the event loop
+        """
+        self.config = config
+        self.max_workers = max_workers
+        self.authenticator = Authenticator(valid_url_methods, valid_query_string)
+        self.engine = Engine(self.authenticator.tokens_cache)
+        self.executor = None
+        self.semaphore = None
+        self.admin_task = None  # asyncio task reading token revocations from kafka 'admin' topic
+        self.http_metrics = None    # HttpMetrics when enabled by configuration
+        self.tracer = None          # Tracer when enabled by configuration
+        self.logger = logging.getLogger("nbi.async")
+
+    def _start_engine(self):
+        global_config = self.config["global"]
+        if global_config.get("metrics.http"):
+            self.http_metrics = HttpMetrics()
+        self.engine.start(self.config)
+        self.authenticator.start(self.config)
+        self.authenticator.load_operation_to_allowed_roles()
+        if global_config.get("trace.slow_request") is not None or global_config.get("trace.otlp_file"):
+            slow_request = global_config.get("trace.slow_request")
+            self.tracer = Tracer(float(slow_request) if slow_request is not None else None,
+                                 global_config.get("trace.otlp_file"))
+            self.tracer.attach_db(self.engine.db)
+            self.tracer.attach_db(self.authenticator.db)
+
+    async def start(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="nbi-async")
+        self.semaphore = asyncio.Semaphore(self.max_workers)
+        # the message bus is only read, at this event loop
+        self.config["message"]["loop"] = asyncio.get_event_loop()
+        await self._run(self._start_engine)
+        self.admin_task = asyncio.ensure_future(self._read_token_revocations())
+        self.logger.info("Starting osm_nbi asynchronous server")
+
+    async def stop(self):
+        if self.admin_task:
+            self.admin_task.cancel()
+        await self._run(self.engine.stop)
+        self.executor.shutdown(wait=True)
+        self.logger.info("Stopping osm_nbi asynchronous server")
+
+    async def _read_token_revocations(self):
+        """
+        Reads kafka 'admin' topic, with a group id own of this instance, to remove the tokens revoked at other NBI
+        instances from the tokens cache, and to reload the roles changed at other NBI instances. Also reads the
+        descriptor topics to remove from the descriptor cache the descriptors edited or deleted at other NBI instances
+        """
+        group_id = "nbi-async-" + uuid4().hex
+
+        async def _msg_callback(topic, command, params):
+            if topic in DescriptorCache.msg_topics:
+                if self.engine.descriptor_cache:
+                    self.engine.descriptor_cache.process_msg(topic, command, params)
+            elif command == "revoke_token":
+                invalidate_tokens_cache(self.authenticator.tokens_cache, params)
+            elif command == "reload_roles":
+                await self._run(self.authenticator.process_roles_reload, params)
+
+        while True:
+            try:
+                await self.engine.msg.aioread(("admin",) + tuple(DescriptorCache.msg_topics),
+                                              loop=asyncio.get_event_loop(), aiocallback=_msg_callback,
+                                              group_id=group_id)
+            except asyncio.CancelledError:
+                return
+            except Exception as e:
+                self.logger.error("Error reading kafka 'admin' topic '{}'. Retrying ...".format(e))
+            await asyncio.sleep(10)
+
+    async def _run(self, function, *args, **kwargs):
+        """
+        Runs a blocking function at the bounded executor
+        """
+        async with self.semaphore:
+            return await asyncio.get_event_loop().run_in_executor(self.executor, partial(function, *args, **kwargs))
+
+    async def _run_traced(self, trace, function, *args, **kwargs):
+        """
+        Runs a blocking function at the bounded executor, as part of the trace of the request
+        :param trace: Trace of the request, or None if it is not traced
+        """
+        return await self._run(run_in_trace, trace, function, *args, **kwargs)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self.start()
+                    await send({"type": "lifespan.startup.complete"})
+                except Exception as e:
+                    self.logger.critical("Cannot start: {}".format(e), exc_info=True)
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+            elif message["type"] == "lifespan.shutdown":
+                await self.stop()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    @staticmethod
+    def _parse_query_string(query_string):
+        """
+        Converts the query string into a dictionary in the same way than cherrypy: repeated keys generates a list
+        """
+        kwargs = {}
+        for k, v in parse_qsl(query_string.decode("latin-1"), keep_blank_values=True):
+            if k not in kwargs:
+                kwargs[k] = v
+            elif isinstance(kwargs[k], list):
+                kwargs[k].append(v)
+            else:
+                kwargs[k] = [kwargs[k], v]
+        return kwargs
+
+    async def _authorize(self, headers, method, role_permission, query_string_operations, item_id, trace=None):
+        token = None
+        auth = headers.get("authorization")
+        if auth:
+            auth_list = auth.split(" ")
+            if auth_list[0].lower() == "bearer":
+                token = auth_list[-1]
+        if not token:
+            raise AuthException("Needed a token or Authorization http header", http_code=HTTPStatus.UNAUTHORIZED)
+        if self.authenticator.is_token_cached(token):
+            # only memory operations, it is done at the event loop
+            return self.authenticator.authorize_token(token, method, role_permission, query_string_operations,
+                                                      item_id)
+        return await self._run_traced(trace, self.authenticator.authorize_token, token, method, role_permission,
+                                      query_string_operations, item_id)
+
+    @staticmethod
+    def _format_out(data, accept):
+        """
+        Encodes the response data according to the accept header. By default yaml
+        :return: tuple with generator of encoded chunks and content type
+        """
+        if accept and "application/json" in accept:
+            return (serializer.iter_json(data, serializer.get_json_indent(accept)),
+                    "application/json; charset=utf-8")
+        return serializer.iter_yaml(data), "application/yaml"
+
+    @staticmethod
+    async def _send_headers(send, status, headers):
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(k.encode("latin-1"), str(v).encode("latin-1")) for k, v in headers.items()],
+        })
+
+    @classmethod
+    async def _send_body(cls, send, status, headers, body):
+        headers["Content-Length"] = len(body)
+        await cls._send_headers(send, status, headers)
+        await send({"type": "http.response.body", "body": body})
+
+    async def _send_file(self, send, file, _format, headers):
+        try:
+            if _format:
+                headers["Content-Type"] = _format
+            elif "b" in file.mode:   # binary assuming zip
+                headers["Content-Type"] = "application/zip"
+            else:
+                headers["Content-Type"] = "text/plain"
+            await self._send_headers(send, HTTPStatus.OK.value, headers)
+            while True:
+                chunk = await self._run(file.read, self.file_chunk_size)
+                if isinstance(chunk, str):
+                    chunk = chunk.encode("utf8")
+                await send({"type": "http.response.body", "body": chunk, "more_body": bool(chunk)})
+                if not chunk:
+                    break
+        finally:
+            file.close()
+
+    async def _http(self, scope, send):
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+        request_metrics = self.http_metrics.start() if self.http_metrics else null_request_metrics
+        trace = None
+        if self.tracer:
+            # engine calls are done at executor threads, that take this trace with run_in_trace
+            trace = self.tracer.start(scope["method"], headers.get("traceparent"), current=False, path=scope["path"])
+        error_text = None
+        try:
+            error_text = await self._http_request(scope, send, headers, request_metrics, trace)
+        finally:
+            request_metrics.done()
+            if trace:
+                await self._run(self.tracer.finish, trace, error_text)
+
+    async def _http_request(self, scope, send, headers, request_metrics, trace):
+        """
+        Processes a request and sends the response
+        :param scope: ASGI connection scope
+        :param send: ASGI send function
+        :param headers: dictionary of request headers, with lowercase names
+        :param request_metrics: RequestMetrics (or null_request_metrics) of this request
+        :param trace: Trace of this request, or None if not traced
+        :return: the error text if the request fails, None otherwise
+        """
+        method = scope["method"]
+        response_headers = {}
+        if trace:
+            response_headers["traceparent"] = trace.get_traceparent()
+        status = HTTPStatus.OK.value
+        error_text = None
+        try:
+            url_items = [x for x in scope["path"].split("/") if x]
+            if not url_items or url_items[0] != "osm":
+                raise NbiException("URL must start with '/osm'", HTTPStatus.NOT_FOUND)
+            if len(url_items) > 1 and url_items[1] == "test":
+                raise NbiException("URL '/osm/test' is only served by the main NBI server",
+                                   HTTPStatus.METHOD_NOT_ALLOWED)
+            url_items = url_items[1:] + [None] * (6 - len(url_items))
+            main_topic, version, topic, _id, item = url_items[0:5]
+            args = url_items[5:]
+            if not main_topic or not version or not topic:
+                raise NbiException("URL must contain at least 'main_topic/version/topic'",
+                                   HTTPStatus.METHOD_NOT_ALLOWED)
+            if main_topic not in valid_main_topics:
+                raise NbiException("URL main_topic '{}' not supported".format(main_topic),
+                                   HTTPStatus.METHOD_NOT_ALLOWED)
+            if version != 'v1':
+                raise NbiException("URL version '{}' not supported".format(version), HTTPStatus.METHOD_NOT_ALLOWED)
+            if method != "GET" or (main_topic == "admin" and topic == "tokens"):
+                raise NbiException("Method {} not allowed at the asynchronous server. Use the main NBI server"
+                                   .format(method), HTTPStatus.METHOD_NOT_ALLOWED)
+
+            kwargs = self._parse_query_string(scope["query_string"])
+            role_permission = Server._check_valid_url_method(method, main_topic, version, topic, _id, item, *args)
+            request_metrics.set_operation(role_permission, method)
+            if trace:
+                trace.root.name = role_permission
+            query_string_operations = Server._extract_query_string_operations(kwargs, method)
+            token_info = await self._authorize(headers, method, role_permission, query_string_operations, _id,
+                                               trace)
+            if main_topic == "admin" and topic == "metrics":
+                request_metrics.mark("authorize")
+                body = request_metrics.finish(status, metrics.registry.render().encode("utf8"))
+                await self._send_body(send, status, {"Content-Type": metrics.content_type}, body)
+                return
+            engine_session = Server._manage_admin_query(token_info, kwargs, method, _id)
+            request_metrics.mark("authorize")
+            Server._format_query_string(kwargs, headers.get("query-string-format") == "yaml")
+            request_metrics.mark("format_in")
+            engine_topic = Server._get_engine_topic(main_topic, topic, item)
+
+            if item in file_items:
+                if item in ("vnfd", "nsd", "nst"):
+                    file_path = "$DESCRIPTOR"
+                elif args:
+                    file_path = args
+                elif item == "artifacts":
+                    file_path = ()
+                else:
+                    file_path = None
+                outdata, _format = await self._run_traced(trace, self.engine.get_file, engine_session,
+                                                          engine_topic, _id, file_path, headers.get("accept"))
+                if hasattr(outdata, "read"):  # file object. Otherwise, as folder content, it is serialized
+                    request_metrics.mark("engine")
+                    await self._send_file(send, request_metrics.finish(status, outdata), _format, response_headers)
+                    return
+            elif engine_topic == "pm_jobs" and item == "reports":
+                # TODO check that project_id (_id in this context) has permissions
+                outdata = await self.engine.map_topic["pm_jobs"].show_async(engine_session, args[0], self.executor)
+            elif not _id and ("limit" in kwargs or "nextpage_opaque_marker" in kwargs):
+                outdata, next_marker = await self._run_traced(trace, self.engine.get_item_page, engine_session,
+                                                              engine_topic, kwargs)
+                if next_marker:
+                    response_headers["Link"] = Server._get_next_page_link(
+                        scope.get("root_path", "") + scope["path"], scope["query_string"].decode("latin-1"),
+                        next_marker)
+            elif not _id:
+                outdata = await self._run_traced(trace, self.engine.get_item_list, engine_session, engine_topic,
+                                                 kwargs)
+            elif item == "usage":
+                outdata = await self._run_traced(trace, self.engine.get_quota_usage, engine_session, _id)
+            else:
+                outdata = await self._run_traced(trace, self.engine.get_item, engine_session, engine_topic, _id,
+                                                 kwargs)
+            request_metrics.mark("engine")
+        except Exception as e:
+            request_metrics.mark_failed()
+            if isinstance(e, (NbiException, EngineException, DbException, FsException, MsgException, AuthException,
+                              ValidationError, AuthconnException)):
+                http_code = e.http_code
+                self.logger.info("Exception {}".format(e))
+                if isinstance(e, AuthException) and not isinstance(e, AuthExceptionUnauthorized):
+                    response_headers["WWW-Authenticate"] = 'Bearer realm="{}"'.format(e)
+            else:
+                http_code = HTTPStatus.BAD_REQUEST
+                self.logger.critical("Exception {}".format(e), exc_info=True)
+            status = http_code.value
+            error_text = str(e)
+            outdata = {
+                "code": http_code.name,
+                "status": http_code.value,
+                "detail": error_text,
+            }
+        if trace:
+            trace.root.attributes["status"] = status
+        chunks, response_headers["Content-Type"] = self._format_out(outdata, headers.get("accept"))
+        if isinstance(outdata, list) and outdata:
+            # large lists are sent while being encoded, with chunked transfer encoding
+            await self._send_headers(send, status, response_headers)
+            for chunk in request_metrics.finish(status, chunks):
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        else:
+            await self._send_body(send, status, response_headers, request_metrics.finish(status, b"".join(chunks)))
+        return error_text
+
+
+def _load_config(config_file):
+    """
+    Loads the cherrypy style configuration file and override it with OSMNBI_ environment variables
+    :param config_file: configuration file
+    :return: two level dictionary with the configuration
+    """
+    config = reprconf.Config(config_file)
+    for k, v in environ.items():
+        if not k.startswith("OSMNBI_"):
+            continue
+        k1, _, k2 = k[7:].lower().partition("_")
+        if not k2:
+            continue
+        if k1 in ("server", "asgi", "log", "codec", "metrics", "trace"):
+            config["global"][k1 + '.' + k2] = v
+        elif k1 in ("message", "database", "storage", "authentication"):
+            config[k1][k2] = int(v) if k2 in ("port", "db_port") else v
+    return config
+
+
+def nbi_async(config_file):
+    config = _load_config(config_file)
+    global_config = config["global"]
+    log_format = "%(asctime)s %(levelname)s %(name)s %(filename)s:%(lineno)s %(message)s"
+    logging.basicConfig(format=log_format, datefmt='%Y-%m-%dT%H:%M:%S',
+                        level=global_config.get("log.level", "INFO"))
+    for k1, logname in {"message": "nbi.msg", "database": "nbi.db", "storage": "nbi.fs"}.items():
+        config[k1]["logger_name"] = logname
+    if global_config.get("codec.json"):
+        serializer.set_json_codec(global_config["codec.json"])
+
+    if not uvicorn:
+        print("Python module 'uvicorn' is needed for running the asynchronous server", file=sys.stderr)
+        exit(1)
+    application = AsyncServer(config, max_workers=int(global_config.get("asgi.thread_pool", 10)))
+    ssl_params = {}
+    if global_config.get("server.ssl_certificate"):
+        ssl_params = {"ssl_certfile": global_config["server.ssl_certificate"],
+                      "ssl_keyfile": global_config.get("server.ssl_private_key"),
+                      "ssl_keyfile_password": global_config.get("server.ssl_pass_phrase")}
+    uvicorn.run(application, host=global_config.get("asgi.socket_host", global_config.get("server.socket_host")),
+                port=int(global_config.get("asgi.socket_port", 9998)), lifespan="on", **ssl_params)
+
+
+def usage():
+    print("""Usage: {} [options]
+        -c|--config [configuration_file]: loads the configuration file (default: ./nbi.cfg)
+        -h|--help: shows this help
+        """.format(sys.argv[0]))
+
+
+if __name__ == '__main__':
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hc:", ["config=", "help"])
+        config_file = None
+        for o, a in opts:
+            if o in ("-h", "--help"):
+                usage()
+                sys.exit()
+            elif o in ("-c", "--config"):
+                config_file = a
+        if config_file:
+            if not path.isfile(config_file):
+                print("configuration file '{}' that not exist".format(config_file), file=sys.stderr)
+                exit(1)
+        else:
+            for config_file in (path.dirname(__file__) + "/nbi.cfg", "./nbi.cfg", "/etc/osm/nbi.cfg"):
+                if path.isfile(config_file):
+                    break
+            else:
+                print("No configuration file 'nbi.cfg' found neither at local folder nor at /etc/osm/", file=sys.stderr)
+                exit(1)
+        nbi_async(config_file)
+    except getopt.GetoptError as e:
+        print(str(e), file=sys.stderr)
+        exit(1)
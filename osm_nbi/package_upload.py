@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Single pass processing of the uploaded packages: while the content is written to storage it is hashed and, for tar
+packages, the tar index is validated, so that the package is not read again for that
+"""
+
+import bz2
+import lzma
+import re
+import tarfile
+import zlib
+from hashlib import md5, sha256
+from osm_nbi.base_topic import EngineException
+
+
+BLOCKSIZE = tarfile.BLOCKSIZE
+DECOMPRESS_SIZE = 1 << 20  # maximum size of each piece of uncompressed data
+descriptor_extensions = (".yaml", ".json", ".yml")
+pax_record = re.compile(br"(\d+) ([^=]+)=")   # as parsed by tarfile
+
+
+def check_member_name(tarinfo):
+    """
+    Checks that a tar member is inside a folder without absolute paths or '..'
+    :param tarinfo: tarfile.TarInfo
+    :return: None. Raises EngineException if not valid
+    """
+    tarname_path = tarinfo.name.split("/")
+    if not tarname_path[0] or ".." in tarname_path:  # if start with "/" means absolute path
+        raise EngineException("Absolute path or '..' are not allowed for package descriptor tar.gz")
+    if len(tarname_path) == 1 and not tarinfo.isdir():
+        raise EngineException("All files must be inside a dir for package descriptor tar.gz")
+
+
+def check_tar_members(tar):
+    """
+    Checks the member names of a tar file as read by tarfile, before extracting it. The index validated while
+    receiving is not trusted for that, in case it is parsed differently
+    :param tar: tarfile.TarFile
+    :return: None. Raises EngineException if not valid
+    """
+    for tarinfo in tar:
+        check_member_name(tarinfo)
+
+
+def _block_size(size):
+    if size < 0:
+        raise tarfile.ReadError("invalid member size")
+    return BLOCKSIZE * ((size + BLOCKSIZE - 1) // BLOCKSIZE)
+
+
+def _data_size(tarinfo):
+    # size of the member data at the tar file, computed as tarfile does
+    if tarinfo.isreg() or tarinfo.type not in tarfile.SUPPORTED_TYPES:
+        return _block_size(tarinfo.size)
+    return 0
+
+
+class TarIndexValidator:
+    """
+    Parses incrementally the headers of a tar file, compressed or not, while it is being received. Checks that all the
+    members are inside a folder without absolute paths or '..', and looks for the descriptor file, a yaml or json file
+    at the first folder level. Member data is skipped, not decompressed into memory. GNU longname and pax headers,
+    including the pax size, are applied to the members as tarfile does; sparse members are not allowed.
+    Raises tarfile.ReadError for an invalid file and EngineException for an invalid package
+    """
+
+    def __init__(self):
+        self.decompressor = None  # None until the compression is detected from the first bytes
+        self.gzip = False
+        self.buffer = bytearray()
+        self.skip = 0       # bytes of the current member data still to be skipped
+        self.offset = 0     # position at the uncompressed tar of the next header
+        self.extended_headers = []  # GNU longname and pax headers of the next member, as (type, name or pax dict)
+        self.global_pax = {}    # pax global headers, applied to all the following members
+        self.next_data = None   # type, block size and size of a GNU longname or pax header content being received
+        self.finished = False
+        self.descriptor_file_name = None
+        self.pkg_dir = None
+
+    def _decompress(self, data):
+        """
+        Generator of the uncompressed data, in pieces of limited size to bound the memory of highly compressed content
+        """
+        if self.decompressor is None:
+            self.buffer += data     # wait until having the magic bytes
+            if len(self.buffer) < 6:
+                return
+            data, self.buffer = bytes(self.buffer), bytearray()
+            self.gzip = data.startswith(b"\x1f\x8b")
+            if self.gzip:
+                self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            elif data.startswith(b"BZh"):
+                self.decompressor = bz2.BZ2Decompressor()
+            elif data.startswith(b"\xfd7zXZ\x00"):
+                self.decompressor = lzma.LZMADecompressor()
+            else:
+                self.decompressor = False   # not compressed
+        if not self.decompressor:
+            yield data
+            return
+        try:
+            while True:
+                if self.gzip:
+                    if self.decompressor.eof and self.decompressor.unused_data:
+                        # concatenated gzip members
+                        data = self.decompressor.unused_data
+                        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                    output = self.decompressor.decompress(data, DECOMPRESS_SIZE)
+                    data = self.decompressor.unconsumed_tail
+                    pending = data or (self.decompressor.eof and self.decompressor.unused_data)
+                else:
+                    if self.decompressor.eof:
+                        return
+                    output = self.decompressor.decompress(data, DECOMPRESS_SIZE)
+                    data = b""
+                    pending = not self.decompressor.needs_input and not self.decompressor.eof
+                if output:
+                    yield output
+                if not pending:
+                    return
+        except (zlib.error, OSError, EOFError, lzma.LZMAError) as e:
+            raise tarfile.ReadError("invalid compressed data: {}".format(e))
+
+    def update(self, data):
+        """
+        Processes the next uploaded bytes
+        :param data: bytes, as uploaded (compressed)
+        :return: None
+        """
+        for output in self._decompress(data):
+            if self.finished:
+                return
+            if self.skip:
+                skipped = min(self.skip, len(output))
+                self.skip -= skipped
+                self.offset += skipped
+                output = output[skipped:]
+            if output:
+                self.buffer += output
+                self._parse()
+
+    def _parse(self):
+        position = 0
+        buffer = self.buffer
+        while not self.finished:
+            if self.next_data:
+                member_type, size, data_size = self.next_data
+                if len(buffer) - position < size:
+                    break
+                self._process_extended_header(member_type, bytes(buffer[position:position + data_size]))
+                self.next_data = None
+                position += size
+                self.offset += size
+                continue
+            if len(buffer) - position < BLOCKSIZE:
+                break
+            self._process_header(bytes(buffer[position:position + BLOCKSIZE]))
+            position += BLOCKSIZE
+            self.offset += BLOCKSIZE
+            if self.skip:
+                skipped = min(self.skip, len(buffer) - position)
+                self.skip -= skipped
+                self.offset += skipped
+                position += skipped
+        del buffer[:position]
+        if self.finished:
+            self.buffer = bytearray()
+
+    def _process_header(self, header):
+        try:
+            tarinfo = tarfile.TarInfo.frombuf(header, tarfile.ENCODING, "surrogateescape")
+        except tarfile.HeaderError as e:
+            # as tarfile, an invalid or zero filled block ends the archive, and it is an error if it is the first one
+            if self.offset == 0 or self.extended_headers:
+                raise tarfile.ReadError(str(e))
+            self.finished = True
+            return
+        if tarinfo.type in (tarfile.GNUTYPE_LONGNAME, tarfile.GNUTYPE_LONGLINK, tarfile.XHDTYPE,
+                            tarfile.SOLARIS_XHDTYPE, tarfile.XGLTYPE):
+            self.next_data = (tarinfo.type, _block_size(tarinfo.size), tarinfo.size)
+            return
+        if tarinfo.type == tarfile.GNUTYPE_SPARSE:
+            raise EngineException("Sparse files are not allowed for package descriptor tar.gz")
+        # as tarfile, the data size is given by the header, global pax fields are applied after that, and then the
+        # extended headers, from the last received to the first one, where a pax size replaces the data size
+        data_size = _data_size(tarinfo)
+        self._apply_pax(tarinfo, self.global_pax)
+        for member_type, value in reversed(self.extended_headers):
+            if member_type == tarfile.GNUTYPE_LONGNAME:
+                tarinfo.name = value.rstrip("/") if tarinfo.isdir() else value
+            elif member_type in (tarfile.XHDTYPE, tarfile.SOLARIS_XHDTYPE):
+                self._apply_pax(tarinfo, value)
+                if "size" in value:
+                    data_size = _data_size(tarinfo)
+        self.extended_headers = []
+        if tarinfo.isdir():
+            tarinfo.name = tarinfo.name.rstrip("/")
+        self._check_member(tarinfo)
+        self.skip = data_size
+
+    @staticmethod
+    def _apply_pax(tarinfo, pax_headers):
+        if "path" in pax_headers:
+            tarinfo.name = pax_headers["path"].rstrip("/")
+        if "size" in pax_headers:
+            try:
+                tarinfo.size = int(pax_headers["size"])
+            except ValueError:
+                tarinfo.size = 0
+
+    def _process_extended_header(self, member_type, data):
+        if member_type == tarfile.GNUTYPE_LONGNAME:
+            self.extended_headers.append((member_type, tarfile.nts(data, tarfile.ENCODING, "surrogateescape")))
+            return
+        if member_type not in (tarfile.XHDTYPE, tarfile.SOLARIS_XHDTYPE, tarfile.XGLTYPE):
+            return
+        pax_headers = self.global_pax if member_type == tarfile.XGLTYPE else dict(self.global_pax)
+        position = 0
+        while True:
+            match = pax_record.match(data, position)
+            if not match:
+                break
+            length, keyword = match.groups()
+            length = int(length)
+            if length == 0:
+                raise tarfile.ReadError("invalid header")
+            keyword = keyword.decode("utf-8", "surrogateescape")
+            if keyword.startswith("GNU.sparse."):
+                raise EngineException("Sparse files are not allowed for package descriptor tar.gz")
+            value = data[match.end(2) + 1:match.start(1) + length - 1]
+            pax_headers[keyword] = value.decode("utf-8", "surrogateescape")
+            position += length
+        if member_type != tarfile.XGLTYPE:
+            self.extended_headers.append((member_type, pax_headers))
+
+    def _check_member(self, tarinfo):
+        check_member_name(tarinfo)
+        tarname = tarinfo.name
+        tarname_path = tarname.split("/")
+        if tarname.endswith(descriptor_extensions):
+            self.pkg_dir = tarname_path[0]
+            if len(tarname_path) == 2:
+                if self.descriptor_file_name:
+                    raise EngineException("Found more than one descriptor file at package descriptor tar.gz")
+                self.descriptor_file_name = tarname
+
+    def close(self):
+        """
+        Checks that the tar file is complete and contains a descriptor file
+        :return: the descriptor file name
+        """
+        if not self.finished:
+            if self.decompressor is None or self.offset == 0:
+                raise tarfile.ReadError("empty file")
+            if self.buffer or self.skip or self.next_data or self.extended_headers or \
+                    (self.decompressor and not self.decompressor.eof):
+                raise tarfile.ReadError("unexpected end of data")
+        if not self.descriptor_file_name:
+            raise EngineException("Not found any descriptor file at package descriptor tar.gz")
+        return self.descriptor_file_name
+
+
+class PackageUpload:
+    """
+    State of a package upload: MD5 and SHA-256 of the content received so far, and the tar index validator. It is
+    kept between the chunks of a Content-Range upload
+    """
+
+    def __init__(self, compressed=False):
+        self.size = 0
+        self.md5 = md5()
+        self.sha256 = sha256()
+        self.tar_validator = TarIndexValidator() if compressed else None
+
+    def update(self, data):
+        """
+        Processes uploaded content, previously or just written to storage
+        """
+        self.size += len(data)
+        self.md5.update(data)
+        self.sha256.update(data)
+        if self.tar_validator:
+            self.tar_validator.update(data)
+
+    def write(self, file_obj, indata, buffer_size):
+        """
+        Copies the request body to the storage file, processing it at the same time
+        :param file_obj: opened storage file, in append mode
+        :param indata: request body, file-like object with read method; or bytes
+        :param buffer_size: size of the reads
+        :return: number of bytes written
+        """
+        if isinstance(indata, (bytes, bytearray)):
+            file_obj.write(indata)
+            self.update(indata)
+            return len(indata)
+        length = 0
+        while True:
+            data = indata.read(buffer_size)
+            if not data:
+                return length
+            file_obj.write(data)
+            self.update(data)
+            length += len(data)
+
+    def load(self, file_obj, buffer_size):
+        """
+        Processes the content already stored, when the state of a previous chunk is not available, e.g. because it was
+        uploaded to other NBI instance
+        :param file_obj: opened storage file
+        :param buffer_size: size of the reads
+        :return: None
+        """
+        file_obj.seek(0, 0)
+        while True:
+            data = file_obj.read(buffer_size)
+            if not data:
+                return
+            self.update(data)
+
+
+class MultipartPart:
+    """
+    Part of a multipart/form-data body. Its content is read directly from the request body, it is not stored
+    """
+
+    def __init__(self, reader, headers):
+        self.reader = reader
+        self.headers = headers
+        self.content_type = headers.get("content-type")
+        self.name = None
+        self.filename = None
+        for param in headers.get("content-disposition", "").split(";")[1:]:
+            key, _, value = param.strip().partition("=")
+            if key.lower() == "name":
+                self.name = value.strip('"')
+            elif key.lower() == "filename":
+                self.filename = value.strip('"')
+
+    def read(self, size=-1):
+        """
+        :param size: maximum number of bytes to return. -1 for all the part content
+        :return: bytes. Empty at the end of the part
+        """
+        if size is None or size < 0:
+            return b"".join(iter(lambda: self.reader.read_part(self.reader.buffer_size), b""))
+        return self.reader.read_part(size)
+
+
+class MultipartReader:
+    """
+    Parses a multipart body while it is read. Iterating over it provides the MultipartPart, each one must be read
+    before requesting the next one, otherwise its content is discarded
+    """
+    max_header_size = 65536
+
+    def __init__(self, fp, boundary, buffer_size=1 << 20):
+        """
+        :param fp: request body, file-like object with read method
+        :param boundary: multipart boundary, bytes
+        :param buffer_size: size of the reads from fp
+        """
+        self.fp = fp
+        self.delimiter = b"\r\n--" + boundary
+        self.buffer_size = buffer_size
+        self.buffer = bytearray(b"\r\n")  # so that the first boundary is preceded by CRLF as the others
+        self.fp_end = False
+        self.part_end = False  # the content before the first boundary is handled as a part to be discarded
+
+    def _fill(self, size):
+        while len(self.buffer) < size and not self.fp_end:
+            data = self.fp.read(max(size - len(self.buffer), self.buffer_size))
+            if not data:
+                self.fp_end = True
+            self.buffer += data
+
+    def read_part(self, size):
+        """
+        Reads the content of the current part, up to the next boundary
+        :param size: maximum number of bytes to return
+        :return: bytes. Empty at the end of the part
+        """
+        if self.part_end or size == 0:
+            return b""
+        delimiter_size = len(self.delimiter)
+        self._fill(size + delimiter_size)
+        position = self.buffer.find(self.delimiter, 0, size + delimiter_size)
+        if position >= 0 and position <= size:
+            data = bytes(self.buffer[:position])
+            del self.buffer[:position + delimiter_size]
+            self.part_end = True
+            return data
+        if position < 0 and self.fp_end and len(self.buffer) < size + delimiter_size:
+            raise ValueError("Unexpected end of multipart body, boundary not found")
+        # a delimiter can start at the last bytes
+        size = min(size, len(self.buffer) - delimiter_size + 1)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def __iter__(self):
+        while True:
+            while self.read_part(self.buffer_size):
+                pass    # discard the content not read of previous part
+            self._fill(2)
+            if self.buffer.startswith(b"--"):
+                return  # final boundary
+            while True:
+                headers_end = self.buffer.find(b"\r\n\r\n")
+                if headers_end >= 0:
+                    break
+                if len(self.buffer) > self.max_header_size or self.fp_end:
+                    raise ValueError("Invalid multipart body, part headers not found")
+                self._fill(len(self.buffer) + 1)
+            header_lines = self.buffer[:headers_end].decode("latin-1").split("\r\n")
+            del self.buffer[:headers_end + 4]
+            headers = {}
+            for line in header_lines[1:]:   # first one is the rest of the boundary line
+                key, _, value = line.partition(":")
+                headers[key.strip().lower()] = value.strip()
+            self.part_end = False
+            yield MultipartPart(self, headers)
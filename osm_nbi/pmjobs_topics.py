@@ -17,7 +17,7 @@ import asyncio
 import aiohttp
 from http import HTTPStatus
 from urllib.parse import quote
-from osm_nbi.base_topic import EngineException
+from osm_nbi.base_topic import EngineException, get_descriptor
 
 __author__ = "Vijay R S <vijay.r@tataelxsi.co.in>"
 
@@ -37,7 +37,7 @@ class PmJobsTopic():
             raise EngineException("NS not found with id {}".format(ns_id), http_code=HTTPStatus.NOT_FOUND)
         else:
             for vnfr in vnfr_desc:
-                vnfd_desc = self.db.get_one("vnfds", {"_id": vnfr["vnfd-id"]}, fail_on_empty=True, fail_on_more=False)
+                vnfd_desc = get_descriptor(self.db, "vnfds", vnfr["vnfd-id"])
                 if vnfd_desc.get("vdu"):
                     for vdu in vnfd_desc['vdu']:
                         # Checks for vdu metric in vdu-configuration
@@ -65,11 +65,28 @@ class PmJobsTopic():
         except aiohttp.client_exceptions.ClientConnectorError as e:
             raise EngineException("Connection to '{}'Failure: {}".format(self.url, e))
 
-    def show(self, session, ns_id):
+    def show(self, session, ns_id, kwargs=None):
         metrics_list = self._get_vnf_metric_list(ns_id)
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         prom_metric = loop.run_until_complete(self._prom_metric_request(ns_id, metrics_list))
+        return self._format_metric(prom_metric)
+
+    async def show_async(self, session, ns_id, executor=None):
+        """
+        Same as show, to be used from a running event loop. Database is accessed at executor to not block the loop
+        :param session: contains "username", "admin", "force", "public", "project_id", "set_project"
+        :param ns_id: ns instance id
+        :param executor: executor used for the blocking database access. None for the loop default one
+        :return: dictionary with the metric entries
+        """
+        loop = asyncio.get_event_loop()
+        metrics_list = await loop.run_in_executor(executor, self._get_vnf_metric_list, ns_id)
+        prom_metric = await self._prom_metric_request(ns_id, metrics_list)
+        return self._format_metric(prom_metric)
+
+    @staticmethod
+    def _format_metric(prom_metric):
         metric = {}
         metric_temp = []
         for index_list in prom_metric:
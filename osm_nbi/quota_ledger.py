@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+from http import HTTPStatus
+from threading import Lock
+from time import time
+from osm_common.dbbase import DbException
+from osm_common.dbmongo import DbMongo
+
+
+class QuotaLedger:
+    """
+    Keeps at database the number of items of each topic that every project has, so that quotas are checked without
+    counting the topic collection. Counters are increased and decreased when items are created, shared or deleted.
+    Projects not present at the ledger are counted at database the first time they are needed.
+    The method reconcile counts again all of them, fixing deviations, e.g. because of items deleted by other modules
+    or a failure between an item creation and the ledger update
+    """
+    collection = "quota_usage"
+    db_indexes = (("project_id",),)
+
+    def __init__(self, db):
+        self.db = db
+        self.lock = Lock()  # for the databases without atomic increment
+        self.logger = logging.getLogger("nbi.engine.quota")
+
+    @staticmethod
+    def _get_key(topic, project_id):
+        return "{}:{}".format(topic, project_id)
+
+    def _count(self, topic, project_id):
+        return self.db.count(topic, {"_admin.projects_read": project_id})
+
+    def _store(self, topic, project_id, count):
+        key = self._get_key(topic, project_id)
+        content = {"_id": key, "topic": topic, "project_id": project_id, "count": count, "modified": time()}
+        if isinstance(self.db, DbMongo):
+            try:
+                self.db.db[self.collection].replace_one({"_id": key}, content, upsert=True)
+            except Exception as e:
+                raise DbException(e, HTTPStatus.INTERNAL_SERVER_ERROR)
+            return
+        with self.lock:
+            if self.db.get_one(self.collection, {"_id": key}, fail_on_empty=False):
+                self.db.replace(self.collection, key, content)
+            else:
+                self.db.create(self.collection, content)
+
+    def get_usage(self, topic, project_id):
+        """
+        Obtains the number of items of a topic that a project has
+        :param topic: database collection of the topic
+        :param project_id: project _id
+        :return: the number of items
+        """
+        entry = self.db.get_one(self.collection, {"_id": self._get_key(topic, project_id)}, fail_on_empty=False)
+        if entry:
+            return entry["count"]
+        count = self._count(topic, project_id)
+        self._store(topic, project_id, count)
+        return count
+
+    def add(self, topic, project_ids, increment):
+        """
+        Updates the number of items of a topic after an item creation or deletion. Projects that have not been
+        counted yet are ignored
+        :param topic: database collection of the topic
+        :param project_ids: list of project _id that gain or lose the item. "ANY" is ignored
+        :param increment: 1 for a new item, -1 for a removed one
+        :return: None
+        """
+        for project_id in project_ids:
+            if project_id == "ANY":
+                continue
+            key = self._get_key(topic, project_id)
+            if isinstance(self.db, DbMongo):
+                try:
+                    self.db.db[self.collection].update_one({"_id": key}, {"$inc": {"count": increment},
+                                                                          "$set": {"modified": time()}})
+                except Exception as e:
+                    raise DbException(e, HTTPStatus.INTERNAL_SERVER_ERROR)
+                continue
+            with self.lock:
+                entry = self.db.get_one(self.collection, {"_id": key}, fail_on_empty=False)
+                if entry:
+                    self.db.set_one(self.collection, {"_id": key}, {"count": entry["count"] + increment,
+                                                                    "modified": time()})
+
+    def _correct(self, entry, count):
+        """
+        Applies the difference between the counted items and the ledger entry as an increment, only if the entry has
+        not been modified since it was read. Otherwise, the increments done meanwhile would be lost
+        :param entry: ledger entry as read before counting
+        :param count: number of items counted at database
+        :return: True if corrected, False if the entry has been modified meanwhile
+        """
+        q_filter = {"_id": entry["_id"], "count": entry["count"]}
+        if isinstance(self.db, DbMongo):
+            try:
+                result = self.db.db[self.collection].update_one(q_filter, {"$inc": {"count": count - entry["count"]},
+                                                                           "$set": {"modified": time()}})
+            except Exception as e:
+                raise DbException(e, HTTPStatus.INTERNAL_SERVER_ERROR)
+            return result.modified_count == 1
+        with self.lock:
+            if not self.db.get_one(self.collection, q_filter, fail_on_empty=False):
+                return False
+            self.db.set_one(self.collection, {"_id": entry["_id"]}, {"count": count, "modified": time()})
+            return True
+
+    def reconcile(self):
+        """
+        Counts again at database the number of items of every project and topic of the ledger. Counters modified
+        while being counted are not corrected, they are checked again at the next reconcile
+        :return: number of counters that were wrong and have been fixed
+        """
+        fixed = 0
+        for entry in self.db.get_list(self.collection):
+            count = self._count(entry["topic"], entry["project_id"])
+            if count != entry["count"] and self._correct(entry, count):
+                self.logger.warning("Fixing {} usage of project {}: {} instead of {}".format(
+                    entry["topic"], entry["project_id"], count, entry["count"]))
+                fixed += 1
+        return fixed
+
+    def delete_project(self, project_id):
+        """
+        Removes the counters of a deleted project
+        :param project_id: project _id
+        :return: None
+        """
+        self.db.del_list(self.collection, {"project_id": project_id})
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Codecs of the requests and responses. Lists are encoded item by item, yielding chunks of about chunk_size bytes, so
+that the whole response is never built in memory as a single string and the first bytes can be sent before encoding
+the rest.
+json uses orjson or ujson when installed, and the standard json library otherwise or when an indented output is
+requested. yaml uses the libyaml C bindings when available
+"""
+
+import json
+import yaml
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+chunk_size = 65536
+json_codecs = ("orjson", "ujson", "json")
+json_codec = None   # codec in use, set by set_json_codec
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+YamlDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+
+def set_json_codec(codec=None):
+    """
+    Selects the library used for json
+    :param codec: one of json_codecs. None for the fastest available one
+    :return: the selected codec. It raises ValueError if not valid or not installed
+    """
+    global json_codec, json_loads, _json_dumps_compact
+    available = {"orjson": orjson, "ujson": ujson, "json": json}
+    if codec is None:
+        codec = next(c for c in json_codecs if available[c])
+    elif codec not in json_codecs:
+        raise ValueError("Invalid json codec '{}'. Must be one of {}".format(codec, ", ".join(json_codecs)))
+    elif not available[codec]:
+        raise ValueError("json codec '{}' is not installed".format(codec))
+    if codec == "orjson":
+        json_loads = orjson.loads
+        _json_dumps_compact = _orjson_dumps
+    elif codec == "ujson":
+        json_loads = ujson.loads
+        _json_dumps_compact = _ujson_dumps
+    else:
+        json_loads = json.loads
+        _json_dumps_compact = _stdlib_dumps
+    json_codec = codec
+    return codec
+
+
+def _orjson_dumps(data):
+    return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode("utf8")
+
+
+def _ujson_dumps(data):
+    return ujson.dumps(data, ensure_ascii=False, escape_forward_slashes=False)
+
+
+def _stdlib_dumps(data):
+    return json.dumps(data, separators=(",", ":"))
+
+
+def json_load(stream):
+    """
+    Decodes a json content
+    :param stream: file like object, or str or bytes
+    :return: the decoded content. It raises ValueError on invalid json
+    """
+    if hasattr(stream, "read"):
+        stream = stream.read()
+    return json_loads(stream)
+
+
+def yaml_load(stream):
+    """
+    Decodes a yaml content
+    :param stream: file like object, or str or bytes
+    :return: the decoded content. It raises yaml.YAMLError on invalid yaml
+    """
+    return yaml.load(stream, Loader=YamlLoader)
+
+
+def get_json_indent(accept):
+    """
+    Obtain the indentation requested at the json media type of the Accept header, as "application/json; indent=4".
+    :param accept: content of the Accept header
+    :return: None for compact output, or the number of spaces used for indenting
+    """
+    if not accept:
+        return None
+    for media_range in accept.split(","):
+        media_params = media_range.split(";")
+        if media_params[0].strip() != "application/json":
+            continue
+        for param in media_params[1:]:
+            name, _, value = param.partition("=")
+            if name.strip() == "indent":
+                try:
+                    return max(int(value.strip().strip('"')), 0) or None
+                except ValueError:
+                    return None
+        return None
+    return None
+
+
+def _join_chunks(encoded_items, start, end):
+    """
+    Generator that joins the already encoded items in chunks of about chunk_size bytes
+    :param encoded_items: iterable of text strings
+    :param start: text to be sent before the items
+    :param end: text to be sent after the items
+    :return: generator of bytes
+    """
+    buffer = [start]
+    buffer_len = len(start)
+    for encoded_item in encoded_items:
+        buffer.append(encoded_item)
+        buffer_len += len(encoded_item)
+        if buffer_len >= chunk_size:
+            yield "".join(buffer).encode("utf8")
+            buffer = []
+            buffer_len = 0
+    buffer.append(end)
+    yield "".join(buffer).encode("utf8")
+
+
+def iter_json(data, indent=None):
+    """
+    Encodes data as json
+    :param data: content to encode
+    :param indent: None for compact output, or number of spaces used for indenting
+    :return: generator of bytes chunks
+    """
+    if indent:
+        item_separator = ",\n" + " " * indent
+
+        def dumps(content):
+            return json.dumps(content, indent=indent)
+    else:
+        item_separator = ","
+        dumps = _json_dumps_compact
+    if not isinstance(data, list) or not data:
+        yield (dumps(data) + "\n").encode("utf8")
+        return
+
+    def _encode_items():
+        for index, item in enumerate(data):
+            encoded_item = dumps(item)
+            if indent:
+                # encoded strings do not contain new lines; all of them are the ones inserted by the indentation
+                encoded_item = encoded_item.replace("\n", "\n" + " " * indent)
+            yield item_separator + encoded_item if index else encoded_item
+
+    if indent:
+        yield from _join_chunks(_encode_items(), "[\n" + " " * indent, "\n]\n")
+    else:
+        yield from _join_chunks(_encode_items(), "[", "]\n")
+
+
+def _yaml_dump(data, explicit_start):
+    return yaml.dump(data, Dumper=YamlDumper, explicit_start=explicit_start, indent=4, default_flow_style=False,
+                     tags=False, allow_unicode=True)
+
+
+def iter_yaml(data):
+    """
+    Encodes data as yaml
+    :param data: content to encode
+    :return: generator of bytes chunks
+    """
+    if not isinstance(data, list) or not data:
+        yield _yaml_dump(data, True).encode("utf8")
+        return
+    # a block sequence dumped item by item is identical to the whole sequence dumped at once
+    yield from _join_chunks((_yaml_dump([item], False) for item in data), "---\n", "")
+
+
+def dumps_json(data, indent=None):
+    """
+    Encodes data as json in a single bytes string. Used for small contents
+    """
+    return b"".join(iter_json(data, indent))
+
+
+def dumps_yaml(data):
+    """
+    Encodes data as yaml in a single bytes string. Used for small contents
+    """
+    return b"".join(iter_yaml(data))
+
+
+set_json_codec()
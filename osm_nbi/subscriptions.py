@@ -17,7 +17,9 @@
 This module implements a thread that reads from kafka bus implementing all the subscriptions.
 It is based on asyncio.
 To avoid race conditions it uses same engine class as the main module for database changes
-For the moment this module only deletes NS instances when they are terminated with the autoremove flag
+For the moment this module only deletes NS instances when they are terminated with the autoremove flag, removes
+from the tokens cache the tokens revoked at other NBI instances, and removes from the descriptor cache the descriptors
+edited or deleted at other NBI instances
 """
 
 import logging
@@ -28,6 +30,9 @@ from osm_common import dbmongo, dbmemory, msglocal, msgkafka
 from osm_common.dbbase import DbException
 from osm_common.msgbase import MsgException
 from osm_nbi.engine import EngineException
+from osm_nbi.auth import invalidate_tokens_cache
+from osm_nbi.descriptor_cache import DescriptorCache
+from uuid import uuid4
 
 __author__ = "Alfonso Tierno <alfonso.tiernosepulveda@telefonica.com>"
 
@@ -40,12 +45,15 @@ class SubscriptionException(Exception):
 
 
 class SubscriptionThread(threading.Thread):
+    quota_reconcile_period = 3600  # seconds between countings of the project items to fix the quota usage ledger
 
-    def __init__(self, config, engine):
+    def __init__(self, config, engine, authenticator=None):
         """
         Constructor of class
         :param config: configuration parameters of database and messaging
         :param engine: an instance of Engine class, used for deleting instances
+        :param authenticator: an instance of Authenticator class, used for reloading roles changed at other NBI
+            instances. None for not reloading
         """
         threading.Thread.__init__(self)
         self.to_terminate = False
@@ -53,9 +61,14 @@ class SubscriptionThread(threading.Thread):
         self.db = None
         self.msg = None
         self.engine = engine
+        self.authenticator = authenticator
         self.loop = None
         self.logger = logging.getLogger("nbi.subscriptions")
         self.aiomain_task = None  # asyncio task for receiving kafka bus
+        self.aioadmin_task = None  # asyncio task for receiving kafka 'admin' topic
+        self.aioquota_task = None  # asyncio task for reconciling quota usage
+        # 'admin' topic is read with a group different for each NBI instance, so that all of them receive the messages
+        self.admin_group_id = "nbi-" + uuid4().hex
         self.internal_session = {  # used for a session to the engine methods
             "project_id": (),
             "set_project": (),
@@ -76,6 +89,8 @@ class SubscriptionThread(threading.Thread):
                 await self.msg.aiowrite("admin", "echo", "dummy message", loop=self.loop)
                 await self.msg.aiowrite("ns", "echo", "dummy message", loop=self.loop)
                 await self.msg.aiowrite("nsi", "echo", "dummy message", loop=self.loop)
+                for msg_topic in DescriptorCache.msg_topics:
+                    await self.msg.aiowrite(msg_topic, "echo", "dummy message", loop=self.loop)
                 if not kafka_working:
                     self.logger.critical("kafka is working again")
                     kafka_working = True
@@ -83,7 +98,21 @@ class SubscriptionThread(threading.Thread):
                 self.aiomain_task = asyncio.ensure_future(self.msg.aioread(("ns", "nsi"), loop=self.loop,
                                                                            aiocallback=self._msg_callback),
                                                           loop=self.loop)
-                await asyncio.wait_for(self.aiomain_task, timeout=None, loop=self.loop)
+                # descriptor changes are also read by every NBI instance, to invalidate its descriptor cache
+                admin_topics = ("admin",) + tuple(DescriptorCache.msg_topics)
+                self.aioadmin_task = asyncio.ensure_future(self.msg.aioread(admin_topics, loop=self.loop,
+                                                                            aiocallback=self._msg_callback,
+                                                                            group_id=self.admin_group_id),
+                                                           loop=self.loop)
+                try:
+                    done, _ = await asyncio.wait((self.aiomain_task, self.aioadmin_task),
+                                                 return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        task.result()   # raises the reading exception if any
+                finally:
+                    for task in (self.aiomain_task, self.aioadmin_task):
+                        if not task.done():
+                            task.cancel()
             except Exception as e:
                 if self.to_terminate:
                     return
@@ -127,6 +156,7 @@ class SubscriptionThread(threading.Thread):
             raise SubscriptionException(str(e), http_code=e.http_code)
 
         self.logger.debug("Starting")
+        self.aioquota_task = asyncio.ensure_future(self.reconcile_quota_usage(), loop=self.loop)
         while not self.to_terminate:
             try:
 
@@ -141,6 +171,23 @@ class SubscriptionThread(threading.Thread):
         self._stop()
         self.loop.close()
 
+    async def reconcile_quota_usage(self):
+        """
+        Counts again periodically the items of each project, to fix the quota usage ledger used by the engine
+        :return: None
+        """
+        period = int(self.config["database"].get("quota_reconcile_period", self.quota_reconcile_period))
+        if not period:
+            return
+        while not self.to_terminate:
+            await asyncio.sleep(period, loop=self.loop)
+            try:
+                fixed = await self.loop.run_in_executor(None, self.engine.reconcile_quota_usage)
+                if fixed:
+                    self.logger.info("Fixed {} quota usage counters".format(fixed))
+            except Exception as e:
+                self.logger.error("Error reconciling quota usage: {}".format(e))
+
     async def _msg_callback(self, topic, command, params):
         """
         Callback to process a received message from kafka
@@ -165,6 +212,17 @@ class SubscriptionThread(threading.Thread):
                         self.engine.del_item(self.internal_session, "nsis", _id=params["nsir_id"],
                                              not_send_msg=msg_to_send)
                         self.logger.debug("nsis={} deleted from database".format(params["nsir_id"]))
+            elif topic in DescriptorCache.msg_topics:
+                if self.engine.descriptor_cache:
+                    self.engine.descriptor_cache.process_msg(topic, command, params)
+            elif topic == "admin":
+                if command == "revoke_token" and self.engine.token_cache is not None:
+                    removed = invalidate_tokens_cache(self.engine.token_cache, params)
+                    self.logger.debug("received token revocation {}, {} tokens removed from cache".format(params,
+                                                                                                          removed))
+                elif command == "reload_roles" and self.authenticator:
+                    if self.authenticator.process_roles_reload(params):
+                        self.logger.debug("received roles reload {}".format(params))
 
             # writing to kafka must be done with our own loop. For this reason it is not allowed Engine to do that, 
             # but content to be written is stored at msg_to_send
@@ -198,3 +256,7 @@ class SubscriptionThread(threading.Thread):
         self.to_terminate = True
         if self.aiomain_task:
             self.loop.call_soon_threadsafe(self.aiomain_task.cancel)
+        if self.aioadmin_task:
+            self.loop.call_soon_threadsafe(self.aioadmin_task.cancel)
+        if self.aioquota_task:
+            self.loop.call_soon_threadsafe(self.aioquota_task.cancel)
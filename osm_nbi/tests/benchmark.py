@@ -0,0 +1,479 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import getopt
+import sys
+import json
+import yaml
+import tracemalloc
+from copy import deepcopy
+from time import perf_counter
+from osm_nbi import serializer
+from osm_nbi.tests import test_db_descriptors
+from osm_nbi.tests.test_db_descriptors import db_nsrs_text
+
+__version__ = "0.1"
+
+"""
+Micro benchmarks of NBI internal operations, using the descriptors of the unit tests. It does not need a running NBI
+"""
+
+
+def usage():
+    print("Usage: ", sys.argv[0], "[options] [benchmark ...]")
+    print("      --version: prints current version")
+    print("      -h|--help: shows this help")
+    print("      -n|--size N: number of items of the tested lists, by default 1000")
+    print("      -r|--repeat N: number of repetitions, the best one is shown. By default 3")
+    print("      benchmark: some of {}. By default all".format(", ".join(benchmarks)))
+    return
+
+
+def measure(function, repeat):
+    """
+    Executes a function several times
+    :param function: function without arguments to measure
+    :param repeat: number of executions
+    :return: tuple with the best time in seconds and the maximum memory allocated in bytes during the execution
+    """
+    best_time = None
+    peak_memory = 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = perf_counter()
+        function()
+        elapsed = perf_counter() - start
+        peak_memory = max(peak_memory, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        if best_time is None or elapsed < best_time:
+            best_time = elapsed
+    return best_time, peak_memory
+
+
+def print_result(name, best_time, peak_memory):
+    print("    {:<48} {:10.2f} ms {:10.1f} MB peak".format(name, best_time * 1000, peak_memory / 1048576))
+
+
+def get_nsrs(size):
+    nsr = yaml.safe_load(db_nsrs_text)[0]
+    nsrs = []
+    for index in range(size):
+        nsrs.append(deepcopy(nsr))
+        nsrs[-1]["_id"] = "{}-{}".format(nsr["_id"][:-6], index)
+    return nsrs
+
+
+def bench_serializer(size, repeat):
+    """Full encoding of the responses versus streaming them in chunks"""
+    nsrs = get_nsrs(size)
+
+    def consume(chunks):
+        # emulates the sending of the chunks to the socket
+        return sum(len(chunk) for chunk in chunks)
+
+    print("Encoding of a list of {} nsrs".format(size))
+    print_result("json indent=4 (full response)", *measure(
+        lambda: (json.dumps(nsrs, indent=4) + "\n").encode("utf8"), repeat))
+    print_result("json indent=4 (streamed)", *measure(lambda: consume(serializer.iter_json(nsrs, 4)), repeat))
+    print_result("json compact (streamed)", *measure(lambda: consume(serializer.iter_json(nsrs)), repeat))
+    print_result("yaml (full response)", *measure(
+        lambda: yaml.safe_dump(nsrs, explicit_start=True, indent=4, default_flow_style=False, tags=False,
+                               encoding='utf-8', allow_unicode=True), repeat))
+    print_result("yaml (streamed)", *measure(lambda: consume(serializer.iter_yaml(nsrs)), repeat))
+
+
+def bench_codecs(size, repeat):
+    """Decoding and encoding of the test descriptors with the available json codecs and yaml loaders/dumpers"""
+    descriptors = []
+    for name in ("db_vim_accounts_text", "db_vnfds_text", "db_nsds_text", "db_nsrs_text", "db_nslcmops_text",
+                 "db_vnfrs_text"):
+        descriptors += yaml.safe_load(getattr(test_db_descriptors, name))
+    content = [deepcopy(descriptors[index % len(descriptors)]) for index in range(size)]
+    json_text = json.dumps(content).encode("utf8")
+    yaml_text = yaml.safe_dump(content, default_flow_style=False).encode("utf8")
+    codec = serializer.json_codec
+
+    print("Codecs of a list of {} descriptors: {:.1f} MB json, {:.1f} MB yaml".format(
+        size, len(json_text) / 1048576, len(yaml_text) / 1048576))
+    try:
+        for json_codec in serializer.json_codecs:
+            try:
+                serializer.set_json_codec(json_codec)
+            except ValueError:
+                print("    {:<48} not installed".format(json_codec))
+                continue
+            print_result("json load ({})".format(json_codec), *measure(lambda: serializer.json_load(json_text),
+                                                                       repeat))
+            print_result("json dump ({})".format(json_codec), *measure(lambda: serializer.dumps_json(content),
+                                                                       repeat))
+    finally:
+        serializer.set_json_codec(codec)
+    loaders = [("SafeLoader", yaml.SafeLoader, yaml.SafeDumper)]
+    if getattr(yaml, "CSafeLoader", None):
+        loaders.append(("CSafeLoader", yaml.CSafeLoader, yaml.CSafeDumper))
+    for name, loader, dumper in loaders:
+        print_result("yaml load ({})".format(name), *measure(lambda: yaml.load(yaml_text, Loader=loader), repeat))
+        print_result("yaml dump ({})".format(name.replace("Loader", "Dumper")), *measure(
+            lambda: yaml.dump(content, Dumper=dumper, indent=4, default_flow_style=False), repeat))
+
+
+def bench_validation(size, repeat):
+    """Input validation creating a jsonschema validator per request versus the cached validators"""
+    import jsonschema
+    from osm_nbi import validation
+    inputs = {
+        "ns_instantiate": {
+            "nsName": "name", "nsdId": "b3c3b1c0-5ae0-4ca2-9e7b-3d6e6e8a7c11",
+            "vimAccountId": "f48163a6-c807-47bc-9682-f72caef5af85",
+            "vnf": [{"member-vnf-index": "1",
+                     "vdu": [{"id": "vdu1", "interface": [{"name": "eth0", "ip-address": "10.0.0.1"}]}]}],
+            "vld": [{"name": "mgmt", "vim-network-name": "mgmt", "ip-profile": {"ip-version": "ipv4"}}],
+        },
+        "ns_action": {"member_vnf_index": "1", "primitive": "touch", "primitive_params": {"filename": "/tmp/f"}},
+        "vim_account_new_schema": {"name": "vim", "vim_type": "openstack", "vim_url": "http://10.0.0.1:5000/v3",
+                                   "vim_tenant_name": "osm", "vim_user": "osm", "vim_password": "osm"},
+        "nsi_instantiate": {"nsiName": "slice", "nstId": "nst", "vimAccountId": "f48163a6-c807-47bc-9682-f72caef5af85"},
+    }
+    print("Validation of {} requests".format(size))
+    for name, indata in inputs.items():
+        schema = getattr(validation, name)
+        print_result("{} (jsonschema.validate)".format(name), *measure(
+            lambda: [jsonschema.validate(indata, schema) for _ in range(size)], repeat))
+        print_result("{} (validate_input)".format(name), *measure(
+            lambda: [validation.validate_input(indata, schema) for _ in range(size)], repeat))
+
+
+def bench_users(size, repeat):
+    """Database queries and time of listing users with the internal authentication backend, as users grow"""
+    from unittest.mock import Mock
+    from osm_common.dbmemory import DbMemory
+    from osm_nbi.authconn_internal import AuthconnInternal
+    from osm_nbi.cache import LruCache
+    from osm_nbi.tests.test_authconn_internal import fill_users
+
+    print("Listing of users with 10 project role mappings each")
+    for users in sorted({max(1, size // 100), max(1, size // 10), size}):
+        db = DbMemory()
+        fill_users(db, users)
+        db.get_list = Mock(side_effect=db.get_list)
+        db.get_one = Mock(side_effect=db.get_one)
+        auth = AuthconnInternal({}, db, LruCache())
+        for cache in AuthconnInternal.names_cache.values():
+            cache.clear()
+        auth.get_user_list()
+        queries = db.get_list.call_count + db.get_one.call_count
+        print("    {:<48} {:10d} queries".format("{} users (database queries, not cached)".format(users), queries))
+        print_result("{} users (get_user_list)".format(users), *measure(auth.get_user_list, repeat))
+
+
+def bench_vnfrs(size, repeat):
+    """Database round trips and time of creating and instantiating a NS, as its number of VNFs grows. Vnfrs are
+    written one by one with a driver without bulk support; with create_list (DbMemory); or with insert_many and
+    bulk_write (DbMongo, emulated over a DbMemory)"""
+    from unittest.mock import Mock
+    from osm_common.dbmemory import DbMemory
+    from osm_common.dbmongo import DbMongo
+    from osm_nbi.instance_topics import NsrTopic, NsLcmOpTopic
+    from osm_nbi.tests.test_db_descriptors import db_vim_accounts_text, db_nsds_text, db_vnfds_text
+
+    db_methods = ["get_list", "get_one", "count", "create", "set_one", "del_one", "del_list"]
+
+    def get_driver(db, driver):
+        if driver == "DbMemory":
+            return Mock(wraps=db, spec=db_methods + ["create_list"])
+        counted_db = Mock(wraps=db, spec=db_methods + ["db"])
+        if driver == "DbMongo":
+            counted_db.__class__ = DbMongo
+            collection = Mock()
+            collection.insert_many.side_effect = lambda contents, ordered: [db.create("vnfrs", content)
+                                                                            for content in contents]
+            collection.bulk_write.side_effect = lambda updates, ordered: Mock(matched_count=len(
+                [db.set_one("vnfrs", update._filter, update._doc["$set"]) for update in updates]))
+            counted_db.db = {"vnfrs": collection}
+        return counted_db
+
+    def round_trips(counted_db):
+        collection = counted_db.db["vnfrs"] if isinstance(counted_db, DbMongo) else None
+        return len(counted_db.method_calls) + (collection.insert_many.call_count + collection.bulk_write.call_count
+                                               if collection else 0)
+
+    nsd = yaml.safe_load(db_nsds_text)[0]
+    member_vnf = nsd["constituent-vnfd"][0]
+    session = {"force": True, "admin": True, "public": False, "project_id": nsd["_admin"]["projects_read"],
+               "method": "write"}
+    print("Creation and instantiation of a NS (vnfrs created and updated)")
+    for vnfs in sorted({max(1, size // 100), max(1, size // 10), size}):
+        nsd["constituent-vnfd"] = [dict(member_vnf, **{"member-vnf-index": str(index)})
+                                   for index in range(1, vnfs + 1)]
+        additional_params = [{"member-vnf-index": member["member-vnf-index"],
+                              "additionalParams": {"touch_filename": "file"}} for member in nsd["constituent-vnfd"]]
+        for driver in ("per item", "DbMemory", "DbMongo"):
+            db = DbMemory()
+            db.create("nsds", deepcopy(nsd))
+            db.create("vnfds", yaml.safe_load(db_vnfds_text)[0])
+            db.create("vim_accounts", yaml.safe_load(db_vim_accounts_text)[0])
+            counted_db = get_driver(db, driver)
+            nsr_topic = NsrTopic(counted_db, Mock(), Mock(), None)
+            nslcmop_topic = NsLcmOpTopic(counted_db, Mock(), Mock(), None)
+            indata = {"nsdId": nsd["_id"], "nsName": "name", "vimAccountId": db.get_list("vim_accounts")[0]["_id"],
+                      "additionalParamsForVnf": additional_params}
+
+            def create_and_instantiate():
+                rollback = []
+                nsr_id, _ = nsr_topic.new(rollback, session, deepcopy(indata))
+                nslcmop_topic._update_vnfrs(session, rollback, {"_id": nsr_id}, deepcopy(indata))
+                return rollback
+
+            counted_db.reset_mock()
+            rollback = create_and_instantiate()
+            print("    {:<48} {:10d} round trips {:4d} rollback entries".format(
+                "{} vnfs ({})".format(vnfs, driver), round_trips(counted_db), len(rollback)))
+            print_result("{} vnfs ({})".format(vnfs, driver), *measure(create_and_instantiate, repeat))
+
+
+def get_synthetic_descriptors(vnfs, vdus, project):
+    """
+    Builds a vnfd with vdus connected to an internal vld and to one external connection point each; and a nsd with
+    vnfs members of this vnfd, connected by a vld per external connection point
+    :return: tuple with nsd and vnfd
+    """
+    admin = {"projects_read": [project], "projects_write": [project]}
+    vnfd = {
+        "_id": "5ca1ab1e-0000-4000-8000-000000000001", "id": "synthetic-vnf", "name": "synthetic-vnf", "_admin": admin,
+        "mgmt-interface": {"cp": "cp0"},
+        "connection-point": [{"id": "cp{}".format(index), "name": "cp{}".format(index)} for index in range(vdus)],
+        "internal-vld": [{"id": "internal", "internal-connection-point": [
+            {"id-ref": "vdu{}-internal".format(index)} for index in range(vdus)]}],
+        "vdu": [{
+            "id": "vdu{}".format(index), "name": "vdu{}".format(index), "count": 2,
+            "internal-connection-point": [{"id": "vdu{}-internal".format(index)}],
+            "interface": [{"name": "eth0", "external-connection-point-ref": "cp{}".format(index)},
+                          {"name": "eth1", "internal-connection-point-ref": "vdu{}-internal".format(index)}],
+        } for index in range(vdus)],
+    }
+    nsd = {
+        "_id": "5ca1ab1e-0000-4000-8000-000000000002", "id": "synthetic-ns", "name": "synthetic-ns", "_admin": admin,
+        "constituent-vnfd": [{"member-vnf-index": str(member), "vnfd-id-ref": "synthetic-vnf"}
+                             for member in range(1, vnfs + 1)],
+        "vld": [{"id": "net{}".format(index), "vnfd-connection-point-ref": [
+            {"member-vnf-index-ref": str(member), "vnfd-connection-point-ref": "cp{}".format(index),
+             "vnfd-id-ref": "synthetic-vnf"} for member in range(1, vnfs + 1)]} for index in range(vdus)],
+    }
+    return nsd, vnfd
+
+
+def bench_nsr(size, repeat):
+    """Creation of a NS record (nsr and vnfrs) from synthetic descriptors of 10 VDUs per VNF, as the VNFs grow"""
+    from unittest.mock import Mock
+    from osm_common.dbmemory import DbMemory
+    from osm_nbi.instance_topics import NsrTopic
+
+    project = "synthetic-project"
+    session = {"force": True, "admin": True, "public": False, "project_id": [project], "method": "write"}
+    print("Creation of a NS with 10 VDUs of count 2 per VNF")
+    for vnfs in sorted({max(1, size // 100), max(1, size // 10)}):
+        nsd, vnfd = get_synthetic_descriptors(vnfs, 10, project)
+        db = DbMemory()
+        db.create("nsds", nsd)
+        db.create("vnfds", vnfd)
+        db.create = Mock(return_value=None)     # measures the building of the records, not the storing
+        db.create_list = Mock(return_value=[])
+        nsr_topic = NsrTopic(db, Mock(), Mock(), None)
+        indata = {"nsdId": nsd["_id"], "nsName": "name", "vimAccountId": "5ca1ab1e-0000-4000-8000-000000000003"}
+        name = "{} vnfs, {} vdus, {} vdurs".format(vnfs, vnfs * 10, vnfs * 20)
+        best_time, peak_memory = measure(lambda: nsr_topic.new([], session, deepcopy(indata)), repeat)
+        print_result(name, best_time, peak_memory)
+        print("    {:<48} {:10.2f} us".format("{} (per vdur)".format(name), best_time * 1000000 / (vnfs * 20)))
+
+
+def get_synthetic_vnfd(vdus):
+    """
+    Builds a vnfd where each vdu has an external and an internal interface, a charm, a cloud-init file, a monitoring
+    param and a metric, all of them referenced from the vnfd internal-vld, monitoring-param and scaling-group
+    """
+    return {
+        "id": "synthetic-vnf", "name": "synthetic-vnf",
+        "mgmt-interface": {"cp": "cp0"},
+        "connection-point": [{"id": "cp{}".format(index), "name": "cp{}".format(index)} for index in range(vdus)],
+        "internal-vld": [{"id": "internal", "name": "internal", "internal-connection-point": [
+            {"id-ref": "vdu{}-internal".format(index)} for index in range(vdus)]}],
+        "vdu": [{
+            "id": "vdu{}".format(index), "name": "vdu{}".format(index), "cloud-init-file": "cloud-config.txt",
+            "internal-connection-point": [{"id": "vdu{}-internal".format(index)}],
+            "interface": [{"name": "eth0", "external-connection-point-ref": "cp{}".format(index)},
+                          {"name": "eth1", "internal-connection-point-ref": "vdu{}-internal".format(index)}],
+            "monitoring-param": [{"id": "vdu{}-cpu".format(index)}],
+            "vdu-configuration": {"juju": {"charm": "simple"}, "metrics": [{"name": "users"}]},
+        } for index in range(vdus)],
+        "monitoring-param": [mp for index in range(vdus) for mp in (
+            {"id": "vdu{}-cpu".format(index), "vdu-monitoring-param": {
+                "vdu-ref": "vdu{}".format(index), "vdu-monitoring-param-ref": "vdu{}-cpu".format(index)}},
+            {"id": "vdu{}-users".format(index), "vdu-metric": {
+                "vdu-ref": "vdu{}".format(index), "vdu-metric-name-ref": "users"}})],
+        "scaling-group-descriptor": [{
+            "name": "scale", "vdu": [{"vdu-id-ref": "vdu{}".format(index)} for index in range(vdus)],
+            "scaling-policy": [{"name": "policy", "scaling-criteria": [
+                {"name": "vdu{}-cpu".format(index), "vnf-monitoring-param-ref": "vdu{}-cpu".format(index)}
+                for index in range(vdus)]}],
+        }],
+    }
+
+
+def bench_vnfd(size, repeat):
+    """Validation of the cross references of a vnfd, as the VDUs grow. Pyangbind validation is not measured"""
+    from unittest.mock import Mock
+    from osm_nbi.descriptor_topics import VnfdTopic
+
+    print("Cross reference validation of a vnfd")
+    for vdus in sorted({max(1, size // 10), max(1, size // 2)}):
+        vnfd = get_synthetic_vnfd(vdus)
+        fs = Mock()
+        fs.file_exists.return_value = True
+        fs.dir_ls.return_value = ["charm"]
+        vnfd_topic = VnfdTopic(Mock(), fs, Mock(), None)
+        vnfd_topic.pyangbind_validation = lambda item, data, force=False: data
+        storage_params = {"folder": "5ca1ab1e-0000-4000-8000-000000000001", "pkg-dir": "synthetic_vnfd"}
+        vnfd_topic._validate_input_new(vnfd, storage_params)
+        queries = fs.file_exists.call_count + fs.dir_ls.call_count
+        print("    {:<48} {:10d} storage queries".format("{} vdus".format(vdus), queries))
+        print_result("{} vdus".format(vdus), *measure(lambda: vnfd_topic._validate_input_new(vnfd, storage_params),
+                                                      repeat))
+
+
+def bench_upload(size, repeat):
+    """Storage of an uploaded package tar.gz of size/100 MB, with MD5 check and tar index validation: copy and then
+    read again for hashing and for validating versus the single pass pipeline"""
+    import io
+    import os
+    import shutil
+    import tarfile
+    import tempfile
+    from hashlib import md5
+    from osm_nbi.package_upload import MultipartReader, PackageUpload
+
+    package_size = max(1, size // 100) << 20
+    package = io.BytesIO()
+    with tarfile.open(fileobj=package, mode="w:gz") as tar:
+        for name, content in (("pkg/vnfd.yaml", b"vnfd: {}\n"), ("pkg/images/image.qcow2", os.urandom(package_size))):
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.size = len(content)
+            tar.addfile(tarinfo, io.BytesIO(content))
+    package = package.getvalue()
+    expected_md5 = md5(package).hexdigest()
+
+    def copy_read_again(file_path):
+        body = io.BytesIO(package)
+        with open(file_path, "w+b") as file_pkg:
+            while True:
+                chunk_data = body.read(4096)
+                if not chunk_data:
+                    break
+                file_pkg.write(chunk_data)
+            file_pkg.seek(0, 0)
+            file_md5 = md5()
+            chunk_data = file_pkg.read(1024)
+            while chunk_data:
+                file_md5.update(chunk_data)
+                chunk_data = file_pkg.read(1024)
+            assert file_md5.hexdigest() == expected_md5
+            file_pkg.seek(0, 0)
+            assert len(tarfile.open(mode="r", fileobj=file_pkg).getmembers()) == 2
+
+    def single_pass(file_path):
+        upload = PackageUpload(compressed=True)
+        with open(file_path, "w+b") as file_pkg:
+            upload.write(file_pkg, io.BytesIO(package), 1 << 20)
+        assert upload.md5.hexdigest() == expected_md5
+        upload.tar_validator.close()
+
+    boundary = b"----boundary"
+    multipart = b"--" + boundary + b'\r\nContent-Disposition: form-data; name="descriptor_file"; ' \
+        b'filename="package.tar.gz"\r\nContent-Type: application/gzip\r\n\r\n' + package + \
+        b"\r\n--" + boundary + b"--\r\n"
+
+    def multipart_spooled(file_path):
+        # as cherrypy default processor, the file is stored at a temporary file and then copied
+        upload = PackageUpload(compressed=True)
+        with tempfile.TemporaryFile() as spool_file:
+            for part in MultipartReader(io.BytesIO(multipart), boundary):
+                shutil.copyfileobj(part, spool_file, 1 << 20)
+            spool_file.seek(0, 0)
+            with open(file_path, "w+b") as file_pkg:
+                upload.write(file_pkg, spool_file, 1 << 20)
+        assert upload.md5.hexdigest() == expected_md5
+
+    def multipart_streamed(file_path):
+        upload = PackageUpload(compressed=True)
+        with open(file_path, "w+b") as file_pkg:
+            for part in MultipartReader(io.BytesIO(multipart), boundary):
+                upload.write(file_pkg, part, 1 << 20)
+        assert upload.md5.hexdigest() == expected_md5
+
+    print("Upload of a package of {:.1f} MB".format(len(package) / 1048576))
+    with tempfile.TemporaryDirectory() as folder:
+        file_path = os.path.join(folder, "package.tar.gz")
+        for name, function in (("copy, read to hash, read to validate", copy_read_again),
+                               ("single pass, hash and validate while copying", single_pass),
+                               ("multipart, spooled to temporary file", multipart_spooled),
+                               ("multipart, streamed to storage", multipart_streamed)):
+            best_time, peak_memory = measure(lambda: function(file_path), repeat)
+            print_result(name, best_time, peak_memory)
+            print("    {:<48} {:10.1f} MB/s".format(name, len(package) / 1048576 / best_time))
+
+
+benchmarks = {
+    "serializer": bench_serializer,
+    "codecs": bench_codecs,
+    "validation": bench_validation,
+    "users": bench_users,
+    "vnfrs": bench_vnfrs,
+    "nsr": bench_nsr,
+    "vnfd": bench_vnfd,
+    "upload": bench_upload,
+}
+
+
+if __name__ == "__main__":
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hn:r:", ["help", "version", "size=", "repeat="])
+        size = 1000
+        repeat = 3
+
+        for o, a in opts:
+            if o == "--version":
+                print("benchmark version " + __version__)
+                sys.exit()
+            elif o in ("-h", "--help"):
+                usage()
+                sys.exit()
+            elif o in ("-n", "--size"):
+                size = int(a)
+            elif o in ("-r", "--repeat"):
+                repeat = int(a)
+            else:
+                assert False, "Unhandled option"
+        for benchmark in args:
+            if benchmark not in benchmarks:
+                raise ValueError("Unknown benchmark '{}'".format(benchmark))
+        for benchmark in args or benchmarks:
+            benchmarks[benchmark](size, repeat)
+    except getopt.GetoptError as e:
+        print(str(e), file=sys.stderr)
+        # usage()
+        exit(1)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        exit(1)
@@ -27,6 +27,8 @@ from random import randint
 from osm_common import dbbase, fsbase, msgbase
 from osm_nbi import authconn, validation
 from osm_nbi.admin_topics import ProjectTopicAuth, RoleTopicAuth, UserTopicAuth, CommonVimWimSdn
+from osm_nbi.base_topic import BaseTopic
+from osm_nbi.cache import LruCache
 from osm_nbi.engine import EngineException
 from osm_nbi.authconn import AuthconnNotFoundException
 
@@ -495,6 +497,24 @@ class Test_UserTopicAuth(TestCase):
             self.assertEqual(rc, {"deleted": 1}, "Wrong user deletion return info")
             self.assertEqual(self.auth.get_user.call_args[0][0], uid, "Wrong user identifier")
             self.assertEqual(self.auth.delete_user.call_args[0][0], uid, "Wrong user identifier")
+            self.assertEqual(self.msg.write.call_args[0], ("admin", "revoke_token", {"user_id": uid}),
+                             "Wrong token revocation message")
+        with self.subTest(i=2):
+            # message bus failure: the user is deleted and its tokens removed from the local cache anyway
+            uid = str(uuid4())
+            BaseTopic.token_cache = LruCache(max_size=10)
+            try:
+                BaseTopic.token_cache.set("token1", {"_id": "token1", "user_id": uid, "username": "other-user-name"})
+                BaseTopic.token_cache.set("token2", {"_id": "token2", "user_id": "other", "username": "other"})
+                self.auth.get_user.return_value = {"_id": uid, "username": "other-user-name",
+                                                   "project_role_mappings": []}
+                self.msg.write.side_effect = msgbase.MsgException("kafka is down")
+                rc = self.topic.delete(self.fake_session, uid)
+                self.assertEqual(rc, {"deleted": 1}, "Wrong user deletion return info")
+                self.assertIsNone(BaseTopic.token_cache.get("token1"), "Tokens of the user must be removed")
+                self.assertIsNotNone(BaseTopic.token_cache.get("token2"), "Other tokens must be kept")
+            finally:
+                BaseTopic.token_cache = None
 
     def test_conflict_on_new(self):
         with self.subTest(i=1):
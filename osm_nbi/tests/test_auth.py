@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from unittest.mock import Mock
+from osm_nbi.auth import Authenticator
+from osm_nbi.authconn import AuthExceptionUnauthorized
+from osm_nbi.metrics import MetricsRegistry
+
+roles = [
+    {"_id": "r1", "name": "system_admin", "permissions": {"default": True, "admin": True}},
+    {"_id": "r2", "name": "project_user", "permissions": {"default": False, "admin": False, "nsds": True,
+                                                          "nsds:id:delete": False, "ns_instances:get": True}},
+    {"_id": "r3", "name": "reader", "permissions": {"default": False, "nsds:get": True, "admin:get": True,
+                                                    "force:get": True}},
+    {"_id": "r4", "name": "anonymous", "permissions": {"default": False, "tokens:post": True}},
+]
+
+
+class Test_Authenticator(unittest.TestCase):
+
+    def setUp(self):
+        self.auth = Authenticator({}, ())
+        self.auth.role_permissions = ["nsds:get", "nsds:post", "nsds:id:get", "nsds:id:delete", "ns_instances:get",
+                                      "tokens:post", "admin:get", "admin:post", "admin:delete", "force:get"]
+        self.auth.backend = Mock()
+        self.auth.backend.get_role_list.return_value = roles
+        self.auth.msg = Mock()
+        self.auth.load_operation_to_allowed_roles()
+
+    def check(self, roles_names, method, role_permission, query_string_operations=None):
+        token_info = {"roles": [{"name": name} for name in roles_names], "username": "user"}
+        return self.auth.check_permissions(token_info, method, role_permission, query_string_operations), \
+            token_info["admin"]
+
+    def test_permission_matrix(self):
+        self.assertEqual(self.auth.operation_to_allowed_roles["nsds:id:get"], ["system_admin", "project_user"])
+        self.assertEqual(self.auth.operation_to_allowed_roles["nsds:id:delete"], ["system_admin"])
+        self.assertEqual(self.auth.operation_to_allowed_roles["admin:get"], ["system_admin", "reader"])
+        self.assertEqual(self.auth.operation_to_allowed_roles["tokens:post"], ["system_admin", "anonymous"])
+
+    def test_check_permissions(self):
+        self.assertEqual(self.check(["project_user"], "GET", "nsds:id:get"), (True, False))
+        self.assertEqual(self.check(["project_user", "reader"], "GET", "nsds:get"), (True, True))
+        self.assertEqual(self.check([], "POST", "tokens:post"), (True, False), "anonymous operation")
+        with self.assertRaisesRegex(AuthExceptionUnauthorized, "lack of permissions"):
+            self.check(["project_user"], "DELETE", "nsds:id:delete")
+        with self.assertRaisesRegex(AuthExceptionUnauthorized, "admin query string"):
+            self.check(["project_user"], "GET", "nsds:get", ["force:get"])
+        # a single role must allow the operation and the query string
+        self.assertEqual(self.check(["project_user", "reader"], "GET", "nsds:get", ["force:get"]), (True, True))
+        with self.assertRaisesRegex(AuthExceptionUnauthorized, "admin query string"):
+            self.check(["project_user", "reader"], "GET", "ns_instances:get", ["force:get"])
+
+    def test_decisions_memoized(self):
+        self.check(["project_user"], "GET", "nsds:id:get")
+        self.check(["project_user"], "GET", "nsds:id:get")
+        self.assertEqual(self.auth.get_permission_decisions_stats()["hits"], 1)
+        roles[1]["permissions"]["nsds:id:get"] = False
+        try:
+            self.auth.reload_roles()
+            with self.assertRaises(AuthExceptionUnauthorized):
+                self.check(["project_user"], "GET", "nsds:id:get")
+        finally:
+            del roles[1]["permissions"]["nsds:id:get"]
+        self.auth.msg.write.assert_called_once_with("admin", "reload_roles", {"sender": self.auth.instance_id})
+
+    def test_tokens_cache_metrics(self):
+        self.auth.tokens_cache.set("token1", {"_id": "token1"})
+        self.auth.tokens_cache.get("token1")
+        self.auth.tokens_cache.get("token2")
+        registry = MetricsRegistry()
+        registry.set_collector("tokens_cache", self.auth.collect_tokens_cache_metrics)
+        text = registry.render()
+        for line in ("osm_nbi_tokens_cache_entries 1", "osm_nbi_tokens_cache_hits_total 1",
+                     "osm_nbi_tokens_cache_misses_total 1"):
+            self.assertIn(line + "\n", text)
+
+    def test_roles_reload_message(self):
+        # own messages are ignored
+        self.auth.backend.reset_mock()
+        self.assertFalse(self.auth.process_roles_reload({"sender": self.auth.instance_id}))
+        self.auth.backend.get_role_list.assert_not_called()
+
+        # roles changed at other NBI instance are read again, not from the backend snapshot
+        roles[1]["permissions"]["nsds:id:get"] = False
+        try:
+            self.assertTrue(self.auth.process_roles_reload({"sender": "other"}))
+            self.auth.backend.invalidate_directory.assert_called_once_with()
+            self.assertEqual(self.auth.backend.method_calls[:2], [("invalidate_directory", (), {}),
+                                                                  ("get_role_list", (), {})])
+            with self.assertRaises(AuthExceptionUnauthorized):
+                self.check(["project_user"], "GET", "nsds:id:get")
+        finally:
+            del roles[1]["permissions"]["nsds:id:get"]
+
+
+if __name__ == '__main__':
+    unittest.main()
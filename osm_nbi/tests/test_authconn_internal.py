@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from unittest.mock import Mock
+from uuid import uuid4
+from osm_common.dbmemory import DbMemory
+from osm_nbi.authconn_internal import AuthconnInternal
+from osm_nbi.cache import LruCache
+
+
+def fill_users(db, users, projects=10, roles=3):
+    """
+    Creates projects, roles and users with a project role mapping in every project
+    :return: list of project _id, list of role _id
+    """
+    project_ids = [str(uuid4()) for _ in range(projects)]
+    role_ids = [str(uuid4()) for _ in range(roles)]
+    for index, pid in enumerate(project_ids):
+        db.create("projects", {"_id": pid, "name": "project{}".format(index)})
+    for index, rid in enumerate(role_ids):
+        db.create("roles", {"_id": rid, "name": "role{}".format(index)})
+    db.create("roles", {"_id": str(uuid4()), "name": "project_admin"})
+    for index in range(users):
+        db.create("users", {"_id": str(uuid4()), "username": "user{}".format(index), "_admin": {"salt": "s"},
+                            "project_role_mappings": [{"project": pid, "role": role_ids[i % roles]}
+                                                      for i, pid in enumerate(project_ids)]})
+    return project_ids, role_ids
+
+
+class Test_AuthconnInternal(unittest.TestCase):
+
+    def setUp(self):
+        self.db = DbMemory()
+        self.db.get_list = Mock(side_effect=self.db.get_list)
+        self.db.get_one = Mock(side_effect=self.db.get_one)
+        self.auth = AuthconnInternal({}, self.db, LruCache())
+        for cache in AuthconnInternal.names_cache.values():
+            cache.clear()
+
+    def test_get_user_list_queries(self):
+        project_ids, role_ids = fill_users(self.db, 50)
+        users = self.auth.get_user_list()
+        self.assertEqual(len(users), 50)
+        self.assertEqual(users[0]["project_role_mappings"][1]["project_name"], "project1")
+        self.assertEqual(users[0]["project_role_mappings"][1]["role_name"], "role1")
+        self.assertEqual(users[0]["projects"], ["project{}".format(i) for i in range(10)])
+        self.assertEqual(self.db.get_list.call_count, 3, "one query for users, projects and roles")
+        self.db.get_one.assert_not_called()
+
+        # projects and roles are cached
+        self.auth.get_user_list()
+        self.assertEqual(self.db.get_list.call_count, 4)
+
+        # changed roles are not cached any more
+        self.auth.update_role({"_id": role_ids[1], "name": "renamed"})
+        users = self.auth.get_user_list()
+        self.assertEqual(users[0]["project_role_mappings"][1]["role_name"], "renamed")
+        self.assertEqual(self.db.get_list.call_count, 6)
+
+    def test_get_user_list_old_projects(self):
+        fill_users(self.db, 0)
+        self.db.create("users", {"_id": str(uuid4()), "username": "old", "projects": ["project1", "project2"]})
+        user = self.auth.get_user_list()[0]
+        self.assertEqual([prm["project_name"] for prm in user["project_role_mappings"]], ["project1", "project2"])
+        self.assertEqual(user["project_role_mappings"][0]["role_name"], "project_admin")
+        self.db.get_one.assert_not_called()
+
+    def test_authenticate_roles(self):
+        project_ids, role_ids = fill_users(self.db, 1, projects=1)
+        prms = self.db.get_one("users", {"username": "user0"})["project_role_mappings"]
+        prms.append({"project": "project0", "role": "role2"})
+        prms.append({"project": project_ids[0], "role": role_ids[0]})
+        self.db.set_one("users", {"username": "user0"}, {"project_role_mappings": prms})
+        self.db.get_list.reset_mock()
+        token = self.auth.authenticate(None, None, token_info={"username": "user0"})
+        self.assertEqual(token["project_name"], "project0")
+        self.assertEqual(token["roles"], [{"name": "role0", "id": role_ids[0]}, {"name": "role2", "id": role_ids[2]}])
+        # roles referenced by _id and by name are obtained with two queries
+        self.assertEqual(len([call for call in self.db.get_list.call_args_list if call[0][0] == "roles"]), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import json
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from time import sleep, time
+from types import SimpleNamespace
+from unittest.mock import patch
+from osm_nbi.auth import Authenticator, invalidate_tokens_cache
+from osm_nbi.authconn import AuthException
+from osm_nbi.authconn_keystone import AuthconnKeystone
+
+valid_token = "valid-token"
+project_ids = ["2d7ef2b3-0c43-4c5a-8f38-ad2dd2cb1a01", "2d7ef2b3-0c43-4c5a-8f38-ad2dd2cb1a02"]
+role_ids = ["9a4a5e0f-2f7e-4b2e-8b0e-1b9e3c1d2e01", "9a4a5e0f-2f7e-4b2e-8b0e-1b9e3c1d2e02"]
+user_ids = ["5c1b6f3e-8d0a-4e4b-9d0c-7f0a1e2b3c01", "5c1b6f3e-8d0a-4e4b-9d0c-7f0a1e2b3c02"]
+directory = {
+    "users": [{"id": user_id, "name": "user{}".format(index), "domain_id": "default", "enabled": True}
+              for index, user_id in enumerate(user_ids)],
+    "projects": [{"id": project_id, "name": "project{}".format(index), "domain_id": "default"}
+                 for index, project_id in enumerate(project_ids)],
+    "roles": [{"id": role_id, "name": "role{}".format(index), "permissions": {"default": True}}
+              for index, role_id in enumerate(role_ids)],
+    "role_assignments": [
+        {"user": {"id": user_ids[0]}, "role": {"id": role_ids[0]}, "scope": {"project": {"id": project_ids[0]}}},
+        {"user": {"id": user_ids[0]}, "role": {"id": role_ids[1]}, "scope": {"project": {"id": project_ids[1]}}},
+        {"user": {"id": user_ids[1]}, "role": {"id": role_ids[1]}, "scope": {"project": {"id": project_ids[0]}}},
+        {"group": {"id": "group"}, "role": {"id": role_ids[1]}, "scope": {"project": {"id": project_ids[1]}}},
+    ],
+}
+
+
+class StubKeystoneHandler(BaseHTTPRequestHandler):
+    """
+    Minimal keystone v3 identity API: service authentication and token validation
+    """
+    validations = []        # tokens validated, in order
+    requests = []           # method and path of the requests, in order
+    validation_delay = 0    # seconds that takes a validation
+
+    def log_message(self, *args):
+        pass
+
+    def _token_body(self, project_name):
+        url = "http://{}:{}/v3".format(*self.server.server_address)
+        return {"token": {
+            "methods": ["password"], "issued_at": "2019-01-01T00:00:00.000000Z",
+            "expires_at": "2099-01-01T00:00:00.000000Z",
+            "user": {"id": "user-id", "name": "user", "domain": {"id": "default", "name": "Default"}},
+            "project": {"id": project_name + "-id", "name": project_name,
+                        "domain": {"id": "default", "name": "Default"}},
+            "roles": [{"id": "role-id", "name": "admin"}],
+            "catalog": [{"id": "identity", "type": "identity", "name": "keystone",
+                         "endpoints": [{"id": interface, "interface": interface, "region": "RegionOne",
+                                        "region_id": "RegionOne", "url": url}
+                                       for interface in ("public", "internal", "admin")]}],
+        }}
+
+    def _send(self, status, body, token=None):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        if token:
+            self.send_header("X-Subject-Token", token)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        path = self.path.partition("?")[0].rstrip("/")
+        self.requests.append(("GET", path))
+        if path == "/v3":
+            self._send(HTTPStatus.OK, {"version": {"id": "v3.10", "status": "stable"}})
+        elif self.path.startswith("/v3/auth/tokens"):
+            token = self.headers.get("X-Subject-Token")
+            self.validations.append(token)
+            sleep(self.validation_delay)
+            if token == valid_token:
+                self._send(HTTPStatus.OK, self._token_body("project"), token=token)
+            else:
+                self._send(HTTPStatus.NOT_FOUND, {"error": {"code": 404, "title": "Not Found",
+                                                            "message": "Could not find token"}})
+        elif path[4:] in directory:
+            self._send(HTTPStatus.OK, {path[4:]: directory[path[4:]], "links": {"self": self.path, "next": None}})
+        else:
+            self._send(HTTPStatus.NOT_FOUND, {"error": {"code": 404, "title": "Not Found", "message": ""}})
+
+    def do_DELETE(self):
+        self.requests.append(("DELETE", self.path))
+        self.send_response(HTTPStatus.NO_CONTENT)
+        self.end_headers()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        if self.path.startswith("/v3/auth/tokens"):
+            self._send(HTTPStatus.CREATED, self._token_body("service"), token="service-token")
+        else:
+            self._send(HTTPStatus.NOT_FOUND, {"error": {"code": 404, "title": "Not Found", "message": ""}})
+
+
+class Test_AuthconnKeystone(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubKeystoneHandler)
+        cls.server.daemon_threads = True
+        Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        StubKeystoneHandler.validations = []
+        StubKeystoneHandler.requests = []
+        StubKeystoneHandler.validation_delay = 0
+        config = {"auth_url": self.server.server_address[0], "auth_port": self.server.server_address[1]}
+        self.auth = AuthconnKeystone(config, None, None)
+
+    def test_validate_token_cached(self):
+        token_info = self.auth.validate_token(valid_token)
+        self.assertEqual(token_info["_id"], valid_token)
+        self.assertEqual(token_info["project_name"], "project")
+        self.assertTrue(self.auth.is_token_cached(valid_token))
+        self.assertEqual(self.auth.validate_token(valid_token), token_info)
+        self.assertEqual(StubKeystoneHandler.validations, [valid_token], "Validated token must be cached")
+
+    def test_invalid_token_cached(self):
+        for _ in range(3):
+            with self.assertRaises(AuthException) as e:
+                self.auth.validate_token("invalid-token")
+            self.assertEqual(e.exception.http_code, HTTPStatus.UNAUTHORIZED)
+        self.assertEqual(StubKeystoneHandler.validations, ["invalid-token"], "Invalid token must be cached")
+
+    def test_concurrent_validations(self):
+        StubKeystoneHandler.validation_delay = 0.5
+        results = []
+        threads = [Thread(target=lambda: results.append(self.auth.validate_token(valid_token))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(results), 5)
+        self.assertEqual(StubKeystoneHandler.validations, [valid_token],
+                         "Concurrent validations must be done with one request")
+
+    def test_concurrent_permissions(self):
+        # the token_info obtained is modified with the permissions of each request; it must not be shared
+        token_info_keystone = {"_id": valid_token, "expires": 4070908800, "roles": [{"name": "admin", "id": "id"}]}
+
+        def _validate_token_keystone(token):
+            sleep(0.2)
+            return dict(token_info_keystone, roles=[dict(role) for role in token_info_keystone["roles"]])
+
+        def _validate(admin):
+            token_info = self.auth.validate_token(valid_token)
+            token_info["admin"] = admin
+            token_info["allow_show_user_project_role"] = admin
+            sleep(0.1)
+            results[admin] = (token_info["admin"], token_info["allow_show_user_project_role"])
+
+        results = {}
+        with patch.object(self.auth, "_validate_token_keystone", side_effect=_validate_token_keystone) as validate:
+            threads = [Thread(target=_validate, args=(admin,)) for admin in (True, False)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(5)
+            self.assertEqual(validate.call_count, 1, "Concurrent validations must be done with one request")
+            self.assertEqual(results, {True: (True, True), False: (False, False)})
+            token_info = self.auth.validate_token(valid_token)
+        self.assertNotIn("admin", token_info, "Cached token_info must not be modified by the callers")
+        token_info["roles"].append({"name": "other"})
+        self.assertEqual(len(self.auth.validate_token(valid_token)["roles"]), 1)
+
+    def test_login_then_authorize(self):
+        # the login information cached by the authenticator has no roles; it is not taken as a validation
+        authenticator = Authenticator({}, {})
+        authenticator.backend = AuthconnKeystone(self.auth.config, None, authenticator.tokens_cache)
+        login_info = {"_id": valid_token, "id": valid_token, "username": "user", "project_id": "project-id",
+                      "project_name": "project", "expires": time() + 3600}
+        remote = SimpleNamespace(name=None, ip="127.0.0.1", port=5000)
+        with patch.object(authenticator.backend, "authenticate", return_value=login_info):
+            authenticator.new_token(None, {"username": "user", "password": "password"}, remote)
+        self.assertFalse(authenticator.is_token_cached(valid_token))
+        token_info = authenticator.authorize_token(valid_token, "GET")
+        self.assertEqual(token_info["roles"], [{"id": "role-id", "name": "admin"}])
+        self.assertEqual(authenticator.authorize_token(valid_token, "GET")["roles"], token_info["roles"])
+        self.assertEqual(StubKeystoneHandler.validations, [valid_token])
+        self.assertEqual(authenticator.tokens_cache.peek(valid_token)["remote_host"], "127.0.0.1",
+                         "login information must be kept for the token list")
+
+        # a revoked token is validated again
+        invalidate_tokens_cache(authenticator.tokens_cache, {"_id": valid_token})
+        self.assertFalse(authenticator.is_token_cached(valid_token))
+        authenticator.authorize_token(valid_token, "GET")
+        self.assertEqual(StubKeystoneHandler.validations, [valid_token, valid_token])
+
+    def test_max_age(self):
+        self.auth.token_cache_max_age = 0
+        self.auth.validate_token(valid_token)
+        sleep(0.01)
+        self.auth.validate_token(valid_token)
+        self.assertEqual(len(StubKeystoneHandler.validations), 2)
+
+    def directory_requests(self):
+        return [path for method, path in StubKeystoneHandler.requests if method == "GET" and
+                path in ("/v3/users", "/v3/projects", "/v3/roles", "/v3/role_assignments")]
+
+    def test_directory_cache(self):
+        users = self.auth.get_user_list()
+        self.assertEqual([user["username"] for user in users], ["user0", "user1"])
+        self.assertEqual(users[0]["projects"], ["project0", "project1"])
+        self.assertEqual(users[0]["project_role_mappings"][1], {"project": project_ids[1], "project_name": "project1",
+                                                                "role": role_ids[1], "role_name": "role1"})
+        self.assertEqual(users[1]["project_role_mappings"], [{"project": project_ids[0], "project_name": "project0",
+                                                              "role": role_ids[1], "role_name": "role1"}])
+        self.assertEqual(len(self.directory_requests()), 4, "directory must be read with four bulk requests")
+
+        # all the reads are served from memory
+        self.assertEqual(self.auth.get_user_list({"username": "user1"})[0]["_id"], user_ids[1])
+        self.assertEqual(self.auth.get_project(project_ids[1])["name"], "project1")
+        self.assertEqual(self.auth.get_role_list({"name": "role0"})[0]["_id"], role_ids[0])
+        self.assertEqual(self.auth.get_role(role_ids[1])["permissions"], {"default": True})
+        self.assertEqual(len(self.directory_requests()), 4)
+
+        # a change forces a new reading
+        self.auth.delete_user(user_ids[1])
+        self.auth.get_user_list()
+        self.assertEqual(len(self.directory_requests()), 8)
+
+        # directory expiration
+        self.auth._directory["expires"] = 0
+        self.auth.get_project_list()
+        self.assertEqual(len(self.directory_requests()), 12)
+
+        # a change at other NBI instance, e.g. notified with a roles reload, forces a new reading
+        self.auth.invalidate_directory()
+        self.auth.get_role_list()
+        self.assertEqual(len(self.directory_requests()), 16)
+
+
+if __name__ == '__main__':
+    unittest.main()
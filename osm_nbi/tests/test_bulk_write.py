@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from http import HTTPStatus
+from unittest.mock import Mock, MagicMock
+from osm_common.dbbase import DbException
+from osm_common.dbmemory import DbMemory
+from osm_common.dbmongo import DbMongo
+from osm_nbi.backend_metrics import BackendMetrics
+from osm_nbi.base_topic import BaseTopic, bulk_create, bulk_set, extend_db
+from osm_nbi.metrics import MetricsRegistry
+
+
+class VnfrTestTopic(BaseTopic):
+    topic = "vnfrs"
+    topic_msg = "vnfr"
+
+
+def get_mongo_mock():
+    db = Mock(spec=DbMongo)
+    del db.create_list     # force the native insert_many
+    db.db = MagicMock()
+    return db, db.db.__getitem__.return_value
+
+
+class Test_BulkWrite(unittest.TestCase):
+
+    def setUp(self):
+        self.db = DbMemory()
+        self.topic = VnfrTestTopic(self.db, None, None, None)
+        self.vnfrs = [{"_id": "vnfr{}".format(index), "vim-account-id": None} for index in range(3)]
+
+    def test_generic_driver(self):
+        rollback = []
+        self.assertEqual(self.topic._create_list(rollback, self.vnfrs), ["vnfr0", "vnfr1", "vnfr2"])
+        self.topic._set_list(rollback, [("vnfr0", {"vim-account-id": "vim1"}, {"vim-account-id": None}),
+                                        ("vnfr1", {}, {}),
+                                        ("vnfr2", {"vim-account-id": "vim2"}, {"vim-account-id": None})])
+        self.assertEqual([vnfr["vim-account-id"] for vnfr in self.db.get_list("vnfrs")], ["vim1", None, "vim2"])
+        self.assertEqual(rollback, [
+            {"topic": "vnfrs", "_ids": ["vnfr0", "vnfr1", "vnfr2"]},
+            {"topic": "vnfrs", "operation": "set_list",
+             "contents": [("vnfr0", {"vim-account-id": None}), ("vnfr2", {"vim-account-id": None})]},
+        ])
+        with self.assertRaises(DbException):
+            bulk_set(self.db, "vnfrs", [("vnfr4", {"vim-account-id": "vim1"})])
+        self.assertEqual(bulk_set(self.db, "vnfrs", [("vnfr4", {"vim-account-id": "vim1"})], fail_on_empty=False),
+                         1)
+
+    def test_mongo_driver(self):
+        db, collection = get_mongo_mock()
+        self.assertEqual(bulk_create(db, "vnfrs", self.vnfrs), ["vnfr0", "vnfr1", "vnfr2"])
+        collection.insert_many.assert_called_once_with(self.vnfrs, ordered=True)
+        db.create.assert_not_called()
+
+        collection.bulk_write.return_value.matched_count = 2
+        self.assertEqual(bulk_set(db, "vnfrs", [("vnfr0", {"vim-account-id": "vim1"}), ("vnfr1", {}),
+                                                ("vnfr2", {"vim-account-id": "vim2"})]), 2)
+        self.assertEqual(collection.bulk_write.call_count, 1)
+        self.assertEqual(len(collection.bulk_write.call_args[0][0]), 2, "empty updates must be skipped")
+        db.set_one.assert_not_called()
+
+        collection.bulk_write.return_value.matched_count = 1
+        with self.assertRaises(DbException) as e:
+            bulk_set(db, "vnfrs", [("vnfr0", {"vim-account-id": "vim1"}), ("vnfr4", {"vim-account-id": "vim1"})])
+        self.assertEqual(e.exception.http_code, HTTPStatus.NOT_FOUND)
+
+        collection.insert_many.side_effect = Exception("duplicate key")
+        with self.assertRaises(DbException) as e:
+            bulk_create(db, "vnfrs", self.vnfrs)
+        self.assertEqual(e.exception.http_code, HTTPStatus.INTERNAL_SERVER_ERROR)
+
+    def test_mongo_list_projected(self):
+        db, collection = get_mongo_mock()
+        db._format_filter.side_effect = lambda q_filter: q_filter
+        extend_db(db)
+        backend_metrics = BackendMetrics(MetricsRegistry())
+        backend_metrics.attach_db(db)
+        topic = VnfrTestTopic(db, None, None, None)
+        collection.find.return_value.sort.return_value.limit.return_value = iter(self.vnfrs[:2])
+        content = topic._get_list_from_db({"_id.gt": "vnfr"}, projection={"name": 0}, limit=2)
+        self.assertEqual(content, self.vnfrs[:2])
+        collection.find.assert_called_once_with({"_id.gt": "vnfr"}, {"name": 0})
+        collection.find.return_value.sort.assert_called_once_with("_id", 1)
+        collection.find.return_value.sort.return_value.limit.assert_called_once_with(2)
+        self.assertEqual(backend_metrics.requests.get(("db", "get_list_projected", "vnfrs", "_id")), 1,
+                         "native query must be done through the instrumented database method")
+        self.assertIsNone(backend_metrics.requests.get(("db", "get_list", "vnfrs", "_id")))
+
+        collection.find.side_effect = Exception("connection lost")
+        with self.assertRaises(DbException) as e:
+            topic._get_list_from_db({}, projection={"name": 0})
+        self.assertEqual(e.exception.http_code, HTTPStatus.INTERNAL_SERVER_ERROR)
+        self.assertEqual(backend_metrics.errors.get(("db", "get_list_projected", "vnfrs", "")), 1)
+
+        # other drivers load the list and apply the projection and limit in memory
+        extend_db(self.db)
+        self.assertFalse(hasattr(self.db, "get_list_projected"))
+
+    def test_rollback(self):
+        from osm_nbi.engine import Engine
+        engine = Mock(db=self.db, quota_ledger=Mock())
+        self.db.create("vnfrs", {"_id": "vnfr9", "vim-account-id": "vim1"})
+        rollback = []
+        self.topic._create_list(rollback, self.vnfrs)
+        rollback.append({"topic": "nsrs", "_id": "nsr1", "quota_projects": ["p1"]})
+        with self.assertRaises(DbException):   # partially updated
+            self.topic._set_list(rollback, [("vnfr9", {"vim-account-id": "vim2"}, {"vim-account-id": "vim1"}),
+                                            ("vnfr8", {"vim-account-id": "vim2"}, {"vim-account-id": None})])
+        self.assertEqual(self.db.get_one("vnfrs", {"_id": "vnfr9"})["vim-account-id"], "vim2")
+        self.assertEqual(Engine.rollback(engine, rollback), [])
+        self.assertEqual(self.db.get_list("vnfrs"), [{"_id": "vnfr9", "vim-account-id": "vim1"}])
+        engine.quota_ledger.add.assert_called_once_with("nsrs", ["p1"], -1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from time import time
+from osm_nbi.cache import LruCache
+
+
+class Test_LruCache(unittest.TestCase):
+
+    def test_lru(self):
+        cache = LruCache(max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)   # "b" is the least recently used
+        self.assertNotIn("b", cache)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.get_stats(), {"size": 2, "max_size": 2, "hits": 2, "misses": 1})
+        self.assertEqual(cache.pop("a"), 1)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_expiration(self):
+        cache = LruCache()
+        now = time()
+        cache.set("expired", {"user_id": "u1"}, expires=now - 1)
+        cache.set("valid", {"user_id": "u1"}, expires=now + 60)
+        cache.set("other", {"user_id": "u2"})
+        self.assertIsNone(cache.peek("expired"))
+        self.assertIsNone(cache.get("expired"))
+        self.assertNotIn("expired", cache, "Expired entry must be removed on lookup")
+        self.assertEqual(cache.get("valid"), {"user_id": "u1"})
+        cache.set("expired", {"user_id": "u2"}, expires=now - 1)
+        self.assertCountEqual(cache.values(), [{"user_id": "u1"}, {"user_id": "u2"}])
+        self.assertEqual(cache.prune(), 1)
+        self.assertEqual(cache.pop_if(lambda value: value["user_id"] == "u1"), 1)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get_stats()["misses"], 1, "peek must not change the statistics")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from unittest.mock import Mock, MagicMock
+from osm_common.dbmemory import DbMemory
+from osm_common.dbmongo import DbMongo
+from osm_nbi.db_indexes import get_filter_fields, is_covered, ensure_indexes, IndexAdvisor
+from osm_nbi.descriptor_topics import NsdTopic, PduTopic
+from osm_nbi.instance_topics import VnfrTopic, NsLcmOpTopic, NsiLcmOpTopic
+
+catalogue = {
+    "vnfrs": (("_admin.projects_read",), ("nsr-id-ref",)),
+    "pdus": (("type", "vim_accounts", "_admin.usageState"),),
+}
+
+
+class Test_DbIndexes(unittest.TestCase):
+
+    def test_filter_fields(self):
+        self.assertEqual(get_filter_fields(None), ())
+        self.assertEqual(get_filter_fields({"_admin.projects_read.cont": ["p1"], "id": "x", "_id.neq": "y"}),
+                         ("_admin.projects_read", "_id", "id"))
+        self.assertEqual(get_filter_fields({"constituent-vnfd.ANYINDEX.vnfd-id-ref": "x", "vdur.0.name": "y"}),
+                         ("constituent-vnfd.vnfd-id-ref", "vdur.name"))
+        self.assertEqual(get_filter_fields({"gt": 1}), ("gt",))
+
+    def test_covered(self):
+        self.assertTrue(is_covered(("nsr-id-ref", "member-vnf-index-ref"), catalogue["vnfrs"]))
+        self.assertTrue(is_covered(("_id", "name"), ()))
+        self.assertTrue(is_covered((), ()))
+        self.assertTrue(is_covered(("_admin.usageState", "type"), catalogue["pdus"]))
+        self.assertFalse(is_covered(("_admin.usageState", "vim_accounts"), catalogue["pdus"]),
+                         "leading field of the index is needed")
+        # the project filter index only covers the plain listings of a project
+        self.assertTrue(is_covered(("_admin.projects_read",), catalogue["vnfrs"]))
+        self.assertTrue(is_covered(("_admin.projects_read", "nsr-id-ref"), catalogue["vnfrs"]))
+        self.assertFalse(is_covered(("_admin.projects_read", "vdur.pdu-id"), catalogue["vnfrs"]))
+        self.assertFalse(is_covered(("_admin.projects_read", "_admin.projects_write", "vim-account-id"),
+                                    catalogue["vnfrs"]))
+        self.assertFalse(is_covered(("_admin.projects_read",), catalogue["pdus"]))
+
+    def test_ensure_indexes(self):
+        self.assertEqual(ensure_indexes(DbMemory(), catalogue), 0)
+        db = Mock(spec=DbMongo)
+        db.db = MagicMock()
+        self.assertEqual(ensure_indexes(db, catalogue), 3)
+        db.db["pdus"].create_index.assert_called_with([("type", 1), ("vim_accounts", 1), ("_admin.usageState", 1)],
+                                                      background=True)
+
+    def test_advisor(self):
+        db = DbMemory()
+        advisor = IndexAdvisor(catalogue)
+        advisor.attach(db)
+        db.create("vnfrs", {"_id": "vnfr1", "nsr-id-ref": "nsr1", "vim-account-id": "vim1"})
+        self.assertEqual(len(db.get_list("vnfrs", {"nsr-id-ref": "nsr1"})), 1)
+        db.get_list("vnfrs", {"vim-account-id": "vim1"})
+        db.get_list("vnfrs", {"vim-account-id": "vim2"})
+        db.get_one("vnfrs", {"_id": "vnfr1"})
+        self.assertEqual(advisor.get_report(), [{"collection": "vnfrs", "fields": ["vim-account-id"], "queries": 2,
+                                                 "covered": False}])
+        self.assertEqual(len(advisor.get_report(uncovered_only=False)), 3)
+
+        # project filtered queries are reported by the other fields they compare
+        advisor = IndexAdvisor({"vnfrs": (("_admin.projects_read",),),
+                                "pdus": (("_admin.projects_read",), ("name",))})
+        advisor.attach(db)
+        project_filter = {"_admin.projects_read.cont": ["p1", "ANY"]}
+        db.get_list("vnfrs", project_filter)
+        db.get_list("vnfrs", dict(project_filter, **{"nsr-id-ref": "nsr1"}))
+        db.get_list("vnfrs", dict(project_filter, **{"vdur.pdu-id": "pdu1"}))
+        db.get_list("pdus", dict(project_filter, **{"type": "t", "_admin.usageState": "NOT_IN_USE"}))
+        self.assertEqual(sorted((shape["collection"], shape["fields"]) for shape in advisor.get_report()), [
+            ("pdus", ["_admin.projects_read", "_admin.usageState", "type"]),
+            ("vnfrs", ["_admin.projects_read", "nsr-id-ref"]),
+            ("vnfrs", ["_admin.projects_read", "vdur.pdu-id"]),
+        ])
+
+    def test_topic_catalogue(self):
+        # common filters of NBI are covered by the topic indexes
+        shapes = (
+            (VnfrTopic, {"_admin.projects_read.cont": ["p1"], "nsr-id-ref": "nsr1"}),
+            (VnfrTopic, {"_admin.projects_read.cont": ["p1"], "vdur.pdu-id": "pdu1"}),
+            (VnfrTopic, {"vdur.pdu-id": "pdu1"}),
+            (NsLcmOpTopic, {"nsInstanceId": "nsr1"}),
+            (NsiLcmOpTopic, {"netsliceInstanceId": "nsi1"}),
+            (NsdTopic, {"constituent-vnfd.ANYINDEX.vnfd-id-ref": "vnfd"}),
+            (NsdTopic, {"id": "nsd"}),
+            (PduTopic, {"vim_accounts": "vim1", "type": "t", "_admin.operationalState": "ENABLED",
+                        "_admin.usageState": "NOT_IN_USE"}),
+        )
+        for topic_class, q_filter in shapes:
+            self.assertTrue(is_covered(get_filter_fields(q_filter), topic_class.db_indexes),
+                            "{} {}".format(topic_class.topic, q_filter))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from http import HTTPStatus
+from unittest.mock import Mock
+from osm_common.dbbase import DbException
+from osm_common.dbmemory import DbMemory
+from osm_nbi.base_topic import BaseTopic, get_descriptor
+from osm_nbi.descriptor_cache import DescriptorCache, match_project_filter
+
+
+class VnfdTestTopic(BaseTopic):
+    topic = "vnfds"
+    topic_msg = "vnfd"
+
+
+def get_vnfd(_id, projects):
+    return {"_id": _id, "id": "vnfd-" + _id, "vdu": [{"id": "vdu1"}],
+            "_admin": {"projects_read": projects, "projects_write": projects, "modified": 1.0}}
+
+
+class Test_DescriptorCache(unittest.TestCase):
+
+    def setUp(self):
+        self.db = DbMemory()
+        self.db.create("vnfds", get_vnfd("vnfd1", ["p1"]))
+        self.db.create("vnfds", get_vnfd("vnfd2", ["ANY"]))
+        self.db.get_one = Mock(wraps=self.db.get_one)
+        self.cache = DescriptorCache(self.db, max_size=8)
+        BaseTopic.descriptor_cache = self.cache
+
+    def tearDown(self):
+        BaseTopic.descriptor_cache = None
+
+    def test_read_through(self):
+        vnfd = get_descriptor(self.db, "vnfds", "vnfd1")
+        vnfd["vdu"].append({"id": "vdu2"})   # copies can be modified
+        for _ in range(3):
+            self.assertEqual(len(get_descriptor(self.db, "vnfds", "vnfd1")["vdu"]), 1)
+        self.assertEqual(self.db.get_one.call_count, 1)
+        self.assertEqual(self.cache.get_stats()["hits"], 3)
+
+        with self.assertRaises(DbException) as e:
+            get_descriptor(self.db, "vnfds", "vnfd9")
+        self.assertEqual(e.exception.http_code, HTTPStatus.NOT_FOUND)
+        self.assertIsNone(get_descriptor(self.db, "vnfds", "vnfd9", fail_on_empty=False))
+
+        # not cached topics are read from database
+        self.db.create("vnfrs", {"_id": "vnfr1"})
+        get_descriptor(self.db, "vnfrs", "vnfr1")
+        get_descriptor(self.db, "vnfrs", "vnfr1")
+        self.assertEqual(len(self.cache.cache), 1)
+
+    def test_project_filter(self):
+        p1_filter = BaseTopic._get_project_filter({"project_id": ["p1"], "method": "write", "public": None})
+        p2_filter = BaseTopic._get_project_filter({"project_id": ["p2"], "method": "list", "public": False})
+        self.assertEqual(get_descriptor(self.db, "vnfds", "vnfd1", p1_filter)["_id"], "vnfd1")
+        with self.assertRaises(DbException):
+            get_descriptor(self.db, "vnfds", "vnfd1", p2_filter)
+        self.assertIsNone(get_descriptor(self.db, "vnfds", "vnfd2", p2_filter, fail_on_empty=False),
+                          "public ones excluded")
+        # same result as database
+        for vnfd in self.db.get_list("vnfds"):
+            for project_filter in (p1_filter, p2_filter):
+                self.assertEqual(match_project_filter(vnfd, project_filter),
+                                 bool(self.db.get_list("vnfds", dict(project_filter, _id=vnfd["_id"]))))
+
+    def test_invalidation(self):
+        topic = VnfdTestTopic(self.db, None, Mock(), None)
+        session = {"project_id": ["p1"], "set_project": None, "method": "write", "public": None, "force": False,
+                   "admin": False}
+        get_descriptor(self.db, "vnfds", "vnfd1")
+        topic.edit(session, "vnfd1", {"description": "new"}, content=self.db.get_one("vnfds", {"_id": "vnfd1"}))
+        self.assertEqual(get_descriptor(self.db, "vnfds", "vnfd1")["description"], "new")
+
+        # edited at other NBI instance
+        self.db.set_one("vnfds", {"_id": "vnfd1"}, {"description": "newer"})
+        self.assertTrue(self.cache.process_msg("vnfd", "edited", {"_id": "vnfd1"}))
+        self.assertEqual(get_descriptor(self.db, "vnfds", "vnfd1")["description"], "newer")
+        self.assertFalse(self.cache.process_msg("ns", "terminated", {"nsr_id": "vnfd1"}))
+
+        get_descriptor(self.db, "vnfds", "vnfd2")
+        self.cache.process_msg("vnfd", "deleted", {"_id": "vnfd2"})
+        self.assertNotIn(("vnfds", "vnfd2"), self.cache.cache)
+
+        # removed from one of the projects at other NBI instance
+        msg = Mock()
+        other_topic = VnfdTestTopic(self.db, None, msg, None)
+        self.db.set_one("vnfds", {"_id": "vnfd1"},
+                        {"_admin.projects_read": ["p1", "p2"], "_admin.projects_write": ["p1", "p2"]})
+        self.cache.invalidate("vnfds", "vnfd1")
+        p2_filter = BaseTopic._get_project_filter({"project_id": ["p2"], "method": "list", "public": False})
+        self.assertEqual(get_descriptor(self.db, "vnfds", "vnfd1", p2_filter)["_id"], "vnfd1")
+        other_cache = DescriptorCache(self.db, max_size=8)
+        BaseTopic.descriptor_cache = other_cache
+        other_topic.delete(dict(session, project_id=["p2"]), "vnfd1")
+        BaseTopic.descriptor_cache = self.cache
+        msg.write.assert_called_once_with("vnfd", "edited", {"_id": "vnfd1"})
+        self.cache.process_msg(*msg.write.call_args[0])
+        with self.assertRaises(DbException):
+            get_descriptor(self.db, "vnfds", "vnfd1", p2_filter)
+        self.assertEqual(get_descriptor(self.db, "vnfds", "vnfd1")["_admin"]["projects_read"], ["p1"])
+
+        # a descriptor read before an edition is not stored
+        def edited_while_reading(*args, **kwargs):
+            content = DbMemory.get_one(self.db, *args, **kwargs)
+            self.cache.invalidate("vnfds", "vnfd2")
+            return content
+        self.db.get_one = edited_while_reading
+        get_descriptor(self.db, "vnfds", "vnfd2")
+        self.assertNotIn(("vnfds", "vnfd2"), self.cache.cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
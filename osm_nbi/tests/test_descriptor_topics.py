@@ -27,7 +27,7 @@ from time import time
 from osm_common import dbbase, fsbase, msgbase
 from osm_nbi import authconn
 from osm_nbi.tests.test_pkg_descriptors import db_vnfds_text, db_nsds_text
-from osm_nbi.descriptor_topics import VnfdTopic, NsdTopic
+from osm_nbi.descriptor_topics import VnfdTopic, NsdTopic, VnfdSymbolTable, PackageFolders
 from osm_nbi.engine import EngineException
 from osm_common.dbbase import DbException
 import yaml
@@ -440,6 +440,23 @@ class Test_VnfdTopic(TestCase):
             self.assertIn("'vnfd' must be a list of only one element", norm(str(e.exception)), "Wrong exception text")
         return
 
+    def test_pyangbind_validation_cache(self):
+        self.topic.pyangbind_cache.clear()
+        content = deepcopy(db_vnfd_content)
+        content.pop("_id")
+        content.pop("_admin")
+        hits = self.topic.pyangbind_cache.hits
+        out1 = self.topic.pyangbind_validation("vnfds", content)
+        out2 = self.topic.pyangbind_validation("vnfds", deepcopy(content))
+        self.assertEqual(self.topic.pyangbind_cache.hits, hits + 1, "Identical descriptor must be cached")
+        self.assertEqual(out1, out2, "Cached validation differs")
+        out2["name"] = "modified-name"
+        out3 = self.topic.pyangbind_validation("vnfds", content)
+        self.assertEqual(out3["name"], out1["name"], "Cached content must not be modified by callers")
+        self.topic.pyangbind_validation("vnfds", content, force=True)
+        self.assertEqual(self.topic.pyangbind_cache.hits, hits + 2, "Force flag must be part of the cache key")
+        self.assertEqual(len(self.topic.pyangbind_cache), 2)
+
     def test_delete_vnfd(self):
         did = db_vnfd_content["_id"]
         self.db.get_one.return_value = db_vnfd_content
@@ -812,5 +829,31 @@ class Test_NsdTopic(TestCase):
         return
 
 
+class Test_VnfdSymbolTable(TestCase):
+
+    def test_symbols(self):
+        symbols = VnfdSymbolTable(db_vnfd_content)
+        self.assertEqual(set(symbols.cps), {cp["name"] for cp in db_vnfd_content["connection-point"]})
+        self.assertEqual(set(symbols.vdus), {vdu["id"] for vdu in db_vnfd_content["vdu"]})
+        for vdu in db_vnfd_content["vdu"]:
+            for internal_cp in vdu.get("internal-connection-point", ()):
+                self.assertEqual(symbols.icps[internal_cp["id"]], vdu["id"])
+            for metric in vdu.get("vdu-configuration", {}).get("metrics", ()):
+                self.assertIn((vdu["id"], metric["name"]), symbols.vdu_metrics)
+        self.assertEqual(set(symbols.monitoring_params), {mp["id"] for mp in db_vnfd_content["monitoring-param"]})
+
+    def test_package_folders(self):
+        fs = Mock(fsbase.FsBase())
+        fs.file_exists.return_value = True
+        fs.dir_ls.return_value = ["charm"]
+        package_folders = PackageFolders(fs, {"folder": "vnfd-id", "pkg-dir": "pkg"})
+        for _ in range(3):
+            self.assertTrue(package_folders.has_content("charms"))
+            self.assertTrue(package_folders.has_file("cloud_init", "cloud-config.txt"))
+        fs.dir_ls.assert_called_once_with("vnfd-id_/pkg/charms")
+        self.assertEqual(fs.file_exists.call_count, 3, "base folder, charms folder and cloud-init file, once each")
+        self.assertFalse(PackageFolders(fs, {"folder": "vnfd-id"}).has_content("charms"))
+
+
 if __name__ == '__main__':
     unittest.main()
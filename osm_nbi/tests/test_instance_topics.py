@@ -24,6 +24,7 @@ from osm_common.fsbase import FsBase
 from osm_common.msgbase import MsgBase
 from http import HTTPStatus
 from osm_nbi.instance_topics import NsLcmOpTopic, NsrTopic
+from osm_nbi.base_topic import ReferenceResolver
 from osm_nbi.tests.test_db_descriptors import db_vim_accounts_text, db_nsds_text, db_vnfds_text, db_nsrs_text,\
     db_vnfrs_text
 from copy import deepcopy
@@ -96,8 +97,11 @@ class TestNsLcmOpTopic(unittest.TestCase):
         self.assertTrue(created_nslcmop["lcmOperationType"] == "instantiate",
                         "Database record must contain 'lcmOperationType=instantiate'")
 
-        self.assertEqual(len(rollback), len(self.db.set_one.call_args_list) + 1,
-                         "rollback mismatch with created/set items at database")
+        vnfrs = self.db.get_list("vnfrs", {"nsr-id-ref": self.nsr_id})
+        self.assertEqual(self.db.set_one.call_count, len(vnfrs), "vnfrs must be updated at database")
+        self.assertEqual(len(rollback), 2, "a single rollback entry must cover all the vnfrs updated at database")
+        self.assertEqual(rollback[0]["operation"], "set_list")
+        self.assertEqual([_id for _id, _ in rollback[0]["contents"]], [vnfr["_id"] for vnfr in vnfrs])
 
         # test parameters with error
         bad_id = "88d90b0c-faff-4b9f-bccd-aaaaaaaaaaaa"
@@ -176,6 +180,7 @@ class TestNsrTopic(unittest.TestCase):
         }
         rollback = []
         headers = {}
+        self.db.create_list = Mock(side_effect=lambda table, contents: [content["_id"] for content in contents])
 
         self.nsr_topic.new(rollback, session, indata=indata, kwargs=None, headers=headers)
 
@@ -183,10 +188,11 @@ class TestNsrTopic(unittest.TestCase):
         created_vnfrs = []
         created_nsrs = []
         nsr_id = None
-        for _call in self.db.create.call_args_list:
-            assert len(_call[0]) >= 2, "called db.create with few parameters"
-            created_item = _call[0][1]
-            if _call[0][0] == "vnfrs":
+        self.assertEqual(self.db.create_list.call_count, 1, "vnfrs must be created at database at once")
+        created_items = [(_call[0][0], _call[0][1]) for _call in self.db.create.call_args_list]
+        created_items += [("vnfrs", vnfr) for vnfr in self.db.create_list.call_args[0][1]]
+        for table, created_item in created_items:
+            if table == "vnfrs":
                 created_vnfrs.append(created_item)
                 self.assertIn("member-vnf-index-ref", created_item,
                               "Created item must contain member-vnf-index-ref section")
@@ -195,14 +201,14 @@ class TestNsrTopic(unittest.TestCase):
                 else:
                     nsr_id = created_item["nsr-id-ref"]
 
-            elif _call[0][0] == "nsrs":
+            elif table == "nsrs":
                 created_nsrs.append(created_item)
                 if nsr_id:
                     self.assertEqual(nsr_id, created_item["_id"], "bad reference id from vnfr to nsr")
                 else:
                     nsr_id = created_item["_id"]
             else:
-                assert True, "created an unknown record {} at database".format(_call[0][0])
+                assert True, "created an unknown record {} at database".format(table)
 
             self.assertTrue(created_item["_admin"].get("projects_read"),
                             "Database record must contain '_amdin.projects_read'")
@@ -213,7 +219,9 @@ class TestNsrTopic(unittest.TestCase):
         self.assertEqual(len(created_vnfrs), len(self.nsd["constituent-vnfd"]),
                          "created a mismatch number of vnfr at database")
         self.assertEqual(len(created_nsrs), 1, "Only one nsrs must be created at database")
-        self.assertEqual(len(rollback), len(created_vnfrs) + 1, "rollback mismatch with created items at database")
+        self.assertEqual(len(rollback), 2, "rollback mismatch with created items at database")
+        self.assertEqual(rollback[0]["_ids"], [vnfr["_id"] for vnfr in created_vnfrs],
+                         "a single rollback entry must cover all the vnfrs")
 
         # test parameters with error
         bad_id = "88d90b0c-faff-4b9f-bccd-aaaaaaaaaaaa"
@@ -233,3 +241,106 @@ class TestNsrTopic(unittest.TestCase):
                 for expect_text in expect_text_list:
                     self.assertIn(expect_text, str(e.exception).lower(),
                                   "Expected '{}' at exception text".format(expect_text))
+
+    def test_create_shared_resolver(self):
+        # as done by NetSlice instances, the descriptors are fetched once for all the nsrs created
+        session = {"force": False, "admin": False, "public": False, "project_id": [self.nsd_project], "method": "write"}
+        indata = {"nsdId": self.nsd_id, "nsName": "name", "vimAccountId": self.vim_id,
+                  "additionalParamsForVnf": [{"member-vnf-index": "1", "additionalParams": {"touch_filename": "file"}},
+                                             {"member-vnf-index": "2", "additionalParams": {"touch_filename": "file"}}]}
+        self.db.create_list = Mock(side_effect=lambda table, contents: [content["_id"] for content in contents])
+        self.db.get_list = Mock(wraps=self.db.get_list)
+        self.db.get_one = Mock(wraps=self.db.get_one)
+        resolver = ReferenceResolver(self.db, session)
+        for _ in range(3):
+            self.nsr_topic.new([], session, indata=deepcopy(indata), kwargs=None, headers={}, resolver=resolver)
+        tables = [_call[0][0] for _call in self.db.get_list.call_args_list + self.db.get_one.call_args_list]
+        self.assertEqual(tables.count("nsds"), 1)
+        self.assertEqual(tables.count("vnfds"), 1)
+        self.assertIn("_admin", resolver.get_one("vnfds", self.nsd["constituent-vnfd"][0]["vnfd-id-ref"]),
+                      "shared descriptors must not be modified")
+
+    def test_create_vdurs(self):
+        session = {"force": False, "admin": False, "public": False, "project_id": [self.nsd_project], "method": "write"}
+        indata = {
+            "nsdId": self.nsd_id,
+            "nsName": "name",
+            "vimAccountId": self.vim_id,
+            "additionalParamsForVnf": [{"member-vnf-index": "1", "additionalParams": {"touch_filename": "file"},
+                                        "additionalParamsForVdu": [{"vdu_id": "mgmtVM",
+                                                                    "additionalParams": {"param": "vdu"}}]},
+                                       {"member-vnf-index": "2", "additionalParams": {"touch_filename": "file2"}}]
+        }
+        vnfd = yaml.load(db_vnfds_text, Loader=yaml.Loader)[0]
+        vnfd["vdu"][0]["count"] = 3
+        self.db.del_list("vnfds")
+        self.db.create_list("vnfds", [vnfd])
+        self.db.create_list = Mock(side_effect=lambda table, contents: [content["_id"] for content in contents])
+
+        self.nsr_topic.new([], session, indata=indata, kwargs=None, headers={})
+
+        vnfrs = {vnfr["member-vnf-index-ref"]: vnfr for vnfr in self.db.create_list.call_args[0][1]}
+        self.assertEqual(vnfrs["2"]["additionalParamsForVnf"], {"touch_filename": "file2"})
+        mgmt_vdurs = [vdur for vdur in vnfrs["1"]["vdur"] if vdur["vdu-id-ref"] == "mgmtVM"]
+        self.assertEqual([vdur["count-index"] for vdur in mgmt_vdurs], [0, 1, 2])
+        self.assertEqual(len({vdur["_id"] for vdur in mgmt_vdurs}), 3, "vdur _id must be unique")
+        self.assertIsNot(mgmt_vdurs[0]["interfaces"][0], mgmt_vdurs[1]["interfaces"][0])
+        for vdur in mgmt_vdurs:
+            self.assertEqual(vdur["additionalParams"], {"param": "vdu"})
+            self.assertEqual(vdur["interfaces"][0]["ns-vld-id"], "mgmt")
+            self.assertTrue(vdur["interfaces"][0]["mgmt-vnf"])
+            self.assertEqual(vdur["interfaces"][1]["vnf-vld-id"], "internal")
+        data_vdur = next(vdur for vdur in vnfrs["2"]["vdur"] if vdur["vdu-id-ref"] == "dataVM")
+        self.assertEqual(data_vdur["interfaces"][0]["vnf-vld-id"], "internal")
+        self.assertEqual(data_vdur["interfaces"][1]["ns-vld-id"], "datanet")
+
+    def test_list_page(self):
+        session = {"force": False, "admin": False, "public": None, "project_id": [self.nsd_project], "method": "list"}
+        nsr_ids = ["nsr-{}".format(index) for index in range(5)]
+        self.db.create_list("nsrs", [{"_id": _id, "_admin": {"projects_read": [self.nsd_project],
+                                                             "projects_write": [self.nsd_project]}}
+                                     for _id in reversed(nsr_ids)])
+        self.db.create_list("nsrs", [{"_id": "nsr-other", "_admin": {"projects_read": ["other"],
+                                                                     "projects_write": ["other"]}}])
+        listed_ids = []
+        next_marker = None
+        for page in range(3):
+            content, next_marker = self.nsr_topic.list_page(session, {}, 2, next_marker)
+            self.assertLessEqual(len(content), 2, "Page must not exceed limit")
+            listed_ids += [nsr["_id"] for nsr in content]
+            if not next_marker:
+                break
+        self.assertIsNone(next_marker, "Last page must not return a marker")
+        self.assertEqual(listed_ids, nsr_ids, "Pages must be sorted by _id and contain only project items")
+
+        # _id is needed for paging, but it must not be returned if excluded
+        pages = []
+        next_marker = None
+        for page in range(3):
+            content, next_marker = self.nsr_topic.list_page(session, {"exclude_fields": "_id"}, 2, next_marker)
+            pages.append(content)
+            if not next_marker:
+                break
+        self.assertEqual([len(content) for content in pages], [2, 2, 1])
+        self.assertFalse(any("_id" in nsr for content in pages for nsr in content), "_id must be excluded")
+        self.assertIn("_admin", pages[0][0])
+
+    def test_attribute_selectors(self):
+        session = {"force": False, "admin": False, "public": None, "project_id": [self.nsd_project], "method": "list"}
+        self.db.create_list("nsrs", [{"_id": "nsr-id", "name": "name", "nsd": {"id": "nsd-id"},
+                                      "_admin": {"projects_read": [self.nsd_project],
+                                                 "projects_write": [self.nsd_project]}}])
+        content = self.nsr_topic.list(session, {})
+        self.assertIn("nsd", content[0], "By default all fields must be returned")
+        content = self.nsr_topic.list(session, {"exclude_default": None})
+        self.assertNotIn("nsd", content[0], "'nsd' is at the default exclude set")
+        self.assertIn("name", content[0])
+        content = self.nsr_topic.list(session, {"exclude_default": None, "fields": "nsd"})
+        self.assertIn("nsd", content[0], "'fields' must override the default exclude set")
+        content = self.nsr_topic.list(session, {"fields": ["name", "nsd.id"]})
+        self.assertEqual(content[0], {"_id": "nsr-id", "name": "name", "nsd": {"id": "nsd-id"}})
+        session["method"] = "show"
+        content = self.nsr_topic.show(session, "nsr-id", {"exclude_fields": "_admin,nsd.id"})
+        self.assertEqual(content, {"_id": "nsr-id", "name": "name", "nsd": {}})
+        with self.assertRaises(EngineException, msg="fields and exclude_fields cannot be combined"):
+            self.nsr_topic.list(session, {"fields": "name", "exclude_fields": "nsd"})
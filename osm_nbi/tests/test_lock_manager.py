@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from threading import Thread, Event
+from unittest.mock import Mock
+from osm_nbi.engine import Engine
+from osm_nbi.lock_manager import LockManager
+from osm_nbi.metrics import MetricsRegistry
+
+
+class Test_LockManager(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.lock_manager = LockManager(self.registry)
+
+    def _try_lock(self, *resources, shared=()):
+        """Try to lock resources from another thread. Returns the Event set when locked, and the releasing Event"""
+        locked = Event()
+        release = Event()
+
+        def run():
+            with self.lock_manager.lock(*resources, shared=shared):
+                locked.set()
+                release.wait(5)
+
+        Thread(target=run, daemon=True).start()
+        return locked, release
+
+    def test_different_topics_do_not_block(self):
+        with self.lock_manager.lock("vnfds"):
+            locked, release = self._try_lock("vim_accounts")
+            self.assertTrue(locked.wait(2), "Lock of other topic must not wait")
+            release.set()
+
+    def test_same_topic_blocks(self):
+        with self.lock_manager.lock("vnfds"):
+            locked, release = self._try_lock("vnfds")
+            self.assertFalse(locked.wait(0.2), "Lock of same topic must wait")
+        self.assertTrue(locked.wait(2), "Lock must be obtained after releasing")
+        release.set()
+
+    def test_items(self):
+        with self.lock_manager.lock(("nsrs", "id1")):
+            locked, release = self._try_lock(("nsrs", "id2"))
+            self.assertTrue(locked.wait(2), "Lock of other item must not wait")
+            release.set()
+            locked, release = self._try_lock(("nsrs", "id1"))
+            self.assertFalse(locked.wait(0.2), "Lock of same item must wait")
+            locked_topic, release_topic = self._try_lock("nsrs")
+            self.assertFalse(locked_topic.wait(0.2), "Lock of whole topic must wait for items")
+        # waiting whole topic lock has preference over items
+        self.assertTrue(locked_topic.wait(2))
+        self.assertFalse(locked.is_set())
+        release_topic.set()
+        self.assertTrue(locked.wait(2))
+        release.set()
+
+    def test_several_topics_and_stats(self):
+        with self.lock_manager.lock("vnfrs", "nsrs"):
+            locked, release = self._try_lock("nsrs", "vnfrs")
+            self.assertFalse(locked.wait(0.2))
+        self.assertTrue(locked.wait(2))
+        release.set()
+        stats = self.lock_manager.get_stats()
+        self.assertEqual(set(stats.keys()), {"nsrs", "vnfrs"})
+        self.assertEqual(stats["nsrs"]["acquired"], 2)
+        self.assertEqual(stats["nsrs"]["contended"], 1)
+        self.assertGreater(stats["nsrs"]["max_wait_time"], 0.1)
+        self.assertEqual(self.registry.get("osm_nbi_engine_lock_wait_seconds").get(("nsrs", "topic"))["count"], 2)
+
+    def test_shared(self):
+        with self.lock_manager.lock("nsds", shared=("vnfds",)):
+            locked, release = self._try_lock("nsrs", shared=("vnfds",))
+            self.assertTrue(locked.wait(2), "Shared locks must not wait among them")
+            release.set()
+            locked, release = self._try_lock(("vnfds", "id1"))
+            self.assertFalse(locked.wait(0.2), "Lock of an item must wait for shared locks")
+            locked_shared, release_shared = self._try_lock(shared=("vnfds",))
+            self.assertFalse(locked_shared.wait(0.2), "Waiting item lock has preference over new shared locks")
+        self.assertTrue(locked.wait(2))
+        self.assertFalse(locked_shared.wait(0.2), "Shared lock must wait for items")
+        release.set()
+        self.assertTrue(locked_shared.wait(2))
+        locked, release = self._try_lock("vnfds")
+        self.assertFalse(locked.wait(0.2), "Lock of whole topic must wait for shared locks")
+        release_shared.set()
+        self.assertTrue(locked.wait(2))
+        release.set()
+        # a topic that is also written is not locked in shared mode
+        with self.lock_manager.lock(("vnfds", "id1"), shared=("vnfds",)):
+            locked, release = self._try_lock(("vnfds", "id2"))
+            self.assertTrue(locked.wait(2))
+            release.set()
+
+
+class Test_EngineLocks(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = Engine(None)
+        self.engine.lock_manager = LockManager(MetricsRegistry())
+        self.in_delete = Event()
+        self.release_delete = Event()
+        self.checked = []
+
+        def delete(session, _id, not_send_msg=None):
+            self.in_delete.set()
+            self.release_delete.wait(5)
+            self.checked.append("deleted " + _id)
+
+        def new(rollback, session, indata=None, kwargs=None, headers=None):
+            self.checked.append("referenced vnfd exists")
+        self.engine.map_topic = {"vnfds": Mock(delete=delete), "nsds": Mock(new=new),
+                                 "nsrs": Mock(new=new)}
+
+    def test_delete_and_referencing_create(self):
+        for topic, deleted_topic in (("nsds", "vnfds"), ("nsrs", "vnfds")):
+            self.checked.clear()
+            self.in_delete.clear()
+            self.release_delete.clear()
+            deleting = Thread(target=self.engine.del_item, args=(None, deleted_topic, "id1"), daemon=True)
+            deleting.start()
+            self.assertTrue(self.in_delete.wait(2))
+            creating = Thread(target=self.engine.new_item, args=([], None, topic, {}), daemon=True)
+            creating.start()
+            creating.join(0.2)
+            self.assertTrue(creating.is_alive(), "Creation of {} must wait for the deletion of {}".format(
+                topic, deleted_topic))
+            self.release_delete.set()
+            deleting.join(2)
+            creating.join(2)
+            self.assertEqual(self.checked, ["deleted id1", "referenced vnfd exists"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import unittest
+from osm_common.dbbase import DbException
+from osm_common.dbmemory import DbMemory
+from osm_nbi.backend_metrics import BackendMetrics
+from osm_nbi.http_metrics import HttpMetrics
+from osm_nbi.metrics import MetricsRegistry
+
+
+class MsgTest:
+    def __init__(self):
+        self.messages = []
+
+    def write(self, topic, key, msg):
+        self.messages.append((topic, key, msg))
+
+    async def aiowrite(self, topic, key, msg, loop=None):
+        self.messages.append((topic, key, msg))
+
+
+class Test_MetricsRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_render(self):
+        counter = self.registry.counter("requests_total", "Number of requests", ("method", "path"))
+        counter.inc(("GET", '/a"b'))
+        counter.inc(("GET", '/a"b'), 2)
+        histogram = self.registry.histogram("latency_seconds", "Latency", ("method",), buckets=(0.1, 1))
+        histogram.observe(("GET",), 0.05)
+        histogram.observe(("GET",), 0.5)
+        histogram.observe(("GET",), 3)
+        self.registry.gauge("in_flight", "Requests in progress").set(value=2)
+        self.assertEqual(self.registry.render(), "\n".join((
+            "# HELP in_flight Requests in progress",
+            "# TYPE in_flight gauge",
+            "in_flight 2",
+            "# HELP latency_seconds Latency",
+            "# TYPE latency_seconds histogram",
+            'latency_seconds_bucket{method="GET",le="0.1"} 1',
+            'latency_seconds_bucket{method="GET",le="1"} 2',
+            'latency_seconds_bucket{method="GET",le="+Inf"} 3',
+            'latency_seconds_sum{method="GET"} 3.55',
+            'latency_seconds_count{method="GET"} 3',
+            "# HELP requests_total Number of requests",
+            "# TYPE requests_total counter",
+            'requests_total{method="GET",path="/a\\"b"} 3',
+        )) + "\n")
+
+    def test_collector(self):
+        stats = {"hits": 3}
+        self.registry.set_collector("cache", lambda registry: registry.counter("hits_total", "Hits").set(
+            value=stats["hits"]))
+        self.assertIn("hits_total 3\n", self.registry.render())
+        stats["hits"] = 5
+        self.assertIn("hits_total 5\n", self.registry.render())
+        self.registry.set_collector("cache", None)
+        stats["hits"] = 7
+        self.assertIn("hits_total 5\n", self.registry.render())
+
+    def test_register_twice(self):
+        self.assertIs(self.registry.counter("c", "doc", ("a",)), self.registry.counter("c", "doc", ("a",)))
+        with self.assertRaises(ValueError):
+            self.registry.gauge("c", "doc", ("a",))
+
+
+class Test_BackendMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.backend_metrics = BackendMetrics(self.registry)
+        self.db = DbMemory()
+        self.msg = MsgTest()
+        self.backend_metrics.attach_db(self.db, {"nsrs": (("_admin.projects_read",), ("name",), ("nsd-id",))})
+        self.backend_metrics.attach_msg(self.msg)
+
+    def test_db(self):
+        for index in range(3):
+            self.db.create("nsrs", {"_id": "nsr{}".format(index), "_admin": {"projects_read": ["p1"]}})
+        self.db.get_list("nsrs", {"_admin.projects_read.cont": ["p1"]})
+        self.db.get_list("nsrs", {"_admin.projects_read.cont": ["p2"]})
+        with self.assertRaises(DbException):
+            self.db.get_one("nsrs", {"_id": "nsr4"})
+        labels = ("db", "get_list", "nsrs", "_admin.projects_read")
+        self.assertEqual(self.backend_metrics.requests.get(labels), 2)
+        self.assertEqual(self.backend_metrics.items.get(labels), 3)
+        self.assertEqual(self.backend_metrics.latency.get(labels)["count"], 2)
+        self.assertEqual(self.backend_metrics.requests.get(("db", "create", "nsrs", "")), 3)
+        self.assertEqual(self.backend_metrics.errors.get(("db", "get_one", "nsrs", "_id")), 1)
+        self.assertIn('osm_nbi_backend_requests_total{backend="db",method="get_list",topic="nsrs",'
+                      'filter="_admin.projects_read"} 2', self.registry.render())
+
+        # not indexed fields, as given by the query string, are collapsed
+        self.db.get_list("nsrs", {"_admin.projects_read.cont": ["p1"], "name": "ns", "nsd-id.neq": "nsd1"})
+        self.db.get_list("nsrs", {"_admin.projects_read.cont": ["p1"], "name": "ns", "description": "x"})
+        self.db.get_list("nsrs", {"_admin.projects_read.cont": ["p1"], "name": "ns", "a1.b2": "y", "c3": "z"})
+        self.db.get_list("vnfrs", {"vim-account-id": "vim1", "_id.neq": "vnfr1"})
+        self.assertEqual(self.backend_metrics.requests.get(("db", "get_list", "nsrs",
+                                                            "_admin.projects_read,name,nsd-id")), 1)
+        self.assertEqual(self.backend_metrics.requests.get(("db", "get_list", "nsrs",
+                                                            "_admin.projects_read,name,other")), 2)
+        self.assertEqual(self.backend_metrics.requests.get(("db", "get_list", "vnfrs", "_id,other")), 1)
+
+    def test_msg(self):
+        self.msg.write("ns", "deleted", {"_id": "nsr1"})
+        asyncio.run(self.msg.aiowrite("ns", "deleted", {"_id": "nsr2"}))
+        self.assertEqual(len(self.msg.messages), 2)
+        self.assertEqual(self.backend_metrics.requests.get(("msg", "write", "ns", "")), 1)
+        self.assertEqual(self.backend_metrics.requests.get(("msg", "aiowrite", "ns", "")), 1)
+
+
+class Test_HttpMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.http_metrics = HttpMetrics(MetricsRegistry())
+
+    def test_request(self):
+        request_metrics = self.http_metrics.start()
+        self.assertEqual(self.http_metrics.in_flight.get(), 1)
+        request_metrics.set_operation("ns_instances:id:get", "GET")
+        for phase in ("authorize", "format_in", "engine"):
+            request_metrics.mark(phase)
+        self.assertEqual(request_metrics.finish(200, b"12345"), b"12345")
+        request_metrics.done()
+        request_metrics.done()
+        self.assertEqual(self.http_metrics.in_flight.get(), 0)
+        labels = ("ns_instances:id:get", "GET", "200")
+        self.assertEqual(self.http_metrics.requests.get(labels), 1)
+        self.assertEqual(self.http_metrics.response_size.get(labels)["sum"], 5)
+        for phase in ("authorize", "format_in", "engine", "format_out"):
+            self.assertEqual(self.http_metrics.phase_latency.get(("ns_instances:id:get", "GET", phase))["count"], 1)
+
+    def test_streamed_request(self):
+        request_metrics = self.http_metrics.start()
+        request_metrics.set_operation("ns_instances:get", "GET")
+        body = request_metrics.finish("200 OK", (chunk for chunk in (b"[", b"{}", b"]")))
+        request_metrics.done()
+        labels = ("ns_instances:get", "GET", "200")
+        self.assertIsNone(self.http_metrics.requests.get(labels), "recorded when the stream ends")
+        self.assertEqual(b"".join(body), b"[{}]")
+        self.assertEqual(self.http_metrics.requests.get(labels), 1)
+        self.assertEqual(self.http_metrics.response_size.get(labels)["sum"], 4)
+
+    def test_failed_request(self):
+        # the time until the failure is recorded at the phase that was running
+        for marked, failed in (((), "authorize"), (("authorize", "format_in"), "engine")):
+            self.http_metrics = HttpMetrics(MetricsRegistry())
+            request_metrics = self.http_metrics.start()
+            request_metrics.set_operation("ns_instances:get", "GET")
+            for phase in marked:
+                request_metrics.mark(phase)
+            request_metrics.mark_failed()
+            request_metrics.finish(401, b"{}")
+            recorded = [phase for phase in ("authorize", "format_in", "engine", "format_out")
+                        if self.http_metrics.phase_latency.get(("ns_instances:get", "GET", phase))]
+            self.assertEqual(recorded, list(marked) + [failed, "format_out"])
+
+
+if __name__ == '__main__':
+    unittest.main()
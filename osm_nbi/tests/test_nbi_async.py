@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import json
+import unittest
+import yaml
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from tempfile import TemporaryFile
+from unittest.mock import Mock
+from osm_nbi import tracing
+from osm_nbi.authconn import AuthException
+from osm_nbi.engine import Engine
+from osm_nbi.http_metrics import HttpMetrics
+from osm_nbi.metrics import MetricsRegistry
+from osm_nbi.nbi_async import AsyncServer
+
+token_info = {"_id": "token", "id": "token", "project_id": "project", "username": "user", "admin": False,
+              "allow_show_user_project_role": False, "expires": 4070908800}
+
+
+class Test_AsyncServer(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.server = AsyncServer({"global": {}})
+        self.server.executor = ThreadPoolExecutor(max_workers=2)
+        self.server.semaphore = asyncio.Semaphore(2)
+        self.server.authenticator = Mock()
+        self.server.authenticator.is_token_cached.return_value = True
+        self.server.authenticator.authorize_token.side_effect = lambda *args: dict(token_info)
+        self.server.engine = Mock(Engine(None))
+
+    def tearDown(self):
+        self.server.executor.shutdown(wait=True)
+        self.loop.close()
+
+    def request(self, path, method="GET", query_string="", token="token", accept="application/json"):
+        """
+        Sends a request to the ASGI application
+        :return: tuple with status, response headers and the body, decoded when it is json
+        """
+        headers = [(b"accept", accept.encode())]
+        if token:
+            headers.append((b"authorization", "Bearer {}".format(token).encode()))
+        scope = {"type": "http", "method": method, "path": path, "query_string": query_string.encode(),
+                 "headers": headers}
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        self.loop.run_until_complete(self.server(scope, None, send))
+        self.assertEqual(messages[0]["type"], "http.response.start")
+        self.assertFalse(messages[-1].get("more_body"), "last message must end the body")
+        response_headers = {k.decode(): v.decode() for k, v in messages[0]["headers"]}
+        body = b"".join(message["body"] for message in messages[1:])
+        if response_headers.get("Content-Type", "").startswith("application/json"):
+            body = json.loads(body.decode())
+        return messages[0]["status"], response_headers, body
+
+    def test_auth_failure(self):
+        status, _, body = self.request("/osm/nslcm/v1/ns_instances", token=None)
+        self.assertEqual(status, HTTPStatus.UNAUTHORIZED.value)
+        self.assertEqual(body["code"], "UNAUTHORIZED")
+        self.server.authenticator.authorize_token.assert_not_called()
+
+        self.server.authenticator.is_token_cached.return_value = False
+        self.server.authenticator.authorize_token.side_effect = AuthException("Invalid token")
+        status, headers, body = self.request("/osm/nslcm/v1/ns_instances", token="invalid")
+        self.assertEqual(status, HTTPStatus.UNAUTHORIZED.value)
+        self.assertIn("WWW-Authenticate", headers)
+        self.assertIn("Invalid token", body["detail"])
+        self.server.engine.get_item_list.assert_not_called()
+
+    def test_list(self):
+        self.server.engine.get_item_list.return_value = [{"_id": "ns1"}, {"_id": "ns2"}]
+        status, headers, body = self.request("/osm/nslcm/v1/ns_instances", query_string="name=ns")
+        self.assertEqual(status, HTTPStatus.OK.value)
+        self.assertEqual(body, [{"_id": "ns1"}, {"_id": "ns2"}])
+        session, topic, kwargs = self.server.engine.get_item_list.call_args[0]
+        self.assertEqual(topic, "nsrs")
+        self.assertEqual(session["project_id"], ("project", ))
+        self.assertEqual(kwargs, {"name": "ns"})
+
+        # empty list, not chunked
+        self.server.engine.get_item_list.return_value = []
+        status, headers, body = self.request("/osm/nslcm/v1/ns_instances", accept="application/yaml")
+        self.assertEqual(status, HTTPStatus.OK.value)
+        self.assertEqual(yaml.safe_load(body), [])
+        self.assertEqual(int(headers["Content-Length"]), len(body))
+
+    def test_paging(self):
+        self.server.engine.get_item_page.return_value = ([{"_id": "ns1"}, {"_id": "ns2"}], "ns2")
+        status, headers, body = self.request("/osm/nslcm/v1/ns_instances", query_string="limit=2")
+        self.assertEqual(status, HTTPStatus.OK.value)
+        self.assertEqual(len(body), 2)
+        self.assertIn("/osm/nslcm/v1/ns_instances?", headers["Link"])
+        self.assertIn("nextpage_opaque_marker=ns2", headers["Link"])
+        self.assertIn('rel="next"', headers["Link"])
+        self.server.engine.get_item_list.assert_not_called()
+
+        # last page
+        self.server.engine.get_item_page.return_value = ([{"_id": "ns3"}], None)
+        status, headers, body = self.request("/osm/nslcm/v1/ns_instances",
+                                             query_string="limit=2&nextpage_opaque_marker=ns2")
+        self.assertEqual(body, [{"_id": "ns3"}])
+        self.assertNotIn("Link", headers)
+
+    def test_show(self):
+        self.server.engine.get_item.return_value = {"_id": "ns1", "name": "ns"}
+        status, headers, body = self.request("/osm/nslcm/v1/ns_instances/ns1", accept="application/yaml")
+        self.assertEqual(status, HTTPStatus.OK.value)
+        self.assertEqual(headers["Content-Type"], "application/yaml")
+        self.assertEqual(yaml.safe_load(body), {"_id": "ns1", "name": "ns"})
+        self.assertEqual(self.server.engine.get_item.call_args[0][1:3], ("nsrs", "ns1"))
+
+    def test_file_download(self):
+        with TemporaryFile("w+b") as file:
+            content = b"0123456789" * 10000
+            file.write(content)
+            file.seek(0)
+            self.server.engine.get_file.return_value = (file, None)
+            status, headers, body = self.request("/osm/vnfpkgm/v1/vnf_packages/vnf1/package_content")
+            self.assertTrue(file.closed, "file must be closed once sent")
+        self.assertEqual(status, HTTPStatus.OK.value)
+        self.assertEqual(headers["Content-Type"], "application/zip")
+        self.assertEqual(body, content)
+        self.assertEqual(self.server.engine.get_file.call_args[0][1:4], ("vnfds", "vnf1", None))
+
+    def test_artifacts_folder(self):
+        # folder content is returned as a list, serialized instead of sent as a file
+        self.server.engine.get_file.return_value = (["cloud_init", "scripts"], "text/plain")
+        status, headers, body = self.request("/osm/vnfpkgm/v1/vnf_packages/vnf1/artifacts/pkg")
+        self.assertEqual(status, HTTPStatus.OK.value)
+        self.assertEqual(body, ["cloud_init", "scripts"])
+        self.assertEqual(self.server.engine.get_file.call_args[0][1:4], ("vnfds", "vnf1", ["pkg"]))
+
+        status, headers, body = self.request("/osm/vnfpkgm/v1/vnf_packages/vnf1/artifacts/pkg/scripts",
+                                             accept="application/yaml")
+        self.assertEqual(status, HTTPStatus.OK.value)
+        self.assertEqual(headers["Content-Type"], "application/yaml")
+        self.assertEqual(yaml.safe_load(body), ["cloud_init", "scripts"])
+        self.assertEqual(self.server.engine.get_file.call_args[0][3], ["pkg", "scripts"])
+
+    def test_method_not_allowed(self):
+        for method, path in (("POST", "/osm/nslcm/v1/ns_instances"),
+                             ("DELETE", "/osm/nslcm/v1/ns_instances/ns1"),
+                             ("GET", "/osm/admin/v1/tokens"),
+                             ("GET", "/osm/test/stats"),
+                             ("GET", "/osm/test/db-clear/nsrs"),
+                             ("GET", "/osm/nslcm/v2/ns_instances"),
+                             ("GET", "/osm/unknown/v1/ns_instances"),
+                             ("GET", "/osm/nslcm")):
+            status, _, body = self.request(path, method=method)
+            self.assertEqual(status, HTTPStatus.METHOD_NOT_ALLOWED.value, "{} {}".format(method, path))
+            self.assertEqual(body["code"], "METHOD_NOT_ALLOWED")
+        status, _, _ = self.request("/other/nslcm/v1/ns_instances")
+        self.assertEqual(status, HTTPStatus.NOT_FOUND.value)
+        self.server.authenticator.authorize_token.assert_not_called()
+        self.assertFalse(self.server.engine.method_calls, "engine must not be called")
+
+    def test_metrics_and_usage(self):
+        status, headers, body = self.request("/osm/admin/v1/metrics")
+        self.assertEqual(status, HTTPStatus.OK.value)
+        self.assertTrue(headers["Content-Type"].startswith("text/plain"))
+        self.assertIsInstance(body, bytes)
+
+        self.server.engine.get_quota_usage.return_value = {"nsrs": 3}
+        status, _, body = self.request("/osm/admin/v1/projects/project/usage")
+        self.assertEqual(status, HTTPStatus.OK.value)
+        self.assertEqual(body, {"nsrs": 3})
+        self.assertEqual(self.server.engine.get_quota_usage.call_args[0][1], "project")
+        self.server.engine.get_item.assert_not_called()
+
+    def test_request_metrics_and_tracing(self):
+        self.server.http_metrics = HttpMetrics(MetricsRegistry())
+        self.server.tracer = tracing.Tracer()
+        traces = []
+
+        def get_item_list(*args):
+            # executed at an executor thread, within the trace of the request
+            traces.append(tracing.get_current_trace())
+            return [{"_id": "ns1"}]
+
+        self.server.engine.get_item_list.side_effect = get_item_list
+        status, headers, _ = self.request("/osm/nslcm/v1/ns_instances")
+        self.assertEqual(status, HTTPStatus.OK.value)
+        self.assertIsNotNone(traces[0])
+        self.assertEqual(headers["traceparent"], traces[0].get_traceparent())
+        self.assertEqual(traces[0].root.name, "ns_instances:get")
+        self.assertEqual(traces[0].root.attributes["status"], HTTPStatus.OK.value)
+        self.assertIsNone(tracing.get_current_trace(), "trace must not remain at the event loop thread")
+
+        self.request("/osm/nslcm/v1/ns_instances", token=None)
+        http_metrics = self.server.http_metrics
+        self.assertEqual(http_metrics.requests.get(("ns_instances:get", "GET", "200")), 1)
+        self.assertEqual(http_metrics.requests.get(("ns_instances:get", "GET", "401")), 1)
+        self.assertEqual(http_metrics.latency.get(("ns_instances:get", "GET", "200"))["count"], 1)
+        self.assertEqual(http_metrics.in_flight.get(), 0)
+        self.assertEqual(http_metrics.phase_latency.get(("ns_instances:get", "GET", "authorize"))["count"], 2)
+        self.assertEqual(http_metrics.phase_latency.get(("ns_instances:get", "GET", "engine"))["count"], 1,
+                         "authorization failure must not be recorded as engine time")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+from hashlib import md5, sha256
+from http import HTTPStatus
+from unittest.mock import Mock, patch
+from osm_common.dbmemory import DbMemory
+from osm_nbi.base_topic import EngineException
+from osm_nbi.descriptor_topics import DescriptorTopic
+from osm_nbi.package_upload import MultipartReader, PackageUpload, TarIndexValidator
+
+session = {"username": "user1", "project_id": ("p1",), "method": "write", "public": None, "force": True,
+           "admin": False}
+
+
+def get_package(members, mode="w:gz", tar_format=tarfile.GNU_FORMAT):
+    """
+    :param members: list of (name, content). content None for a folder
+    :return: bytes of the tar file
+    """
+    package = io.BytesIO()
+    with tarfile.open(fileobj=package, mode=mode, format=tar_format) as tar:
+        for name, content in members:
+            tarinfo = tarfile.TarInfo(name)
+            if content is None:
+                tarinfo.type = tarfile.DIRTYPE
+                tar.addfile(tarinfo)
+            else:
+                tarinfo.size = len(content)
+                tar.addfile(tarinfo, io.BytesIO(content))
+    return package.getvalue()
+
+
+def get_header(name, size=0, pax_headers=None):
+    tarinfo = tarfile.TarInfo(name)
+    tarinfo.size = size
+    if pax_headers:
+        tarinfo.pax_headers = pax_headers
+        return tarinfo.tobuf(tarfile.PAX_FORMAT)
+    return tarinfo.tobuf(tarfile.USTAR_FORMAT)
+
+
+def get_pax_size_package():
+    """
+    :return: bytes of a tar.gz file whose first member has ustar size 0 but pax size 512, so that its data, a zero
+        filled block, would end the archive if the pax size were not applied
+    """
+    package = get_header("pkg/pkg.yaml", 0, {"size": "512"}) + bytes(tarfile.BLOCKSIZE)
+    package += get_header("pkg/blob", 3) + b"abc".ljust(tarfile.BLOCKSIZE, b"\0")
+    package += get_header("../evil", 0) + bytes(2 * tarfile.BLOCKSIZE)
+    return gzip.compress(package)
+
+
+def validate(package, chunk_size=1000):
+    validator = TarIndexValidator()
+    for position in range(0, len(package), chunk_size):
+        validator.update(package[position:position + chunk_size])
+    return validator.close(), validator.pkg_dir
+
+
+def get_multipart(boundary, fields, preamble=b"", epilogue=b""):
+    """
+    :param fields: list of (name, filename, content type, content)
+    :return: bytes of the multipart/form-data body
+    """
+    body = preamble
+    for name, filename, content_type, content in fields:
+        body += b"--" + boundary + b"\r\n"
+        disposition = 'Content-Disposition: form-data; name="{}"'.format(name)
+        if filename:
+            disposition += '; filename="{}"'.format(filename)
+        body += disposition.encode() + b"\r\n"
+        if content_type:
+            body += "Content-Type: {}\r\n".format(content_type).encode()
+        body += b"\r\n" + content + b"\r\n"
+    return body + b"--" + boundary + b"--\r\n" + epilogue
+
+
+class ChunkedReader(io.BytesIO):
+    """Request body that returns less bytes than requested, as a socket"""
+
+    def __init__(self, content, chunk_size):
+        super().__init__(content)
+        self.chunk_size = chunk_size
+
+    def read(self, size=-1):
+        return super().read(self.chunk_size if size < 0 else min(size, self.chunk_size))
+
+
+class VnfdTestTopic(DescriptorTopic):
+    topic = "vnfds"
+    topic_msg = "vnfd"
+
+    def _validate_input_new(self, indata, storage_params, force=False):
+        return dict(indata)
+
+
+class Test_TarIndexValidator(unittest.TestCase):
+
+    def test_valid(self):
+        long_name = "pkg/" + "d" * 150 + "/cloud_init.cfg"
+        for mode in ("w", "w:gz", "w:bz2", "w:xz"):
+            for tar_format in (tarfile.USTAR_FORMAT, tarfile.GNU_FORMAT, tarfile.PAX_FORMAT):
+                members = [("pkg", None), ("pkg/vnfd.yaml", b"vnfd: {}"), ("pkg/images/image.qcow2", b"0" * 5000)]
+                if tar_format != tarfile.USTAR_FORMAT:
+                    members.append((long_name, b"#cloud-config"))
+                package = get_package(members, mode, tar_format)
+                for chunk_size in (1, 511, 4096):
+                    self.assertEqual(validate(package, chunk_size), ("pkg/vnfd.yaml", "pkg"),
+                                     "mode={} format={} chunk={}".format(mode, tar_format, chunk_size))
+
+    def test_pax_size(self):
+        # the ustar size of members over 8 GiB is not valid, and the pax size is used instead
+        package = get_header("pkg/image.qcow2", 0, {"size": "1000"}) + os.urandom(1000).ljust(1024, b"\0")
+        package += get_header("pkg/vnfd.yaml", 8) + b"vnfd: {}".ljust(tarfile.BLOCKSIZE, b"\0")
+        package = gzip.compress(package + bytes(2 * tarfile.BLOCKSIZE))
+        for chunk_size in (1, 1000):
+            self.assertEqual(validate(package, chunk_size), ("pkg/vnfd.yaml", "pkg"))
+
+    def test_invalid(self):
+        for members, error in (
+                ([("/pkg/vnfd.yaml", b"")], "Absolute path or '..' are not allowed"),
+                ([("pkg/../vnfd.yaml", b"")], "Absolute path or '..' are not allowed"),
+                ([("vnfd.yaml", b"")], "All files must be inside a dir"),
+                ([("pkg/vnfd.yaml", b""), ("pkg/other.json", b"")], "Found more than one descriptor file"),
+                ([("pkg/scripts/vnfd.yaml", b"")], "Not found any descriptor file")):
+            with self.assertRaises(EngineException, msg=error) as e:
+                validate(get_package(members))
+            self.assertIn(error, str(e.exception))
+
+        # pax size replaces the ustar size, as tarfile does
+        package = get_pax_size_package()
+        with tarfile.open(fileobj=io.BytesIO(package)) as tar:
+            self.assertEqual(tar.getnames(), ["pkg/pkg.yaml", "pkg/blob", "../evil"])
+        for chunk_size in (1, 1000):
+            with self.assertRaises(EngineException) as e:
+                validate(package, chunk_size)
+            self.assertIn("Absolute path or '..' are not allowed", str(e.exception))
+
+        members = [("pkg/vnfd.yaml", b"vnfd: {}"), ("pkg/image.qcow2", os.urandom(50000))]
+        # ends after an extended header, without its member
+        pax_header = get_header("pkg/vnfd.yaml", 0, {"size": "512"})[:-tarfile.BLOCKSIZE]
+        for content in (gzip.compress(pax_header), b"", b"not a tar file" * 100, get_package(members, mode="w")[:30000],
+                        get_package(members)[:30000]):
+            with self.assertRaises(tarfile.ReadError):
+                validate(content)
+
+
+class Test_MultipartReader(unittest.TestCase):
+
+    def test_parts(self):
+        boundary = b"----boundary1234"
+        content = os.urandom(20000) + b"\r\n------boundary123\r\n--" + boundary[:-1] + os.urandom(1000)
+        body = get_multipart(boundary, [("METHOD", None, None, b"PUT"),
+                                        ("descriptor_file", "package.tar.gz", "application/gzip", content),
+                                        ("other", None, None, b"ignored")],
+                             preamble=b"preamble\r\n", epilogue=b"epilogue")
+        for chunk_size, buffer_size in ((1, 16), (7, 100), (4096, 1000), (1 << 20, 1 << 20)):
+            parts = MultipartReader(ChunkedReader(body, chunk_size), boundary, buffer_size)
+            received = []
+            for part in parts:
+                if part.filename:
+                    self.assertEqual((part.name, part.content_type), ("descriptor_file", "application/gzip"))
+                    received.append(b"".join(iter(lambda: part.read(777), b"")))
+                else:
+                    received.append(part.read())
+                    if part.name == "METHOD":
+                        self.assertEqual(part.read(), b"")
+            self.assertEqual(received, [b"PUT", content, b"ignored"], "chunk={}".format(chunk_size))
+
+        # not read parts are discarded
+        parts = [part.name for part in MultipartReader(io.BytesIO(body), boundary, 100)]
+        self.assertEqual(parts, ["METHOD", "descriptor_file", "other"])
+
+    def test_invalid(self):
+        boundary = b"boundary"
+        body = get_multipart(boundary, [("descriptor_file", "package.tar.gz", None, b"0" * 1000)])
+        for content in (body[:500], body[:20], b"no boundary" * 10):
+            with self.assertRaises(ValueError):
+                for part in MultipartReader(io.BytesIO(content), boundary, 64):
+                    part.read()
+
+
+class Test_PackageUpload(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.db = DbMemory()
+        self.db.create("vnfds", {"_id": "vnfd1", "_admin": {"projects_read": ["p1"], "projects_write": ["p1"],
+                                                            "onboardingState": "CREATED"}})
+        self.fs = Mock()
+        self.fs.get_params.return_value = {"fs": "local", "path": self.folder}
+        self.fs.file_exists.side_effect = lambda path, mode=None: os.path.exists(self._path(path))
+        self.fs.file_size.side_effect = lambda path: os.path.getsize(self._path(path))
+        self.fs.file_open.side_effect = lambda path, mode: open(self._path(path), mode)
+        self.fs.mkdir.side_effect = lambda path: os.mkdir(self._path(path))
+        self.fs.file_delete.side_effect = lambda path, ignore_non_exist=False: shutil.rmtree(self._path(path), True)
+        self.fs.file_extract.side_effect = lambda tar, path: tar.extractall(self._path(path))
+        self.fs.dir_rename.side_effect = lambda src, dst: os.rename(self._path(src), self._path(dst))
+        self.topic = VnfdTestTopic(self.db, self.fs, Mock(), None)
+        self.topic.uploads.clear()
+        self.package = get_package([("pkg", None), ("pkg/vnfd.yaml", b"id: vnfd-id\ndescription: uploaded\n"),
+                                    ("pkg/image.qcow2", os.urandom(100000))])
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _path(self, path):
+        return os.path.join(self.folder, *path) if isinstance(path, (tuple, list)) else os.path.join(self.folder, path)
+
+    def upload(self, chunk_size, md5_hash=None):
+        headers = {"Content-Type": "application/gzip", "Content-Filename": "package.tar.gz"}
+        if md5_hash:
+            headers["Content-File-MD5"] = md5_hash
+        total = len(self.package)
+        for start in range(0, total, chunk_size):
+            chunk = self.package[start:start + chunk_size]
+            headers["Content-Range"] = "bytes {}-{}/{}".format(start, start + len(chunk) - 1, total)
+            completed = self.topic.upload_content(session, "vnfd1", io.BytesIO(chunk), None, headers)
+            self.assertEqual(completed, start + chunk_size >= total)
+
+    def test_upload_by_chunks(self):
+        self.topic.upload_buffer_size = 4096
+        self.upload(30000, md5(self.package).hexdigest())
+        vnfd = self.db.get_one("vnfds", {"_id": "vnfd1"})
+        self.assertEqual(vnfd["description"], "uploaded")
+        self.assertEqual(vnfd["_admin"]["onboardingState"], "ONBOARDED")
+        self.assertEqual(vnfd["_admin"]["storage"]["descriptor"], "pkg/vnfd.yaml")
+        self.assertEqual(vnfd["_admin"]["storage"]["pkg-dir"], "pkg")
+        self.assertEqual(vnfd["_admin"]["storage"]["checksum"],
+                         {"algorithm": "SHA-256", "hash": sha256(self.package).hexdigest()})
+        self.assertTrue(os.path.isfile(os.path.join(self.folder, "vnfd1", "pkg", "image.qcow2")))
+        self.assertEqual(len(self.topic.uploads), 0)
+
+    def test_upload_multipart(self):
+        boundary = b"boundary"
+        body = get_multipart(boundary, [("descriptor_file", "package.tar.gz", "application/gzip", self.package)])
+        part = next(iter(MultipartReader(ChunkedReader(body, 1000), boundary)))
+        headers = {"Content-Type": "application/gzip", "Content-File-MD5": md5(self.package).hexdigest()}
+        self.assertTrue(self.topic.upload_content(session, "vnfd1", part, None, headers))
+        vnfd = self.db.get_one("vnfds", {"_id": "vnfd1"})
+        self.assertEqual(vnfd["_admin"]["storage"]["checksum"]["hash"], sha256(self.package).hexdigest())
+        with open(os.path.join(self.folder, "vnfd1", "package.tar.gz"), "rb") as stored:
+            self.assertEqual(stored.read(), self.package)
+
+    def test_upload_without_state(self):
+        # previous chunks uploaded at other NBI instance, content already stored is processed again
+        with patch.object(PackageUpload, "load", autospec=True, side_effect=PackageUpload.load) as mock_load:
+            headers = {"Content-Type": "application/gzip", "Content-Filename": "package.tar.gz"}
+            total = len(self.package)
+            for start in range(0, total, 30000):
+                self.topic.uploads.clear()
+                chunk = self.package[start:start + 30000]
+                headers["Content-Range"] = "bytes {}-{}/{}".format(start, start + len(chunk) - 1, total)
+                self.topic.upload_content(session, "vnfd1", io.BytesIO(chunk), None, headers)
+            self.assertEqual(mock_load.call_count, (total - 1) // 30000)
+        vnfd = self.db.get_one("vnfds", {"_id": "vnfd1"})
+        self.assertEqual(vnfd["_admin"]["storage"]["checksum"]["hash"], sha256(self.package).hexdigest())
+
+    def test_upload_errors(self):
+        with self.assertRaises(EngineException) as e:
+            self.upload(len(self.package), md5(b"other").hexdigest())
+        self.assertEqual(e.exception.http_code, HTTPStatus.CONFLICT)
+        self.assertIn("MD5 mismatch", str(e.exception))
+
+        self.package = b"not a tar file" * 1000
+        with self.assertRaises(EngineException) as e:
+            self.upload(len(self.package))
+        self.assertEqual(e.exception.http_code, HTTPStatus.BAD_REQUEST)
+
+        # tar index is validated while receiving, before the last chunk
+        self.package = get_package([("pkg/vnfd.yaml", b""), ("pkg/image.qcow2", os.urandom(100000)),
+                                    ("/etc/passwd", b"")], mode="w")
+        with self.assertRaises(EngineException) as e:
+            self.upload(len(self.package) - 100)
+        self.assertIn("Absolute path", str(e.exception))
+
+        # member names are checked again before extracting, in case the validator parses the index differently
+        self.topic.uploads.clear()
+        self.package = get_pax_size_package()
+        with patch.object(TarIndexValidator, "_check_member", autospec=True,
+                          side_effect=lambda validator, tarinfo: setattr(validator, "descriptor_file_name",
+                                                                         "pkg/pkg.yaml")):
+            with self.assertRaises(EngineException) as e:
+                self.upload(len(self.package))
+        self.assertIn("Absolute path", str(e.exception))
+        self.fs.file_extract.assert_not_called()
+        self.assertFalse(os.path.exists(os.path.join(self.folder, "evil")))
+
+
+if __name__ == '__main__':
+    unittest.main()
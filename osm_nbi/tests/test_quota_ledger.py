@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from unittest.mock import Mock, MagicMock
+from osm_common.dbmemory import DbMemory
+from osm_common.dbmongo import DbMongo
+from osm_nbi.base_topic import BaseTopic, EngineException
+from osm_nbi.quota_ledger import QuotaLedger
+
+
+class PduTestTopic(BaseTopic):
+    topic = "pdus"
+    topic_msg = "pdu"
+
+
+class Test_QuotaLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.db = DbMemory()
+        self.ledger = QuotaLedger(self.db)
+        for index in range(3):
+            self.db.create("pdus", {"_id": "pdu{}".format(index), "_admin": {"projects_read": ["p1"]}})
+        self.db.create("pdus", {"_id": "pdu3", "_admin": {"projects_read": ["p1", "p2", "ANY"]}})
+
+    def test_usage(self):
+        self.db.count = Mock(side_effect=self.db.count)
+        self.assertEqual(self.ledger.get_usage("pdus", "p1"), 4)
+        self.assertEqual(self.ledger.get_usage("pdus", "p1"), 4)
+        self.assertEqual(self.db.count.call_count, 1, "usage must be counted only once")
+        self.ledger.add("pdus", ["p1", "p2", "ANY"], 1)
+        self.assertEqual(self.ledger.get_usage("pdus", "p1"), 5)
+        self.assertEqual(self.ledger.get_usage("pdus", "p2"), 1, "not counted projects must be ignored by add")
+        self.ledger.add("pdus", ["p1"], -2)
+        self.assertEqual(self.ledger.get_usage("pdus", "p1"), 3)
+
+    def test_reconcile(self):
+        self.ledger.get_usage("pdus", "p1")
+        self.ledger.get_usage("pdus", "p2")
+        self.db.del_one("pdus", {"_id": "pdu0"})
+        self.assertEqual(self.ledger.reconcile(), 1)
+        self.assertEqual(self.ledger.get_usage("pdus", "p1"), 3)
+        self.assertEqual(self.ledger.reconcile(), 0)
+        self.ledger.delete_project("p1")
+        self.assertEqual([entry["_id"] for entry in self.db.get_list(QuotaLedger.collection)], ["pdus:p2"])
+
+    def test_reconcile_concurrent(self):
+        self.ledger.get_usage("pdus", "p1")
+        self.db.del_one("pdus", {"_id": "pdu0"})
+        count = self.ledger._count
+
+        def _count(topic, project_id):
+            # an item is created while counting; its increment must not be lost
+            result = count(topic, project_id)
+            self.db.create("pdus", {"_id": "pdu4", "_admin": {"projects_read": ["p1"]}})
+            self.ledger.add("pdus", ["p1"], 1)
+            return result
+
+        self.ledger._count = _count
+        self.assertEqual(self.ledger.reconcile(), 0, "counter modified meanwhile must not be corrected")
+        self.ledger._count = count
+        self.assertEqual(self.ledger.get_usage("pdus", "p1"), 5)
+        self.assertEqual(self.ledger.reconcile(), 1)
+        self.assertEqual(self.ledger.get_usage("pdus", "p1"), 4)
+
+    def test_reconcile_mongo(self):
+        db = Mock(spec=DbMongo)
+        db.db = MagicMock()
+        collection = db.db.__getitem__.return_value
+        db.get_list.return_value = [{"_id": "pdus:p1", "topic": "pdus", "project_id": "p1", "count": 4}]
+        db.count.return_value = 3
+        collection.update_one.return_value.modified_count = 1
+        ledger = QuotaLedger(db)
+        self.assertEqual(ledger.reconcile(), 1)
+        q_filter, update = collection.update_one.call_args[0]
+        self.assertEqual(q_filter, {"_id": "pdus:p1", "count": 4})
+        self.assertEqual(update["$inc"], {"count": -1})
+        collection.replace_one.assert_not_called()
+        collection.update_one.return_value.modified_count = 0
+        self.assertEqual(ledger.reconcile(), 0)
+
+    def test_topic_quota(self):
+        auth = Mock()
+        auth.get_project.return_value = {"_id": "p1", "name": "project1", "quotas": {"pdus": 5}}
+        topic = PduTestTopic(self.db, Mock(), Mock(), auth)
+        session = {"force": False, "admin": False, "public": None, "project_id": ["p1"], "set_project": None,
+                   "method": "delete"}
+        BaseTopic.quota_ledger = self.ledger
+        try:
+            rollback = []
+            pdu4_id, _ = topic.new(rollback, session, {"name": "pdu4"})
+            self.assertEqual(rollback[0]["quota_projects"], ["p1"])
+            self.assertEqual(self.ledger.get_usage("pdus", "p1"), 5)
+            with self.assertRaises(EngineException):
+                topic.new([], session, {"name": "pdu5"})
+            topic.delete(session, "pdu0")
+            self.assertEqual(self.ledger.get_usage("pdus", "p1"), 4)
+            self.assertEqual(self.ledger.reconcile(), 0)
+
+            # projects added and removed by an edition
+            self.assertEqual(self.ledger.get_usage("pdus", "p2"), 1)
+            self.assertEqual(self.ledger.get_usage("pdus", "p3"), 0)
+            session["method"] = "edit"
+            topic.edit(session, pdu4_id, {"_admin": {"projects_read": ["p2", "p3"]}})
+            self.assertEqual(self.ledger.get_usage("pdus", "p1"), 3)
+            self.assertEqual(self.ledger.get_usage("pdus", "p2"), 2)
+            self.assertEqual(self.ledger.get_usage("pdus", "p3"), 1)
+            self.assertEqual(self.ledger.reconcile(), 0)
+        finally:
+            BaseTopic.quota_ledger = None
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from http import HTTPStatus
+from unittest.mock import Mock
+from osm_common.dbbase import DbException
+from osm_common.dbmemory import DbMemory
+from osm_nbi.base_topic import EngineException, ReferenceResolver
+from osm_nbi.descriptor_topics import NsdTopic, NstTopic
+
+session = {"username": "user1", "project_id": ("p1",), "method": "write", "public": None, "force": False,
+           "admin": False}
+
+
+def get_vnfd(_id, vnfd_id, project, cps=("mgmt", "data")):
+    return {"_id": _id, "id": vnfd_id, "connection-point": [{"name": cp} for cp in cps],
+            "_admin": {"projects_read": [project], "projects_write": [project]}}
+
+
+class Test_ReferenceResolver(unittest.TestCase):
+
+    def setUp(self):
+        self.db = DbMemory()
+        self.db.create("vnfds", get_vnfd("_id1", "vnfd1", "p1"))
+        self.db.create("vnfds", get_vnfd("_id2", "vnfd2", "p1"))
+        self.db.create("vnfds", get_vnfd("_id3", "vnfd3", "p2"))   # other project
+        self.db.create("vnfds", get_vnfd("_id4", "vnfd4", "p1"))
+        self.db.create("vnfds", get_vnfd("_id5", "vnfd4", "ANY"))  # same id twice
+        self.db.get_list = Mock(wraps=self.db.get_list)
+
+    def test_resolve(self):
+        resolver = ReferenceResolver(self.db, session)
+        vnfds = resolver.resolve("vnfds", ["vnfd1", "vnfd2", "vnfd1", "vnfd3", "vnfd9"])
+        self.assertEqual(list(vnfds), ["vnfd1", "vnfd2"])
+        self.assertEqual(vnfds["vnfd2"]["_id"], "_id2")
+        self.assertEqual(self.db.get_list.call_count, 1)
+        self.assertEqual(self.db.get_list.call_args[0][1]["id.cont"], ["vnfd1", "vnfd2", "vnfd3", "vnfd9"])
+
+        # memoized, also by _id; and not found ones are not asked again
+        self.assertIs(resolver.get_one("vnfds", "vnfd1"), vnfds["vnfd1"])
+        self.assertIs(resolver.get_one("vnfds", "_id2", key="_id"), vnfds["vnfd2"])
+        self.assertEqual(resolver.resolve("vnfds", ["vnfd9"]), {})
+        self.assertEqual(self.db.get_list.call_count, 1)
+
+        # only the new ones are fetched
+        self.assertEqual(list(resolver.resolve("vnfds", ["vnfd2", "vnfd4"])), ["vnfd2", "vnfd4"])
+        self.assertEqual(self.db.get_list.call_count, 2)
+        self.assertEqual(self.db.get_list.call_args[0][1]["id"], "vnfd4")
+
+    def test_get_one(self):
+        resolver = ReferenceResolver(self.db, session)
+        with self.assertRaises(DbException) as e:
+            resolver.get_one("vnfds", "vnfd3")
+        self.assertEqual(e.exception.http_code, HTTPStatus.NOT_FOUND)
+        self.assertIn("vnfd3", str(e.exception))
+        with self.assertRaises(DbException) as e:
+            resolver.get_one("vnfds", "vnfd4")
+        self.assertEqual(e.exception.http_code, HTTPStatus.CONFLICT)
+        self.assertEqual(resolver.get_one("vnfds", "_id4", key="_id")["id"], "vnfd4")
+
+    def test_nsd_dependencies(self):
+        topic = NsdTopic(self.db, None, None, None)
+        nsd = {"id": "nsd1",
+               "constituent-vnfd": [{"member-vnf-index": str(index), "vnfd-id-ref": "vnfd{}".format(index % 2 + 1)}
+                                    for index in range(1, 5)],
+               "vld": [{"id": "mgmtnet", "vnfd-connection-point-ref": [
+                   {"member-vnf-index-ref": str(index), "vnfd-connection-point-ref": "mgmt"}
+                   for index in range(1, 5)]}]}
+        topic._check_descriptor_dependencies(session, nsd)
+        self.assertEqual(self.db.get_list.call_count, 1)
+
+        nsd["vld"][0]["vnfd-connection-point-ref"][3]["vnfd-connection-point-ref"] = "wrong-cp"
+        with self.assertRaises(EngineException) as e:
+            topic._check_descriptor_dependencies(session, nsd)
+        self.assertEqual(e.exception.http_code, HTTPStatus.UNPROCESSABLE_ENTITY)
+        self.assertIn("vnfd-connection-point-ref='wrong-cp'", str(e.exception))
+
+        nsd["constituent-vnfd"][2]["vnfd-id-ref"] = "vnfd3"
+        with self.assertRaises(EngineException) as e:
+            topic._check_descriptor_dependencies(session, nsd)
+        self.assertEqual(e.exception.http_code, HTTPStatus.CONFLICT)
+        self.assertIn("'vnfd-id-ref'='vnfd3'", str(e.exception))
+
+    def test_nst_dependencies(self):
+        topic = NstTopic(self.db, None, None, None)
+        for index in range(3):
+            self.db.create("nsds", {"_id": "_nsd{}".format(index), "id": "nsd{}".format(index),
+                                    "_admin": {"projects_read": ["p1"], "projects_write": ["p1"]}})
+        nst = {"id": "nst1", "netslice-subnet": [{"id": "subnet{}".format(index), "nsd-ref": "nsd{}".format(index)}
+                                                 for index in range(3)]}
+        self.db.get_list.reset_mock()
+        topic._check_descriptor_dependencies(session, nst)
+        self.assertEqual(self.db.get_list.call_count, 1)
+        nst["netslice-subnet"][1]["nsd-ref"] = "nsd9"
+        with self.assertRaises(EngineException) as e:
+            topic._check_descriptor_dependencies(session, nst)
+        self.assertEqual(e.exception.http_code, HTTPStatus.CONFLICT)
+        self.assertIn("'nsd-ref'='nsd9'", str(e.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import json
+import yaml
+from osm_nbi import serializer
+from osm_nbi.tests.test_db_descriptors import db_nsrs_text, db_vnfrs_text
+
+
+class Test_Serializer(unittest.TestCase):
+
+    def setUp(self):
+        self.data = yaml.safe_load(db_nsrs_text) + yaml.safe_load(db_vnfrs_text)
+        self.data.append({"text": "multi\nline ñ", "list": [1, {"none": None}], "empty": []})
+        self.chunk_size = serializer.chunk_size
+        serializer.chunk_size = 256
+
+    def tearDown(self):
+        serializer.chunk_size = self.chunk_size
+
+    def test_json(self):
+        chunks = list(serializer.iter_json(self.data))
+        self.assertGreater(len(chunks), 1, "A list must be encoded in several chunks")
+        self.assertEqual(json.loads(b"".join(chunks)), self.data)
+        self.assertNotIn(b"\n", b"".join(chunks)[:-1], "By default json must be compact")
+        for data in (self.data, [], {}, "text", [None]):
+            self.assertEqual(serializer.dumps_json(data, 4), (json.dumps(data, indent=4) + "\n").encode("utf8"))
+
+    def test_yaml(self):
+        chunks = list(serializer.iter_yaml(self.data))
+        self.assertGreater(len(chunks), 1, "A list must be encoded in several chunks")
+        for data in (self.data, [], {}, "text", [None]):
+            self.assertEqual(serializer.dumps_yaml(data),
+                             yaml.dump(data, Dumper=serializer.YamlDumper, explicit_start=True, indent=4,
+                                       default_flow_style=False, tags=False, encoding='utf-8', allow_unicode=True))
+            self.assertEqual(yaml.safe_load(serializer.dumps_yaml(data)), data)
+
+    def test_json_codecs(self):
+        codec = serializer.json_codec
+        try:
+            for json_codec in serializer.json_codecs:
+                try:
+                    serializer.set_json_codec(json_codec)
+                except ValueError:
+                    continue   # not installed
+                self.assertEqual(serializer.json_load(serializer.dumps_json(self.data)), self.data)
+                self.assertEqual(serializer.json_load(b'{"a": [1, null]}'), {"a": [1, None]})
+                with self.assertRaises(ValueError):
+                    serializer.json_load(b'{"a": ')
+            with self.assertRaises(ValueError):
+                serializer.set_json_codec("wrong")
+        finally:
+            serializer.set_json_codec(codec)
+
+    def test_get_json_indent(self):
+        self.assertIsNone(serializer.get_json_indent(None))
+        self.assertIsNone(serializer.get_json_indent("application/json"))
+        self.assertIsNone(serializer.get_json_indent("application/json; indent=wrong"))
+        self.assertIsNone(serializer.get_json_indent("application/yaml; indent=4"))
+        self.assertEqual(serializer.get_json_indent("text/html, application/json; q=0.9; indent=4"), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
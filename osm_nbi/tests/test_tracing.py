@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import unittest
+from os import path
+from tempfile import TemporaryDirectory
+from osm_common.dbmemory import DbMemory
+from osm_nbi import tracing
+from osm_nbi.tracing import Tracer
+
+traceparent = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+
+
+@tracing.traced()
+def create_items(db, count):
+    for index in range(count):
+        db.create("vnfrs", {"_id": "vnfr{}".format(index)})
+
+
+class Test_Tracing(unittest.TestCase):
+
+    def setUp(self):
+        self.db = DbMemory()
+        self.tracer = Tracer()
+        self.tracer.attach_db(self.db)
+
+    def test_traceparent(self):
+        trace = self.tracer.start("ns_instances:get", traceparent)
+        self.tracer.finish(trace)
+        self.assertEqual(trace.trace_id, "4bf92f3577b34da6a3ce929d0e0e4736")
+        self.assertEqual(trace.get_traceparent(), "00-4bf92f3577b34da6a3ce929d0e0e4736-{}-01".format(
+            trace.root.span_id))
+        for invalid in ("00-00000000000000000000000000000000-00f067aa0ba902b7-01", "00-xyz-00f067aa0ba902b7-01",
+                        "garbage"):
+            trace = self.tracer.start("ns_instances:get", invalid)
+            self.tracer.finish(trace)
+            self.assertEqual(len(trace.trace_id), 32)
+            self.assertIsNone(trace.remote_parent_id)
+
+    def test_span_tree(self):
+        create_items(self.db, 2)   # not traced
+        self.tracer.slow_request = 0
+        trace = self.tracer.start("ns_instances_content:post")
+        self.db.get_list("nsds")
+        with tracing.span("engine.new_item", topic="nsrs"):
+            create_items(self.db, 3)
+            vnfr_span = tracing.start_span("create_vnfr", member_vnf_index="1")
+            self.db.create("vnfrs", {"_id": "vnfr4"})
+        with self.assertLogs("nbi.trace", level="WARNING") as logs:
+            self.tracer.finish(trace, "error text")
+        self.assertIsNone(tracing.get_current_trace())
+        self.assertIsNotNone(vnfr_span.end, "open spans are closed with their parent")
+        self.assertEqual(trace.get_db_calls(), 5)
+        self.assertEqual(trace.root.db_calls, 1)
+        new_item = trace.root.children[0]
+        self.assertEqual([child.name for child in new_item.children], ["create_items", "create_vnfr"])
+        self.assertEqual(new_item.children[0].db_calls, 3)
+        tree = logs.output[0].split("\n")
+        self.assertIn("5 database calls", tree[0])
+        self.assertTrue(tree[2].startswith("  engine.new_item ") and tree[2].endswith("topic=nsrs"))
+        self.assertTrue(tree[4].startswith("    create_vnfr ") and "member_vnf_index=1" in tree[4])
+
+    def test_otlp_file(self):
+        with TemporaryDirectory() as tmp_dir:
+            self.tracer = Tracer(otlp_file=path.join(tmp_dir, "traces.json"))
+            for _ in range(2):
+                trace = self.tracer.start("nsds:get", traceparent)
+                with tracing.span("engine.get_item_list", topic="nsds"):
+                    pass
+                self.tracer.finish(trace)
+            with open(path.join(tmp_dir, "traces.json")) as f:
+                lines = f.readlines()
+        self.assertEqual(len(lines), 2)
+        spans = json.loads(lines[0])["resourceSpans"][0]["scopeSpans"][0]["spans"]
+        self.assertEqual([span["name"] for span in spans], ["nsds:get", "engine.get_item_list"])
+        self.assertEqual(spans[0]["parentSpanId"], "00f067aa0ba902b7")
+        self.assertEqual(spans[1]["parentSpanId"], spans[0]["spanId"])
+        self.assertEqual({span["traceId"] for span in spans}, {"4bf92f3577b34da6a3ce929d0e0e4736"})
+
+
+if __name__ == '__main__':
+    unittest.main()
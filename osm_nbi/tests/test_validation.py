@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from http import HTTPStatus
+from osm_nbi import validation
+from osm_nbi.validation import validate_input, ValidationError, ns_instantiate, vim_account_new_schema
+
+
+class Test_Validation(unittest.TestCase):
+
+    def test_validators_are_cached(self):
+        self.assertIs(validation.get_validator(ns_instantiate), validation.get_validator(ns_instantiate))
+        self.assertIn(id(vim_account_new_schema), validation._validators, "global schemas must be compiled at import")
+
+    def test_validate_input(self):
+        self.assertIsNone(validate_input({"nsName": "name", "nsdId": "nsd", "vimAccountId": "vim"}, None))
+        self.assertIsNone(validate_input({"nsName": "name", "nsdId": "b3c3b1c0-5ae0-4ca2-9e7b-3d6e6e8a7c11",
+                                          "vimAccountId": "f48163a6-c807-47bc-9682-f72caef5af85"}, ns_instantiate))
+        with self.assertRaises(ValidationError) as e:
+            validate_input({"nsName": "name", "nsdId": "b3c3b1c0-5ae0-4ca2-9e7b-3d6e6e8a7c11",
+                            "vimAccountId": "wrong"}, ns_instantiate)
+        self.assertEqual(e.exception.http_code, HTTPStatus.UNPROCESSABLE_ENTITY)
+        self.assertIn("Format error at 'vimAccountId'", str(e.exception))
+        with self.assertRaises(ValidationError) as e:
+            validate_input({"name": "name"}, vim_account_new_schema)
+        self.assertIn("is a required property", str(e.exception))
+
+    def test_bad_schema(self):
+        with self.assertRaises(ValidationError) as e:
+            validate_input({}, {"type": "wrong"})
+        self.assertEqual(e.exception.http_code, HTTPStatus.INTERNAL_SERVER_ERROR)
+
+
+if __name__ == '__main__':
+    unittest.main()
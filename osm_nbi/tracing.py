@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Lightweight tracing of the HTTP requests. Each request thread has its current trace, that contains a tree of spans.
+Spans are opened with 'span' context manager, 'traced' decorator or 'start_span'/'end_span' functions, that do
+nothing when there is not any trace at the current thread.
+Trace identifiers follow W3C trace context, and finished traces can be exported at OTLP json format
+"""
+
+import json
+import logging
+from functools import wraps
+from os import urandom
+from threading import local, Lock
+from time import perf_counter, time
+
+
+_local = local()
+
+
+class Span:
+    __slots__ = ("name", "span_id", "parent", "attributes", "start", "end", "start_time", "children", "db_calls",
+                 "error")
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.span_id = urandom(8).hex()
+        self.parent = parent
+        self.attributes = attributes or {}
+        self.start_time = time()
+        self.start = perf_counter()
+        self.end = None
+        self.children = []
+        self.db_calls = 0
+        self.error = None
+
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else perf_counter()) - self.start
+
+
+class Trace:
+    """
+    Tree of spans of a request. The root span is the request itself
+    """
+
+    def __init__(self, name, traceparent=None):
+        self.trace_id = None
+        self.remote_parent_id = None
+        self.sampled = True
+        if traceparent:
+            self._parse_traceparent(traceparent)
+        if not self.trace_id:
+            self.trace_id = urandom(16).hex()
+        self.root = self.current = Span(name)
+
+    def _parse_traceparent(self, traceparent):
+        # version-trace_id-parent_id-flags. Invalid headers are ignored and a new trace is started
+        items = traceparent.strip().lower().split("-")
+        if len(items) < 4 or len(items[0]) != 2 or items[0] == "ff" or len(items[1]) != 32 or len(items[2]) != 16 \
+                or len(items[3]) != 2:
+            return
+        try:
+            trace_id, parent_id, flags = int(items[1], 16), int(items[2], 16), int(items[3], 16)
+        except ValueError:
+            return
+        if not trace_id or not parent_id:
+            return
+        self.trace_id = items[1]
+        self.remote_parent_id = items[2]
+        self.sampled = bool(flags & 1)
+
+    def get_traceparent(self):
+        """
+        :return: W3C traceparent header pointing to the root span of this trace
+        """
+        return "00-{}-{}-{}".format(self.trace_id, self.root.span_id, "01" if self.sampled else "00")
+
+    def open_span(self, name, attributes=None):
+        span = Span(name, self.current, attributes)
+        self.current.children.append(span)
+        self.current = span
+        return span
+
+    def close_span(self, span, error=None):
+        if span.end is not None:   # already closed together with an ancestor
+            return
+        span.end = perf_counter()
+        if error:
+            span.error = str(error) or type(error).__name__
+        # close also the descendants left open, e.g. by an exception between start_span and end_span
+        open_spans = []
+        current = self.current
+        while current is not None and current is not span:
+            open_spans.append(current)
+            current = current.parent
+        if current is None:     # not at the current branch
+            return
+        for open_span in open_spans:
+            open_span.end = span.end
+        self.current = span.parent or self.root
+
+    def iter_spans(self):
+        pending = [self.root]
+        while pending:
+            span = pending.pop()
+            yield span
+            pending.extend(reversed(span.children))
+
+    def get_db_calls(self):
+        return sum(span.db_calls for span in self.iter_spans())
+
+    def format_tree(self):
+        """
+        :return: text with one line per span, indented by depth, with the duration and database calls
+        """
+        lines = []
+
+        def _format(span, depth):
+            attributes = " ".join("{}={}".format(k, v) for k, v in span.attributes.items())
+            lines.append("{}{} {:.1f}ms db={}{}{}".format("  " * depth, span.name, span.duration * 1000,
+                                                          span.db_calls, " " + attributes if attributes else "",
+                                                          " error=" + span.error if span.error else ""))
+            for child in span.children:
+                _format(child, depth + 1)
+        _format(self.root, 0)
+        return "\n".join(lines)
+
+    def to_otlp(self, service_name="osm-nbi"):
+        """
+        :return: dictionary with the trace at OTLP json format (ExportTraceServiceRequest)
+        """
+        spans = []
+        for span in self.iter_spans():
+            parent_id = span.parent.span_id if span.parent else (self.remote_parent_id or "")
+            end_time = span.start_time + span.duration
+            attributes = [{"key": k, "value": {"stringValue": str(v)}} for k, v in span.attributes.items()]
+            attributes.append({"key": "db.calls", "value": {"intValue": str(span.db_calls)}})
+            otlp_span = {
+                "traceId": self.trace_id,
+                "spanId": span.span_id,
+                "parentSpanId": parent_id,
+                "name": span.name,
+                "kind": 2 if span is self.root else 1,   # SERVER, INTERNAL
+                "startTimeUnixNano": str(int(span.start_time * 1e9)),
+                "endTimeUnixNano": str(int(end_time * 1e9)),
+                "attributes": attributes,
+            }
+            if span.error:
+                otlp_span["status"] = {"code": 2, "message": span.error}   # ERROR
+            spans.append(otlp_span)
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+            "scopeSpans": [{"scope": {"name": "osm_nbi"}, "spans": spans}],
+        }]}
+
+
+def get_current_trace():
+    return getattr(_local, "trace", None)
+
+
+def run_in_trace(trace, function, *args, **kwargs):
+    """
+    Runs a function with trace as the current trace of the thread. Used when the request is processed by several
+    threads, as the executor threads of the asynchronous server
+    :param trace: Trace, or None for running without tracing
+    :return: the function result
+    """
+    previous = getattr(_local, "trace", None)
+    _local.trace = trace
+    try:
+        return function(*args, **kwargs)
+    finally:
+        _local.trace = previous
+
+
+def start_span(name, **attributes):
+    """
+    Opens a span as child of the current one. Must be closed with end_span
+    :return: the span, or None if the thread is not being traced
+    """
+    trace = getattr(_local, "trace", None)
+    if trace is None:
+        return None
+    return trace.open_span(name, attributes)
+
+
+def end_span(span, error=None):
+    """
+    Closes a span opened with start_span. Nothing is done if span is None
+    """
+    if span is None:
+        return
+    trace = getattr(_local, "trace", None)
+    if trace is not None:
+        trace.close_span(span, error)
+
+
+def set_attribute(key, value):
+    """
+    Adds an attribute to the current span, if any
+    """
+    trace = getattr(_local, "trace", None)
+    if trace is not None:
+        trace.current.attributes[key] = value
+
+
+class span:
+    """
+    Context manager that opens a span while the block is executed
+    """
+    __slots__ = ("name", "attributes", "span")
+
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.span = None
+
+    def __enter__(self):
+        self.span = start_span(self.name, **self.attributes)
+        return self.span
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end_span(self.span, exc_value)
+        return False
+
+
+def traced(name=None):
+    """
+    Decorator that opens a span while the function is executed
+    :param name: span name. By default the function qualified name
+    """
+    def decorator(function):
+        span_name = name or function.__qualname__
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if getattr(_local, "trace", None) is None:
+                return function(*args, **kwargs)
+            with span(span_name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class Tracer:
+    """
+    Starts and finishes the trace of each request. Finished traces slower than slow_request are logged with their
+    span tree; and all finished traces are appended to otlp_file, one json line per trace
+    """
+    db_methods = ("get_list", "get_list_projected", "get_one", "count", "create", "create_list", "set_one", "set_list",
+                  "replace", "del_one", "del_list")
+    msg_methods = ("write",)
+
+    def __init__(self, slow_request=None, otlp_file=None):
+        """
+        :param slow_request: seconds from which a request is logged as slow. None for not logging
+        :param otlp_file: file to export the traces. None for not exporting
+        """
+        self.slow_request = slow_request
+        self.otlp_file = otlp_file
+        self.otlp_lock = Lock()
+        self.logger = logging.getLogger("nbi.trace")
+
+    def start(self, name, traceparent=None, current=True, **attributes):
+        """
+        Starts the trace of the current thread
+        :param name: name of the root span
+        :param traceparent: W3C traceparent header received, if any
+        :param current: set it as the trace of the current thread. False when the request is processed by other
+            threads, that use run_in_trace
+        :return: Trace object
+        """
+        trace = Trace(name, traceparent)
+        trace.root.attributes.update(attributes)
+        if current:
+            _local.trace = trace
+        return trace
+
+    def finish(self, trace, error=None):
+        """
+        Ends the trace of the current thread, logging and exporting it if needed
+        :param trace: Trace returned by start
+        :param error: exception or error text of the request, if any
+        :return: None
+        """
+        _local.trace = None
+        trace.close_span(trace.root, error)
+        if self.slow_request is not None and trace.root.duration >= self.slow_request:
+            self.logger.warning("Slow request {} took {:.1f}ms with {} database calls. trace_id={}\n{}".format(
+                trace.root.name, trace.root.duration * 1000, trace.get_db_calls(), trace.trace_id,
+                trace.format_tree()))
+        if self.otlp_file and trace.sampled:
+            try:
+                line = json.dumps(trace.to_otlp(), separators=(",", ":")) + "\n"
+                with self.otlp_lock, open(self.otlp_file, "a") as f:
+                    f.write(line)
+            except Exception as e:
+                self.logger.error("Cannot export trace to '{}': {}".format(self.otlp_file, e))
+
+    def attach_db(self, db):
+        """
+        Instruments in place the database methods to count the calls done by each span
+        """
+        for method_name in self.db_methods:
+            if hasattr(db, method_name):
+                setattr(db, method_name, self._count_db_calls(getattr(db, method_name)))
+
+    def attach_msg(self, msg):
+        """
+        Instruments in place the message methods to open a span per message written
+        """
+        for method_name in self.msg_methods:
+            if hasattr(msg, method_name):
+                setattr(msg, method_name, self._trace_msg(getattr(msg, method_name), method_name))
+
+    @staticmethod
+    def _count_db_calls(method):
+        @wraps(method)
+        def instrumented(*args, **kwargs):
+            trace = getattr(_local, "trace", None)
+            if trace is not None:
+                trace.current.db_calls += 1
+            return method(*args, **kwargs)
+        return instrumented
+
+    @staticmethod
+    def _trace_msg(method, method_name):
+        @wraps(method)
+        def instrumented(topic, *args, **kwargs):
+            if getattr(_local, "trace", None) is None:
+                return method(topic, *args, **kwargs)
+            with span("msg." + method_name, topic=topic):
+                return method(topic, *args, **kwargs)
+        return instrumented
@@ -13,10 +13,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from jsonschema import validate as js_v, exceptions as js_e
+from jsonschema import validators as js_validators, exceptions as js_e
+from threading import Lock
 from http import HTTPStatus
 from copy import deepcopy
 from uuid import UUID   # To test for valid UUID
+from osm_nbi.tracing import traced
 
 __author__ = "Alfonso Tierno <alfonso.tiernosepulveda@telefonica.com>"
 __version__ = "0.1"
@@ -905,6 +907,43 @@ class ValidationError(Exception):
         Exception.__init__(self, message)
 
 
+# compiled validators, by schema id. The schema is kept to ensure that the id is not reused by other object
+_validators = {}
+_validators_lock = Lock()
+
+
+def get_validator(schema_to_use):
+    """
+    Obtains the validator of a json schema. It is created and the schema checked only once; then it is cached
+    :param schema_to_use: jsonschema
+    :return: validator. It raises ValidationError if the schema is not valid
+    """
+    cached = _validators.get(id(schema_to_use))
+    if cached and cached[0] is schema_to_use:
+        return cached[1]
+    validator_class = js_validators.validator_for(schema_to_use, default=js_validators.Draft4Validator)
+    try:
+        validator_class.check_schema(schema_to_use)
+    except js_e.SchemaError:
+        raise ValidationError("Bad json schema {}".format(schema_to_use), http_code=HTTPStatus.INTERNAL_SERVER_ERROR)
+    validator = validator_class(schema_to_use)
+    with _validators_lock:
+        _validators[id(schema_to_use)] = (schema_to_use, validator)
+    return validator
+
+
+def compile_schemas(*schemas):
+    """
+    Creates in advance the validators of several json schemas, so that it is not done at the first request
+    :param schemas: jsonschemas. Empty ones are ignored
+    :return: None. It raises ValidationError if any schema is not valid
+    """
+    for schema_to_use in schemas:
+        if schema_to_use:
+            get_validator(schema_to_use)
+
+
+@traced("validate_input")
 def validate_input(indata, schema_to_use):
     """
     Validates input data against json schema
@@ -912,18 +951,16 @@ def validate_input(indata, schema_to_use):
     :param schema_to_use: jsonschema to test
     :return: None if ok, raises ValidationError exception on error
     """
-    try:
-        if schema_to_use:
-            js_v(indata, schema_to_use)
+    if not schema_to_use:
         return None
-    except js_e.ValidationError as e:
-        if e.path:
-            error_pos = "at '" + ":".join(map(str, e.path)) + "'"
-        else:
-            error_pos = ""
-        raise ValidationError("Format error {} '{}' ".format(error_pos, e.message))
-    except js_e.SchemaError:
-        raise ValidationError("Bad json schema {}".format(schema_to_use), http_code=HTTPStatus.INTERNAL_SERVER_ERROR)
+    error = js_e.best_match(get_validator(schema_to_use).iter_errors(indata))
+    if error is None:
+        return None
+    if error.path:
+        error_pos = "at '" + ":".join(map(str, error.path)) + "'"
+    else:
+        error_pos = ""
+    raise ValidationError("Format error {} '{}' ".format(error_pos, error.message))
 
 
 def is_valid_uuid(x):
@@ -937,3 +974,6 @@ def is_valid_uuid(x):
             return True
     except (TypeError, ValueError, AttributeError):
         return False
+
+
+compile_schemas(*nbi_new_input_schemas.values(), *nbi_edit_input_schemas.values(), nsi_instantiate)